@@ -138,6 +138,20 @@ def load_environment(global_conf, app_conf):
     engine = engine_from_config(config, 'sqlalchemy.')
     init_model(engine)
 
+    # setup the change detection for the replicated config
+    from linotp.lib.replication import getConfigNotifier
+    config['pylons.app_globals'].setConfigNotifier(getConfigNotifier(config))
+
+    from linotp.lib.usercache import getUserCache
+    config['pylons.app_globals'].setUserCache(getUserCache(config))
+
+    from linotp.lib.challenges import setupChallengeStore
+    config['pylons.app_globals'].setChallengeStore(
+                                        setupChallengeStore(config))
+
+    from linotp.lib.tokencounter import setupTokenCounter
+    config['pylons.app_globals'].setTokenCounter(setupTokenCounter(config))
+
     # CONFIGURATION OPTIONS HERE (note: all config options will override
     # any Pylons config options)
 
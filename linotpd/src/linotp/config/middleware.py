@@ -132,8 +132,9 @@ def make_app(global_conf, full_stack=True, static_files=True, **app_conf):
         else:
             app = StatusCodeRedirect(app, [400, 401, 403, 404, 500])
 
-    # Establish the Registry for this application
-    app = RegistryManager(app)
+    # Establish the Registry for this application - the registry is kept
+    # until a streamed response is finished
+    app = RegistryManager(app, streaming=True)
 
     if asbool(static_files):
         # Serve static files
@@ -68,7 +68,10 @@ from linotp.lib.reply import (sendResult,
                               sendXMLError,
                               sendCSVResult,
                               sendResultIterator,
+                              sendCSVResultIterator,
+                              sendJSONLinesIterator,
                               )
+from linotp.lib.resolver import closeResolvers
 from linotp.lib.reply import sendQRImageResult
 
 from linotp.lib.validate import get_challenges
@@ -294,7 +297,13 @@ class AdminController(BaseController):
             * page    - optional: reqeuest a certain page
             * pagesize- optional: limit the number of returned tokens
             * user_fields - optional: additional user fields from the userid resolver of the owner (user)
-            * outform - optional: if set to "csv", than the token list will be given in CSV
+            * outform - optional: if set to "csv", than the token list will be given in CSV,
+              if set to "jsonl", than the token list will be given as JSON lines - one token
+              per line. Without a page, the tokens are streamed batch by batch.
+            * cursor  - optional: the cursor of the resultset of the former page - the next page
+              is selected by the sort value of the last token instead of the page offset
+            * count   - optional: if set to "approx", the number of tokens is taken from the
+              token counters or a cached count
 
         returns:
             a json result with:
@@ -345,11 +354,18 @@ class AdminController(BaseController):
             log.info("[show] admin >%s< may display the following realms: %s" % (res['admin'], filterRealm))
             log.info("[show] displaying tokens: serial: %s, page: %s, filter: %s, user: %s", serial, page, filter, user.login)
 
-            toks = TokenIterator(user, serial, page, psize, filter, sort, dir, filterRealm, user_fields)
+            toks = TokenIterator(user, serial, page, psize, filter, sort, dir, filterRealm, user_fields,
+                                 params=param)
 
             c.audit['success'] = True
             c.audit['info'] = "realm: %s, filter: %r" % (filterRealm, filter)
 
+            # the export of all tokens is streamed
+            if output_format == "jsonl":
+                return sendJSONLinesIterator(response, stream_tokens(toks))
+            if output_format == "csv" and page is None:
+                return sendCSVResultIterator(response, stream_tokens(toks))
+
             # put in the result
             result = {}
 
@@ -2434,6 +2450,26 @@ class AdminController(BaseController):
             log.debug('[ocra/checkstatus] done')
 
 
+def stream_tokens(toks):
+    """
+    build a token iterator / generator, which returns the token data on
+    demand - the generator is consumed, after the request has finished, so
+    the Session and the resolvers, which are used for the token data, are
+    closed at the end of the iteration
+
+    :param toks: the TokenIterator
+    :return: generator of the token data dicts (yield)
+    """
+    # the resolvers of the request are already closed
+    c.resolvers_loaded = {}
+    try:
+        for tok in toks:
+            yield tok
+    finally:
+        closeResolvers()
+        Session.remove()
+
+
 def iterate_users(user_iterators):
     """
     build a userlist iterator / generator that returns the user data on demand
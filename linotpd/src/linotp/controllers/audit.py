@@ -118,6 +118,19 @@ class AuditController(BaseController):
                 it a parameter or=true is passed, the filters will
                 be OR concatenated.
 
+            * cursor - optional: the cursor of the former page - the next
+                       page is selected by the sort value of the last entry
+                       instead of the page offset. An empty cursor selects
+                       the first page. The response contains the cursor of
+                       the next page and the total only on the first page.
+
+            * date_from - optional: the first timestamp of the searched
+                          period, e.g. 2015-01-01
+            * date_to - optional: the timestamp after the searched period
+
+            Search values without the wildcard % or _ are compared exactly.
+            Without page and rp all entries are returned batch by batch.
+
             The Flexigrid provides us the following parameters:
                 ('page', u'1'), ('rp', u'25'),
                 ('sortname', u'number'),
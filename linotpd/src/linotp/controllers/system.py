@@ -76,6 +76,9 @@ from linotp.lib.user    import getUserFromRequest
 
 from linotp.lib.realm   import deleteRealm
 from linotp.lib.token   import newToken
+from linotp.lib.otpindex import updateOtpIndex
+from linotp.lib.security.default import reloadKeySlots
+from linotp.lib.security.default import getKeyFileReads
 
 from linotp.lib.policy import checkPolicyPre
 from linotp.lib.policy import checkPolicyPost
@@ -1612,7 +1615,9 @@ class SystemController(BaseController):
 
                 ready = hsm.isReady()
                 res['setupSecurityModule'] = {'activeSecurityModule': hsm_id ,
-                                              'connected' : ready }
+                                              'connected' : ready,
+                                              'key_file_reads': getKeyFileReads(),
+                                              'pool': sep.getPoolStats()}
                 ret = ready
             else:
                 if hsm_id != sep.activeOne:
@@ -1743,6 +1748,236 @@ class SystemController(BaseController):
             Session.close()
             log.error("[setSupport] done")
 
+    def reloadKeys(self):
+        """
+        method:
+            system/reloadKeys
+
+        description:
+            read the key files of the security modules again - the keys are
+            otherwise read only once per process. As this only reloads the
+            keys of the process, which serves the request, the server
+            processes should be sent a SIGHUP instead in multi process
+            setups.
+
+        returns:
+            a json result with the reloaded key files and the number of
+            reads of every key file
+
+        exception:
+            if an error occurs an exception is serialized and returned
+        """
+        try:
+            reloaded = reloadKeySlots()
+            res = {'reloaded': reloaded,
+                   'key_file_reads': getKeyFileReads()}
+
+            c.audit['success'] = True
+            c.audit['info'] = "reloaded %d key files" % len(reloaded)
+
+            Session.commit()
+            return sendResult(response, res, 1)
+
+        except Exception as exx:
+            log.error("[reloadKeys] failed to reload the keys: %r" % exx)
+            log.error("[reloadKeys] %s" % traceback.format_exc())
+            Session.rollback()
+            return sendError(response, exx)
+
+        finally:
+            Session.close()
+            log.debug("[reloadKeys] done")
+
+    def updateOtpIndex(self):
+        """
+        method:
+            system/updateOtpIndex
+
+        description:
+            maintenance job of the otp lookahead index of the unassigned
+            tokens: the index entries of the assigned and deleted tokens are
+            removed and the tokens without a valid index entry are indexed
+
+        arguments:
+            * lookahead - optional - the number of indexed otp values,
+                          default is the config entry OtpIndexLookahead
+            * limit     - optional - the max number of tokens to be indexed
+            * rebuild   - optional - if True, all tokens are indexed again
+
+        returns:
+            a json result with the number of removed entries, the number of
+            indexed tokens and the number of tokens still to be indexed
+
+        exception:
+            if an error occurs an exception is serialized and returned
+        """
+        res = {}
+
+        try:
+            param = getLowerParams(request.params)
+            log.debug("[updateOtpIndex] %r" % param)
+
+            lookahead = param.get('lookahead')
+            if lookahead is not None:
+                lookahead = int(lookahead)
+            limit = param.get('limit')
+            if limit is not None:
+                limit = int(limit)
+            rebuild = param.get('rebuild', 'False').lower() == 'true'
+
+            res = updateOtpIndex(lookahead=lookahead, limit=limit,
+                                 rebuild=rebuild)
+
+            c.audit['success'] = True
+            c.audit['info'] = "indexed %d token" % res['indexed']
+
+            Session.commit()
+            return sendResult(response, res, 1)
+
+        except Exception as exx:
+            log.error("[updateOtpIndex] failed to update the index: %r" % exx)
+            log.error("[updateOtpIndex] %s" % traceback.format_exc())
+            Session.rollback()
+            return sendError(response, exx)
+
+        finally:
+            Session.close()
+            log.debug("[updateOtpIndex] done")
+
+    def verifyAudit(self):
+        """
+        method:
+            system/verifyAudit
+
+        description:
+            verify the integrity of a range of audit entries: the entries
+            are read in the order of their ids, the chained entries are
+            verified by the signed checkpoint of their chain and the entries
+            of the former per row mode by their own signature. The audit
+            search only reports the chained entries as 'CHAINED'.
+
+        arguments:
+            * start_id   - optional - the first audit id
+            * end_id     - optional - the last audit id
+            * max_failed - optional - the max number of reported failed ids,
+                           default is 100
+
+        returns:
+            a json result with the number of entries, the verified, failed
+            and not yet anchored entries and the ids of the failed entries
+
+        exception:
+            if an error occurs an exception is serialized and returned
+        """
+        res = {}
+
+        try:
+            param = getLowerParams(request.params)
+            log.debug("[verifyAudit] %r" % param)
+
+            start_id = param.get('start_id')
+            if start_id is not None:
+                start_id = int(start_id)
+            end_id = param.get('end_id')
+            if end_id is not None:
+                end_id = int(end_id)
+            max_failed = int(param.get('max_failed', 100))
+
+            res = audit.verifyChain(start_id=start_id, end_id=end_id,
+                                    max_failed=max_failed)
+
+            c.audit['success'] = res['failed'] == 0
+            c.audit['info'] = ("verified %d of %d audit entries, %d failed"
+                               % (res['verified'], res['rows'],
+                                  res['failed']))
+
+            Session.commit()
+            return sendResult(response, res, 1)
+
+        except Exception as exx:
+            log.error("[verifyAudit] failed to verify the audit: %r" % exx)
+            log.error("[verifyAudit] %s" % traceback.format_exc())
+            Session.rollback()
+            return sendError(response, exx)
+
+        finally:
+            Session.close()
+            log.debug("[verifyAudit] done")
+
+    def getStats(self):
+        """
+        method:
+            system/getStats
+
+        description:
+            get the runtime counters of the process, which serves the
+            request - in multi process setups every process has its own
+            counters
+
+        returns:
+            a json result with the counters by subsystem:
+            config - the config version, the number of config snapshots
+                and the number and duration of the config reloads
+            audit_writer - the backlog, the latency and the dropped entries
+                of the asynchronous audit writer or null
+            ldap - the reuse rate and the wait time of the LDAP connection
+                pools
+            user_cache - the hit and miss counters of the user cache or null
+            challenge_sweeper - the challenges and entries purged per run
+                and in total or null
+            token_counter - the runs and corrected counters of the token
+                counter reconcile or null
+            audit_rotation - the rotations and archived buckets of the audit
+                rotation or null
+
+        exception:
+            if an error occurs an exception is serialized and returned
+        """
+        res = {}
+
+        try:
+            from linotp.lib.config import getGlobalObject
+            glo = getGlobalObject()
+
+            res['config'] = {'version': glo.getConfigVersion(),
+                             'snapshots': glo.getConfigSnapshotCount()}
+            res['config'].update(glo.getConfigReloadStats())
+
+            res['audit_writer'] = audit.getWriterStats()
+
+            import useridresolver.LDAPIdResolver
+            res['ldap'] = \
+                useridresolver.LDAPIdResolver.getConnectionPoolStats()
+
+            user_cache = glo.getUserCache()
+            res['user_cache'] = user_cache.getStats() if user_cache else None
+
+            sweeper = None
+            if glo.getChallengeStore() is not None:
+                (_store, sweeper) = glo.getChallengeStore()
+            res['challenge_sweeper'] = sweeper.getStats() if sweeper else None
+
+            token_counter = glo.getTokenCounter()
+            res['token_counter'] = (token_counter.getStats()
+                                    if token_counter else None)
+
+            res['audit_rotation'] = audit.getRotationStats()
+
+            c.audit['success'] = True
+
+            Session.commit()
+            return sendResult(response, res, 1)
+
+        except Exception as exx:
+            log.error("[getStats] failed to get the counters: %r" % exx)
+            log.error("[getStats] %s" % traceback.format_exc())
+            Session.rollback()
+            return sendError(response, exx)
+
+        finally:
+            Session.close()
+            log.debug("[getStats] done")
+
 
 #eof###########################################################################
 
@@ -40,6 +40,20 @@ pver = float(int(ma) + int(mi) * 0.1)
 
 log = logging.getLogger(__name__)
 
+try:
+    from hmac import compare_digest
+except ImportError:
+    def compare_digest(a, b):
+        '''
+        constant time comparison for python < 2.7.7
+        '''
+        if len(a) != len(b):
+            return False
+        result = 0
+        for x, y in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
 
 class HmacOtp():
 
@@ -88,6 +102,35 @@ class HmacOtp():
             self.counter = counter + 1
         return sotp
 
+    def generateWindow(self, start, end):
+        '''
+        compute the otp values of the counters start up to end at once - the
+        key of the secret object is set up only once for all counters
+
+        :param start: the first counter
+        :param end: the counter after the last one
+        :return: list of the otp values
+        '''
+        counters = xrange(start, end)
+        data_inputs = [struct.pack(">Q", counter) for counter in counters]
+
+        if hasattr(self.secretObj, 'hmac_digests'):
+            digests = self.secretObj.hmac_digests(data_inputs, self.hashfunc)
+        else:
+            digests = [str(self.secretObj.hmac_digest(data_input,
+                                                      self.hashfunc))
+                       for data_input in data_inputs]
+
+        modulo = 10 ** self.digits
+        otp_format = "%%0%dd" % self.digits
+        otps = []
+        for digest in digests:
+            # dynamic truncation - see truncate
+            offset = ord(digest[-1]) & 0x0f
+            binary = struct.unpack(">I", digest[offset:offset + 4])[0]
+            otps.append(otp_format % ((binary & 0x7fffffff) % modulo))
+        return otps
+
     def checkOtp(self, anOtpVal, window, symetric=False):
         res = -1
         start = self.counter
@@ -98,18 +141,20 @@ class HmacOtp():
             start = 0 if (start < 0) else start
             end = self.counter + (window)
 
-        log.debug("[checkOTP] OTP range counter: %r - %r" % (start, end))
-        for c in range(start , end):
-            log.debug("[checkOTP] looping")
-            otpval = self.generate(c)
-            log.debug("[checkOtp] calculating counter %r: %r %r"
-                      % (c, anOtpVal, otpval))
-            #log.error("otp[%d]: %s : %s",c,otpval,anOtpVal)
-
-            if (unicode(otpval) == unicode(anOtpVal)):
-                # log.debug("Match Pin: %s : %d : %s",otpval,c,anOtpVal)
-                res = c
-                break
+        log.debug("[checkOTP] OTP range counter: %r - %r", start, end)
+
+        if isinstance(anOtpVal, unicode):
+            anOtpVal = anOtpVal.encode('utf-8')
+        else:
+            anOtpVal = str(anOtpVal)
+
+        # all otp values of the window are compared in constant time, so the
+        # duration does not depend on the position of the matching counter
+        otps = self.generateWindow(start, end)
+        for counter, otpval in zip(xrange(start, end), otps):
+            if compare_digest(otpval, anOtpVal) and res == -1:
+                res = counter
+
         #return -1 or the counter
         return res
 
@@ -26,7 +26,6 @@
 
 """The application's Globals object"""
 import threading
-import copy
 import logging
 
 from linotp.lib.security.provider import SecurityProvider
@@ -52,8 +51,20 @@ class Globals(object):
         self.resolverLock = RWLock()
         self.rcount = 0
 
-        self.config = {}
+        # the config snapshot is a tuple of version and config dict. The
+        # config dict is shared read only by all requests and never
+        # modified in place - every change publishes a new snapshot
+        self.config_snapshot = (0, {})
+        self.config_snapshots = 1
         self.config_incomplete = False
+        self.config_notifier = None
+        self.config_reloads = 0
+        self.config_reload_duration = 0.0
+        self.config_reload_duration_total = 0.0
+        self.policy_set = None
+        self.user_cache = None
+        self.challenge_store = None
+        self.token_counter = None
         self.configLock = RWLock()
         secLock = RWLock()
 
@@ -87,14 +98,120 @@ class Globals(object):
 
     def getConfig(self):
         '''
-            retrieve (the deep copy of) the actual config
+            retrieve the actual config - the returned dict is shared
+            and must not be modified
         '''
-        self.configLock.acquire_read()
+        return self.config_snapshot[1]
+
+    def getConfigVersion(self):
+        '''
+            get the version of the actual config, which is incremented
+            on every config change
+        '''
+        return self.config_snapshot[0]
+
+    def getConfigSnapshot(self):
+        '''
+            get the actual config together with its version
+
+            :return: tuple of version and the read only config dict
+        '''
+        return self.config_snapshot
+
+    def getConfigSnapshotCount(self):
+        '''
+            get the number of config snapshots built so far
+        '''
+        return self.config_snapshots
+
+    def _publishConfig(self, config):
+        '''
+            make the new config dict the actual config snapshot - the
+            caller must hold the config write lock
+        '''
+        version = self.config_snapshot[0] + 1
+        self.config_snapshot = (version, config)
+        self.config_snapshots += 1
+        return version
+
+    def setConfigNotifier(self, notifier=None):
+        '''
+            hold the notifier, which detects changes of the replicated config
+        '''
+        self.config_notifier = notifier
+
+    def getConfigNotifier(self):
+        return self.config_notifier
+
+    def recordConfigReload(self, duration):
+        '''
+            count the reloads of the config from the database
+        '''
+        self.configLock.acquire_write()
         try:
-            config = copy.deepcopy(self.config)
+            self.config_reloads += 1
+            self.config_reload_duration = duration
+            self.config_reload_duration_total += duration
         finally:
             self.configLock.release()
-        return config
+        return
+
+    def getConfigReloadStats(self):
+        '''
+            get the number and the duration of the config reloads
+
+            :return: dict with the reload count, the duration of the last
+                     reload and the accumulated duration in seconds
+        '''
+        return {'reload_count': self.config_reloads,
+                'reload_duration': self.config_reload_duration,
+                'reload_duration_total': self.config_reload_duration_total,
+                }
+
+    def getPolicySet(self, version):
+        '''
+            get the compiled policies, if they are built from the
+            given config version
+        '''
+        policy_set = self.policy_set
+        if policy_set is not None and policy_set[0] == version:
+            return policy_set[1]
+        return None
+
+    def setPolicySet(self, version, policy_set):
+        '''
+            hold the compiled policies of the given config version
+        '''
+        if version == self.getConfigVersion():
+            self.policy_set = (version, policy_set)
+        return
+
+    def setUserCache(self, user_cache=None):
+        '''
+            hold the process wide cache of the user resolution
+        '''
+        self.user_cache = user_cache
+
+    def getUserCache(self):
+        return self.user_cache
+
+    def setChallengeStore(self, challenge_store=None):
+        '''
+            hold the challenge store and its sweeper
+        '''
+        self.challenge_store = challenge_store
+
+    def getChallengeStore(self):
+        return self.challenge_store
+
+    def setTokenCounter(self, token_counter=None):
+        '''
+            hold the reconcile job of the token counters
+        '''
+        self.token_counter = token_counter
+
+    def getTokenCounter(self):
+        return self.token_counter
 
     def setTokenclasses(self, tcl):
         self.tokenclasses = tcl
@@ -124,11 +241,12 @@ class Globals(object):
                 err = 'cannot set global config from object ' + ty
 
             else:
-                conf = copy.deepcopy(config)
                 if replace == True:
-                    self.config = conf
+                    conf = dict(config)
                 else:
-                    self.config.update(conf)
+                    conf = dict(self.getConfig())
+                    conf.update(config)
+                self._publishConfig(conf)
         finally:
             self.configLock.release()
             if err is not None:
@@ -164,13 +282,15 @@ class Globals(object):
         try:
             ty = type(conf).__name__
 
+            config = dict(self.getConfig())
             if ty == 'list' or ty == 'dict':
                 for k in conf:
-                    if self.config.has_key(k):
-                        del self.config[k]
+                    if config.has_key(k):
+                        del config[k]
             elif ty == 'str' or ty == 'unicode':
-                if self.config.has_key(conf):
-                    del self.config[conf]
+                if config.has_key(conf):
+                    del config[conf]
+            self._publishConfig(config)
         finally:
             self.configLock.release()
         return
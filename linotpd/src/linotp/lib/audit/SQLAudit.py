@@ -36,7 +36,9 @@ uses a public/private key for signing the log entries
 """
 
 import datetime
-from sqlalchemy import schema, types, orm, and_, or_, asc, desc
+import threading
+from sqlalchemy import schema, types, orm
+from sqlalchemy import bindparam
 
 ## TODO: the wildcard import is bad!!
 from migrate import *
@@ -44,8 +46,19 @@ from migrate import *
 from M2Crypto import EVP, RSA
 from binascii import hexlify
 from binascii import unhexlify
+from base64 import b64decode
 from sqlalchemy import create_engine
 from linotp.lib.audit.base import AuditBase
+from linotp.lib.audit.writer import getAsyncWriter
+from linotp.lib.audit.chain import AuditChain
+from linotp.lib.audit.chain import ChainVerifier
+from linotp.lib.audit.chain import chain_hash
+from linotp.lib.audit.chain import parse_signature
+from linotp.lib.audit.chain import LINK
+from linotp.lib.audit.chain import CHECKPOINT
+from linotp.lib.audit.chain import DEFAULT_CHECKPOINT_INTERVAL
+from linotp.lib.audit.rotation import getAuditRotation
+import linotp.lib.audit.search as audit_search
 from pylons import config
 
 import logging.config
@@ -75,13 +88,13 @@ audit_table = schema.Table(audit_table_name, metadata,
     schema.Column('id', types.Integer, schema.Sequence('audit_seq_id',
                                                        optional=True),
                   primary_key=True),
-    schema.Column('timestamp', types.Unicode(30), default=now, index=True),
+    schema.Column('timestamp', types.Unicode(30), default=now),
     schema.Column('signature', types.Unicode(512), default=u''),
-    schema.Column('action', types.Unicode(30), index=True),
+    schema.Column('action', types.Unicode(30)),
     schema.Column('success', types.Unicode(30), default=u"False"),
-    schema.Column('serial', types.Unicode(30), index=True),
+    schema.Column('serial', types.Unicode(30)),
     schema.Column('tokentype', types.Unicode(40)),
-    schema.Column('user', types.Unicode(255), index=True),
+    schema.Column('user', types.Unicode(255)),
     schema.Column('realm', types.Unicode(255), index=True),
     schema.Column('administrator', types.Unicode(255)),
     schema.Column('action_detail', types.Unicode(512), default=u''),
@@ -92,6 +105,20 @@ audit_table = schema.Table(audit_table_name, metadata,
     schema.Column('clearance_level', types.Integer, default=0)
 )
 
+# the indexes of the common search filters - the rows of a filter are
+# sorted by their id or timestamp, so that the pages of a search are
+# selected by the index
+AUDIT_INDEXES = [
+    ('timestamp_id', ['timestamp', 'id']),
+    ('serial_id', ['serial', 'id']),
+    ('user_realm_id', ['user', 'realm', 'id']),
+    ('action_id', ['action', 'id']),
+]
+
+for index_name, columns in AUDIT_INDEXES:
+    schema.Index('ix_%s_%s' % (audit_table_name, index_name),
+                 *[audit_table.c[column] for column in columns])
+
 
 AUDIT_ENCODE = ["action", "serial", "success", "user", "realm", "tokentype",
                 "administrator", "action_detail", "info", "linotp_server",
@@ -223,6 +250,11 @@ class AuditTable(object):
 
 orm.mapper(AuditTable, audit_table)
 
+# the update of the signatures of a batch of new audit rows
+sign_update = audit_table.update().\
+                where(audit_table.c.id == bindparam('audit_id')).\
+                values(signature=bindparam('signature'))
+
 ########################################################################################
 
 class Audit(AuditBase):
@@ -260,8 +292,10 @@ class Audit(AuditBase):
                                    autocommit=True, expire_on_commit=True)
         self.session = orm.scoped_session(self.sm)
 
-        # initialize signing keys
+        # initialize signing keys - the private key is loaded only once
         self.readKeys()
+        self.SignEVP = EVP.load_key_string(self.private)
+        self.sign_lock = threading.Lock()
 
         self.PublicKey = RSA.load_pub_key(config.get("linotpAudit.key.public"))
         self.VerifyEVP = EVP.PKey()
@@ -276,6 +310,21 @@ class Audit(AuditBase):
             # Obviously we already migrated the database.
             log.info("[__init__] Error during database migration: %r" % exx)
 
+        # with the 'chain' integrity the rows are hash chained and only the
+        # checkpoints are signed - otherwise every row is signed
+        self.chain = None
+        integrity = config.get("linotpAudit.integrity", "signature")
+        if integrity.strip().lower() == 'chain':
+            interval = int(config.get("linotpAudit.chain.checkpoint",
+                                      DEFAULT_CHECKPOINT_INTERVAL))
+            self.chain = AuditChain(self._sign_data,
+                                    checkpoint_interval=interval)
+
+        # the optional writer thread, which stores the entries in batches
+        self.writer = getAsyncWriter(config, self._store)
+
+        # the optional rotation of the audit table into time buckets
+        self.rotation = getAuditRotation(config, self.engine, audit_table)
 
     def _attr_to_dict(self, audit_line):
 
@@ -311,14 +360,22 @@ class Audit(AuditBase):
         s_audit = getAsString(line)
         log.debug("[_sign] signing %s" % s_audit)
 
-        key = EVP.load_key_string(self.private)
-        key.reset_context(md='sha256')
-        key.sign_init()
-        key.sign_update(s_audit)
-        signature = key.sign_final()
+        signature = self._sign_data(s_audit)
         log.debug("[_sign] signature : %s" % hexlify(signature))
         return hexlify(signature)
 
+    def _sign_data(self, data):
+        '''
+        create the binary RSA signature of a string
+        '''
+        with self.sign_lock:
+            key = self.SignEVP
+            key.reset_context(md='sha256')
+            key.sign_init()
+            key.sign_update(data)
+            signature = key.sign_final()
+        return signature
+
 
     def _verify(self, auditline, signature):
         '''
@@ -332,12 +389,18 @@ class Audit(AuditBase):
         s_audit = getAsString(auditline)
         log.debug("[_verify] verifying %s" % s_audit)
 
-        self.VerifyEVP.verify_init()
-        self.VerifyEVP.verify_update(s_audit)
-        res = self.VerifyEVP.verify_final(unhexlify(signature))
+        res = self._verify_data(s_audit, unhexlify(signature))
 
         return res
 
+    def _verify_data(self, data, signature):
+        '''
+        verify the binary RSA signature of a string
+        '''
+        self.VerifyEVP.verify_init()
+        self.VerifyEVP.verify_update(data)
+        return self.VerifyEVP.verify_final(signature) == 1
+
     def log(self, param):
         '''
         This method is used to log the data. It splits information of
@@ -349,15 +412,25 @@ class Audit(AuditBase):
             serial = param.get('serial', '') or ''
             if not serial:
                 ## if no serial, do as before
-                self.log_entry(param)
+                entries = [self._entry(param)]
             else:
                 ## look if we have multiple serials inside
+                entries = []
                 serials = serial.split(',')
                 for serial in serials:
                     p = {}
                     p.update(param)
                     p['serial'] = serial
-                    self.log_entry(p)
+                    entries.append(self._entry(p))
+
+            if self.rotation is not None:
+                self.rotation.start()
+
+            if self.writer is not None:
+                for entry in entries:
+                    self.writer.put(entry)
+            else:
+                self._store(entries)
 
             #self.session.commit()
             log.debug("[log] writing log done!")
@@ -378,8 +451,19 @@ class Audit(AuditBase):
         This method is used to log the data.
         It should hash the data and do a hash chain and sign the data
         '''
+        entry = self._entry(param)
+        if self.writer is not None:
+            self.writer.put(entry)
+        else:
+            self._store([entry])
+
+    def _entry(self, param):
+        '''
+        create the audit db entry from the audit parameters - the entry is
+        created in the request, so the timestamp is the one of the request
+        '''
 
-        at = AuditTable(
+        return AuditTable(
                     serial=param.get('serial'),
                     action=param.get('action'),
                     success=1 if param.get('success') else 0,
@@ -395,12 +479,162 @@ class Audit(AuditBase):
                     clearance_level=param.get('clearance_level')
             )
 
-        self.session.add(at)
-        self.session.flush()
-        # At this point "at" contains the primary key id
-        at.signature = self._sign(at)
-        self.session.merge(at)
-        self.session.flush()
+    def _store(self, entries):
+        '''
+        store and sign the audit entries in one transaction
+
+        The ids of the entries are required for the signature, so the rows
+        are inserted first. The signatures of all rows are then written by
+        one executemany update.
+
+        With the 'chain' integrity the chain is locked until the rows are
+        committed, so that the rows of one process form one chain in the
+        order of their ids.
+
+        :param entries: list of AuditTable entries
+        '''
+        if self.chain is None:
+            return self._store_entries(entries)
+
+        with self.chain.lock:
+            try:
+                return self._store_entries(entries)
+            except Exception:
+                # the chain must not refer to rows, which are not stored
+                self.chain.reset()
+                raise
+
+    def _store_entries(self, entries):
+        session = self.session()
+        session.begin()
+        try:
+            session.add_all(entries)
+            session.flush()
+            # At this point the entries contain the primary key id
+            signatures = [{'audit_id': at.id, 'signature': self._seal(at)}
+                          for at in entries]
+            session.execute(sign_update, signatures)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.expunge_all()
+        return
+
+    def _seal(self, audit_line):
+        '''
+        :return: the value of the signature column - the RSA signature or
+                 the chain link of the row
+        '''
+        if self.chain is None:
+            return self._sign(audit_line)
+
+        s_audit = getAsString(self._attr_to_dict(audit_line))
+        return self.chain.link(audit_line.id, s_audit)
+
+    def _check(self, line, signature):
+        '''
+        check the signature column of a single row
+
+        A chained row can only be checked against its own chain hash. As
+        this hash is not keyed, the row is not reported as verified - the
+        chain up to the next signed checkpoint is only verified by
+        verifyChain, see system/verifyAudit.
+
+        :return: the check state 'OK', 'FAIL' or 'CHAINED'
+        '''
+        (kind, _prev_id, prev_hash, value) = parse_signature(signature)
+        if kind == LINK:
+            if value != chain_hash(prev_hash, getAsString(line)):
+                return "FAIL"
+            return "CHAINED"
+        if kind == CHECKPOINT:
+            row_hash = chain_hash(prev_hash, getAsString(line))
+            try:
+                if self._verify_data(row_hash, b64decode(value)):
+                    return "OK"
+            except Exception as exx:
+                log.warning("[_check] invalid checkpoint: %r" % exx)
+            return "FAIL"
+        if self._verify(line, signature) == 1:
+            return "OK"
+        return "FAIL"
+
+    def verifyChain(self, start_id=None, end_id=None, max_failed=100):
+        '''
+        verify the integrity of a range of audit rows in one pass
+
+        The rows are read in the order of their ids and every checkpoint
+        signature covers all rows of its chain before. Rows signed in the
+        former per row mode are verified on their own. The ids of the
+        audit table continue the ids of its buckets, so the buckets are
+        read before the audit table.
+
+        :param start_id: the first audit id or None
+        :param end_id: the last audit id or None
+        :param max_failed: the max number of reported failed row ids
+        :return: dict with the number of rows, the verified, failed and
+                 not yet anchored rows and the list of failed row ids
+        '''
+        verifier = ChainVerifier(self._verify_data,
+                                 verify_row=self._verify_row,
+                                 max_failed=max_failed)
+
+        for table in self._getTables({}):
+            query = table.select().order_by(table.c.id)
+            if start_id is not None:
+                query = query.where(table.c.id >= int(start_id))
+            if end_id is not None:
+                query = query.where(table.c.id <= int(end_id))
+
+            result = self.engine.execute(query)
+            try:
+                for audit_line in result:
+                    line = self._decode(audit_line)
+                    verifier.add(audit_line.id, getAsString(line),
+                                 audit_line.signature)
+            finally:
+                result.close()
+
+        res = verifier.result()
+        log.info("[verifyChain] verified audit rows %r - %r: %r"
+                 % (start_id, end_id, res))
+        return res
+
+    def _verify_row(self, data, signature):
+        '''
+        verify the hex RSA signature of a row signed in the per row mode
+        '''
+        if not signature:
+            return False
+        try:
+            return self._verify_data(data, unhexlify(signature))
+        except Exception as exx:
+            log.warning("[_verify_row] invalid signature: %r" % exx)
+            return False
+
+    def getRotationStats(self):
+        '''
+        get the rotations and the archived buckets of the audit rotation
+
+        :return: dict with the rotation statistics or None, if the audit
+                 table is not rotated
+        '''
+        if self.rotation is None:
+            return None
+        return self.rotation.getStats()
+
+    def getWriterStats(self):
+        '''
+        get the backlog and the latency of the asynchronous audit writer
+
+        :return: dict with the writer statistics or None, if the entries
+                 are written synchronously
+        '''
+        if self.writer is None:
+            return None
+        return self.writer.getStats()
 
 
     def initialize_log(self, param):
@@ -419,62 +653,10 @@ class Audit(AuditBase):
         pass
 
 
-    def _buildCondition(self, param, AND):
+    def _decode(self, audit_line):
         '''
-        create the sqlalchemy condition from the params
+        convert the audit db row to a dict of unicode values
         '''
-        conditions = []
-        boolCheck = and_
-        if not AND:
-            boolCheck = or_
-
-        log.debug("[_buildCondition] building condition for params %s with %s"
-                  % (param, AND))
-
-        for k, v in param.items():
-            if "" != v:
-                if "serial" == k:
-                    conditions.append(AuditTable.serial.like(v))
-                elif "user" == k:
-                    conditions.append(AuditTable.user.like(v))
-                elif "realm" == k:
-                    conditions.append(AuditTable.realm.like(v))
-                elif "action" == k:
-                    conditions.append(AuditTable.action.like(v))
-                elif "action_detail" == k:
-                    conditions.append(AuditTable.action_detail.like(v))
-                elif "date" == k:
-                    conditions.append(AuditTable.timestamp.like(v))
-                elif "number" == k:
-                    conditions.append(AuditTable.id.like(v))
-                elif "success" == k:
-                    conditions.append(AuditTable.success.like(v))
-                elif "tokentype" == k:
-                    conditions.append(AuditTable.tokentype.like(v))
-                elif "administrator" == k:
-                    conditions.append(AuditTable.administrator.like(v))
-                elif "info" == k:
-                    conditions.append(AuditTable.info.like(v))
-                elif "linotp_server" == k:
-                    conditions.append(AuditTable.linotp_server.like(v))
-                elif "client" == k:
-                    conditions.append(AuditTable.client.like(v))
-
-        all_conditions = None
-        if conditions:
-            all_conditions = boolCheck(*conditions)
-
-        log.debug("[_buildCondition] return %s" % all_conditions)
-        return all_conditions
-
-    def row2dict(self, audit_line):
-        """
-        convert an SQL audit db to a audit dict
-
-        :param audit_line: audit db row
-        :return: audit entry dict
-        """
-
         line = self._attr_to_dict(audit_line)
 
         ## if we have an \uencoded data, we extract the unicode back
@@ -484,16 +666,22 @@ class Audit(AuditBase):
                 line[key] = value
             elif value is None:
                 line[key] = ''
+        return line
+
+    def row2dict(self, audit_line):
+        """
+        convert an SQL audit db to a audit dict
+
+        :param audit_line: audit db row
+        :return: audit entry dict
+        """
+
+        line = self._decode(audit_line)
 
         # Signature check
-        # TODO: use instead the verify_init
         log.debug("[search] old sig = %s" % audit_line.signature)
 
-        res = self._verify(line, audit_line.signature)
-        if res == 1:
-            line['sig_check'] = "OK"
-        else:
-            line['sig_check'] = "FAIL"
+        line['sig_check'] = self._check(line, audit_line.signature)
 
 
         return line
@@ -505,6 +693,11 @@ class Audit(AuditBase):
         param:
             Search parameters can be passed.
 
+        rp_dict:
+            the sort order and the page - a page is selected by its
+            number or by the cursor of the former page. Without a page all
+            audit entries are returned batch by batch.
+
         return:
             a result object which has to be converted with iter() to an
             iterator
@@ -520,100 +713,52 @@ class Audit(AuditBase):
         log.debug("[search] got the params %s" % param)
         log.debug("[search] got the rp_dict %s" % rp_dict)
 
-        # build the condition / WHERE clause
-        condition = self._buildCondition(param, AND)
-        log.debug("[search] the following condition was built from the "
-                  "parameters %s (%s): %s" % (param, AND, condition))
-
-        order = AuditTable.id
-        if rp_dict.get("sortname"):
-            sortn = rp_dict.get('sortname').lower()
-            if "serial" == sortn:
-                order = AuditTable.serial
-            elif "number" == sortn:
-                order = AuditTable.id
-            elif "user" == sortn:
-                order = AuditTable.user
-            elif "action" == sortn:
-                order = AuditTable.action
-            elif "action_detail" == sortn:
-                order = AuditTable.action_detail
-            elif "realm" == sortn:
-                order = AuditTable.realm
-            elif "date" == sortn:
-                order = AuditTable.timestamp
-            elif "administrator" == sortn:
-                order = AuditTable.administrator
-            elif "success" == sortn:
-                order = AuditTable.success
-            elif "tokentype" == sortn:
-                order = AuditTable.tokentype
-            elif "info" == sortn:
-                order = AuditTable.info
-            elif "linotp_server" == sortn:
-                order = AuditTable.linotp_server
-            elif "client" == sortn:
-                order = AuditTable.client
-            elif "log_level" == sortn:
-                order = AuditTable.log_level
-            elif "clearance_level" == sortn:
-                order = AuditTable.clearance_level
-
-        # build the ordering
-        order_dir = asc(order)
-
-        if rp_dict.get("sortorder"):
-            sorto = rp_dict.get('sortorder').lower()
-            if "desc" == sorto:
-                order_dir = desc(order)
-
-        if type(condition).__name__ == 'NoneType':
-            audit_q = self.session.query(AuditTable)\
-                .order_by(order_dir)
-        else:
-            audit_q = self.session.query(AuditTable)\
-                .filter(condition)\
-                .order_by(order_dir)
-
-        # FIXME? BUT THIS IS SO MUCH SLOWER!
-        # FIXME: Here desc() ordering also does not work! :/
-
-        if 'rp' in rp_dict or 'page' in rp_dict:
-            # build the LIMIT and OFFSET
-            page = 1
-            offset = 0
-            limit = 15
-
-            if 'rp' in rp_dict:
-                limit = int(rp_dict.get('rp'))
+        ## we drop here the ORM due to memory consumption
+        ## and return a resultproxy for row iteration
+        return audit_search.searchTables(self.session.execute,
+                                         self._getTables(param, AND),
+                                         param, AND=AND, rp_dict=rp_dict)
 
-            if 'page' in rp_dict:
-                page = int(rp_dict.get('page'))
+    def _getTables(self, param, AND=True):
+        '''
+        get the audit table and the buckets, which contain the entries of
+        the searched period
 
-            offset = limit * (page - 1)
+        :return: list of the audit tables
+        '''
+        if self.rotation is None:
+            return [audit_table]
 
-            start = offset
-            stop = offset + limit
-            audit_q = audit_q.slice(start, stop)
+        # with OR the entries outside of the period are found as well
+        if not AND:
+            return self.rotation.getTables()
 
-        ## we drop here the ORM due to memory consumption
-        ## and return a resultproxy for row iteration
-        result = self.session.execute(audit_q.statement)
-        return result
+        return self.rotation.getTables(
+                        date_from=param.get(audit_search.PERIOD_FROM),
+                        date_to=param.get(audit_search.PERIOD_TO))
 
+    def getCursor(self, audit_line, rp_dict=None):
+        '''
+        get the cursor of the page, which follows the audit row
 
+        :param audit_line: the last audit row of the current page
+        :param rp_dict: the sort order of the search
+        :return: the cursor string
+        '''
+        return audit_search.getCursor(audit_table, audit_line, rp_dict or {})
 
     def getTotal(self, param, AND=True, display_error=True):
         '''
         This method returns the total number of audit entries in
         the audit store
         '''
-        condition = self._buildCondition(param, AND)
-        log.debug("[getTotal] condition: %s" % condition)
-        if type(condition).__name__ == 'NoneType':
-            c = self.session.query(AuditTable).count()
-        else:
-            c = self.session.query(AuditTable).filter(condition).count()
+        if 'or' in param:
+            if "true" == param['or'].lower():
+                AND = False
+
+        c = sum([audit_search.getTotal(self.session.execute, table,
+                                       param, AND=AND)
+                 for table in self._getTables(param, AND)])
 
         log.debug("[getTotal] count=%s " % str(c))
         return c
@@ -184,6 +184,34 @@ class AuditBase(object):
         '''
         return iter([])
 
+    def getCursor(self, audit_line, rp_dict=None):
+        '''
+        This function returns the cursor of the search page, which follows
+        the audit entry.
+        '''
+        return None
+
+    def verifyChain(self, start_id=None, end_id=None, max_failed=100):
+        '''
+        This function verifies the integrity of a range of audit entries.
+        '''
+        return {'rows': 0, 'verified': 0, 'failed': 0, 'unanchored': 0,
+                'failed_ids': []}
+
+    def getWriterStats(self):
+        '''
+        This function returns the statistics of the asynchronous audit
+        writer or None, if the entries are written synchronously.
+        '''
+        return None
+
+    def getRotationStats(self):
+        '''
+        This function returns the statistics of the audit table rotation
+        or None, if the audit table is not rotated.
+        '''
+        return None
+
 
 def search(param, user=None, columns=None):
 
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+hash chained audit signatures
+
+In the 'chain' integrity mode an audit row is not signed on its own.
+Instead every row carries the sha256 hash over the hash of its predecessor
+and its own content. Only every n-th row - the checkpoint - carries an RSA
+signature of its chain hash, which covers all rows of the chain before.
+
+As several processes and nodes write into the same audit table, there is
+one chain per writer. Every row refers to the id of its predecessor, a
+new chain starts with a checkpoint, which refers to the id 0.
+
+The signature column holds
+
+    h:<prev id>:<prev hash>:<hash>          for a chained row
+    c:<prev id>:<prev hash>:<rsa signature> for a checkpoint row
+
+The rows signed by the former mode contain the hex RSA signature only.
+"""
+
+import os
+import base64
+import hashlib
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+LINK = 'h'
+CHECKPOINT = 'c'
+SIGNATURE = 'rsa'
+
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+
+
+def chain_hash(prev_hash, data):
+    '''
+    the chain hash of a row
+
+    :param prev_hash: the hex chain hash of the predecessor or ''
+    :param data: the audit row as string - see getAsString
+    :return: the hex sha256 hash
+    '''
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return hashlib.sha256(str(prev_hash) + ':' + data).hexdigest()
+
+
+def parse_signature(value):
+    '''
+    split the content of the signature column
+
+    :return: tuple of kind, prev id, prev hash and the hash or signature -
+             kind is LINK, CHECKPOINT or SIGNATURE for the former per row
+             RSA signature
+    '''
+    value = value or ''
+    parts = value.split(':')
+    if len(parts) == 4 and parts[0] in (LINK, CHECKPOINT):
+        try:
+            return (parts[0], int(parts[1]), parts[2], parts[3])
+        except ValueError:
+            pass
+    return (SIGNATURE, None, None, value)
+
+
+class AuditChain(object):
+    '''
+    the chain state of one audit writer
+    '''
+
+    def __init__(self, sign, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        '''
+        :param sign: function, which returns the binary RSA signature of
+                     the given string
+        :param checkpoint_interval: the number of rows between checkpoints
+        '''
+        self.sign = sign
+        self.checkpoint_interval = checkpoint_interval
+        self.lock = threading.Lock()
+
+        self.reset()
+        self.checkpoints = 0
+        self.links = 0
+
+    def reset(self):
+        '''
+        start a new chain - used after the rows of a chain could not be
+        stored, so that no row refers to a missing predecessor. A forked
+        process starts its own chain as well.
+        '''
+        self.pid = os.getpid()
+        self.prev_id = 0
+        self.prev_hash = ''
+        self.count = 0
+
+    def link(self, row_id, data):
+        '''
+        append the row to the chain
+
+        :param row_id: the id of the row
+        :param data: the audit row as string
+        :return: the value of the signature column
+        '''
+        if self.pid != os.getpid():
+            self.reset()
+
+        row_hash = chain_hash(self.prev_hash, data)
+
+        if self.prev_id == 0 or self.count >= self.checkpoint_interval:
+            signature = base64.b64encode(self.sign(row_hash))
+            value = "%s:%d:%s:%s" % (CHECKPOINT, self.prev_id,
+                                     self.prev_hash, signature)
+            self.count = 0
+            self.checkpoints += 1
+        else:
+            value = "%s:%d:%s:%s" % (LINK, self.prev_id, self.prev_hash,
+                                     row_hash)
+            self.links += 1
+
+        self.prev_id = row_id
+        self.prev_hash = row_hash
+        self.count += 1
+        return value
+
+
+class ChainVerifier(object):
+    '''
+    verify a range of audit rows in one pass
+
+    The rows have to be added in the order of their ids. A row is verified,
+    if its hash and the link to its predecessor are valid up to the next
+    valid checkpoint of its chain. The rows after the last checkpoint of a
+    chain are reported as unanchored.
+    '''
+
+    def __init__(self, verify, verify_row=None, max_failed=100):
+        '''
+        :param verify: function, which verifies the binary RSA signature of
+                       a chain hash: verify(hash, signature) -> bool
+        :param verify_row: function, which verifies a row signed in the
+                           former per row mode: verify_row(data, signature)
+        :param max_failed: the max number of reported failed row ids
+        '''
+        self.verify = verify
+        self.verify_row = verify_row
+        self.max_failed = max_failed
+
+        # the chain tips: row id -> (chain hash, chain state)
+        self.tips = {}
+        self.first_id = None
+
+        self.rows = 0
+        self.verified = 0
+        self.failed = 0
+        self.failed_ids = []
+
+    def _fail(self, row_ids):
+        self.failed += len(row_ids)
+        room = self.max_failed - len(self.failed_ids)
+        if room > 0:
+            self.failed_ids.extend(row_ids[:room])
+
+    def add(self, row_id, data, value):
+        '''
+        verify the next row
+
+        :param row_id: the id of the row
+        :param data: the audit row as string
+        :param value: the content of the signature column
+        '''
+        self.rows += 1
+        if self.first_id is None:
+            self.first_id = row_id
+
+        (kind, prev_id, prev_hash, value) = parse_signature(value)
+
+        if kind == SIGNATURE:
+            if self.verify_row is not None and self.verify_row(data, value):
+                self.verified += 1
+            else:
+                self._fail([row_id])
+            return
+
+        row_hash = chain_hash(prev_hash, data)
+
+        tip = self.tips.pop(prev_id, None)
+        if tip is not None:
+            (tip_hash, state) = tip
+            state['ok'] = state['ok'] and tip_hash == prev_hash
+        else:
+            # a new chain, a chain started before the range or a row,
+            # whose predecessor is missing or has another successor
+            missing = prev_id != 0 and prev_id >= self.first_id
+            state = {'ok': not missing, 'pending': []}
+            if prev_id == 0 and kind != CHECKPOINT:
+                state['ok'] = False
+
+        state['pending'].append(row_id)
+
+        if kind == LINK:
+            if value != row_hash:
+                state['ok'] = False
+        else:
+            try:
+                valid = self.verify(row_hash, base64.b64decode(value))
+            except Exception as exx:
+                log.warning("[add] invalid checkpoint %r: %r"
+                            % (row_id, exx))
+                valid = False
+
+            if state['ok'] and valid:
+                self.verified += len(state['pending'])
+            else:
+                self._fail(state['pending'])
+            state = {'ok': True, 'pending': []}
+
+        self.tips[row_id] = (row_hash, state)
+        return
+
+    def result(self):
+        '''
+        :return: dict with the number of rows, the verified, the failed and
+                 the not yet anchored rows and the first failed row ids
+        '''
+        unanchored = 0
+        failed = list(self.failed_ids)
+        failed_count = self.failed
+        for (_hash, state) in self.tips.values():
+            if state['ok']:
+                unanchored += len(state['pending'])
+            else:
+                failed_count += len(state['pending'])
+                failed.extend(state['pending'])
+
+        return {'rows': self.rows,
+                'verified': self.verified,
+                'failed': failed_count,
+                'unanchored': unanchored,
+                'failed_ids': sorted(failed)[:self.max_failed],
+                }
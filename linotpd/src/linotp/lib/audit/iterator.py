@@ -116,6 +116,11 @@ class AuditQuery(object):
         if 'rp' in param:
             self._rp_dict['rp'] = param.get('rp', '15') or '15'
 
+        # with a cursor - even an empty one for the first page - the page
+        # follows the last entry of the former page
+        if 'cursor' in param:
+            self._rp_dict['cursor'] = param.get('cursor') or ''
+
         self._rp_dict['sortname'] = param.get('sortname')
         self._rp_dict['sortorder'] = param.get('sortorder')
         log.debug("[search] rp_dict: %s" % self._rp_dict)
@@ -166,8 +171,28 @@ class AuditQuery(object):
         return entry
 
     def get_total(self):
+        # the total is only counted for the first page of a cursor search
+        if self._rp_dict.get('cursor'):
+            return None
         return self._audit.getTotal(self._search_dict)
 
+    def with_cursor(self):
+        return 'cursor' in self._rp_dict
+
+    def get_pagesize(self):
+        return int(self._rp_dict.get('rp', 15))
+
+    def get_cursor(self, row):
+        """
+        get the cursor of the page, which follows the row
+
+        :param row: the last row of the page or None
+        :return: the cursor or None, if there is no further page
+        """
+        if row is None:
+            return None
+        return self._audit.getCursor(row, rp_dict=self._rp_dict)
+
 class JSONAuditIterator(object):
     """
     default audit output generator in json format
@@ -182,6 +207,8 @@ class JSONAuditIterator(object):
         self.page = audit_query.get_page()
         self.i = 0
         self.closed = False
+        self.rows = 0
+        self.last_row = None
 
     def next(self):
         """
@@ -201,10 +228,20 @@ class JSONAuditIterator(object):
             row_data = self.result.next()
             entry = self.audit_query.get_entry(row_data)
             res = "%s %s" % (res, json.dumps(entry, indent=3))
+            self.rows = self.rows + 1
+            self.last_row = row_data
 
         except StopIteration as exx:
             if self.closed == False:
-                res = '%s ], "total": %d }' % (prefix, self.audit_query.get_total())
+                res = '%s ], "total": %s' % (prefix, json.dumps(
+                                            self.audit_query.get_total()))
+                if self.audit_query.with_cursor():
+                    # a short page is the last one
+                    cursor = None
+                    if self.rows == self.audit_query.get_pagesize():
+                        cursor = self.audit_query.get_cursor(self.last_row)
+                    res = '%s, "cursor": %s' % (res, json.dumps(cursor))
+                res = '%s }' % res
                 self.closed = True
             else:
                 log.info("returned %d entries" % self.i)
@@ -0,0 +1,630 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+rotation of the audit table into time buckets
+
+The audit table is rotated by the AuditRotation thread: as soon as the
+table contains entries of a former period, it is renamed to the bucket
+<audit table>_<YYYYMMDD> - named by the start of the current period - and
+an empty audit table takes its place. Renaming and dropping a table does
+not depend on the number of its rows. The ids of the new table continue
+the ids of the former one, so the signatures and the chain links of the
+entries stay valid:
+
+    linotpAudit.retention.bucket = day | week | month
+    linotpAudit.retention.days = 365
+    linotpAudit.retention.archive = /var/lib/linotp/audit
+    linotpAudit.retention.interval = 3600
+
+A bucket, whose newest entry is older than the retention days, is written
+to the archive directory as gzip compressed file of json lines - one line
+with all columns, including the signature, per entry - and then dropped.
+Without an archive directory the expired buckets are kept.
+
+The audit search reads the audit table and the buckets, which overlap the
+searched period.
+
+Every server process runs the rotation thread, but only one process of
+all nodes rotates and archives at a time: a run is skipped, unless the
+process holds the lease of the lock row in the <audit table>_lock table.
+"""
+
+import os
+import re
+import gzip
+import time
+import socket
+import binascii
+import logging
+import datetime
+import tempfile
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import sqlalchemy as sa
+
+from sqlalchemy import schema
+from sqlalchemy import types
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+
+from linotp.lib.audit.search import streamRows
+from linotp.lib.worker import PeriodicWorker
+
+log = logging.getLogger(__name__)
+
+BUCKET_PERIODS = ('day', 'week', 'month')
+
+#  the format of the audit timestamp
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+#  the gap between the last id of the bucket and the first id of the new
+#  audit table, which covers the entries written during the rotation
+ID_GAP = 1000
+
+#  the seconds, for which the list of buckets is cached
+BUCKET_CACHE_TTL = 60
+
+#  the seconds, for which a process holds the rotation lock - the lease is
+#  renewed for every bucket, it only expires if the process died
+LOCK_LEASE = 3600
+
+
+def periodStart(now, period):
+    '''
+    get the start of the bucket period, which contains the given time
+
+    :param now: the datetime
+    :param period: 'day', 'week' or 'month'
+    :return: the datetime of the period start
+    '''
+    day = datetime.datetime(now.year, now.month, now.day)
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def copyColumn(column):
+    '''
+    copy a column without its index and unique flags - otherwise the copy
+    would define an index named by the new table
+    '''
+    new_column = column.copy()
+    new_column.index = None
+    new_column.unique = None
+    return new_column
+
+
+def copyTable(table, name, metadata, index_prefix=None):
+    '''
+    define a table with the columns of the audit table
+
+    The index names are unique per database, so the indexes of the audit
+    table are only copied with an own name prefix.
+
+    :param table: the audit table
+    :param name: the name of the new table
+    :param metadata: the metadata of the new table
+    :param index_prefix: the prefix of the index names of the new table or
+                         None to copy no indexes
+    :return: the table
+    '''
+    columns = [copyColumn(column) for column in table.columns]
+    new_table = schema.Table(name, metadata, *columns,
+                             sqlite_autoincrement=True)
+    if index_prefix is None:
+        return new_table
+
+    table_prefix = 'ix_%s_' % table.name
+    for index in sorted(table.indexes, key=lambda index: index.name):
+        index_name = index.name
+        if index_name.startswith(table_prefix):
+            index_name = index_name[len(table_prefix):]
+        schema.Index('%s_%s' % (index_prefix, index_name),
+                     *[new_table.c[column.name] for column in index.columns],
+                     unique=index.unique)
+    return new_table
+
+
+def continueIds(connection, table, next_id):
+    '''
+    let the ids of the new table start with the next id
+
+    :param connection: the connection of the rotation
+    :param table: the new audit table
+    :param next_id: the first id of the new table
+    '''
+    dialect = connection.dialect.name
+    name = connection.dialect.identifier_preparer.quote(table.name)
+
+    if dialect == 'postgresql':
+        connection.execute(text("SELECT setval(pg_get_serial_sequence("
+                                ":table_name, 'id'), :last_id)"),
+                           table_name=name, last_id=next_id - 1)
+    elif dialect == 'mysql':
+        connection.execute("ALTER TABLE %s AUTO_INCREMENT = %d"
+                           % (name, next_id))
+    elif dialect == 'sqlite':
+        connection.execute(text("INSERT INTO sqlite_sequence (name, seq) "
+                                "VALUES (:table_name, :last_id)"),
+                           table_name=table.name, last_id=next_id - 1)
+    else:
+        # the ids are taken from the audit sequence, which is shared by
+        # all tables
+        log.debug("[continueIds] ids of %r are taken from the sequence"
+                  % table.name)
+    return
+
+
+def swapTables(connection, table_name, bucket_name, next_name):
+    '''
+    rename the audit table to the bucket and the new table to the audit
+    table - MySQL renames both tables at once, the other databases rename
+    them in the transaction of the rotation
+    '''
+    quote = connection.dialect.identifier_preparer.quote
+
+    if connection.dialect.name == 'mysql':
+        connection.execute("RENAME TABLE %s TO %s, %s TO %s"
+                           % (quote(table_name), quote(bucket_name),
+                              quote(next_name), quote(table_name)))
+        return
+
+    connection.execute("ALTER TABLE %s RENAME TO %s"
+                       % (quote(table_name), quote(bucket_name)))
+    connection.execute("ALTER TABLE %s RENAME TO %s"
+                       % (quote(next_name), quote(table_name)))
+    return
+
+
+class RotationLock(object):
+    '''
+    lock of the rotation across all processes and nodes - a single row,
+    whose lease is taken over by an atomic insert or update
+
+    Other than a row lock of a transaction, the lease survives the implicit
+    commits of the DDL statements on MySQL.
+    '''
+
+    def __init__(self, engine, table_name, lease=LOCK_LEASE):
+        self.engine = engine
+        self.lease = lease
+        self.table = schema.Table('%s_lock' % table_name, schema.MetaData(),
+                            schema.Column('name', types.Unicode(32),
+                                          primary_key=True),
+                            schema.Column('owner', types.Unicode(128)),
+                            schema.Column('expires', types.Float),
+                            )
+        self.created = False
+        self.owner = None
+
+    def _where(self, *conditions):
+        return and_(self.table.c.name == u'rotation', *conditions)
+
+    def acquire(self):
+        '''
+        take the lock, if it is free or its lease is expired
+
+        :return: boolean - True if this process holds the lock
+        '''
+        if not self.created:
+            self.table.create(self.engine, checkfirst=True)
+            self.created = True
+
+        owner = u'%s:%d:%s' % (socket.gethostname(), os.getpid(),
+                               binascii.hexlify(os.urandom(4)))
+        now = time.time()
+        try:
+            self.engine.execute(self.table.insert(), name=u'rotation',
+                                owner=owner, expires=now + self.lease)
+        except IntegrityError:
+            result = self.engine.execute(self.table.update()
+                            .where(self._where(self.table.c.expires < now))
+                            .values(owner=owner, expires=now + self.lease))
+            if result.rowcount != 1:
+                return False
+
+        self.owner = owner
+        return True
+
+    def renew(self):
+        '''
+        extend the lease of the lock
+
+        :return: boolean - False if the lock has been lost
+        '''
+        if self.owner is None:
+            return False
+        result = self.engine.execute(self.table.update()
+                            .where(self._where(self.table.c.owner ==
+                                               self.owner))
+                            .values(expires=time.time() + self.lease))
+        if result.rowcount != 1:
+            self.owner = None
+            return False
+        return True
+
+    def release(self):
+        if self.owner is None:
+            return
+        self.engine.execute(self.table.delete().where(
+                                self._where(self.table.c.owner == self.owner)))
+        self.owner = None
+        return
+
+
+class AuditRotation(PeriodicWorker):
+    '''
+    rotate the audit table into buckets and archive the expired buckets in
+    a background thread
+    '''
+
+    def __init__(self, engine, table, period='month', retention_days=None,
+                 archive_dir=None, interval=3600):
+        '''
+        :param engine: the engine of the audit database
+        :param table: the audit table
+        :param period: the period of a bucket - 'day', 'week' or 'month'
+        :param retention_days: the days, after which a bucket is archived
+                               and dropped or None to keep the buckets
+        :param archive_dir: the directory of the archived buckets
+        :param interval: the seconds between the rotation runs
+        '''
+        if period not in BUCKET_PERIODS:
+            raise ValueError("unknown audit bucket period %r" % period)
+
+        PeriodicWorker.__init__(self, 'linotp audit rotation', interval)
+
+        self.engine = engine
+        self.table = table
+        self.period = period
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+
+        self.bucket_pattern = re.compile(r'^%s_(\d{8})$'
+                                         % re.escape(table.name))
+        self.buckets = None
+        self.buckets_read = 0
+        self.bucket_tables = {}
+        self.bucket_ranges = {}
+        self.bucket_lock = threading.Lock()
+        self.rotation_lock = RotationLock(engine, table.name)
+
+        self.runs = 0
+        self.skipped = 0
+        self.rotated = 0
+        self.archived = 0
+        self.last_run = None
+
+    def work(self):
+        self.run()
+
+    def run(self, now=None):
+        '''
+        run one rotation and archive the expired buckets - errors are only
+        logged, as the next run will catch up. The run is skipped, if
+        another process holds the rotation lock.
+
+        :param now: the datetime of the run
+        '''
+        now = now or datetime.datetime.now()
+        try:
+            locked = self.rotation_lock.acquire()
+        except Exception as exx:
+            log.error("[run] failed to lock the audit rotation: %r" % exx)
+            locked = False
+
+        if not locked:
+            log.debug("[run] audit rotation is run by another process")
+            self.skipped += 1
+            self.last_run = time.time()
+            return
+
+        try:
+            try:
+                if self.rotate(now) is not None:
+                    self.rotated += 1
+            except Exception as exx:
+                log.error("[run] failed to rotate the audit table: %r" % exx)
+
+            try:
+                self.archived += len(self.expire(now))
+            except Exception as exx:
+                log.error("[run] failed to archive the audit buckets: %r"
+                          % exx)
+        finally:
+            try:
+                self.rotation_lock.release()
+            except Exception as exx:
+                log.error("[run] failed to unlock the audit rotation: %r"
+                          % exx)
+
+        self.runs += 1
+        self.last_run = time.time()
+        return
+
+    def getStats(self):
+        '''
+        get the number of rotation runs, rotations and archived buckets
+        '''
+        return {'runs': self.runs,
+                'skipped': self.skipped,
+                'rotated': self.rotated,
+                'archived': self.archived,
+                'last_run': self.last_run,
+                'buckets': len(self.getBuckets()),
+                }
+
+    def getBuckets(self, refresh=False):
+        '''
+        get the names of the buckets in the order of their periods
+
+        :param refresh: read the buckets from the database
+        :return: list of the bucket table names
+        '''
+        with self.bucket_lock:
+            if (refresh or self.buckets is None or
+                    time.time() - self.buckets_read > BUCKET_CACHE_TTL):
+                names = sa.inspect(self.engine).get_table_names()
+                self.buckets = sorted([name for name in names
+                                       if self.bucket_pattern.match(name)])
+                self.buckets_read = time.time()
+            return list(self.buckets)
+
+    def getBucketTable(self, name):
+        '''
+        get the table definition of a bucket
+        '''
+        with self.bucket_lock:
+            if name not in self.bucket_tables:
+                self.bucket_tables[name] = copyTable(self.table, name,
+                                                     schema.MetaData())
+            return self.bucket_tables[name]
+
+    def getRange(self, name):
+        '''
+        get the timestamps of the first and the last entry of a bucket -
+        a bucket is not written any more, so its range is cached
+
+        :return: tuple of the first and the last timestamp
+        '''
+        if name not in self.bucket_ranges:
+            table = self.getBucketTable(name)
+            row = self.engine.execute(select([func.min(table.c.timestamp),
+                                              func.max(table.c.timestamp)]
+                                             )).first()
+            self.bucket_ranges[name] = (row[0], row[1])
+        return self.bucket_ranges[name]
+
+    def getTables(self, date_from=None, date_to=None):
+        '''
+        get the tables, which contain the entries of the period
+
+        :param date_from: the first timestamp of the period or None
+        :param date_to: the timestamp after the period or None
+        :return: list of the bucket tables and the audit table
+        '''
+        tables = []
+        for name in self.getBuckets():
+            if date_from or date_to:
+                (first, last) = self.getRange(name)
+                if first is None:
+                    continue
+                if date_from and last < date_from:
+                    continue
+                if date_to and first >= date_to:
+                    continue
+            tables.append(self.getBucketTable(name))
+
+        tables.append(self.table)
+        return tables
+
+    def rotate(self, now=None):
+        '''
+        rename the audit table to a bucket, if it contains entries of a
+        former period
+
+        :param now: the datetime of the rotation
+        :return: the name of the new bucket or None
+        '''
+        now = now or datetime.datetime.now()
+        start = periodStart(now, self.period)
+
+        first = self.engine.execute(select([func.min(self.table.c.timestamp)])
+                                    ).scalar()
+        if first is None or first >= start.strftime(TIMESTAMP_FORMAT):
+            return None
+
+        table_name = self.table.name
+        bucket_name = '%s_%s' % (table_name, start.strftime('%Y%m%d'))
+        next_name = '%s_next' % table_name
+
+        # MySQL commits every DDL statement on its own, so the rotation is
+        # not one transaction there - the rotation lock of the run keeps
+        # the other processes away from the next table
+
+        # the indexes of the new table are named by its period, as the
+        # bucket keeps the indexes of the former table
+        index_prefix = 'ix_%s_%s' % (table_name, start.strftime('%Y%m%d'))
+        next_table = copyTable(self.table, next_name, schema.MetaData(),
+                               index_prefix=index_prefix)
+
+        quote = self.engine.dialect.identifier_preparer.quote
+        with self.engine.begin() as connection:
+            if self.engine.dialect.has_table(connection, bucket_name):
+                log.warning("[rotate] audit bucket %r already exists"
+                            % bucket_name)
+                return None
+
+            next_table.drop(connection, checkfirst=True)
+            next_table.create(connection)
+
+            if connection.dialect.name == 'postgresql':
+                # no entries are written until the tables are swapped
+                connection.execute("LOCK TABLE %s IN EXCLUSIVE MODE"
+                                   % quote(table_name))
+
+            last_id = connection.execute(select([func.max(self.table.c.id)])
+                                         ).scalar() or 0
+            continueIds(connection, next_table, last_id + ID_GAP)
+            swapTables(connection, table_name, bucket_name, next_name)
+
+        self.getBuckets(refresh=True)
+        log.info("[rotate] rotated the audit table %r to %r"
+                 % (table_name, bucket_name))
+        return bucket_name
+
+    def expire(self, now=None):
+        '''
+        archive and drop the buckets, whose entries are older than the
+        retention days
+
+        :param now: the datetime of the run
+        :return: list of the archive files
+        '''
+        if not self.retention_days:
+            return []
+
+        now = now or datetime.datetime.now()
+        limit = (now - datetime.timedelta(days=self.retention_days))\
+                    .strftime(TIMESTAMP_FORMAT)
+
+        archives = []
+        for name in self.getBuckets(refresh=True):
+            (_first, last) = self.getRange(name)
+            if last is not None and last >= limit:
+                continue
+
+            if not self.archive_dir:
+                log.warning("[expire] audit bucket %r is expired, but no "
+                            "archive directory is defined" % name)
+                continue
+
+            if (self.rotation_lock.owner is not None and
+                    not self.rotation_lock.renew()):
+                log.error("[expire] lost the audit rotation lock")
+                break
+
+            # the bucket is only dropped, if this process wrote its archive
+            archives.append(self.archive(name))
+            self.drop(name)
+
+        return archives
+
+    def archive(self, name):
+        '''
+        write all entries of a bucket to a gzip compressed file of json
+        lines - the file is written to a temporary file of its own and only
+        renamed to its final name, after all entries have been written
+
+        :param name: the name of the bucket
+        :return: the path of the archive file
+        '''
+        table = self.getBucketTable(name)
+        path = os.path.join(self.archive_dir, '%s.jsonl.gz' % name)
+        (fd, tmp_path) = tempfile.mkstemp(prefix='%s.jsonl.gz.' % name,
+                                          suffix='.tmp',
+                                          dir=self.archive_dir)
+
+        entries = 0
+        try:
+            with os.fdopen(fd, 'wb') as archive_file:
+                gzip_file = gzip.GzipFile(filename='%s.jsonl' % name,
+                                          mode='wb', fileobj=archive_file)
+                try:
+                    for row in streamRows(self.engine.execute, table,
+                                          table.select(), table.c.id, False):
+                        gzip_file.write(json.dumps(dict(row.items())) + "\n")
+                        entries += 1
+                finally:
+                    gzip_file.close()
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+
+            count = self.engine.execute(select([func.count()])
+                                        .select_from(table)).scalar()
+            if count != entries:
+                raise Exception("audit bucket %r changed during the archive: "
+                                "%d of %d entries" % (name, entries, count))
+        except:
+            os.remove(tmp_path)
+            raise
+
+        os.rename(tmp_path, path)
+        log.info("[archive] archived %d entries of the audit bucket %r to "
+                 "%r" % (entries, name, path))
+        return path
+
+    def drop(self, name):
+        '''
+        drop a bucket
+        '''
+        table = self.getBucketTable(name)
+        table.drop(self.engine)
+
+        with self.bucket_lock:
+            self.bucket_tables.pop(name, None)
+            self.bucket_ranges.pop(name, None)
+            self.buckets = None
+        log.info("[drop] dropped the audit bucket %r" % name)
+        return
+
+
+def getAuditRotation(config, engine, table):
+    '''
+    create the audit rotation as defined in the ini file
+
+    :param config: the pylons config
+    :param engine: the engine of the audit database
+    :param table: the audit table
+    :return: the AuditRotation or None if the audit table is not rotated
+    '''
+    period = config.get('linotpAudit.retention.bucket')
+    if not period:
+        return None
+
+    retention_days = config.get('linotpAudit.retention.days')
+    rotation = AuditRotation(
+            engine, table,
+            period=period.strip().lower(),
+            retention_days=int(retention_days) if retention_days else None,
+            archive_dir=config.get('linotpAudit.retention.archive'),
+            interval=int(config.get('linotpAudit.retention.interval', 3600)))
+
+    log.info("[getAuditRotation] rotating the audit table %r every %s"
+             % (table.name, rotation.period))
+    return rotation
+
+###eof#########################################################################
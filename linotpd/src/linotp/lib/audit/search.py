@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+the conditions, the sort order and the pagination of the audit search
+
+The search values are compared by equality, as long as they contain no
+LIKE wildcard, so that the indexes of the audit table are used. The pages
+are either selected by their offset or - with a cursor - by the sort value
+and the id of the last row of the former page. Without a page, all rows
+are read in batches, which are selected the same way.
+
+The rows of several tables - the audit table and its buckets - are merged
+in the sort order. As the tables follow each other in the id and the
+timestamp order, an offset page of these orders is read table by table,
+the tables before the page are skipped by their number of rows.
+"""
+
+import heapq
+import logging
+import itertools
+
+from sqlalchemy import and_, or_, asc, desc
+from sqlalchemy import func
+from sqlalchemy import select
+
+from linotp.lib.util import encodeCursor
+from linotp.lib.util import decodeCursor
+
+log = logging.getLogger(__name__)
+
+#  the search parameter with the searched audit column
+SEARCH_COLUMNS = {
+    "serial": "serial",
+    "user": "user",
+    "realm": "realm",
+    "action": "action",
+    "action_detail": "action_detail",
+    "date": "timestamp",
+    "number": "id",
+    "success": "success",
+    "tokentype": "tokentype",
+    "administrator": "administrator",
+    "info": "info",
+    "linotp_server": "linotp_server",
+    "client": "client",
+}
+
+#  the search parameter of the searched period: the first timestamp and
+#  the timestamp after the period
+PERIOD_FROM = "date_from"
+PERIOD_TO = "date_to"
+
+#  the sort parameter with the sorted audit column
+SORT_COLUMNS = {
+    "serial": "serial",
+    "number": "id",
+    "user": "user",
+    "action": "action",
+    "action_detail": "action_detail",
+    "realm": "realm",
+    "date": "timestamp",
+    "administrator": "administrator",
+    "success": "success",
+    "tokentype": "tokentype",
+    "info": "info",
+    "linotp_server": "linotp_server",
+    "client": "client",
+    "log_level": "log_level",
+    "clearance_level": "clearance_level",
+}
+
+#  the default number of rows of a page
+PAGESIZE = 15
+
+#  the number of rows, which are read together, if all rows are exported
+EXPORT_BATCH = 1000
+
+
+def isPattern(value):
+    '''
+    check if the search value contains a LIKE wildcard
+    '''
+    return '%' in value or '_' in value
+
+
+def buildCondition(table, param, AND=True):
+    '''
+    create the sqlalchemy condition from the search params
+
+    :param table: the audit table
+    :param param: dict of the search parameters and values
+    :param AND: combine the conditions by AND - otherwise by OR
+    :return: the condition or None
+    '''
+    conditions = []
+    boolCheck = and_
+    if not AND:
+        boolCheck = or_
+
+    for k, v in param.items():
+        if "" == v:
+            continue
+
+        if PERIOD_FROM == k:
+            conditions.append(table.c.timestamp >= v)
+            continue
+        if PERIOD_TO == k:
+            conditions.append(table.c.timestamp < v)
+            continue
+
+        if k not in SEARCH_COLUMNS:
+            continue
+
+        column = table.c[SEARCH_COLUMNS[k]]
+        if "number" == k and v.isdigit():
+            conditions.append(column == int(v))
+        elif isPattern(v):
+            conditions.append(column.like(v))
+        else:
+            conditions.append(column == v)
+
+    if not conditions:
+        return None
+    return boolCheck(*conditions)
+
+
+def getOrder(table, rp_dict):
+    '''
+    get the sort column and the sort direction from the rp_dict
+
+    :return: tuple of the column and True, if the order is descending
+    '''
+    sortname = (rp_dict.get('sortname') or '').lower()
+    order = table.c[SORT_COLUMNS.get(sortname, 'id')]
+
+    sortorder = (rp_dict.get('sortorder') or '').lower()
+    return (order, "desc" == sortorder)
+
+
+def orderBy(table, order, descending):
+    '''
+    the complete sort order - the rows with the same sort value are sorted
+    by their id
+    '''
+    direction = desc if descending else asc
+    if order is table.c.id:
+        return [direction(order)]
+    return [direction(order), direction(table.c.id)]
+
+
+def keysetCondition(table, order, descending, position):
+    '''
+    the condition for the rows, which follow the position in the sort order
+
+    :param table: the audit table
+    :param order: the sort column
+    :param descending: True, if the order is descending
+    :param position: tuple of the sort value and the audit id
+    '''
+    (value, audit_id) = position
+    if order is table.c.id:
+        return order < audit_id if descending else order > audit_id
+    if descending:
+        return or_(order < value, and_(order == value,
+                                       table.c.id < audit_id))
+    return or_(order > value, and_(order == value, table.c.id > audit_id))
+
+
+def getCursor(table, row, rp_dict):
+    '''
+    build the cursor of the page, which follows the row
+
+    :param row: the last row of the current page
+    :return: the cursor string
+    '''
+    (order, _descending) = getOrder(table, rp_dict)
+    return encodeCursor(row[order.name], row[table.c.id.name])
+
+
+def searchQuery(execute, table, param, AND=True, rp_dict=None):
+    '''
+    search the audit rows
+
+    :param execute: the execute method of the audit session or engine
+    :param table: the audit table
+    :param param: dict of the search parameters and values
+    :param AND: combine the conditions by AND - otherwise by OR
+    :param rp_dict: dict with the sort and the page parameters
+    :return: iterable of the audit rows
+    '''
+    if rp_dict is None:
+        rp_dict = {}
+
+    query = selectRows(table, param, AND)
+
+    (order, descending) = getOrder(table, rp_dict)
+    order_by = orderBy(table, order, descending)
+
+    if 'cursor' in rp_dict:
+        # the page is selected by the position of the former page
+        position = decodeCursor(rp_dict.get('cursor'))
+        if position is not None:
+            query = query.where(keysetCondition(table, order, descending,
+                                                position))
+        limit = int(rp_dict.get('rp') or PAGESIZE)
+        return execute(query.order_by(*order_by).limit(limit))
+
+    if 'rp' in rp_dict or 'page' in rp_dict:
+        limit = int(rp_dict.get('rp') or PAGESIZE)
+        page = int(rp_dict.get('page') or 1)
+        query = query.order_by(*order_by).limit(limit)\
+                     .offset(limit * (page - 1))
+        return execute(query)
+
+    return streamRows(execute, table, query, order, descending)
+
+
+def selectRows(table, param, AND=True):
+    '''
+    the select of the audit rows of the search
+
+    :return: the select statement
+    '''
+    query = table.select()
+    condition = buildCondition(table, param, AND)
+    if condition is not None:
+        query = query.where(condition)
+    return query
+
+
+def streamRows(execute, table, query, order, descending, batch=None):
+    '''
+    read all rows of the query in batches, each selected by the position
+    of the last row of the former batch - other than a server side cursor
+    this works on every database and does not keep the connection busy,
+    while the rows are written
+
+    :param execute: the execute method of the audit session or engine
+    :param table: the audit table
+    :param query: the select of the audit rows
+    :param order: the sort column
+    :param descending: True, if the order is descending
+    :param batch: the number of rows per batch
+    '''
+    batch = batch or EXPORT_BATCH
+    order_by = orderBy(table, order, descending)
+
+    position = None
+    while True:
+        batch_query = query
+        if position is not None:
+            batch_query = query.where(keysetCondition(table, order,
+                                                      descending, position))
+        rows = execute(batch_query.order_by(*order_by).limit(batch))\
+                .fetchall()
+
+        for row in rows:
+            yield row
+
+        if len(rows) < batch:
+            break
+        position = (rows[-1][order.name], rows[-1][table.c.id.name])
+
+    log.debug("[streamRows] read the rows of %r" % table.name)
+
+
+class _Position(object):
+    '''
+    the sort position of a row in the heap of the merged rows
+    '''
+
+    def __init__(self, key, descending):
+        self.key = key
+        self.descending = descending
+
+    def __lt__(self, other):
+        if self.descending:
+            return other.key < self.key
+        return self.key < other.key
+
+
+def mergeRows(results, order, descending):
+    '''
+    merge the sorted rows of several tables into one sorted sequence
+
+    :param results: list of the sorted row iterables
+    :param order: the sort column
+    :param descending: True, if the order is descending
+    :return: generator of the rows (yield)
+    '''
+    heap = []
+    for result in results:
+        rows = iter(result)
+        for row in rows:
+            position = _Position((row[order.name], row['id']), descending)
+            heap.append((position, row, rows))
+            break
+    heapq.heapify(heap)
+
+    while heap:
+        (_position, row, rows) = heap[0]
+        yield row
+        for row in rows:
+            position = _Position((row[order.name], row['id']), descending)
+            heapq.heapreplace(heap, (position, row, rows))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+def searchTables(execute, tables, param, AND=True, rp_dict=None):
+    '''
+    search the audit rows of several tables - each table is searched on
+    its own and the rows are merged in the sort order
+
+    :param execute: the execute method of the audit session or engine
+    :param tables: list of the audit tables in the order of their periods
+    :param param: dict of the search parameters and values
+    :param AND: combine the conditions by AND - otherwise by OR
+    :param rp_dict: dict with the sort and the page parameters
+    :return: iterable of the audit rows
+    '''
+    if rp_dict is None:
+        rp_dict = {}
+
+    if len(tables) == 1:
+        return searchQuery(execute, tables[0], param, AND=AND,
+                           rp_dict=rp_dict)
+
+    (order, descending) = getOrder(tables[0], rp_dict)
+
+    if 'cursor' in rp_dict:
+        # every table returns its rows of the page
+        limit = int(rp_dict.get('rp') or PAGESIZE)
+        results = [list(searchQuery(execute, table, param, AND=AND,
+                                    rp_dict=rp_dict))
+                   for table in tables]
+        rows = mergeRows(results, order, descending)
+        return [row for (i, row) in zip(range(limit), rows)]
+
+    if 'rp' in rp_dict or 'page' in rp_dict:
+        limit = int(rp_dict.get('rp') or PAGESIZE)
+        page = int(rp_dict.get('page') or 1)
+        offset = limit * (page - 1)
+
+        if order.name in ('id', 'timestamp'):
+            return _searchPage(execute, tables, param, AND, order, descending,
+                               offset, limit)
+
+        # the rows of the other orders are interleaved - every table is
+        # read in batches of the page size up to the end of the page
+        results = [streamRows(execute, table, selectRows(table, param, AND),
+                              table.c[order.name], descending, batch=limit)
+                   for table in tables]
+        rows = mergeRows(results, order, descending)
+        return list(itertools.islice(rows, offset, offset + limit))
+
+    return mergeRows([searchQuery(execute, table, param, AND=AND,
+                                  rp_dict=rp_dict)
+                      for table in tables], order, descending)
+
+
+def _searchPage(execute, tables, param, AND, order, descending, offset,
+                limit):
+    '''
+    read an offset page of the tables, which follow each other in the sort
+    order - only the tables of the page are searched, the tables before are
+    skipped by their number of rows
+
+    :param tables: list of the audit tables in the order of their periods
+    :return: list of the rows of the page
+    '''
+    if descending:
+        tables = list(reversed(tables))
+
+    rows = []
+    for table in tables:
+        if len(rows) >= limit:
+            break
+
+        if offset > 0:
+            total = getTotal(execute, table, param, AND)
+            if total <= offset:
+                offset -= total
+                continue
+
+        order_by = orderBy(table, table.c[order.name], descending)
+        query = selectRows(table, param, AND).order_by(*order_by)\
+                    .limit(limit - len(rows)).offset(offset)
+        rows.extend(execute(query).fetchall())
+        offset = 0
+
+    return rows
+
+
+def getTotal(execute, table, param, AND=True):
+    '''
+    count the audit rows of the search
+
+    :return: the number of rows
+    '''
+    query = select([func.count()]).select_from(table)
+    condition = buildCondition(table, param, AND)
+    if condition is not None:
+        query = query.where(condition)
+    return execute(query).scalar()
+
+###eof#########################################################################
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+asynchronous writer of the audit entries
+
+The request only puts its audit entries into a bounded queue. A background
+thread takes the entries from the queue and hands them over in batches to
+the audit implementation, which stores and signs a whole batch at once:
+
+    linotpAudit.async.enable = True
+    linotpAudit.async.queue_size = 10000
+    linotpAudit.async.batch_size = 100
+    linotpAudit.async.overflow = block | drop
+    linotpAudit.async.block_timeout = 5
+
+If the queue is full, the request either waits up to block_timeout seconds
+for free space ('block') or the entry is dropped immediately ('drop').
+Dropped entries are counted and logged.
+"""
+
+import time
+import Queue
+import atexit
+import logging
+import threading
+
+from linotp.lib.worker import PeriodicWorker
+
+log = logging.getLogger(__name__)
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP = 'drop'
+
+
+class AsyncAuditWriter(PeriodicWorker):
+    '''
+    bounded queue of audit entries with a background writer thread - the
+    thread waits for the queued entries itself, so it has no interval
+    '''
+
+    def __init__(self, write_batch, queue_size=10000, batch_size=100,
+                 overflow=OVERFLOW_BLOCK, block_timeout=5):
+        '''
+        :param write_batch: function, which stores a list of audit entries
+        :param queue_size: the max number of queued entries
+        :param batch_size: the max number of entries stored at once
+        :param overflow: 'block' or 'drop' - what to do if the queue is full
+        :param block_timeout: max seconds to wait with the 'block' overflow
+        '''
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP):
+            raise ValueError("unknown audit overflow policy %r" % overflow)
+
+        PeriodicWorker.__init__(self, 'linotp audit writer', 0)
+
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.stats_lock = threading.Lock()
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.latency = 0.0
+        self.latency_max = 0.0
+        self.latency_total = 0.0
+
+    def put(self, entry):
+        '''
+        queue the audit entry for the writer thread
+
+        :param entry: the audit entry
+        :return: boolean - False if the entry has been dropped
+        '''
+        if not self.isRunning():
+            self.start()
+
+        item = (time.time(), entry)
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+        except Queue.Full:
+            with self.stats_lock:
+                self.dropped += 1
+            log.error("[put] audit queue is full - dropped audit entry, "
+                      "%d entries dropped so far" % self.dropped)
+            return False
+
+        with self.stats_lock:
+            self.enqueued += 1
+        return True
+
+    def _next_batch(self):
+        '''
+        wait for the next entry and take all further entries up to the
+        batch size, which are already queued
+        '''
+        try:
+            batch = [self.queue.get(timeout=1)]
+        except Queue.Empty:
+            return []
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def work(self):
+        batch = self._next_batch()
+        if batch:
+            self._write(batch)
+        return
+
+    def _write(self, batch):
+        written = 0
+        try:
+            self.write_batch([entry for _queued, entry in batch])
+            written = len(batch)
+        except Exception as exx:
+            log.error("[_write] failed to write %d audit entries: %r"
+                      % (len(batch), exx))
+        finally:
+            now = time.time()
+            latency = max(now - queued for queued, _entry in batch)
+            with self.stats_lock:
+                self.written += written
+                self.failed += len(batch) - written
+                self.batches += 1
+                self.latency = latency
+                self.latency_max = max(self.latency_max, latency)
+                self.latency_total += sum(now - queued
+                                          for queued, _entry in batch)
+            for _item in batch:
+                self.queue.task_done()
+        return
+
+    def flush(self, timeout=None):
+        '''
+        wait until all queued entries are written
+
+        :param timeout: max seconds to wait or None to wait until done
+        :return: boolean - True if the queue is empty
+        '''
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() > deadline:
+                return False
+            if self.thread is None or not self.thread.is_alive():
+                # no writer in this process - write the rest ourself
+                batch = self._next_batch()
+                if batch:
+                    self._write(batch)
+                continue
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout=5):
+        '''
+        write the queued entries and stop the writer thread
+        '''
+        self.flush(timeout=timeout)
+        PeriodicWorker.stop(self)
+        return
+
+    def getStats(self):
+        '''
+        :return: dict with the backlog, the entry counters and the latency
+                 in seconds between queuing and writing of the entries
+        '''
+        with self.stats_lock:
+            finished = self.written + self.failed
+            latency_avg = 0.0
+            if finished:
+                latency_avg = self.latency_total / finished
+
+            return {'backlog': self.queue.qsize(),
+                    'queue_size': self.queue.maxsize,
+                    'overflow': self.overflow,
+                    'enqueued': self.enqueued,
+                    'written': self.written,
+                    'dropped': self.dropped,
+                    'failed': self.failed,
+                    'batches': self.batches,
+                    'latency': self.latency,
+                    'latency_max': self.latency_max,
+                    'latency_avg': latency_avg,
+                    }
+
+
+def getAsyncWriter(config, write_batch):
+    '''
+    create the asynchronous audit writer as defined in the ini file
+
+    :param config: the pylons config
+    :param write_batch: function, which stores a list of audit entries
+    :return: the AsyncAuditWriter or None if the entries are written
+             synchronously
+    '''
+    enable = config.get('linotpAudit.async.enable', 'False')
+    if str(enable).strip().lower() != 'true':
+        return None
+
+    writer = AsyncAuditWriter(
+            write_batch,
+            queue_size=int(config.get('linotpAudit.async.queue_size', 10000)),
+            batch_size=int(config.get('linotpAudit.async.batch_size', 100)),
+            overflow=config.get('linotpAudit.async.overflow',
+                                OVERFLOW_BLOCK).strip().lower(),
+            block_timeout=float(config.get('linotpAudit.async.block_timeout',
+                                           5)))
+
+    # write the queued entries on shutdown
+    atexit.register(writer.stop)
+
+    log.info("[getAsyncWriter] writing audit entries asynchronously in "
+             "batches of %d" % writer.batch_size)
+    return writer
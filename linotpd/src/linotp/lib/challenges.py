@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+'''
+storage of the challenges of the challenge response tokens
+
+The challenge store is defined in the ini file:
+
+    linotpChallenges.store = sql | memory
+    linotpChallenges.ttl = 86400
+    linotpChallenges.sweep_interval = 300
+    linotpChallenges.sweep_batch = 1000
+    linotpChallenges.sweep_limit = 100000
+
+'sql' keeps the challenges in the challenges table, which is looked up by
+the indices on the transaction id and on the token serial. 'memory' keeps
+the challenges in the process and is only suitable for a single node, which
+runs LinOTP in one process, as the challenge and the response must be
+handled by the same process.
+
+The sweeper thread deletes every 'sweep_interval' seconds the challenges,
+which are older than 'ttl' seconds, in batches of 'sweep_batch' challenges.
+The 'ttl' must be longer than the validity time of every challenge.
+
+The sweeper runs as well the janitor of the ocra challenges, which deletes
+the ocra challenges beyond the OcraChallengeTimeout or the
+OcraMaxChallengeRequests. Each run deletes at most 'sweep_limit' challenges
+of each kind, the rest is left for the next run.
+'''
+
+import time
+import logging
+import threading
+import itertools
+
+from datetime import datetime
+from datetime import timedelta
+
+from sqlalchemy import and_, or_
+from sqlalchemy import desc
+from sqlalchemy import select
+
+from linotp.model import meta
+from linotp.model import Challenge
+from linotp.model import challenges_table
+from linotp.model import timestamp_column
+from linotp.model.meta import Session
+from linotp.lib.worker import PeriodicWorker
+
+log = logging.getLogger(__name__)
+
+
+class ChallengeStore(object):
+    '''
+    base class of the challenge stores
+    '''
+
+    def lookup(self, serial=None, transid=None, exact=True):
+        '''
+        get the challenges of a token and / or of a transaction
+
+        :param serial: the serial number of the token
+        :param transid: the transaction id
+        :param exact: if False, the challenges of the sub transactions
+                      'transid.nn' are included
+        :return: list of challenges, the latest first
+        '''
+        raise NotImplementedError("lookup is not implemented by %r"
+                                  % self.__class__.__name__)
+
+    def exists(self, transid):
+        '''
+        check if a challenge with this transaction id exists
+        '''
+        return len(self.lookup(transid=transid)) > 0
+
+    def save(self, challenge):
+        '''
+        store a new or changed challenge
+        '''
+        raise NotImplementedError("save is not implemented by %r"
+                                  % self.__class__.__name__)
+
+    def delete(self, serial, challenge_ids=None):
+        '''
+        delete challenges of a token
+
+        :param serial: the serial number of the token
+        :param challenge_ids: the ids of the challenges - if None, all
+                              challenges of the token are deleted
+        '''
+        raise NotImplementedError("delete is not implemented by %r"
+                                  % self.__class__.__name__)
+
+    def expire(self, ttl, limit=1000):
+        '''
+        delete one batch of challenges, which are older than ttl seconds
+
+        :return: the number of deleted challenges
+        '''
+        raise NotImplementedError("expire is not implemented by %r"
+                                  % self.__class__.__name__)
+
+
+def _sub_transactions(transid):
+    '''
+    the sub transactions 'transid.nn' are the transaction ids between
+    'transid.' and 'transid/' - other than a 'like' this range could always
+    be looked up by the transaction id index
+    '''
+    return and_(Challenge.transid > transid + u'.',
+                Challenge.transid < transid + u'/')
+
+
+class SQLChallengeStore(ChallengeStore):
+    '''
+    the challenges in the challenges table of the request Session
+    '''
+
+    def lookup(self, serial=None, transid=None, exact=True):
+        conditions = ()
+        if serial is not None:
+            conditions += (Challenge.tokenserial == u'' + serial,)
+        if transid is not None:
+            transid = u'' + transid
+            if exact:
+                conditions += (Challenge.transid == transid,)
+            else:
+                conditions += (or_(Challenge.transid == transid,
+                                   _sub_transactions(transid)),)
+        if not conditions:
+            return []
+
+        return Session.query(Challenge).filter(and_(*conditions))\
+                                       .order_by(desc(Challenge.id)).all()
+
+    def exists(self, transid):
+        return Session.query(Challenge.id).filter(
+                        Challenge.transid == u'' + transid).first() is not None
+
+    def save(self, challenge):
+        Session.add(challenge)
+        Session.commit()
+
+    def delete(self, serial, challenge_ids=None):
+        query = Session.query(Challenge).filter(
+                                Challenge.tokenserial == u'' + serial)
+        if challenge_ids is not None:
+            if len(challenge_ids) == 0:
+                return
+            query = query.filter(Challenge.id.in_(challenge_ids))
+
+        for challenge in query:
+            Session.delete(challenge)
+        return
+
+    def expire(self, ttl, limit=1000):
+        '''
+        delete the expired challenges with an own connection, so that the
+        sweeper does not interfere with the request Session
+        '''
+        table = challenges_table
+        before = datetime.now() - timedelta(seconds=ttl)
+
+        query = select([table.c.id]).where(
+                            table.c[timestamp_column] < before)\
+                            .order_by(table.c.id).limit(limit)
+
+        connection = meta.engine.connect()
+        try:
+            ids = [row[0] for row in connection.execute(query)]
+            if ids:
+                connection.execute(table.delete().where(table.c.id.in_(ids)))
+        finally:
+            connection.close()
+
+        return len(ids)
+
+
+class MemoryChallengeStore(ChallengeStore):
+    '''
+    the challenges in the memory of the process - the challenges are
+    indexed by id, transaction id and token serial
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.challenges = {}
+        self.transids = {}
+        self.serials = {}
+
+    def __len__(self):
+        return len(self.challenges)
+
+    def lookup(self, serial=None, transid=None, exact=True):
+        with self.lock:
+            if transid is not None:
+                ids = set()
+                if transid in self.transids:
+                    ids.add(self.transids[transid])
+                if not exact:
+                    prefix = transid + '.'
+                    ids.update(c_id for (c_transid, c_id)
+                               in self.transids.items()
+                               if c_transid.startswith(prefix))
+                if serial is not None:
+                    ids.intersection_update(self.serials.get(serial, ()))
+            elif serial is not None:
+                ids = set(self.serials.get(serial, ()))
+            else:
+                return []
+
+            return [self.challenges[c_id] for c_id in
+                    sorted(ids, reverse=True)]
+
+    def exists(self, transid):
+        with self.lock:
+            return transid in self.transids
+
+    def save(self, challenge):
+        with self.lock:
+            if challenge.id is None:
+                challenge.id = self.ids.next()
+            self.challenges[challenge.id] = challenge
+            self.transids[challenge.transid] = challenge.id
+            self.serials.setdefault(challenge.tokenserial,
+                                    set()).add(challenge.id)
+
+    def _remove(self, challenge):
+        del self.challenges[challenge.id]
+        self.transids.pop(challenge.transid, None)
+        ids = self.serials.get(challenge.tokenserial)
+        if ids is not None:
+            ids.discard(challenge.id)
+            if not ids:
+                del self.serials[challenge.tokenserial]
+
+    def delete(self, serial, challenge_ids=None):
+        with self.lock:
+            ids = set(self.serials.get(serial, ()))
+            if challenge_ids is not None:
+                ids.intersection_update(challenge_ids)
+            for c_id in ids:
+                self._remove(self.challenges[c_id])
+
+    def expire(self, ttl, limit=1000):
+        before = datetime.now() - timedelta(seconds=ttl)
+        with self.lock:
+            expired = [challenge for challenge in self.challenges.values()
+                       if challenge.timestamp < before][:limit]
+            for challenge in expired:
+                self._remove(challenge)
+        return len(expired)
+
+
+class ChallengeSweeper(PeriodicWorker):
+    '''
+    delete the expired challenges in a background thread
+    '''
+
+    def __init__(self, store, ttl=86400, interval=300, batch=1000,
+                 limit=100000, janitors=None):
+        PeriodicWorker.__init__(self, 'linotp challenge sweeper', interval,
+                                wait_first=True)
+        self.store = store
+        self.ttl = ttl
+        self.batch = batch
+        self.limit = limit
+
+        # the additional janitors by name - a janitor is called with the
+        # batch size and returns the number of deleted entries
+        self.janitors = dict(janitors or {})
+
+        self.runs = 0
+        self.deleted = 0
+        self.purged = {}
+        self.last_purged = {}
+        self.last_run = None
+
+    def work(self):
+        self.sweep()
+
+    def _purge(self, name, janitor):
+        '''
+        run one janitor batch by batch up to the limit - errors are only
+        logged, as the next run will catch up
+        '''
+        deleted = 0
+        try:
+            while deleted < self.limit:
+                count = janitor(min(self.batch, self.limit - deleted))
+                deleted += count
+                if count < self.batch:
+                    break
+        except Exception as exx:
+            log.error("[sweep] failed to purge the %s: %r" % (name, exx))
+
+        self.last_purged[name] = deleted
+        self.purged[name] = self.purged.get(name, 0) + deleted
+        if deleted:
+            log.info("[sweep] purged %d %s" % (deleted, name))
+        return deleted
+
+    def sweep(self):
+        '''
+        delete the expired challenges and run the janitors
+
+        :return: the number of deleted challenges
+        '''
+        deleted = self._purge('challenges', lambda limit:
+                              self.store.expire(self.ttl, limit=limit))
+        for name, janitor in sorted(self.janitors.items()):
+            self._purge(name, janitor)
+
+        self.runs += 1
+        self.deleted += deleted
+        self.last_run = time.time()
+        return deleted
+
+    def getStats(self):
+        '''
+        get the number of sweeper runs and of the deleted challenges
+
+        :return: dict with the totals and the numbers of the last run
+                 for the challenges and every janitor
+        '''
+        return {'runs': self.runs,
+                'deleted': self.deleted,
+                'purged': dict(self.purged),
+                'last_purged': dict(self.last_purged),
+                'last_run': self.last_run,
+                }
+
+
+def _ocra_janitor(limit):
+    '''
+    purge the outdated ocra challenges
+    '''
+    from linotp.lib.tokenclass import OcraTokenClass
+    return OcraTokenClass.janitor(limit=limit)
+
+
+def getChallengeStore():
+    '''
+    get the challenge store of the application - without an application
+    context, the challenges are kept in the challenges table
+
+    :return: the ChallengeStore
+    '''
+    from linotp.lib.config import getGlobalObject
+
+    glo = getGlobalObject()
+    if glo is None or glo.getChallengeStore() is None:
+        return SQLChallengeStore()
+
+    (store, sweeper) = glo.getChallengeStore()
+    if sweeper is not None and not sweeper.isRunning():
+        sweeper.start()
+    return store
+
+
+def setupChallengeStore(config):
+    '''
+    create the challenge store and its sweeper as defined in the ini file
+
+    :param config: the pylons config
+    :return: tuple of the ChallengeStore and the ChallengeSweeper, which is
+             None if the sweeping is disabled
+    '''
+    store_type = config.get('linotpChallenges.store', 'sql')
+    store_type = store_type.strip().lower()
+
+    if store_type == 'sql':
+        store = SQLChallengeStore()
+    elif store_type == 'memory':
+        store = MemoryChallengeStore()
+    else:
+        raise Exception("unknown challenge store %r" % store_type)
+
+    sweeper = None
+    interval = float(config.get('linotpChallenges.sweep_interval', 300))
+    if interval > 0:
+        sweeper = ChallengeSweeper(store,
+                        ttl=float(config.get('linotpChallenges.ttl', 86400)),
+                        interval=interval,
+                        batch=int(config.get('linotpChallenges.sweep_batch',
+                                             1000)),
+                        limit=int(config.get('linotpChallenges.sweep_limit',
+                                             100000)),
+                        janitors={'ocra challenges': _ocra_janitor})
+
+    log.info("[setupChallengeStore] using %s" % store.__class__.__name__)
+    return (store, sweeper)
@@ -43,6 +43,8 @@ from linotp.model.meta import Session
 from linotp.lib.crypt import encryptPassword
 from linotp.lib.crypt import decryptPassword
 
+from linotp.lib.replication import markConfigChanged
+
 from datetime import datetime
 
 
@@ -138,13 +140,17 @@ class LinOtpConfig(dict):
 
         self.delay = False
         self.realms = None
+        # the global config version this config is a copy of and the
+        # compiled policies of this config - both are reset on change
+        self.version = None
+        self.policy_set = None
         self.glo = getGlobalObject()
         conf = self.glo.getConfig()
 
         do_reload = False
 
         # do the bootstrap if no entry in the app_globals
-        if len(conf.keys()) == 0:
+        if len(conf) == 0:
             do_reload = True
 
         if self.glo.isConfigComplet() == False:
@@ -159,8 +165,14 @@ class LinOtpConfig(dict):
                 e_conf_date = conf.get('linotp.Config')
 
                 # # in case of replication, we always have to look if the
-                # # config data in the database changed
-                db_conf_date = _retrieveConfigDB('linotp.Config')
+                # # config data in the database changed - if there is a
+                # # notifier, it provides the last seen timestamp
+                db_conf_date = None
+                notifier = self.glo.getConfigNotifier()
+                if notifier is not None:
+                    db_conf_date = notifier.getConfigDate()
+                if db_conf_date is None:
+                    db_conf_date = _retrieveConfigDB('linotp.Config')
 
                 if str(db_conf_date) != str(e_conf_date):
                     do_reload = True
@@ -169,21 +181,23 @@ class LinOtpConfig(dict):
 
     def refreshConfig(self, do_reload=False):
 
-        conf = self.glo.getConfig()
+        # # the global config is a shared read only snapshot
+        (version, conf) = self.glo.getConfigSnapshot()
 
         if do_reload == True:
+            start = time.time()
+            previous_conf = conf
+
             # # in case there is no entry in the dbconf or
             # # the config file is newer, we write the config back to the db
-            entries = conf.keys()
-            for entry in entries:
-                del conf[entry]
+            conf = {}
 
             writeback = False
             # # get all conf entries from the config file
             fileconf = _getConfigFromEnv()
 
             # #  get all configs from the DB
-            (dbconf, delay) = _retrieveAllConfigDB()
+            (dbconf, delay) = _retrieveAllConfigDB(previous_conf)
             self.glo.setConfigIncomplete(not delay)
 
             # # we only merge the config file once as a removed entry
@@ -222,8 +236,21 @@ class LinOtpConfig(dict):
                 _storeConfigDB('linotp.Config', datetime.now())
 
             self.glo.setConfig(conf, replace=True)
+            version = None
+            self.glo.recordConfigReload(time.time() - start)
 
         self.parent.update(conf)
+        self.version = version
+        self.policy_set = None
+        return
+
+    def _changed(self):
+        '''
+        mark the config as locally modified, which disconnects it from
+        the global config version
+        '''
+        self.version = None
+        self.policy_set = None
         return
 
     def setRealms(self, realmDict):
@@ -286,6 +313,7 @@ class LinOtpConfig(dict):
             res = self.parent.__setitem__(key, nVal)
             self.glo.setConfig({key:nVal})
 
+        self._changed()
         _storeConfigDB(key, val, typ, des)
         _storeConfigDB('linotp.Config', datetime.now())
         return res
@@ -359,6 +387,8 @@ class LinOtpConfig(dict):
             # # sync with global dict
             self.glo.delConfig(encKey)
 
+        self._changed()
+
         # # sync with db
         if key.startswith('linotp.'):
             Key = key
@@ -380,6 +410,7 @@ class LinOtpConfig(dict):
         :rtype  : any value a dict update will return
         '''
         res = self.parent.update(dic)
+        self._changed()
         # # sync the lobal dict
         self.glo.setConfig(dic)
         # # sync to disc
@@ -494,6 +525,7 @@ def _storeConfigDB(key, val, typ=None, desc=None):
                         )
     if theConf is not None:
         Session.add(theConf)
+        markConfigChanged()
 
     return 101
 
@@ -514,6 +546,7 @@ def _removeConfigDB(key):
         try:
             # Session.add(theConf)
             Session.delete(theConf)
+            markConfigChanged()
 
         except Exception as e:
             log.error('[removeConfigDB] failed')
@@ -538,10 +571,21 @@ def _retrieveConfigDB(Key):
         myVal = _expandHere(myVal)
     return myVal
 
-def _retrieveAllConfigDB():
+def _retrieveAllConfigDB(previous=None):
+    '''
+    read all config entries from the database
+
+    :param previous: the former config - the passwords, which did not
+                     change, are taken from here and not decrypted again
+    :return: tuple of the config dict and the delay flag, which is set if
+             the passwords could not be decrypted
+    '''
+    if previous is None:
+        previous = {}
 
     config = {}
     delay = False
+    changed = 0
     for conf in Session.query(Config).all():
         log.debug("[retrieveAllConfigDB] key %r:%r" % (conf.Key, conf.Value))
         key = conf.Key
@@ -549,16 +593,23 @@ def _retrieveAllConfigDB():
             key = "linotp." + conf.Key
         nVal = _expandHere(conf.Value)
         config[key] = nVal
+        if previous.get(key) != nVal:
+            changed += 1
         myTyp = conf.Type
         if myTyp is not None:
             if myTyp == 'password':
-                if hasattr(c, 'hsm') == True and isinstance(c.hsm, dict):
+                if (previous.get(key) == nVal and
+                        previous.get('enc' + key) is not None):
+                    config['enc' + key] = previous.get('enc' + key)
+                elif hasattr(c, 'hsm') == True and isinstance(c.hsm, dict):
                     hsm = c.hsm.get('obj')
                     if hsm is not None and hsm.isReady() == True:
                         config['enc' + key] = decryptPassword(conf.Value)
                 else:
                     delay = True
 
+    log.debug("[retrieveAllConfigDB] %d of %d entries changed"
+              % (changed, len(config)))
     return (config, delay)
 
 ########### external interfaces ###############
@@ -57,6 +57,12 @@ from Crypto.Cipher import AES
 
 from linotp.lib.ext.pbkdf2  import PBKDF2
 
+try:
+    # the native PBKDF2 of python >= 2.7.8
+    from hashlib import pbkdf2_hmac
+except ImportError:
+    pbkdf2_hmac = None
+
 try:
     import json
 except ImportError:
@@ -129,6 +135,26 @@ class SecretObj:
         self._clearKey_(preserve=self.preserve)
         return h
 
+    def hmac_digests(self, data_inputs, hash_algo):
+        '''
+        compute the hmac of several inputs with only one key setup
+
+        :param data_inputs: list of the data buffers
+        :param hash_algo: the hash function
+        :return: list of the binary digests
+        '''
+        self._setupKey_()
+        try:
+            base = hmac.new(self.bkey, digestmod=hash_algo)
+            digests = []
+            for data_input in data_inputs:
+                h = base.copy()
+                h.update(data_input)
+                digests.append(h.digest())
+        finally:
+            self._clearKey_(preserve=self.preserve)
+        return digests
+
     def aes_decrypt(self, data_input):
         '''
         support inplace aes decryption for the yubikey
@@ -308,8 +334,6 @@ def kdf2(sharesecret, nonce , activationcode, len, iterations=10000,
     :param activationcode:  base32 encoded value
 
     '''
-    digestmodule = c_hash.get(digest.lower(), None)
-
     byte_len = 2
     salt_len = 8 * byte_len
 
@@ -337,10 +361,37 @@ def kdf2(sharesecret, nonce , activationcode, len, iterations=10000,
 
     activ = binascii.hexlify(bcode)
     passphrase = u'' + sharesecret + activ + nonce[:-salt_len]
-    keyStream = PBKDF2(binascii.unhexlify(passphrase), bSalt, iterations=iterations, digestmodule=digestmodule)
-    key = keyStream.read(len)
+    key = pbkdf2(binascii.unhexlify(passphrase), bSalt, len,
+                 iterations=iterations, digest=digest)
     return key
 
+def pbkdf2(passphrase, salt, len, iterations=10000, digest='SHA256',
+           native=True):
+    '''
+    PBKDF2-HMAC key derivation - the native implementation of hashlib is
+    used if available, otherwise the pure python linotp.lib.ext.pbkdf2
+
+    :param passphrase: the binary passphrase
+    :param salt: the binary salt
+    :param len: the length of the derived key in bytes
+    :param iterations: the number of iterations
+    :param digest: the name of the hash algorithm
+    :param native: if False, the pure python implementation is used
+    :return: the binary key
+    '''
+    if native and pbkdf2_hmac is not None:
+        try:
+            return pbkdf2_hmac(digest.lower(), passphrase, salt,
+                               iterations, len)
+        except ValueError as exx:
+            log.warning("[pbkdf2] native pbkdf2 does not support %r: %r"
+                        % (digest, exx))
+
+    digestmodule = c_hash.get(digest.lower(), None)
+    keyStream = PBKDF2(passphrase, salt, iterations=iterations,
+                       digestmodule=digestmodule)
+    return keyStream.read(len)
+
 def hash(val, seed, algo=None):
     log.debug('hash()')
     m = sha256()
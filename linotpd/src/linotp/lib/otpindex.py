@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+'''
+otp lookahead index of the unassigned tokens
+
+The lookup of a token by its otp value - getSerialByOtp and the auto
+assignment - has to compute the otp values of every token in question. To
+avoid this, the index holds a keyed hash of the next 'lookahead' otp values
+of every unassigned HMAC token, so that the lookup becomes an indexed query
+and the otp only has to be confirmed for the few matching tokens.
+
+An index entry is only valid for the token counter it is built from. Tokens
+without a valid index entry - new tokens, tokens whose counter has moved or
+tokens of other types - are still checked one by one, so the index never
+hides a token. The index is refreshed by the maintenance job
+'system/updateOtpIndex' and for the token found by a lookup.
+
+The index is enabled by the config entries
+
+    OtpIndex = True
+    OtpIndexLookahead = 20
+'''
+
+import hmac
+import logging
+from hashlib import sha256
+
+from sqlalchemy import and_, or_, not_
+from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import select
+
+from linotp.model import Token
+from linotp.model import OtpIndex
+from linotp.model import otpindex_table
+from linotp.model import token_table
+from linotp.model.meta import Session
+
+from linotp.lib.config import getFromConfig
+from linotp.lib.crypt import encrypt
+from linotp.lib.crypt import TOKEN_KEY
+
+log = logging.getLogger(__name__)
+
+# the token types, whose otp values could be computed in advance
+INDEX_TYPES = [u'hmac']
+
+# the otp lengths, which are checked for a password of the auto assignment
+OTP_LENGTHS = [6, 8]
+
+DEFAULT_LOOKAHEAD = 20
+
+INDEX_LABEL = 'linotp.OtpIndex'
+INDEX_IV = '\x00' * 16
+
+
+def isOtpIndexEnabled():
+    return getFromConfig("OtpIndex", "False").lower() == "true"
+
+
+def getOtpIndexLookahead():
+    return int(getFromConfig("OtpIndexLookahead", DEFAULT_LOOKAHEAD))
+
+
+def getIndexKey():
+    '''
+    derive the key of the otp hashes from the token encryption key - so the
+    index can't be reversed without the key, though an otp only has a couple
+    of digits
+    '''
+    return sha256(encrypt(INDEX_LABEL, INDEX_IV, id=TOKEN_KEY)).digest()
+
+
+def otpDigest(key, otp):
+    '''
+    :return: the keyed hash of an otp value as hex string
+    '''
+    return unicode(hmac.new(key, str(otp), sha256).hexdigest())
+
+
+def getOtpCandidates(query, otps, key, window=None):
+    '''
+    restrict the token query to the tokens, which might generate one of the
+    otp values: the tokens with a matching index entry and all tokens, which
+    are not covered by the index
+
+    :param query: the sqlalchemy query of Token objects
+    :param otps: the list of the possible otp values
+    :param key: the index key
+    :param window: the lookahead window of the search - if None, the count
+                   window of each token is used
+    :return: the restricted query
+    '''
+    digests = list(set(otpDigest(key, otp) for otp in otps))
+    lengths = list(set(len(otp) for otp in otps))
+
+    if window is None:
+        window = Token.LinOtpCountWindow
+
+    valid = and_(OtpIndex.token_id == Token.LinOtpTokenId,
+                 OtpIndex.counter == Token.LinOtpCount,
+                 OtpIndex.lookahead >= window)
+
+    hit = exists().where(and_(valid, OtpIndex.digest.in_(digests)))
+    covered = and_(Token.LinOtpOtpLen.in_(lengths), exists().where(valid))
+
+    return query.filter(or_(hit, not_(covered)))
+
+
+def indexToken(token, lookahead, key):
+    '''
+    (re)build the index entries of one token - assigned tokens and tokens,
+    which are not supported by the index, only loose their entries
+
+    :param token: the token class object
+    :param lookahead: the number of the indexed otp values
+    :param key: the index key
+    :return: the number of index entries of the token
+    '''
+    token_id = token.token.LinOtpTokenId
+    Session.execute(otpindex_table.delete().where(
+                            otpindex_table.c.token_id == token_id))
+
+    if token.type.lower() not in INDEX_TYPES or token.token.LinOtpUserid:
+        return 0
+
+    (res, _error, otp_dict) = token.get_multi_otp(count=lookahead)
+    if not res:
+        return 0
+
+    counter = int(token.token.LinOtpCount)
+    entries = [{'token_id': token_id,
+                'digest': otpDigest(key, otp),
+                'counter': counter,
+                'lookahead': lookahead}
+               for otp in otp_dict['otp'].values()]
+    Session.execute(otpindex_table.insert(), entries)
+    return len(entries)
+
+
+def refreshToken(token):
+    '''
+    refresh the index entries of a token, after its counter has moved or it
+    has been assigned
+    '''
+    if not isOtpIndexEnabled():
+        return
+    try:
+        indexToken(token, getOtpIndexLookahead(), getIndexKey())
+    except Exception as exx:
+        # the token is then checked without the index
+        log.warning("[refreshToken] failed to index token %r: %r"
+                    % (token.getSerial(), exx))
+    return
+
+
+def updateOtpIndex(lookahead=None, limit=None, rebuild=False):
+    '''
+    maintenance job of the index: remove the entries of the assigned and
+    deleted tokens and index the unassigned tokens without a valid index
+
+    :param lookahead: the number of the indexed otp values
+    :param limit: the max number of tokens to be indexed in this run
+    :param rebuild: if True, all unassigned tokens are indexed again
+    :return: dict with the number of removed entries, indexed tokens and
+             the number of tokens left to be indexed
+    '''
+    from linotp.lib.token import createTokenClassObject
+
+    if lookahead is None:
+        lookahead = getOtpIndexLookahead()
+    key = getIndexKey()
+
+    unassigned = or_(token_table.c.LinOtpUserid == None,
+                     token_table.c.LinOtpUserid == u'')
+
+    # entries of the tokens, which are assigned or have been deleted
+    owners = select([token_table.c.LinOtpTokenId]).where(unassigned)
+    res = Session.execute(otpindex_table.delete().where(
+                            not_(otpindex_table.c.token_id.in_(owners))))
+    removed = res.rowcount
+
+    query = Session.query(Token).filter(
+                            func.lower(Token.LinOtpTokenType).in_(INDEX_TYPES),
+                            or_(Token.LinOtpUserid == None,
+                                Token.LinOtpUserid == u''))
+    if not rebuild:
+        valid = and_(OtpIndex.token_id == Token.LinOtpTokenId,
+                     OtpIndex.counter == Token.LinOtpCount,
+                     OtpIndex.lookahead == lookahead)
+        query = query.filter(not_(exists().where(valid)))
+
+    pending = query.count()
+    if limit is not None:
+        query = query.order_by(Token.LinOtpTokenId).limit(limit)
+
+    indexed = 0
+    for db_token in query.all():
+        token = createTokenClassObject(db_token)
+        indexToken(token, lookahead, key)
+        indexed += 1
+
+    result = {'removed': removed,
+              'indexed': indexed,
+              'pending': pending - indexed,
+              }
+    log.info("[updateOtpIndex] %r" % result)
+    return result
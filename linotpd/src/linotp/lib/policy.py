@@ -32,6 +32,7 @@ from pylons.i18n.translation import _
 from pylons import request, config, tmpl_context as c
 
 from linotp.lib.config import getLinotpConfig
+from linotp.lib.config import getGlobalObject
 from linotp.lib.config import removeFromConfig
 from linotp.lib.config import storeConfig
 
@@ -44,10 +45,9 @@ from linotp.lib.user import getResolversOfUser
 
 from linotp.lib.util import get_client
 
-from linotp.lib.error import ServerError, LinotpError
+from linotp.lib.policyset import PolicySet
 
-from netaddr import IPAddress
-from netaddr import IPNetwork
+from linotp.lib.error import ServerError, LinotpError
 
 from configobj import ConfigObj
 
@@ -515,35 +515,50 @@ def create_policy_export_file(policy, filename):
     return filename
 
 
-def getPolicies(config=None):
-    # First we load ALL policies from the Config
+def getPolicySet(config=None):
+    '''
+    get the compiled policies of the config
+
+    the PolicySet is built only once per config version and shared by all
+    requests, which refer to the same config version. A request local
+    config, which has been modified, gets its own PolicySet.
+
+    :param config: the linotp config - if None the request config is taken
+    :return: the PolicySet
+    '''
     if not config:
         lConfig = getLinotpConfig()
     else:
         lConfig = config
 
-    Policies = {}
-    for entry in lConfig:
-        if entry.startswith("linotp.Policy."):
-            #log.debug("[getPolicy] entry: %s" % entry )
-            policy = entry.split(".", 4)
-            if len(policy) == 4:
-                name = policy[2]
-                key = policy[3]
-                value = lConfig.get(entry)
-
-                # prepare the value to be at least an empty string
-                if value is None and key in ('user', 'client', 'realm'):
-                    value = ''
-                if key == "realm":
-                    value = value.lower()
-
-                if name in Policies:
-                    Policies[name][key] = value
-                else:
-                    Policies[name] = {key: value}
+    policy_set = getattr(lConfig, 'policy_set', None)
+    if policy_set is not None:
+        return policy_set
 
-    return Policies
+    glo = getGlobalObject()
+    version = getattr(lConfig, 'version', None)
+    if version is not None and glo is not None:
+        policy_set = glo.getPolicySet(version)
+
+    if policy_set is None:
+        policy_set = PolicySet(lConfig)
+        if version is not None and glo is not None:
+            glo.setPolicySet(version, policy_set)
+
+    if hasattr(lConfig, 'policy_set'):
+        lConfig.policy_set = policy_set
+
+    return policy_set
+
+
+def getPolicies(config=None):
+    '''
+    get all policy definitions
+
+    :param config: the linotp config - if None the request config is taken
+    :return: dict of policy name with a copy of the policy definition
+    '''
+    return getPolicySet(config).getPolicies()
 
 
 def getPolicy(param, display_inactive=False):
@@ -563,128 +578,8 @@ def getPolicy(param, display_inactive=False):
     :return: a dictionary with the policies. The name of the policy being
              the key
     '''
-    #log.debug("[getPolicy] params %s" % str(param))
-    Policies = {}
-
-    # First we load ALL policies from the Config
-    lConfig = getLinotpConfig()
-    lPolicies = getPolicies(lConfig)
-
-    if param.get('name', None):
-        # If a named policy was requested, we add
-        # the policy if the name does match case insensitiv
-        p_name = param['name'].lower()
-        for pol_name in lPolicies:
-            if pol_name.lower() == p_name:
-                Policies[pol_name] = lPolicies[pol_name]
-    else:
-        Policies = lPolicies
-
-    # Now we need to clean up policies, that are inactive
-    if not display_inactive:
-        pol2delete = []
-        for polname, policy in Policies.items():
-            pol_active = policy.get("active", "True")
-            if pol_active == "False":
-                pol2delete.append(polname)
-        for polname in pol2delete:
-            del Policies[polname]
-
-    # Now we need to clean up realms, that were not requested
-    pol2delete = []
-    if param.get('realm', None) is not None:
-        #log.debug("[getPolicy] cleanup acccording to realm %s"
-        #          % param["realm"])
-        for polname, policy in Policies.items():
-            delete_it = True
-            #log.debug("[getPolicy] evaluating policy %s: %s"
-            #          % (polname, str(policy)))
-            if policy.get("realm") is not None:
-                pol_realms = [p.strip()
-                              for p in policy['realm'].lower().split(',')]
-                #log.debug("[getPolicy] realms in policy %s: %s"
-                #          % (polname, str(pol_realms) ))
-                for r in pol_realms:
-                    #log.debug("[getPolicy] Realm: %s" % r)
-                    if r == param['realm'].lower() or r == '*':
-                        #log.debug( "[getPolicy] Setting delete_it to false.
-                        # Se we are using policy: %s" % str(polname))
-                        delete_it = False
-            if delete_it:
-                pol2delete.append(polname)
-        for polname in pol2delete:
-            del Policies[polname]
-
-    pol2delete = []
-    if param.get('scope', None) is not None:
-        #log.debug("[getPolicy] cleanup acccording to scope %s"
-        #          % param["scope"])
-        for polname, policy in Policies.items():
-            if policy['scope'].lower() != param['scope'].lower():
-                pol2delete.append(polname)
-        for polname in pol2delete:
-            del Policies[polname]
-
-    pol2delete = []
-    if param.get('action', None) is not None:
-        #log.debug("[getPolicy] cleanup acccording to action %s"
-        #          % param["action"])
-        param_action = param['action'].strip().lower()
-        for polname, policy in Policies.items():
-            delete_it = True
-            #log.debug("[getPolicy] evaluating policy %s: %s"
-            #          % (polname, str(policy)))
-            if policy.get("action") is not None:
-                pol_actions = [p.strip()
-                               for p in policy.get('action', "").
-                               lower().split(',')]
-                #log.debug("[getPolicy] actions in policy %s: %s "
-                #          % (polname, str(pol_actions) ))
-                for policy_action in pol_actions:
-                    if policy_action == '*' or policy_action == param_action:
-                        # If any action (*) or the exact action we are looking
-                        # for matches, then keep the policy
-                        # e.g. otppin=1 matches when we search for 'otppin=1'
-                        delete_it = False
-                    elif policy_action.split('=')[0].strip() == param_action:
-                        # If the first part of the action matches then keep the
-                        # policy
-                        # e.g. otppin=1 matches when we search for 'otppin'
-                        delete_it = False
-                    else:
-                        # No match, delete_it = True
-                        pass
-            if delete_it:
-                pol2delete.append(polname)
-        for polname in pol2delete:
-            del Policies[polname]
-
-    pol2delete = []
-    if param.get('user', None) is not None:
-        # log.debug("[getPolicy] cleanup acccording to user %s" % param["user"])
-        for polname, policy in Policies.items():
-            if policy.get('user'):
-                pol_users = [p.strip()
-                             for p in policy.get('user').lower().split(',')]
-                # log.debug("[getPolicy] users in policy %s: %s"
-                #          % (polname, str(pol_users) ))
-            else:
-                log.error("Empty userlist in policy '%s' not supported!" % polname)
-                raise Exception("Empty userlist in policy '%s' not supported!" % polname)
-
-            delete_it = True
-            for u in pol_users:
-                # log.debug("[getPolicy] User: %s" % u )
-                if u == param['user'].lower() or u == '*':
-                    # log.debug("[getPolicy] setting delete_it to false."
-                    #          "We are using policy %s" % str(polname))
-                    delete_it = False
-                    break
-
-            if delete_it:
-                pol2delete.append(polname)
-        for polname in pol2delete:
-            del Policies[polname]
+    Policies = getPolicySet().select(param,
+                                     display_inactive=display_inactive)
 
     log.debug("[getPolicy] getting policies %s for "
               "params %s" % (Policies, param))
@@ -2557,6 +2452,10 @@ def checkPolicyPre(controller, method, param={}, authUser=None, user=None):
             'checkPolicy': "read",
             'delPolicy': 'write',
             'setSupport': 'write',
+            'updateOtpIndex': 'write',
+            'reloadKeys': 'write',
+            'getStats': 'read',
+            'verifyAudit': 'read',
             }
 
         if not method in actions:
@@ -2750,8 +2649,6 @@ def get_client_policy(client, scope=None, action=None, realm=None, user=None,
 
     3. then we try to find resolvers in the username (OPTIONAL)
     '''
-    Policies = {}
-
     param = {}
 
     if scope:
@@ -2763,91 +2660,35 @@ def get_client_policy(client, scope=None, action=None, realm=None, user=None,
 
     log.debug("[get_client_policy] with params %r, "
               "client %r and user %r" % (param, client, user))
-    Pols = getPolicy(param)
+    policy_set = getPolicySet()
+    Pols = policy_set.select(param)
     log.debug("[get_client_policy] got policies %s " % Pols)
 
-    def get_array(policy, attribute="client", marks=False):
-        ## This function returns the parameter "client" or
-        ## "user" in a policy as an array
-        attrs = policy.get(attribute, "")
-        if attrs == "None" or attrs is None:
-            attrs = ""
-        log.debug("[get_array] splitting <%s>" % attrs)
-        attrs_array = []
-        if marks:
-            attrs_array = [co.strip()[:-1] for co in attrs.split(',')
-                           if len(co.strip()) and co.strip()[-1] == ":"]
-        else:
-            attrs_array = [co.strip()
-                           for co in attrs.split(',')
-                           if len(co.strip()) and co.strip()[-1] != ":"]
-        # if for some reason the first element is empty, delete it.
-        if len(attrs_array) and attrs_array[0] == "":
-            del attrs_array[0]
-        return attrs_array
-
-    ## 1. Find a policy with this client
-    for pol, policy in Pols.items():
-        log.debug("[get_client_policy] checking policy %s" % pol)
-        clients_array = get_array(policy, attribute="client")
-        log.debug("[get_client_policy] the policy %s has these clients: %s. "
-                  "checking against %s." % (pol, clients_array, client))
-        client_found = False
-        client_excluded = False
-        for cl in clients_array:
-            try:
-                if cl[0] in ['-', '!']:
-                    if IPAddress(client) in IPNetwork(cl[1:]):
-                        log.debug("[get_client_policy] the client %s is "
-                                  "excluded by %s in policy "
-                                  "%s" % (client, cl, pol))
-                        client_excluded = True
-                if IPAddress(client) in IPNetwork(cl):
-                    client_found = True
-            except Exception as e:
-                log.warning("[get_client_policy] authorization policy %s with "
-                            "invalid client: %r" % (pol, e))
-
-        if client_found and not client_excluded:
-            Policies[pol] = policy
-
-    # No policy for this client was found, but maybe
-    # there is one without clients
-    if len(Policies) == 0:
-        log.debug("[get_client_policy] looking for policy without any client")
-        for pol, policy in Pols.items():
-            if len(get_array(policy, attribute="client")) == 0:
-                Policies[pol] = policy
+    ## 1. Find a policy with this client - or, if there is none, the
+    ##    policies without any client
+    names = policy_set.select_client(Pols.keys(), client)
+    log.debug("[get_client_policy] policies %r match the client %s"
+              % (names, client))
 
     ## 2. Within those policies select the policy with the user.
     ##     if there is a policy with this very user, return only
     ##     these policies, otherwise return all policies
     if user:
         user_policy_found = False
-        own_policies = {}
-        default_policies = {}
-        for polname, pol in Policies.items():
-            users = get_array(pol, attribute="user")
-            log.debug("[get_client_policy] search user %s in users %s "
-                      "of policy %s" % (user, users, polname))
+        own_policies = []
+        default_policies = []
+        for polname in names:
+            users = policy_set.get(polname).client_users
             if user in users or '*' in users:
-                log.debug("[get_client_policy] adding %s to "
-                          "own_policies" % polname)
-                own_policies[polname] = pol
+                own_policies.append(polname)
             elif len(users) == 0:
-                log.debug("[get_client_policy] adding %s to "
-                          "default_policies" % polname)
-
-                default_policies[polname] = pol
-            else:
-                log.debug("[get_client_policy] policy %s contains only users "
-                          "(%s) other than %s" % (polname, users, user))
+                default_policies.append(polname)
 
         if len(own_policies):
-            Policies = own_policies
+            names = own_policies
             user_policy_found = True
         else:
-            Policies = default_policies
+            names = default_policies
 
         ##3. If no user specific policy was found, we now take a look,
         ##   if we find a policy with the matching resolver.
@@ -2858,32 +2699,27 @@ def get_client_policy(client, scope=None, action=None, realm=None, user=None,
                 resolvers = getResolversOfUser(userObj)
             else:
                 resolvers = getResolversOfUser(User(login=user, realm=realm))
-            own_policies = {}
-            default_policies = {}
-            for polname, pol in Policies.items():
-                resolvs = get_array(pol, attribute="user", marks=True)
-                for r in resolvers:
-                    # trim the resolver useridresolver.LDAPIdResolver.\
-                    # IdResolver.local to its name
-                    r = r[r.rfind('.') + 1:]
-                    if r in resolvs:
-                        log.debug("[get_client_policy] adding %s to "
-                                  "own_policies" % polname)
-                        own_policies[polname] = pol
-                    elif len(resolvs) == 0:
-                        log.debug("[get_client_policy] adding %s (no "
-                                  "resolvers) to default_policies" % polname)
-                        default_policies[polname] = pol
-                    else:
-                        log.debug("[get_client_policy] policy %s contains "
-                                  "only resolvers (%s) other than %s" %
-                                  (polname, resolvs, r))
+            # trim the resolver useridresolver.LDAPIdResolver.\
+            # IdResolver.local to its name
+            resolvers = [r[r.rfind('.') + 1:] for r in resolvers]
+
+            own_policies = []
+            default_policies = []
+            for polname in names:
+                resolvs = policy_set.get(polname).client_resolvers
+                if len(resolvs) == 0:
+                    if resolvers:
+                        default_policies.append(polname)
+                elif any(r in resolvs for r in resolvers):
+                    own_policies.append(polname)
+
             if len(own_policies):
-                Policies = own_policies
+                names = own_policies
             else:
-                Policies = default_policies
+                names = default_policies
 
-    return Policies
+    log.debug("[get_client_policy] selected policies %r" % names)
+    return dict((polname, Pols[polname]) for polname in names)
 
 
 def set_realm(login, realm, exception=False):
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+compiled policy set
+
+the policy definitions are stored as flat 'linotp.Policy.<name>.<attr>'
+config entries. The PolicySet parses these entries once and holds
+indexes by name, scope, realm and action together with the already split
+user lists and parsed client networks, so that a policy lookup is only a
+couple of dict hits.
+
+A PolicySet is immutable - it is rebuilt whenever the config changes.
+"""
+
+import logging
+
+from netaddr import IPAddress
+from netaddr import IPNetwork
+
+log = logging.getLogger(__name__)
+
+POLICY_PREFIX = "linotp.Policy."
+
+
+def split_attribute(value, marks=False):
+    '''
+    split the comma separated policy attribute like 'client' or 'user'
+    into a list
+
+    :param value: the raw policy attribute value
+    :param marks: if True, only the entries ending with a ':' are returned
+                  (without the ':' - these are the resolver definitions),
+                  otherwise only the entries without a trailing ':'
+
+    :return: list of the stripped entries
+    '''
+    if value == "None" or value is None:
+        value = ""
+
+    entries = [entry.strip() for entry in value.split(',')]
+    if marks:
+        attrs = [entry[:-1] for entry in entries
+                 if len(entry) and entry[-1] == ":"]
+    else:
+        attrs = [entry for entry in entries
+                 if len(entry) and entry[-1] != ":"]
+
+    # if for some reason the first element is empty, delete it.
+    if len(attrs) and attrs[0] == "":
+        del attrs[0]
+    return attrs
+
+
+class CompiledPolicy(object):
+    '''
+    one policy with all its attributes prepared for the lookup
+    '''
+
+    __slots__ = ('name', 'data', 'active', 'scope', 'realms', 'actions',
+                 'users', 'client_users', 'client_resolvers',
+                 'has_clients', 'networks')
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+        self.active = data.get('active', "True") != "False"
+
+        scope = data.get('scope')
+        self.scope = scope.lower() if scope is not None else None
+
+        # realms, actions and users are None if the policy does not
+        # define them at all - then the policy will never match a search
+        # on this attribute
+        realm = data.get('realm')
+        self.realms = None
+        if realm is not None:
+            self.realms = set(r.strip() for r in realm.lower().split(','))
+
+        action = data.get('action')
+        self.actions = None
+        if action is not None:
+            self.actions = set()
+            for act in action.lower().split(','):
+                act = act.strip()
+                self.actions.add(act)
+                self.actions.add(act.split('=')[0].strip())
+
+        user = data.get('user')
+        self.users = None
+        if user:
+            self.users = set(u.strip() for u in user.lower().split(','))
+
+        self.client_users = split_attribute(user)
+        self.client_resolvers = split_attribute(user, marks=True)
+
+        clients = split_attribute(data.get('client', ""))
+        self.has_clients = len(clients) > 0
+        self.networks = []
+        for client in clients:
+            excluded = client[0] in ['-', '!']
+            if excluded:
+                client = client[1:]
+            try:
+                self.networks.append((IPNetwork(client), excluded))
+            except Exception as exx:
+                log.warning("[CompiledPolicy] authorization policy %s with "
+                            "invalid client: %r" % (name, exx))
+
+    def match_client(self, address):
+        '''
+        check if the client address is contained and not excluded by
+        the client definition of the policy
+
+        :param address: the IPAddress of the client or None
+        :return: boolean
+        '''
+        if address is None:
+            return False
+
+        found = False
+        for network, excluded in self.networks:
+            if address in network:
+                if excluded:
+                    return False
+                found = True
+        return found
+
+
+class PolicySet(object):
+    '''
+    the compiled, indexed set of all policies of one config
+    '''
+
+    def __init__(self, config):
+        '''
+        parse all policy entries of the config
+
+        :param config: the linotp config dict
+        '''
+        policies = {}
+        for entry in config:
+            if not entry.startswith(POLICY_PREFIX):
+                continue
+            policy = entry.split(".", 4)
+            if len(policy) != 4:
+                continue
+
+            name = policy[2]
+            key = policy[3]
+            value = config.get(entry)
+
+            # prepare the value to be at least an empty string
+            if value is None and key in ('user', 'client', 'realm'):
+                value = ''
+            if key == "realm":
+                value = value.lower()
+
+            policies.setdefault(name, {})[key] = value
+
+        self.policies = {}
+        self.names = {}
+        self.active = set()
+        self.scopes = {}
+        self.realms = {}
+        self.actions = {}
+
+        for name, data in policies.items():
+            pol = CompiledPolicy(name, data)
+            self.policies[name] = pol
+
+            self.names.setdefault(name.lower(), set()).add(name)
+            if pol.active:
+                self.active.add(name)
+            if pol.scope is not None:
+                self.scopes.setdefault(pol.scope, set()).add(name)
+            for realm in pol.realms or []:
+                self.realms.setdefault(realm, set()).add(name)
+            for action in pol.actions or []:
+                self.actions.setdefault(action, set()).add(name)
+
+    def __len__(self):
+        return len(self.policies)
+
+    def get(self, name):
+        '''
+        :return: the CompiledPolicy of the given name or None
+        '''
+        return self.policies.get(name)
+
+    def getPolicies(self):
+        '''
+        :return: dict of all policy definitions - the definitions are
+                 copies, so the caller might modify them
+        '''
+        return dict((name, dict(pol.data))
+                    for name, pol in self.policies.items())
+
+    def _lookup(self, index, key):
+        '''
+        get the names of the policies with the key or the wildcard '*'
+        '''
+        return index.get(key, set()) | index.get('*', set())
+
+    def select(self, param, display_inactive=False):
+        '''
+        select the policies matching the given parameters - see getPolicy
+
+        :param param: dict with the optional keys name, realm, scope,
+                      action and user
+        :param display_inactive: if True, the inactive policies are returned
+                                 as well
+        :return: dict with the copies of the matching policy definitions
+        '''
+        candidates = []
+
+        if param.get('name', None):
+            candidates.append(self.names.get(param['name'].lower(), set()))
+
+        if not display_inactive:
+            candidates.append(self.active)
+
+        if param.get('realm', None) is not None:
+            candidates.append(self._lookup(self.realms,
+                                           param['realm'].lower()))
+
+        if param.get('scope', None) is not None:
+            candidates.append(self.scopes.get(param['scope'].lower(), set()))
+
+        if param.get('action', None) is not None:
+            candidates.append(self._lookup(self.actions,
+                                           param['action'].strip().lower()))
+
+        if candidates:
+            candidates.sort(key=len)
+            names = set(candidates[0])
+            for names_subset in candidates[1:]:
+                names &= names_subset
+        else:
+            names = set(self.policies.keys())
+
+        if param.get('user', None) is not None:
+            user = param['user'].lower()
+            matching = set()
+            for name in names:
+                users = self.policies[name].users
+                if not users:
+                    log.error("Empty userlist in policy '%s' not supported!"
+                              % name)
+                    raise Exception("Empty userlist in policy '%s' not "
+                                    "supported!" % name)
+                if user in users or '*' in users:
+                    matching.add(name)
+            names = matching
+
+        return dict((name, dict(self.policies[name].data)) for name in names)
+
+    def select_client(self, names, client):
+        '''
+        select the policies of the given names, which are defined for the
+        client. If there is no policy for the client, the policies without
+        any client definition are returned.
+
+        :param names: list of policy names
+        :param client: the client ip address as string
+        :return: list of the matching policy names
+        '''
+        found = []
+        if any(self.policies[name].has_clients for name in names):
+            address = None
+            try:
+                address = IPAddress(client)
+            except Exception as exx:
+                log.warning("[select_client] invalid client %r: %r"
+                            % (client, exx))
+
+            found = [name for name in names
+                     if self.policies[name].match_client(address)]
+        if not found:
+            found = [name for name in names
+                     if not self.policies[name].has_clients]
+        return found
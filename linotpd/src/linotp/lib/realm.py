@@ -26,6 +26,8 @@
 """realm processing logic"""
 
 from linotp.model import Realm, TokenRealm
+from linotp.model import TokenCounter
+from linotp.model import COUNTER_REALM
 from linotp.model.meta import Session
 
 from linotp.lib.config import getLinotpConfig
@@ -33,6 +35,7 @@ from linotp.lib.config import storeConfig
 from linotp.lib.config import getFromConfig
 
 from sqlalchemy import func
+from sqlalchemy import and_
 
 import logging
 log = logging.getLogger(__name__)
@@ -313,6 +316,9 @@ def deleteRealm(realmname):
         if realmId != 0:
             log.debug("[deleteRealm] Now deleting all realations with realm_id=%i" % realmId)
             Session.query(TokenRealm).filter(TokenRealm.realm_id == realmId).delete()
+            Session.query(TokenCounter).filter(and_(
+                            TokenCounter.scope == COUNTER_REALM,
+                            TokenCounter.name == u'' + r.name)).delete()
         Session.delete(r)
 
     else:
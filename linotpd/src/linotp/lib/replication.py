@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+'''
+change detection for the replicated config
+
+With 'linotp.enableReplication' several LinOTP nodes share one config
+database. Every config change updates the 'linotp.Config' timestamp entry,
+which is compared with the timestamp of the local config to detect changes
+of the other nodes.
+
+A config notifier observes this timestamp in a background thread, so that
+a request only has to compare two values instead of running a database
+query. The notifier is defined in the ini file:
+
+    linotpReplication.notifier = db | file
+    linotpReplication.poll_interval = 5
+    linotpReplication.notify_file = /var/run/linotp/config.changed
+
+'db' polls the timestamp entry every poll_interval seconds. 'file' only
+looks at the modification time of the notify file, which is touched by
+every node after it committed a config change - the timestamp is only
+read from the database, when the file has changed.
+'''
+
+import os
+import time
+import logging
+
+from sqlalchemy import select
+from sqlalchemy import event
+
+from linotp.model import meta
+from linotp.model import config_table
+from linotp.lib.worker import PeriodicWorker
+
+log = logging.getLogger(__name__)
+
+CONFIG_TIMESTAMP = u'linotp.Config'
+CONFIG_CHANGED = 'linotp.config_changed'
+
+
+class ConfigNotifier(PeriodicWorker):
+    '''
+    base class of the config change notifiers
+    '''
+
+    def __init__(self, interval=5):
+        PeriodicWorker.__init__(self, 'linotp config notifier', interval,
+                                wait_first=True)
+
+        self.config_date = None
+        self.polls = 0
+        self.last_poll = None
+
+    def start(self):
+        '''
+        read the actual config timestamp and start the polling thread
+        '''
+        if not self.isRunning():
+            self.refresh()
+        PeriodicWorker.start(self)
+        return
+
+    def work(self):
+        self.refresh()
+
+    def refresh(self):
+        '''
+        poll the config timestamp - errors are only logged, as the last
+        known timestamp is still valid
+        '''
+        try:
+            self.poll()
+            self.polls += 1
+            self.last_poll = time.time()
+        except Exception as exx:
+            log.error("[refresh] failed to poll the config timestamp: %r"
+                      % exx)
+        return
+
+    def poll(self):
+        '''
+        update the config_date - to be implemented by the notifiers
+        '''
+        raise NotImplementedError("poll is not implemented by %r"
+                                  % self.__class__.__name__)
+
+    def notify(self):
+        '''
+        inform the other nodes, that this node committed a config change
+        '''
+        return
+
+    def getConfigDate(self):
+        '''
+        get the last seen config timestamp of the config database
+
+        :return: the timestamp string or None
+        '''
+        if not self.isRunning():
+            self.start()
+        return self.config_date
+
+    def _readConfigDate(self):
+        '''
+        read the config timestamp from the database - the notifier uses its
+        own connection and not the request Session
+        '''
+        query = select([config_table.c.Value]).where(
+                                    config_table.c.Key == CONFIG_TIMESTAMP)
+        row = meta.engine.execute(query).first()
+        if row is None:
+            return None
+        return row[0]
+
+
+class DBConfigNotifier(ConfigNotifier):
+    '''
+    poll the config timestamp from the database
+    '''
+
+    def poll(self):
+        self.config_date = self._readConfigDate()
+        return
+
+
+class FileConfigNotifier(ConfigNotifier):
+    '''
+    read the config timestamp from the database only if the notify file
+    has been touched by one of the nodes
+    '''
+
+    def __init__(self, filename, interval=5):
+        ConfigNotifier.__init__(self, interval=interval)
+        self.filename = filename
+        self.file_stat = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.filename)
+            return (stat.st_mtime, stat.st_size)
+        except OSError:
+            return None
+
+    def poll(self):
+        file_stat = self._stat()
+        if file_stat != self.file_stat or self.polls == 0:
+            self.config_date = self._readConfigDate()
+            self.file_stat = file_stat
+        return
+
+    def notify(self):
+        try:
+            with open(self.filename, 'a'):
+                os.utime(self.filename, None)
+        except IOError as exx:
+            log.error("[notify] failed to touch the notify file %r: %r"
+                      % (self.filename, exx))
+        # the next poll reads the timestamp, even if the file time did not
+        # change within its resolution
+        self.file_stat = None
+        return
+
+
+def _after_commit(session):
+    '''
+    session hook: notify the other nodes after a config change is committed
+    and take over the new config timestamp - otherwise every request of
+    this process would reload the config until the next poll
+    '''
+    if session.info.pop(CONFIG_CHANGED, False):
+        notifier = _get_notifier()
+        if notifier is not None:
+            notifier.notify()
+            notifier.refresh()
+    return
+
+
+def _after_rollback(session):
+    session.info.pop(CONFIG_CHANGED, None)
+    return
+
+
+def _get_notifier():
+    from linotp.lib.config import getGlobalObject
+    glo = getGlobalObject()
+    if glo is None:
+        return None
+    return glo.getConfigNotifier()
+
+
+def markConfigChanged():
+    '''
+    remember in the request Session, that the config has been changed, so
+    that the other nodes are notified after the commit
+    '''
+    meta.Session().info[CONFIG_CHANGED] = True
+    return
+
+
+def getConfigNotifier(config):
+    '''
+    create the config notifier as defined in the ini file
+
+    :param config: the pylons config
+    :return: the ConfigNotifier or None if no notifier is defined
+    '''
+    notifier_type = config.get('linotpReplication.notifier', '')
+    notifier_type = notifier_type.strip().lower()
+    if not notifier_type:
+        return None
+
+    interval = float(config.get('linotpReplication.poll_interval', 5))
+
+    if notifier_type == 'db':
+        notifier = DBConfigNotifier(interval=interval)
+    elif notifier_type == 'file':
+        filename = config.get('linotpReplication.notify_file')
+        if not filename:
+            raise Exception("linotpReplication.notify_file is required "
+                            "for the file notifier")
+        notifier = FileConfigNotifier(filename, interval=interval)
+    else:
+        raise Exception("unknown config notifier %r" % notifier_type)
+
+    if not event.contains(meta.Session, 'after_commit', _after_commit):
+        event.listen(meta.Session, 'after_commit', _after_commit)
+        event.listen(meta.Session, 'after_rollback', _after_rollback)
+
+    log.info("[getConfigNotifier] using %s with poll interval %s"
+             % (notifier.__class__.__name__, interval))
+    return notifier
@@ -437,6 +437,64 @@ def sendCSVResult(response, obj, flat_lines=False,
 
     return output
 
+def sendCSVResultIterator(response, obj,
+                          filename="linotp-tokendata.csv"):
+    '''
+    returns a CSV document of the rows of an iterator in a streamed mode -
+    the document is the same as of the sendCSVResult
+
+    :param response: The pylons response object
+    :param obj: iterator or generator of the row dicts
+    :param filename: the file name of the download
+    :return: generator of response data (yield)
+    '''
+    delim = "'"
+    response.content_type = "application/force-download"
+    response.headers['Content-disposition'] = 'attachment; filename=%s' % filename
+
+    def iterate_lines(rows):
+        keys = None
+        for row in rows:
+            output = u""
+            if keys is None:
+                # Do the header
+                keys = row.keys()
+                for k in keys:
+                    output += "%s%s%s, " % (delim, k, delim)
+                output += "\n"
+
+            # Do the data
+            for k in keys:
+                val = row.get(k)
+                if type(val) in [str, unicode]:
+                    value = val.replace("\n", " ")
+                else:
+                    value = val
+                output += "%s%s%s, " % (delim, value, delim)
+            output += "\n"
+            yield output.encode('utf-8')
+
+    return iterate_lines(obj)
+
+
+def sendJSONLinesIterator(response, obj):
+    '''
+    returns the rows of an iterator as JSON lines document in a streamed
+    mode - one json object per line
+
+    :param response: The pylons response object
+    :param obj: iterator or generator of the row dicts
+    :return: generator of response data (yield)
+    '''
+    response.content_type = "application/x-json-stream"
+
+    def iterate_lines(rows):
+        for row in rows:
+            yield json.dumps(row) + "\n"
+
+    return iterate_lines(obj)
+
+
 def sendXMLResult(response, obj, id=1):
     response.content_type = 'text/xml'
     res = '<?xml version="1.0" encoding="UTF-8"?>\
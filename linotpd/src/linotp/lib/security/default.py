@@ -29,6 +29,10 @@
 import logging
 import binascii
 import os
+import ctypes
+import ctypes.util
+import signal
+import threading
 
 from Crypto.Cipher import AES
 
@@ -44,6 +48,201 @@ DEFAULT_KEY = 3
 
 log = logging.getLogger(__name__)
 
+KEY_SIZE = 32
+
+
+def _libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except Exception as exx:
+        log.debug("[_libc] no libc available: %r" % exx)
+        return None
+
+
+class KeySlots(object):
+    '''
+    the keys of a key file - the file is read only once into a buffer,
+    which is locked into memory (mlock) where available, so that the keys
+    are never swapped out
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.buffer = None
+        self.size = 0
+        self.locked = False
+        self.reads = 0
+
+    def load(self):
+        '''
+        (re)read the key file into a new buffer
+        '''
+        with open(self.filename) as f:
+            data = f.read()
+
+        size = len(data)
+        buf = ctypes.create_string_buffer(size or 1)
+        ctypes.memmove(buf, data, size)
+        if size:
+            zerome(data)
+        del data
+
+        locked = self._mlock(buf)
+
+        with self.lock:
+            (old_buffer, old_locked) = (self.buffer, self.locked)
+            self.buffer = buf
+            self.size = size
+            self.locked = locked
+            self.reads += 1
+
+        self._clear(old_buffer, old_locked)
+        log.info("[KeySlots] loaded key file %r (locked in memory: %r)"
+                 % (self.filename, locked))
+        return
+
+    def get(self, id):
+        '''
+        :return: a copy of the key in the slot - the caller might zero it
+        '''
+        with self.lock:
+            if self.buffer is None:
+                raise Exception("key file %s is not loaded" % self.filename)
+            start = id * KEY_SIZE
+            secret = ctypes.string_at(ctypes.addressof(self.buffer) + start,
+                                      max(min(KEY_SIZE, self.size - start), 0))
+        return secret
+
+    def clear(self):
+        with self.lock:
+            (buf, locked) = (self.buffer, self.locked)
+            self.buffer = None
+            self.locked = False
+        self._clear(buf, locked)
+
+    def _mlock(self, buf):
+        libc = _libc()
+        if libc is None or not hasattr(libc, 'mlock'):
+            return False
+        res = libc.mlock(ctypes.c_void_p(ctypes.addressof(buf)),
+                         ctypes.c_size_t(ctypes.sizeof(buf)))
+        if res != 0:
+            log.warning("[KeySlots] failed to lock the keys into memory: %r"
+                        % os.strerror(ctypes.get_errno()))
+            return False
+        return True
+
+    def _clear(self, buf, locked):
+        if buf is None:
+            return
+        ctypes.memset(buf, 0, ctypes.sizeof(buf))
+        if locked:
+            libc = _libc()
+            libc.munlock(ctypes.c_void_p(ctypes.addressof(buf)),
+                         ctypes.c_size_t(ctypes.sizeof(buf)))
+        return
+
+
+# the process wide key slots - one per key file
+key_slots = {}
+key_slots_lock = threading.Lock()
+
+
+def getKeySlots(filename):
+    '''
+    get the loaded key slots of the key file - the file is read on the first
+    access only
+
+    :param filename: the key file
+    :return: KeySlots
+    '''
+    with key_slots_lock:
+        slots = key_slots.get(filename)
+        if slots is None:
+            slots = KeySlots(filename)
+            key_slots[filename] = slots
+
+    if slots.buffer is None:
+        with key_slots_lock:
+            if slots.buffer is None:
+                slots.load()
+    return slots
+
+
+def reloadKeySlots():
+    '''
+    re-read all key files - called by the admin or on SIGHUP
+
+    :return: the list of the reloaded key files
+    '''
+    with key_slots_lock:
+        slots = list(key_slots.values())
+
+    reloaded = []
+    for slot in slots:
+        try:
+            slot.load()
+            reloaded.append(slot.filename)
+        except Exception as exx:
+            log.error("[reloadKeySlots] failed to reload key file %r: %r"
+                      % (slot.filename, exx))
+    return reloaded
+
+
+def getKeyFileReads():
+    '''
+    :return: dict with the number of reads of every key file
+    '''
+    with key_slots_lock:
+        return dict((name, slot.reads) for name, slot in key_slots.items())
+
+
+# the SIGHUP handler, which has been replaced by _sighup
+sighup_handler = {}
+
+# set by SIGHUP - the key files are reloaded by the next key access
+reload_requested = threading.Event()
+
+
+def _sighup(signum, frame):
+    '''
+    the signal handler only requests the reload: the handler interrupts the
+    main thread at any point, which might hold the locks of the key slots
+    '''
+    reload_requested.set()
+    previous = sighup_handler.get('previous')
+    if callable(previous):
+        previous(signum, frame)
+
+
+def reloadIfRequested():
+    '''
+    reload the key files, if requested by SIGHUP
+
+    :return: boolean - True if the key files have been reloaded
+    '''
+    if not reload_requested.is_set():
+        return False
+    reload_requested.clear()
+    log.info("[reloadIfRequested] reloading the key files on SIGHUP")
+    reloadKeySlots()
+    return True
+
+
+def installReloadHandler():
+    '''
+    reload the key files on SIGHUP - signal handlers could only be installed
+    by the main thread, otherwise the keys are only reloaded by the admin
+    '''
+    if sighup_handler or not hasattr(signal, 'SIGHUP'):
+        return
+    try:
+        sighup_handler['previous'] = signal.signal(signal.SIGHUP, _sighup)
+    except ValueError as exx:
+        log.debug("[installReloadHandler] no SIGHUP handler: %r" % exx)
+    return
+
 
 class DefaultSecurityModule(SecurityModule):
 
@@ -76,7 +275,16 @@ class DefaultSecurityModule(SecurityModule):
             raise Exception("no secret file defined: linotpSecretFile!")
 
         self.secFile = config.get('file')
-        self.secrets = {}
+        self.slots = None
+
+        # the keys are read only once - on SIGHUP they are read again
+        installReloadHandler()
+        if not self.crypted:
+            try:
+                self.slots = getKeySlots(self.secFile)
+            except Exception as exx:
+                log.error("[__init__] failed to read the key file %r: %r"
+                          % (self.secFile, exx))
 
         return
 
@@ -105,16 +313,12 @@ class DefaultSecurityModule(SecurityModule):
         log.debug('getSecret()')
         id = int(id)
 
-        if self.crypted:
-            if self.secrets.has_key(id):
-                return self.secrets.get(id)
-
         secret = ''
         try:
-                f = open(self.secFile)
-                for _i in range (0 , id + 1):
-                    secret = f.read(32)
-                f.close()
+                reloadIfRequested()
+                if self.slots is None:
+                    self.slots = getKeySlots(self.secFile)
+                secret = self.slots.get(id)
                 if secret == "" :
                     # secret = setupKeyFile(secFile, id+1)
                     raise Exception ("No secret key defined for index: %s !\n"
@@ -123,8 +327,6 @@ class DefaultSecurityModule(SecurityModule):
         except Exception as e:
             raise Exception ("Exception:" + unicode(e))
 
-        if self.crypted:
-            self.secrets[id] = secret
         log.debug('[getSecret] returning secret')
         return secret;
 
@@ -31,8 +31,11 @@ random, crypt, decrypt, sign
 import thread
 import time
 import logging
+import threading
 import traceback
 
+from collections import deque
+
 from linotp.lib.crypt import zerome
 from linotp.lib.error import HSMException
 
@@ -44,6 +47,130 @@ VALUE_KEY = 3
 
 log = logging.getLogger(__name__)
 
+# the default time in seconds to wait for a free security module
+DEFAULT_POOL_TIMEOUT = 30
+
+
+class HSMPool(object):
+    '''
+    bounded pool of the security module instances of one hsm id
+
+    A request session checks out one entry - a dict with the module 'obj',
+    the 'session' and the load 'error' - and returns it at the end of the
+    request. The free entries are held in a queue, so checkout and return
+    don't depend on the pool size. If the pool is exhausted, the session
+    waits up to 'timeout' seconds for a returned entry.
+
+    The pool is defined for every module - default, pkcs11 or yubihsm - by
+
+        linotpSecurity.<hsm_id>.poolsize = 20
+        linotpSecurity.<hsm_id>.pooltimeout = 30
+    '''
+
+    def __init__(self, hsm_id, entries, timeout=DEFAULT_POOL_TIMEOUT):
+        self.hsm_id = hsm_id
+        self.entries = entries
+        self.timeout = timeout
+
+        self.free = deque(entries)
+        self.sessions = {}
+        self.cond = threading.Condition(threading.Lock())
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+        self.max_in_use = 0
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def acquire(self, sessionId, timeout=None):
+        '''
+        bind a free entry to the session - an entry already bound to the
+        session is returned again
+
+        :param sessionId: the session identifier
+        :param timeout: seconds to wait for a free entry, default is the
+                        timeout of the pool
+        :return: the pool entry
+        '''
+        if timeout is None:
+            timeout = self.timeout
+
+        with self.cond:
+            entry = self.sessions.get(sessionId)
+            if entry is not None:
+                return entry
+
+            if not self.free:
+                start = time.time()
+                deadline = start + timeout
+                self.waits += 1
+                while not self.free:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                waited = time.time() - start
+                self.wait_time += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+                if not self.free:
+                    self.timeouts += 1
+                    error = ("[HSMPool:acquire] no free security module %s "
+                             "for session %r after %r seconds"
+                             % (self.hsm_id, sessionId, timeout))
+                    log.error(error)
+                    raise HSMException(error, id=707)
+
+            entry = self.free.popleft()
+            entry['session'] = sessionId
+            self.sessions[sessionId] = entry
+
+            self.checkouts += 1
+            self.max_in_use = max(self.max_in_use, len(self.sessions))
+        return entry
+
+    def release(self, sessionId):
+        '''
+        return the entry of the session to the pool
+
+        :return: the entry or None, if no entry is bound to the session
+        '''
+        with self.cond:
+            entry = self.sessions.pop(sessionId, None)
+            if entry is not None:
+                entry['session'] = 0
+                self.free.append(entry)
+                self.cond.notify()
+        return entry
+
+    def getStats(self):
+        '''
+        :return: dict with the size and the utilisation of the pool, the
+                 number of checkouts and the waits for a free entry
+        '''
+        with self.cond:
+            in_use = len(self.sessions)
+            size = len(self.entries)
+            return {'size': size,
+                    'in_use': in_use,
+                    'max_in_use': self.max_in_use,
+                    'utilisation': float(in_use) / size if size else 0.0,
+                    'checkouts': self.checkouts,
+                    'waits': self.waits,
+                    'wait_time': self.wait_time,
+                    'wait_time_max': self.wait_time_max,
+                    'timeouts': self.timeouts,
+                    }
+
+
 class SecurityProvider(object):
     '''
     the Security provider is the singleton in the server who provides
@@ -72,7 +199,6 @@ class SecurityProvider(object):
         self.activeOne = 'default'
         self.hsmpool = {}
         self.rwLock = secLock
-        self.max_retry = 5
 
     def __createDefault__(self, config):
         '''
@@ -264,8 +390,9 @@ class SecurityProvider(object):
                 ## get the number of entries from the hsd (id) config
                 conf = self.config.get(id)
                 amount = int(conf.get('poolsize', 10))
+                timeout = float(conf.get('pooltimeout', DEFAULT_POOL_TIMEOUT))
                 log.debug("[createHSMPool] creating pool for %r with size %r" % (id, amount))
-                pool = []
+                entries = []
                 for i in range(0, amount):
                     error = ''
                     hsm = None
@@ -275,38 +402,20 @@ class SecurityProvider(object):
                         error = u"%r" % e
                         log.error("[createHSMPool] %r " % (e))
                         log.error("[createHSMPool] %s" % traceback.format_exc())
-                    pool.append({'obj': hsm , 'session': 0, 'error':error})
+                    entries.append({'obj': hsm , 'session': 0, 'error':error})
 
+                pool = HSMPool(id, entries, timeout=timeout)
                 self.hsmpool[id] = pool
         return pool
 
-    def _findHSM4Session(self, pool, sessionId):
-        found = None
-        ## find session
-        for hsm in pool:
-            hsession = hsm.get('session')
-            if hsession == sessionId:
-                found = hsm
-        return found
-
-    def _createHSM4Session(self, pool, sessionId):
-        found = None
-        for hsm in pool:
-            hsession = hsm.get('session')
-            if unicode(hsession) == u'0':
-                hsm['session'] = sessionId
-                found = hsm
-                break
-        return found
+    def getPoolStats(self):
+        '''
+        get the utilisation and the wait times of the security module pools
 
-    def _freeHSMSession(self, pool, sessionId):
-        hsm = None
-        for hsm in pool:
-            hsession = hsm.get('session')
-            if unicode(hsession) == unicode(sessionId):
-                hsm['session'] = 0
-                break
-        return hsm
+        :return: dict with the statistics of every pool
+        '''
+        return dict((hsm_id, pool.getStats())
+                    for hsm_id, pool in self.hsmpool.items())
 
     def dropSecurityModule(self, hsm_id=None, sessionId=None):
         found = None
@@ -322,18 +431,13 @@ class SecurityProvider(object):
             raise HSMException(error, id=707)
             return None
 
-        ## find session
-        try:
-            pool = self._getHsmPool_(hsm_id)
-            self.rwLock.acquire_write()
-            found = self._findHSM4Session(pool, sessionId)
-            if found is None:
-                log.info('[SecurityProvider:dropSecurityModule] could not bind '
-                           'hsm to session %r ' % hsm_id)
-            else:
-                self._freeHSMSession(pool, sessionId)
-        finally:
-            self.rwLock.release()
+        ## return the entry of the session to the pool
+        pool = self._getHsmPool_(hsm_id)
+        if pool is not None:
+            found = pool.release(sessionId)
+        if found is None:
+            log.info('[SecurityProvider:dropSecurityModule] could not bind '
+                       'hsm to session %r ' % hsm_id)
         return True
 
     def getSecurityModule(self, hsm_id=None, sessionId=None):
@@ -349,54 +453,16 @@ class SecurityProvider(object):
             log.error(error)
             raise HSMException(error, id=707)
 
-        retry = True
-        tries = 0
-        locked = False
-
-        while retry == True:
-            try:
-                pool = self._getHsmPool_(hsm_id)
-                self.rwLock.acquire_write()
-                locked = True
-                ## find session
-                found = self._findHSM4Session(pool, sessionId)
-                if found is not None:
-                    ## if session is ok - return
-                    self.rwLock.release()
-                    locked = False
-                    retry = False
-                    log.debug("[getSecurityModule] using existing pool session %s" % found)
-                    return found.get('obj')
-                else:
-                    ## create new entry
-                    log.debug("[getSecurityModule] getting new Session (%s) "
-                              "from pool %s" % (sessionId, pool))
-                    found = self._createHSM4Session(pool, sessionId)
-                    self.rwLock.release()
-                    locked = False
-                    if found is None:
-                        tries += 1
-                        log.warning('try %d: could not bind hsm to session  - '
-                                    'going to sleep for  %r' % (tries, 10 * tries))
-                        time.sleep(10 * tries)
-
-                        if tries >= self.max_retry:
-                            error = ('[SecurityProvider:getSecurityModule] '
-                                     'max_retry %d: could not bind hsm to '
-                                     'session  - going to sleep for  %r'
-                                     % tries, 10 * tries)
-                            log.error(error)
-                            raise Exception(error)
-                        retry = True
-                    else:
-                        retry = False
-
-            finally:
-                if locked == True:
-                    self.rwLock.release()
+        pool = self._getHsmPool_(hsm_id)
+        if pool is None:
+            error = ('[SecurityProvider:getSecurityModule] no pool found for '
+                     'hsm with id %s ' % (unicode(hsm_id)))
+            log.error(error)
+            raise HSMException(error, id=707)
 
+        found = pool.acquire(sessionId)
+        log.debug("[getSecurityModule] using pool session %r" % sessionId)
         return found
-        #return self.loadSecurityModule(id)
 
 def main():
     ## hook for local provider test
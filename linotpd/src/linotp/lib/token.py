@@ -42,6 +42,7 @@ except ImportError:
 
 from sqlalchemy import or_, and_
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 
 from pylons import tmpl_context as c
@@ -68,8 +69,19 @@ from linotp import model
 from linotp.model import Token, createToken, Realm, TokenRealm
 from linotp.model.meta import Session
 from linotp.model import Challenge
+from linotp.model import counter_resolver_name
+from linotp.model import COUNTER_RESOLVER
+from linotp.model import COUNTER_REALM
 
 from linotp.lib.config  import getFromConfig
+from linotp.lib.challenges import getChallengeStore
+from linotp.lib.tokencounter import getTokenCount
+from linotp.lib.otpindex import isOtpIndexEnabled
+from linotp.lib.otpindex import getOtpIndexLookahead
+from linotp.lib.otpindex import getOtpCandidates
+from linotp.lib.otpindex import getIndexKey
+from linotp.lib.otpindex import refreshToken
+from linotp.lib.otpindex import OTP_LENGTHS
 from linotp.lib.resolver import getResolverObject
 
 from linotp.lib.realm import createDBRealm, getRealmObject
@@ -486,7 +498,11 @@ class TokenHandler(object):
                     c.audit['action_detail'] = "User not found"
                     return (False, opt)
 
-        tokenList = getTokens4UserOrSerial(user, serial)
+        if uid:
+            # the user is already identified - no need to resolve it again
+            tokenList = getTokens4UserId(uid, resolverClass, user.getRealm())
+        else:
+            tokenList = getTokens4UserOrSerial(user, serial)
 
         if len(tokenList) == 0:
             c.audit['action_detail'] = "User has no tokens assigned"
@@ -745,7 +761,18 @@ class TokenHandler(object):
 
         # get all tokens of the users realm, which are not assigned
 
-        tokens = getTokensOfType(typ=None, realm=user.realm, assigned="0")
+        if isOtpIndexEnabled():
+            # only the tokens, which might generate the otp part of the
+            # password - the pin is either prepended or appended
+            otps = [passw[-otplen:] for otplen in OTP_LENGTHS] + \
+                   [passw[:otplen] for otplen in OTP_LENGTHS]
+            query = getOtpCandidates(getTokenQuery(realm=user.realm,
+                                                   assigned="0"),
+                                     otps, getIndexKey())
+            tokens = [createTokenClassObject(token) for token in query]
+        else:
+            tokens = getTokensOfType(typ=None, realm=user.realm,
+                                     assigned="0")
         for token in tokens:
 
             token_exists = -1
@@ -788,6 +815,8 @@ class TokenHandler(object):
         # if found, assign the found token to the user.login
         try:
             self.assignToken(serial, user, pin)
+            # the assigned token is no longer part of the otp index
+            refreshToken(token)
             c.audit['serial'] = serial
             c.audit['info'] = "Token auto assigned"
             c.audit['token_type'] = token.getType()
@@ -934,32 +963,24 @@ class TokenHandler(object):
 
         serials = []
         tokens = []
-        token_ids = []
         try:
 
             for token in tokenList:
                 ser = token.getSerial()
                 serials.append(ser)
-                token_ids.append(token.LinOtpTokenId)
                 tokens.append(token)
 
             #  we cleanup the challenges
-            challenges = set()
+            challenge_store = getChallengeStore()
             for serial in serials:
                 serial = linotp.lib.crypt.uencode(serial)
-                challenges.update(linotp.lib.validate.get_challenges(
-                                                                serial=serial))
-
-            for chall in challenges:
-                Session.delete(chall)
+                challenge_store.delete(serial)
 
-            #  due to legacy SQLAlchemy it could happen that the
-            #  foreign key relation could not be deleted
-            #  so we do this manualy
+            #  the realm relations are removed by the token objects, so
+            #  that the token counters of the realms are adjusted as well
 
-            for t_id in token_ids:
-                Session.query(TokenRealm).filter(
-                                    TokenRealm.token_id == t_id).delete()
+            for token in tokens:
+                token.setRealms([])
 
             Session.commit()
 
@@ -1318,8 +1339,7 @@ def get_tokenserial_of_transaction(transId):
     :return: the serial number or None
     '''
 
-    challenges = Session.query(Challenge)\
-                .filter(Challenge.transid == u'' + transId).all()
+    challenges = getChallengeStore().lookup(transid=transId)
 
     if len(challenges) == 0:
         log.info('no challenge found for tranId %r' % (transId))
@@ -1453,6 +1473,10 @@ def getTokenInRealm(realm, active=True):
 
     You can either query only active token or also disabled tokens.
     '''
+    count = getTokenCount(COUNTER_REALM, realm, active=active)
+    if count is not None:
+        return count
+
     if active:
         sqlQuery = Session.query(TokenRealm, Realm, Token).filter(and_(
                             TokenRealm.realm_id == Realm.id,
@@ -1473,8 +1497,15 @@ def getTokenNumResolver(resolver=None, active=True):
     if a resolver is passed, the token number within this resolver is returned
 
     if active is set to false, ALL tokens are returned
+
+    The numbers are taken from the maintained token counters - only if the
+    counter does not exist yet, the tokens are counted.
     '''
     if resolver is None:
+        count = getTokenCount(active=active)
+        if count is not None:
+            return count
+
         if active:
             sqlQuery = Session.query(Token)\
                     .filter(Token.LinOtpIsactive == True).count()
@@ -1482,6 +1513,11 @@ def getTokenNumResolver(resolver=None, active=True):
             sqlQuery = Session.query(Token).count()
         return sqlQuery
     else:
+        count = getTokenCount(COUNTER_RESOLVER,
+                              counter_resolver_name(resolver), active=active)
+        if count is not None:
+            return count
+
         # in the database could be tokens of ResolverClass:
         #    useridresolver. or useridresolveree.
         # so we have to make sure
@@ -1490,8 +1526,8 @@ def getTokenNumResolver(resolver=None, active=True):
         # Remark: when the token is loaded the response to the
         # resolver class is adjusted
 
-        resolver = resolver.resplace('useridresolveree.', 'useridresolver.')
-        resolver = resolver.resplace('useridresolver.', 'useridresolver%.')
+        resolver = resolver.replace('useridresolveree.', 'useridresolver.')
+        resolver = resolver.replace('useridresolver.', 'useridresolver%.')
 
         if active:
             sqlQuery = Session.query(Token)\
@@ -1547,7 +1583,8 @@ def getTokens4UserOrSerial(user=None, serial=None, _class=True):
         #  SAWarning of non unicode type
         serial = linotp.lib.crypt.uencode(serial)
 
-        sqlQuery = Session.query(Token).filter(
+        sqlQuery = Session.query(Token).options(
+                            joinedload(Token.realms)).filter(
                             Token.LinOtpTokenSerialnumber == serial)
 
         for token in sqlQuery:
@@ -1562,39 +1599,8 @@ def getTokens4UserOrSerial(user=None, serial=None, _class=True):
         if not user.isEmpty() and user.login:
             # the upper layer will catch / at least should
             (uid, _resolver, resolverClass) = getUserId(user)
-
-            # in the database could be tokens of ResolverClass:
-            #    useridresolver. or useridresolveree.
-            # so we have to make sure
-            # - there is no 'useridresolveree' in the searchterm and
-            # - there is a wildcard search: second replace
-            # Remark: when the token is loaded the response to the
-            # resolver class is adjusted
-
-            resolverClass = resolverClass.replace('useridresolveree.',
-                                                  'useridresolver.')
-            resolverClass = resolverClass.replace('useridresolver.',
-                                                  'useridresolver%.')
-
-            sqlQuery = Session.query(model.Token).filter(
-                        model.Token.LinOtpUserid == uid).filter(
-                        model.Token.LinOtpIdResClass.like(resolverClass))
-
-            for token in sqlQuery:
-                # we have to check that the token is in
-                # the same realm as the user
-                t_realms = token.getRealmNames()
-                u_realm = user.getRealm()
-                if u_realm != '*':
-                    if len(t_realms) > 0 and len(u_realm) > 0:
-                        if u_realm.lower() not in t_realms:
-                            log.debug("user realm and token realm missmatch"
-                                      " %r::%r" % (u_realm, t_realms))
-                            continue
-
-                log.debug("[getTokens4UserOrSerial] user serial (user): %r"
-                          % token.LinOtpTokenSerialnumber)
-                tokenList.append(token)
+            tokenList.extend(getTokens4UserId(uid, resolverClass,
+                                              user.getRealm(), _class=False))
 
     if _class == True:
         for tok in tokenList:
@@ -1604,6 +1610,60 @@ def getTokens4UserOrSerial(user=None, serial=None, _class=True):
         return tokenList
 
 
+def getTokens4UserId(uid, resolverClass, realm=None, _class=True):
+    '''
+    get the tokens of an already identified user
+
+    the tokens are selected by an exact match on the user id and resolver
+    class and are loaded together with their realms in one query
+
+    :param uid: the user id in the resolver
+    :param resolverClass: the resolver class like
+                 useridresolver.PasswdIdResolver.IdResolver.myDefRes
+    :param realm: the realm of the user - tokens which are only in
+                  other realms are not returned
+    :param _class: if True, the token class objects are returned,
+                   otherwise the database token objects
+
+    :return: list of tokens
+    '''
+    tokenList = []
+
+    # in the database could be tokens of ResolverClass:
+    #    useridresolver. or useridresolveree.
+    # so we search for both variants
+    # Remark: when the token is loaded the response to the
+    # resolver class is adjusted
+    resolverClass = resolverClass.replace('useridresolveree.',
+                                          'useridresolver.')
+    resolverClasses = [resolverClass,
+                       resolverClass.replace('useridresolver.',
+                                             'useridresolveree.')]
+
+    sqlQuery = Session.query(Token).options(
+                    joinedload(Token.realms)).filter(and_(
+                    Token.LinOtpUserid == uid,
+                    Token.LinOtpIdResClass.in_(resolverClasses)))
+
+    for token in sqlQuery:
+        # we have to check that the token is in
+        # the same realm as the user
+        t_realms = token.getRealmNames()
+        if realm and realm != '*' and len(t_realms) > 0:
+            if realm.lower() not in t_realms:
+                log.debug("user realm and token realm missmatch"
+                          " %r::%r" % (realm, t_realms))
+                continue
+
+        log.debug("[getTokens4UserId] user serial (user): %r"
+                  % token.LinOtpTokenSerialnumber)
+        tokenList.append(token)
+
+    if _class == True:
+        return [createTokenClassObject(tok) for tok in tokenList]
+    return tokenList
+
+
 # local method
 def getTokensOfType(typ=None, realm=None, assigned=None):
     '''
@@ -1618,6 +1678,21 @@ def getTokensOfType(typ=None, realm=None, assigned=None):
     tokenList = []
     log.debug("[getTokensOfType] searching tokens type=%r, realm=%r,"
               " assigned=%r" % (typ, realm, assigned))
+
+    for token in getTokenQuery(typ, realm, assigned):
+        log.debug("[getTokensOfType] adding token with serial %r"
+                  % token.LinOtpTokenSerialnumber)
+        # the token is the database object, but we want
+        # an instance of the tokenclass!
+        tokenList.append(createTokenClassObject(token))
+
+    return tokenList
+
+
+def getTokenQuery(typ=None, realm=None, assigned=None):
+    '''
+    build the query of the Token objects for getTokensOfType
+    '''
     sqlQuery = Session.query(Token)
     if typ is not None:
         # filter for type
@@ -1641,14 +1716,7 @@ def getTokensOfType(typ=None, realm=None, assigned=None):
                     TokenRealm.realm_id == Realm.id,
                     TokenRealm.token_id == Token.LinOtpTokenId)).distinct()
 
-    for token in sqlQuery:
-        log.debug("[getTokensOfType] adding token with serial %r"
-                  % token.LinOtpTokenSerialnumber)
-        # the token is the database object, but we want
-        # an instance of the tokenclass!
-        tokenList.append(createTokenClassObject(token))
-
-    return tokenList
+    return sqlQuery
 
 
 def setDefaults(token):
@@ -1929,9 +1997,7 @@ def checkTokenList(tokenList, passw, user=User(), options=None):
         elif len(vToken) > 0:
             audit['weight'] = 30
             matchinCounter = ret
-
-            #any valid otp increments, independent of the tokens state !!
-            token.incOtpCounter(matchinCounter)
+            authenticated = False
 
             # If the allow_inactive option is present, ignore whether the token is marked as active.
             # This is used when completing Elm selfservice provisioning, to validate the code
@@ -1940,9 +2006,7 @@ def checkTokenList(tokenList, passw, user=User(), options=None):
                 if token.getFailCount() < token.getMaxFailCount():
                     if token.check_auth_counter():
                         if token.check_validity_period():
-                            token.inc_count_auth()
-                            token.inc_count_auth_success()
-                            validTokenList.extend(vToken)
+                            authenticated = True
                         else:
                             audit['action_detail'] = "validity period mismatch"
                     else:
@@ -1953,6 +2017,17 @@ def checkTokenList(tokenList, passw, user=User(), options=None):
             else:
                 audit['action_detail'] = "Token inactive"
 
+            #any valid otp increments, independent of the tokens state !!
+            # the counters are advanced by one statement, which fails if the
+            # otp has been used by a concurrent request
+            if token.commitValidation(matchinCounter,
+                                      authenticated=authenticated) < 0:
+                pinMatchingTokenList.extend(vToken)
+                audit['action_detail'] = "otp already used"
+                audit['weight'] = 25
+            elif authenticated:
+                validTokenList.extend(vToken)
+
         # add the audit information to the auditList
         auditList.append(audit)
 
@@ -2231,8 +2306,16 @@ def get_token_by_otp(token_list=None, otp="", window=10, typ=u"HMAC",
     log.debug("[get_token_by_otp] entering function. Searching for otp=%r"
               % otp)
 
+    use_index = False
     if token_list is None:
-        token_list = getTokensOfType(typ, realm, assigned)
+        use_index = (isOtpIndexEnabled() and
+                     window <= getOtpIndexLookahead())
+        if use_index:
+            query = getOtpCandidates(getTokenQuery(typ, realm, assigned),
+                                     [otp], getIndexKey(), window=window)
+            token_list = [createTokenClassObject(token) for token in query]
+        else:
+            token_list = getTokensOfType(typ, realm, assigned)
 
     for token in token_list:
         log.debug("[get_token_by_otp] checking token %r" % token.getSerial())
@@ -2243,6 +2326,9 @@ def get_token_by_otp(token_list=None, otp="", window=10, typ=u"HMAC",
 
     if len(resultList) == 1:
         result_token = resultList[0]
+        if use_index:
+            # the counter of the token has moved
+            refreshToken(result_token)
     elif len(resultList) > 1:
         raise TokenAdminError("get_token_by_otp: multiple tokens are matching"
                               " this OTP value!", id=1200)
@@ -57,6 +57,7 @@ from linotp.lib.util import getParam
 from linotp.lib.util import generate_otpkey
 
 from linotp.lib.config  import getFromConfig
+from linotp.lib.config  import getGlobalObject
 
 from linotp.lib.user import getUserResolverId
 
@@ -75,7 +76,13 @@ from linotp.lib.util import normalize_activation_code
 
 from linotp.lib.ocra    import OcraSuite
 from linotp.model       import OcraChallenge
+from linotp.model       import ocra_table
+from linotp.model       import timestamp_column
+from linotp.model       import token_table
+from linotp.model       import TOKEN_INFO_COLUMNS
+from linotp.model       import VALIDITY_FORMAT
 
+from linotp.model       import meta
 from linotp.model.meta  import Session
 from linotp.lib.reply   import create_img
 
@@ -84,6 +91,9 @@ from linotp.lib.validate import check_otp
 from linotp.lib.validate import split_pin_otp
 
 from sqlalchemy         import asc, desc
+from sqlalchemy         import and_, func
+from sqlalchemy         import select
+from sqlalchemy.orm.attributes import set_committed_value
 #from sqlalchemy.sql.expression import in_
 
 from pylons.i18n.translation import _
@@ -769,87 +779,87 @@ class TokenClass(object):
 
 
     def getTokenInfo(self):
-        info = {}
-
-        tokeninfo = self.token.getInfo()
-        if tokeninfo is not None and len(tokeninfo.strip()) > 0:
-            try:
-                info = json.loads(tokeninfo)
-            except Exception as e:
-                log.error('getTokenInfo %r' % (e))
+        '''
+        get a copy of the token info dict, which is parsed only once per
+        token object
 
-        return info
+        :return: dict of the token info
+        '''
+        return dict(self.token.getInfoDict())
 
     def setTokenInfo(self, info):
 
         if info is not None:
-            tokeninfo = u'' + json.dumps(info, indent=0)
-            self.token.setInfo(tokeninfo)
+            self.token.setInfoDict(dict(info))
 
 
     def addToTokenInfo(self, key, value):
-        info = {}
-        tokeninfo = self.token.getInfo()
-
-        if tokeninfo is not None:
-            if len(tokeninfo) > 0 :
-                info = json.loads(tokeninfo)
-
-        #if info.has_key(key) == True:
+        info = self.token.getInfoDict()
         info[key] = value
-
-        self.setTokenInfo(info)
+        self.token.setInfoDict(info)
 
     def getFromTokenInfo(self, key, default=None):
-        ret = default
-
-        info = self.getTokenInfo()
-
-        if key in info:
-            ret = info.get(key)
-        return ret
+        return self.token.getInfoDict().get(key, default)
 
     def removeFromTokenInfo(self, key):
-        info = self.getTokenInfo()
+        info = self.token.getInfoDict()
         if key in info:
             del info[key]
-            self.setTokenInfo(info)
-
-    # FIXME: we could store the
-    #   count_auth_success_max
-    #   count_auth_success
-    # and
-    #   count_auth_max
-    #   count_auth
-    # in dedicated columns!
+            self.token.setInfoDict(info)
+
+    def _get_info_column(self, key):
+        '''
+        get a token info entry, which is stored in a dedicated column - for
+        tokens, which are not migrated yet, the entry is taken from the
+        token info
+
+        :param key: the token info key
+        :return: the column value or the token info entry
+        '''
+        value = getattr(self.token, TOKEN_INFO_COLUMNS[key])
+        if value is None:
+            value = self.getFromTokenInfo(key)
+        return value
+
+    def _set_info_column(self, key, value):
+        '''
+        set a token info entry in its dedicated column and drop the former
+        entry from the token info
+
+        :param key: the token info key
+        :param value: the new value
+        '''
+        setattr(self.token, TOKEN_INFO_COLUMNS[key], value)
+        self.removeFromTokenInfo(key)
+
     def set_count_auth_success_max(self, count):
         '''
         Sets the counter for the maximum allowed successful logins
         '''
-        self.addToTokenInfo("count_auth_success_max", int(count))
+        self._set_info_column("count_auth_success_max", int(count))
 
     def set_count_auth_success(self, count):
         '''
         Sets the counter for the occurred successful logins
         '''
-        self.addToTokenInfo("count_auth_success", int(count))
+        self._set_info_column("count_auth_success", int(count))
 
     def set_count_auth_max(self, count):
         '''
         Sets the counter for the maximum allowed login attemps
         '''
-        self.addToTokenInfo("count_auth_max", int(count))
+        self._set_info_column("count_auth_max", int(count))
 
     def set_count_auth(self, count):
         '''
         Sets the counter for the occurred login attepms
         '''
-        self.addToTokenInfo("count_auth", int(count))
+        self._set_info_column("count_auth", int(count))
 
     def get_count_auth_success_max(self):
         ret = 0
         try:
-            ret = int(self.getFromTokenInfo("count_auth_success_max"))
+            ret = int(self._get_info_column("count_auth_success_max"))
         except:
             pass
         return ret
@@ -857,7 +867,7 @@ class TokenClass(object):
     def get_count_auth_success(self):
         ret = 0
         try:
-            ret = int(self.getFromTokenInfo("count_auth_success"))
+            ret = int(self._get_info_column("count_auth_success"))
         except:
             pass
         return ret
@@ -865,7 +875,7 @@ class TokenClass(object):
     def get_count_auth_max(self):
         ret = 0
         try:
-            ret = int(self.getFromTokenInfo("count_auth_max"))
+            ret = int(self._get_info_column("count_auth_max"))
         except:
             pass
         return ret
@@ -873,20 +883,34 @@ class TokenClass(object):
     def get_count_auth(self):
         ret = 0
         try:
-            ret = int(self.getFromTokenInfo("count_auth"))
+            ret = int(self._get_info_column("count_auth"))
         except:
             pass
         return ret
 
+    def _get_validity(self, key):
+        '''
+        get a date of the validity period
+
+        :param key: validity_period_start or validity_period_end
+        :return: datetime or None, if the date is not set
+        '''
+        value = self._get_info_column(key)
+        if value is None or isinstance(value, datetime.datetime):
+            return value
+        try:
+            return datetime.datetime.strptime(value, VALIDITY_FORMAT)
+        except:
+            return None
+
     def get_validity_period_end(self):
         '''
         returns the end of validity period (if set)
         '''
         ret = ""
-        try:
-            ret = self.getFromTokenInfo("validity_period_end")
-        except:
-            pass
+        end = self._get_validity("validity_period_end")
+        if end is not None:
+            ret = end.strftime(VALIDITY_FORMAT)
         return ret
 
     def set_validity_period_end(self, end_date):
@@ -894,19 +918,18 @@ class TokenClass(object):
         sets the end date of the validity period for a token
         '''
         ## upper layer will catch. we just try to verify the date format
-        datetime.datetime.strptime(end_date, "%d/%m/%y %H:%M")
+        end = datetime.datetime.strptime(end_date, VALIDITY_FORMAT)
 
-        self.addToTokenInfo("validity_period_end", end_date)
+        self._set_info_column("validity_period_end", end)
 
     def get_validity_period_start(self):
         '''
         returns the start of validity period (if set)
         '''
         ret = ""
-        try:
-            ret = self.getFromTokenInfo("validity_period_start")
-        except:
-            pass
+        start = self._get_validity("validity_period_start")
+        if start is not None:
+            ret = start.strftime(VALIDITY_FORMAT)
         return ret
 
     def set_validity_period_start(self, start_date):
@@ -914,8 +937,8 @@ class TokenClass(object):
         sets the start date of the validity period for a token
         '''
         ##  upper layer will catch. we just try to verify the date format
-        datetime.datetime.strptime(start_date, "%d/%m/%y %H:%M")
-        self.addToTokenInfo("validity_period_start", start_date)
+        start = datetime.datetime.strptime(start_date, VALIDITY_FORMAT)
+        self._set_info_column("validity_period_start", start)
 
 
     def inc_count_auth_success(self):
@@ -950,30 +973,15 @@ class TokenClass(object):
 
         Returns either True/False
         '''
-        start = self.get_validity_period_start()
-        end = self.get_validity_period_end()
-
-        check_start = False
-        check_end = False
-        try:
-            dt_start = datetime.datetime.strptime(start, "%d/%m/%y %H:%M")
-            check_start = True
-        except:
-            pass
-
-        try:
-            dt_end = datetime.datetime.strptime(end, "%d/%m/%y %H:%M")
-            check_end = True
-        except:
-            pass
+        now = datetime.datetime.now()
 
-        if check_end:
-            if dt_end < datetime.datetime.now():
-                return False
+        end = self._get_validity("validity_period_end")
+        if end is not None and end < now:
+            return False
 
-        if check_start:
-            if dt_start > datetime.datetime.now():
-                return False
+        start = self._get_validity("validity_period_start")
+        if start is not None and start > now:
+            return False
 
         return True
 
@@ -1025,6 +1033,75 @@ class TokenClass(object):
         log.debug("[incOtpCounter] now got counter %s, %s" % (self.token.LinOtpCount, counter))
         return self.token.LinOtpCount
 
+    def commitValidation(self, counter, authenticated=True, reset=True):
+        '''
+        store the result of a successful otp validation by one conditional
+        update statement, which advances the otp counter together with the
+        fail counter reset and the auth counters
+
+        the condition on the otp counter rejects an otp, which has been
+        used meanwhile by a concurrent request, without a row lock
+
+        :param counter: the counter of the matching otp
+        :param authenticated: if True, the auth counters are incremented
+        :param reset: reset the fail counter, if DefaultResetFailCount is set
+        :return: the new otp counter or -1, if the otp was already used
+        '''
+        token = self.token
+        new_counter = counter + 1
+        values = {'LinOtpCount': new_counter}
+
+        if (reset == True and getFromConfig("DefaultResetFailCount") == "True"
+            and token.LinOtpFailCount < token.LinOtpMaxFail
+            and token.LinOtpIsactive == True):
+            values['LinOtpFailCount'] = 0
+
+        ## the auth counters of not migrated tokens start with the value
+        ## from the token info
+        auth_counters = {}
+        if authenticated:
+            for key in ['count_auth', 'count_auth_success']:
+                column = TOKEN_INFO_COLUMNS[key]
+                try:
+                    start = int(self._get_info_column(key) or 0)
+                except:
+                    start = 0
+                auth_counters[column] = start + 1
+                values[column] = func.coalesce(token_table.c[column],
+                                               start) + 1
+
+        ## write pending changes of the token before the update
+        Session.add(token)
+        Session.flush()
+
+        condition = token_table.c.LinOtpTokenId == token.LinOtpTokenId
+        ## tokens without counter based otps, e.g. the static password
+        ## tokens, match a counter below the actual one and are not guarded
+        if token.LinOtpCount <= counter:
+            condition = and_(condition,
+                             token_table.c.LinOtpCount < new_counter)
+
+        statement = token_table.update().where(condition).values(**values)
+        result = Session.execute(statement)
+
+        if result.rowcount != 1:
+            log.warning("[commitValidation] otp counter %r of token %r was "
+                        "already used" % (counter, token.LinOtpTokenSerialnumber))
+            return -1
+
+        ## the token object takes the stored values without a new update
+        auth_counters['LinOtpCount'] = new_counter
+        if 'LinOtpFailCount' in values:
+            auth_counters['LinOtpFailCount'] = 0
+        for column, value in auth_counters.items():
+            set_committed_value(token, column, value)
+
+        if authenticated:
+            self.removeFromTokenInfo('count_auth')
+            self.removeFromTokenInfo('count_auth_success')
+
+        return new_counter
+
 
     def check_otp_exist(self, otp, window=None, user=None, autoassign=False):
         '''
@@ -2162,17 +2239,19 @@ class OcraTokenClass(TokenClass):
 
 
     @classmethod
-    def timeoutJanitor(cls):
+    def getChallengeTimeout(cls, scopeDef=None):
         '''
-        timeoutJanitor - remove all outdated transactions / challenges
-
-        :return: - nothing
+        getChallengeTimeout - get the lifetime of the ocra challenges
 
+        :param scopeDef: the OcraChallengeTimeout definition like '1D' or
+                         '2H30M' or seconds - if None, it is taken from
+                         the config
+        :return: the lifetime as timedelta
         '''
-        log.debug('[timeoutJanitor]')
+        if scopeDef is None:
+            scopeDef = getFromConfig("OcraChallengeTimeout", '1D')
 
         delta = datetime.timedelta(days=0)
-        scopeDef = getFromConfig("OcraChallengeTimeout", '1D')
 
         ##  timedelta supports : days[, seconds[, microseconds[, milliseconds[, minutes[, hours[, weeks]]]]]]])
         if re.match('^(\d+[DHMS])+$', scopeDef):
@@ -2198,42 +2277,130 @@ class OcraTokenClass(TokenClass):
                 log.info('Failed to convert OcraChallengeTimeout value from config: %r' % (scopeDef))
                 delta = datetime.timedelta(days=1)
 
+        return delta
+
+    @classmethod
+    def getMaxChallengeRequests(cls, maxRequests=None):
+        '''
+        getMaxChallengeRequests - get the number of requests, after which an
+        ocra challenge is invalid
+
+        :param maxRequests: the OcraMaxChallengeRequests definition - if
+                            None, it is taken from the config
+        :return: the number of requests
+        '''
+        if maxRequests is None:
+            maxRequests = getFromConfig("OcraMaxChallengeRequests", '3')
+        return int(maxRequests)
+
+    @classmethod
+    def _purge(cls, condition, limit=None):
+        '''
+        delete the ocra challenges, which match the condition, by set based
+        delete statements with an own connection
+
+        :param condition: the where clause on the ocra table
+        :param limit: the maximum number of challenges to be deleted
+        :return: the number of deleted challenges
+        '''
+        table = ocra_table
+
+        connection = meta.engine.connect()
+        try:
+            if limit is None:
+                result = connection.execute(table.delete().where(condition))
+                return result.rowcount
+
+            query = select([table.c.id]).where(condition)\
+                                    .order_by(table.c.id).limit(limit)
+            ids = [row[0] for row in connection.execute(query)]
+            if ids:
+                connection.execute(table.delete().where(table.c.id.in_(ids)))
+            return len(ids)
+        finally:
+            connection.close()
+
+    @classmethod
+    def timeoutJanitor(cls, limit=None, scopeDef=None):
+        '''
+        timeoutJanitor - remove all outdated transactions / challenges
 
-        ocraChallenges = Session.query(OcraChallenge).filter(
-                            OcraChallenge.timestamp < datetime.datetime.now() - delta)
+        :param limit: the maximum number of challenges to be deleted
+        :param scopeDef: the OcraChallengeTimeout definition
+        :return: the number of deleted challenges
 
+        '''
+        log.debug('[timeoutJanitor]')
 
-        for ocraChallenge in ocraChallenges:
-            log.warning("[OcraToken:timeoutJanitor] - dropping outdated ocraChallenge): %r for token %r" %
-                        (ocraChallenge.transid, ocraChallenge.tokenserial))
-            Session.delete(ocraChallenge)
+        delta = cls.getChallengeTimeout(scopeDef)
+        table = ocra_table
+        condition = table.c[timestamp_column] < datetime.datetime.now() - delta
+
+        count = cls._purge(condition, limit=limit)
+        if count:
+            log.warning("[OcraToken:timeoutJanitor] - dropped %d outdated "
+                        "ocraChallenges" % count)
 
         log.debug('[timeoutJanitor]')
-        return
+        return count
 
     @classmethod
-    def maxChallengeRequestJanitor(cls):
+    def maxChallengeRequestJanitor(cls, limit=None, maxRequests=None):
         '''
         maxChallengeRequestJanitor - remove all transactions / challenges which have been made more than maxChallengeRequests
 
-        :return: - nothing
+        :param limit: the maximum number of challenges to be deleted
+        :param maxRequests: the OcraMaxChallengeRequests definition
+        :return: the number of deleted challenges
 
         '''
         log.debug('[maxChallengeRequestJanitor]')
 
+        maxRequests = cls.getMaxChallengeRequests(maxRequests)
+        table = ocra_table
+        condition = table.c.received_count >= maxRequests
+
+        count = cls._purge(condition, limit=limit)
+        if count:
+            log.warning("[OcraToken:maxChallengeRequestJanitor] - dropped %d "
+                        "ocraChallenges with more than %d requests"
+                        % (count, maxRequests))
 
-        maxRequests = int(getFromConfig("OcraMaxChallengeRequests", '3'))
+        log.debug('[maxChallengeRequestJanitor]')
+        return count
 
-        ocraChallenges = Session.query(OcraChallenge).filter(
-                            OcraChallenge.received_count >= maxRequests)
+    @classmethod
+    def janitor(cls, limit=1000):
+        '''
+        janitor - run the timeout and the max request janitor as background
+        job, which takes the config from the application globals
 
+        :param limit: the maximum number of challenges to be deleted by
+                      each janitor
+        :return: the number of deleted challenges
+        '''
+        config = {}
+        glo = getGlobalObject()
+        if glo is not None:
+            config = glo.getConfig()
 
-        for ocraChallenge in ocraChallenges:
-            log.warning("[OcraToken:timeoutJanitor] - dropping outdated ocraChallenge): %r for token %r" % (ocraChallenge.transid, ocraChallenge.tokenserial))
-            Session.delete(ocraChallenge)
+        count = cls.timeoutJanitor(limit=limit, scopeDef=config.get(
+                            'linotp.OcraChallengeTimeout', '1D'))
+        count += cls.maxChallengeRequestJanitor(limit=limit,
+                            maxRequests=config.get(
+                            'linotp.OcraMaxChallengeRequests', '3'))
+        return count
 
-        log.debug('[maxChallengeRequestJanitor]')
-        return
+    @classmethod
+    def _validChallenges(cls):
+        '''
+        the condition for the challenges, which are not yet removed by the
+        janitor, but are outdated or have been requested too often
+        '''
+        delta = cls.getChallengeTimeout()
+        maxRequests = cls.getMaxChallengeRequests()
+        return and_(OcraChallenge.timestamp >= datetime.datetime.now() - delta,
+                    OcraChallenge.received_count < maxRequests)
 
     @classmethod
     def maxChallengeJanitor(cls, transId=None, serial=None):
@@ -2262,30 +2429,30 @@ class OcraTokenClass(TokenClass):
             ones = 3
 
         if transId is not None:
-            challenges = Session.query(OcraChallenge).filter(OcraChallenge.transid == u'' + transId)
-            if challenges is None:
+            challenge = Session.query(OcraChallenge.tokenserial).filter(
+                            OcraChallenge.transid == u'' + transId).first()
+            if challenge is None:
                 log.info('[OcraTokrenClass:maxChallengeJanitor] no ocraChallenge found for tranid %r' % (transId))
                 return
 
-            for challenge in challenges:
-                serial = challenge.tokenserial
+            serial = challenge.tokenserial
 
         if serial is None:
             log.error('[OcraTokrenClass:maxChallengeJanitor] failed to lookup for transid %r or serial %r' % (transId, serial))
             return
 
-        challenges = Session.query(OcraChallenge).\
-                        filter(OcraChallenge.tokenserial == u'' + serial)\
+        ## all but the last ones by the token serial index
+        dropIds = [row.id for row in Session.query(OcraChallenge.id)
+                        .filter(OcraChallenge.tokenserial == u'' + serial)
                         .order_by(desc(OcraChallenge.id))
+                        .offset(ones)]
 
-        lastIds = set()
-        for challenge in challenges:
-            if len(lastIds) < ones:
-                lastIds.add(challenge.id)
-            else:
-                log.warning("[OcraToken:maxChallengeJanitor] - dropping max ocraChallenges: %r :: %r for token %r" % \
-                            (challenge.id, challenge.transid, challenge.tokenserial))
-                Session.delete(challenge)
+        if dropIds:
+            log.warning("[OcraToken:maxChallengeJanitor] - dropping max ocraChallenges: %r for token %r" % \
+                        (dropIds, serial))
+            Session.query(OcraChallenge)\
+                .filter(OcraChallenge.id.in_(dropIds))\
+                .delete(synchronize_session='fetch')
 
         log.debug('[maxChallengeJanitor]')
         return
@@ -2304,17 +2471,18 @@ class OcraTokenClass(TokenClass):
         '''
         log.debug('[getTransaction] %r' % (transId))
 
-        ##  first do housekeeping - remove outdated transactions
-        cls.timeoutJanitor()
-        cls.maxChallengeRequestJanitor()
+        ##  first do housekeeping of the token - the outdated transactions
+        ##  are removed by the janitor in the background
         cls.maxChallengeJanitor(transId=transId)
 
         ocraChallenge = None
         count = 0
-
+        challenges = None
 
         if transId is not None:
-            challenges = Session.query(OcraChallenge).filter(OcraChallenge.transid == u'' + transId)
+            challenges = Session.query(OcraChallenge)\
+                .filter(OcraChallenge.transid == u'' + transId)\
+                .filter(cls._validChallenges())
 
 
         if challenges is None:
@@ -2351,9 +2519,8 @@ class OcraTokenClass(TokenClass):
         '''
         log.debug('[getTransactions4serial] %r: %r' % (serial, currentOnly))
 
-        ##  first do housekeeping - remove outdated transactions
-        cls.timeoutJanitor()
-        cls.maxChallengeRequestJanitor()
+        ##  first do housekeeping of the token - the outdated transactions
+        ##  are removed by the janitor in the background
         cls.maxChallengeJanitor(serial=serial)
 
 
@@ -2366,12 +2533,14 @@ class OcraTokenClass(TokenClass):
             if currentOnly == False:
                 challenges = Session.query(OcraChallenge)\
                     .filter(OcraChallenge.tokenserial == u'' + serial)\
+                    .filter(cls._validChallenges())\
                     .order_by(desc(OcraChallenge.id))
             else:
                 ##  return the oldest transaction onyl -  orderby(id).limit(1)
                 challenges = Session.query(OcraChallenge)\
                     .filter(OcraChallenge.tokenserial == u'' + serial)\
                     .filter(OcraChallenge.received_tan == False)\
+                    .filter(cls._validChallenges())\
                     .order_by(asc(OcraChallenge.id))
 
         if challenges is None:
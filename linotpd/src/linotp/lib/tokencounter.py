@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+'''
+maintained counters of the tokens
+
+The number of the tokens and of the active tokens is kept overall, per
+resolver class and per realm in the TokenCounter table. The counters are
+adjusted in the same transaction as the token changes (see the flush
+listener in linotp.model), so that the token numbers for the audit log, the
+license and the enrollment policy checks do not require a count of the
+token table.
+
+A counter, which does not exist yet, is created by the reconcile job, which
+recounts the tokens every 'reconcile_interval' seconds and corrects the
+drifted counters:
+
+    linotpTokenCounter.reconcile_interval = 3600
+
+Until the counter exists, the tokens are counted in the token table.
+'''
+
+import time
+import logging
+
+import sqlalchemy as sa
+
+from sqlalchemy import and_
+from sqlalchemy import select
+
+import linotp.lib.crypt
+
+from linotp.model import meta
+from linotp.model import TokenCounter
+from linotp.model import token_table
+from linotp.model import tokenrealm_table
+from linotp.model import realm_table
+from linotp.model import tokencounter_table
+from linotp.model import counter_resolver_name
+from linotp.model import COUNTER_ALL
+from linotp.model import COUNTER_RESOLVER
+from linotp.model import COUNTER_REALM
+from linotp.model.meta import Session
+from linotp.lib.worker import PeriodicWorker
+
+log = logging.getLogger(__name__)
+
+
+def getTokenCount(scope=COUNTER_ALL, name=u'*', active=True):
+    '''
+    get the number of tokens from the counter
+
+    :param scope: COUNTER_ALL, COUNTER_RESOLVER or COUNTER_REALM
+    :param name: the resolver class or the realm name
+    :param active: if True, only the active tokens are counted
+    :return: the number of tokens or None, if there is no counter
+    '''
+    _startReconciler()
+
+    row = Session.query(TokenCounter.tokens, TokenCounter.active)\
+                 .filter(and_(TokenCounter.scope == scope,
+                              TokenCounter.name == u'' + name)).first()
+    if row is None:
+        return None
+    if active:
+        return row[1]
+    return row[0]
+
+
+def countTokens(connection):
+    '''
+    count the tokens of all counters in the token table
+
+    :param connection: the database connection
+    :return: dict of the counter keys (scope, name) with the tuple of the
+             number of tokens and of the active tokens
+    '''
+    token_id = token_table.c.LinOtpTokenId
+    tokens = sa.func.count(token_id)
+    active = sa.func.sum(sa.case([(token_table.c.LinOtpIsactive == True, 1)],
+                                 else_=0))
+    counts = {}
+
+    def add(key, row):
+        (num, num_active) = counts.get(key, (0, 0))
+        counts[key] = (num + row[1], num_active + int(row[2] or 0))
+
+    row = connection.execute(select([sa.literal(COUNTER_ALL), tokens,
+                                     active])).first()
+    add((COUNTER_ALL, u'*'), row)
+
+    resclass = token_table.c.LinOtpIdResClass
+    for row in connection.execute(select([resclass, tokens, active])
+                                  .group_by(resclass)):
+        name = counter_resolver_name(row[0])
+        if name:
+            add((COUNTER_RESOLVER, name), row)
+
+    realm_name = realm_table.c.name
+    joined = tokenrealm_table.join(
+                    token_table, tokenrealm_table.c.token_id == token_id)\
+                    .join(realm_table,
+                          tokenrealm_table.c.realm_id == realm_table.c.id)
+    for row in connection.execute(select([realm_name, tokens, active])
+                                  .select_from(joined)
+                                  .group_by(realm_name)):
+        name = linotp.lib.crypt.udecode(row[0]) if row[0] else u''
+        add((COUNTER_REALM, u'' + name), row)
+
+    return counts
+
+
+def reconcile(engine=None):
+    '''
+    recount the tokens and correct, create or remove the counters, which
+    differ - with an own connection, so that the job does not interfere with
+    the request Session
+
+    :param engine: the database engine, default is the engine of the model
+    :return: the number of corrected counters
+    '''
+    table = tokencounter_table
+    engine = engine or meta.engine
+
+    connection = engine.connect()
+    try:
+        transaction = connection.begin()
+        try:
+            # the counter rows are locked before the tokens are counted: a
+            # concurrent token change either is committed before and thus
+            # counted or waits for the reconcile to add its delta afterwards
+            stored = {}
+            for row in connection.execute(select([table.c.scope,
+                                                  table.c.name,
+                                                  table.c.tokens,
+                                                  table.c.active])
+                                          .with_for_update()):
+                stored[(row[0], row[1])] = (row[2], row[3])
+            counts = countTokens(connection)
+
+            corrected = 0
+            for key in sorted(set(counts.keys()) | set(stored.keys())):
+                (scope, name) = key
+                where = and_(table.c.scope == scope, table.c.name == name)
+                if key not in counts:
+                    connection.execute(table.delete().where(where))
+                elif key not in stored:
+                    connection.execute(table.insert(), scope=scope,
+                                       name=name, tokens=counts[key][0],
+                                       active=counts[key][1])
+                elif counts[key] != stored[key]:
+                    log.warning("[reconcile] token counter %r drifted: %r "
+                                "instead of %r" % (key, stored[key],
+                                                   counts[key]))
+                    connection.execute(table.update().where(where),
+                                       tokens=counts[key][0],
+                                       active=counts[key][1])
+                else:
+                    continue
+                corrected += 1
+
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+    finally:
+        connection.close()
+
+    return corrected
+
+
+class TokenCountReconciler(PeriodicWorker):
+    '''
+    reconcile the token counters in a background thread - the missing
+    counters are created by the first run
+    '''
+
+    def __init__(self, interval=3600):
+        PeriodicWorker.__init__(self, 'linotp token count reconciler',
+                                interval)
+
+        self.runs = 0
+        self.corrected = 0
+        self.last_run = None
+
+    def work(self):
+        self.reconcile()
+
+    def reconcile(self):
+        '''
+        run one reconcile - errors are only logged, as the next run will
+        catch up
+
+        :return: the number of corrected counters
+        '''
+        corrected = 0
+        try:
+            corrected = reconcile()
+        except Exception as exx:
+            log.error("[reconcile] failed to reconcile the token counters: "
+                      "%r" % exx)
+
+        self.runs += 1
+        self.corrected += corrected
+        self.last_run = time.time()
+        return corrected
+
+    def getStats(self):
+        '''
+        get the number of reconcile runs and of the corrected counters
+        '''
+        return {'runs': self.runs,
+                'corrected': self.corrected,
+                'last_run': self.last_run,
+                }
+
+
+def _startReconciler():
+    '''
+    start the reconcile job of the application in this process
+    '''
+    from linotp.lib.config import getGlobalObject
+
+    glo = getGlobalObject()
+    if glo is None:
+        return
+
+    reconciler = glo.getTokenCounter()
+    if reconciler is not None and not reconciler.isRunning():
+        reconciler.start()
+    return
+
+
+def setupTokenCounter(config):
+    '''
+    create the reconcile job of the token counters as defined in the ini file
+
+    :param config: the pylons config
+    :return: the TokenCountReconciler or None, if the reconcile is disabled
+    '''
+    interval = float(config.get('linotpTokenCounter.reconcile_interval',
+                                3600))
+    if interval <= 0:
+        log.info("[setupTokenCounter] token counter reconcile is disabled")
+        return None
+
+    return TokenCountReconciler(interval=interval)
@@ -28,7 +28,9 @@
 ENCODING = "utf-8"
 
 import re
+import time
 import logging
+import threading
 
 
 try:
@@ -36,28 +38,109 @@ try:
 except ImportError:
     import simplejson as json
 
+import sqlalchemy as sa
+
 from sqlalchemy import or_, and_, not_
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.orm.attributes import set_committed_value
 
 import linotp
 from linotp.lib.error import UserError
 
 from linotp.lib.token import (getTokenRealms,
                               getTokens4UserOrSerial,
-                              getAllTokenUsers
+                              getAllTokenUsers,
+                              getTokenNumResolver,
+                              getTokenInRealm
                               )
-from linotp.lib.user import getUserId, getUserInfo
+from linotp.lib.user import getUserId, getUserInfo, getUserInfos
 from linotp.lib.user import User
 from linotp.lib.realm import getRealms
 
 from linotp.model import Token
-from linotp.model import Realm, TokenRealm
+from linotp.model import Realm
+from linotp.model import realm_table
+from linotp.model import tokenrealm_table
 from linotp.model.meta import Session
 
 from linotp.lib.config  import getFromConfig
+from linotp.lib.util import encodeCursor
+from linotp.lib.util import decodeCursor
 
 
 log = logging.getLogger(__name__)
 
+#  the sort parameter with the sorted token attribute
+SORT_COLUMNS = {
+    "TokenDesc": "LinOtpTokenDesc",
+    "TokenId": "LinOtpTokenId",
+    "TokenType": "LinOtpTokenType",
+    "TokenSerialnumber": "LinOtpTokenSerialnumber",
+    "IdResClass": "LinOtpIdResClass",
+    "IdResolver": "LinOtpIdResolver",
+    "Userid": "LinOtpUserid",
+    "FailCount": "LinOtpFailCount",
+    "Isactive": "LinOtpIsactive",
+}
+
+#  the token columns, which could be NULL - they are sorted as empty string
+NULLABLE_SORT_COLUMNS = ["TokenDesc", "IdResClass", "IdResolver", "Userid"]
+
+#  the number of tokens, whose owners are resolved together
+OWNER_BATCH = 100
+
+#  the number of tokens, which are read together, if all tokens are listed
+STREAM_BATCH = 500
+
+#  the cached token numbers by query
+COUNT_CACHE_SIZE = 1000
+count_cache = {}
+count_cache_lock = threading.Lock()
+
+
+def _keyset(order, descending, position):
+    '''
+    the condition for the tokens, which follow the position in the sort
+    order
+
+    :param order: the sort column expression
+    :param descending: True, if the order is descending
+    :param position: tuple of the sort value and the token id
+    '''
+    (value, token_id) = position
+    if descending:
+        return or_(order < value, and_(order == value,
+                                       Token.LinOtpTokenId < token_id))
+    return or_(order > value, and_(order == value,
+                                   Token.LinOtpTokenId > token_id))
+
+
+def cachedCount(query, ttl):
+    '''
+    count the tokens of the query - the number is cached per query and
+    query parameters for ttl seconds in the process
+
+    :param query: the token query
+    :param ttl: seconds, for which the number is reused
+    :return: the number of tokens
+    '''
+    statement = query.statement.compile()
+    key = (unicode(statement), repr(sorted(statement.params.items())))
+    now = time.time()
+
+    with count_cache_lock:
+        entry = count_cache.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    count = query.count()
+    with count_cache_lock:
+        if len(count_cache) >= COUNT_CACHE_SIZE:
+            count_cache.clear()
+        count_cache[key] = (now + ttl, count)
+    return count
+
 
 class TokenIterator(object):
     '''
@@ -91,8 +174,11 @@ class TokenIterator(object):
         :type  filterRealm:  string or list
         :param user_fields:  list of additional fields from the user owner
         :type  user_fields: array
-        :param params:  list of additional request parameters
-                        - currently not used
+        :param params:  list of additional request parameters:
+                        'cursor' - the cursor of the page from the
+                        result set info of the former page and
+                        'count' - 'approx' to take the token number from
+                        the token counters or the count cache
         :type  params: dict
 
         :return: - nothing / None
@@ -110,6 +196,8 @@ class TokenIterator(object):
         self.page = 1
         self.pages = 1
         self.tokens = 0
+        self.cursor = None
+        self.owners = {}
         self.user_fields = user_fields
         if self.user_fields == None:
             self.user_fields = []
@@ -134,12 +222,14 @@ class TokenIterator(object):
         #  create a list of all realms, which are allowed to be searched
         #  based on the list of the existing ones
         valid_realms = []
+        view_realms = []
         realms = getRealms().keys()
         if '*' in filterRealm:
             valid_realms.append("*")
         else:
             for realm in realms:
                 if realm in filterRealm:
+                    view_realms.append(realm)
                     realm = linotp.lib.crypt.uencode(realm)
                     valid_realms.append(realm)
 
@@ -301,35 +391,22 @@ class TokenIterator(object):
             log.debug("[TokenIterator::init] adding filter condition"
                       " for realm %r" % valid_realms)
 
-            #  get all matching realms
-            realm_id_tuples = Session.query(Realm.id).\
-                                filter(Realm.name.in_(valid_realms)).all()
-            realm_ids = set()
-            for realm_tuple in realm_id_tuples:
-                realm_ids.add(realm_tuple[0])
-            #  get all tokenrealm ids
-            token_id_tuples = Session.query(TokenRealm.token_id).\
-                        filter(TokenRealm.realm_id.in_(realm_ids)).all()
-            token_ids = set()
-            for token_tuple in token_id_tuples:
-                token_ids.add(token_tuple[0])
-
-            #  define the token id condition
-            r_condition = and_(Token.LinOtpTokenId.in_(token_ids))
+            #  the tokens of the realms are selected by a sub query, which
+            #  is resolved by the realm_id, token_id index of the TokenRealm
+            realm_tokens = select([tokenrealm_table.c.token_id]).where(
+                    and_(tokenrealm_table.c.realm_id == realm_table.c.id,
+                         realm_table.c.name.in_(valid_realms)))
+            r_condition = Token.LinOtpTokenId.in_(realm_tokens)
 
         elif ("''" in filterRealm or '""' in filterRealm or
               "/:no realm:/" in filterRealm):
             log.debug("[TokenIterator::init] search for all tokens, which are"
                       " in no realm")
 
-            #  get all tokenrealm ids
-            token_id_tuples = Session.query(TokenRealm.token_id).all()
-            token_ids = set()
-            for token_tuple in token_id_tuples:
-                token_ids.add(token_tuple[0])
+            r_condition = not_(Token.realms.any())
 
-            #  define the token id not condition
-            r_condition = and_(not_(Token.LinOtpTokenId.in_(token_ids)))
+        only_realms = (condition is None and ucondition is None and
+                       scondition is None)
 
         #  create the final condition as AND of all conditions
         condTuple = ()
@@ -339,46 +416,52 @@ class TokenIterator(object):
 
         condition = and_(*condTuple)
 
-        order = Token.LinOtpTokenDesc
-
-        if sort == "TokenDesc":
-            order = Token.LinOtpTokenDesc
-        elif sort == "TokenId":
-            order = Token.LinOtpTokenId
-        elif sort == "TokenType":
-            order = Token.LinOtpTokenType
-        elif sort == "TokenSerialnumber":
-            order = Token.LinOtpTokenSerialnumber
-        elif sort == "TokenType":
-            order = Token.LinOtpTokenType
-        elif sort == "IdResClass":
-            order = Token.LinOtpIdResClass
-        elif sort == "IdResolver":
-            order = Token.LinOtpIdResolver
-        elif sort == "Userid":
-            order = Token.LinOtpUserid
-        elif sort == "FailCount":
-            order = Token.LinOtpFailCount
-        elif sort == "Userid":
-            order = Token.LinOtpUserid
-        elif sort == "Isactive":
-            order = Token.LinOtpIsactive
+        if sort not in SORT_COLUMNS:
+            sort = "TokenDesc"
+        self.sort_key = SORT_COLUMNS[sort]
+        self.sort_nullable = sort in NULLABLE_SORT_COLUMNS
+
+        #  the token id makes the sort order unique, so that the next page
+        #  could be selected by the sort value and the id of the last token
+        #  of the page (keyset pagination) instead of an offset
+        order = getattr(Token, self.sort_key)
+        if self.sort_nullable:
+            order = func.coalesce(order, u'')
 
         #  care for the result sort order
-        if sortdir is not None and sortdir == "desc":
-            order = order.desc()
+        descending = sortdir is not None and sortdir == "desc"
+        if descending:
+            order_by = (order.desc(), Token.LinOtpTokenId.desc())
         else:
-            order = order.asc()
+            order_by = (order.asc(), Token.LinOtpTokenId.asc())
+
+        query = Session.query(Token).filter(condition)
+
+        #  the token number could be taken from the token counters or
+        #  from the count cache, if the exact number is not required
+        count_realms = None
+        if params.get('count', 'exact') == 'approx' and only_realms:
+            if '*' in valid_realms:
+                count_realms = ['*']
+            elif len(valid_realms) > 0:
+                count_realms = view_realms
+
+        self.cursor = None
 
         #  care for the result pageing
         if page is None:
-            self.toks = Session.query(Token).filter(condition).order_by(order).distinct()
-            self.tokens = self.toks.count()
+            self.toks = query.order_by(*order_by)
+            self.tokens = self._countTokens(query, params, count_realms)
 
             log.debug("[TokenIterator] DB-Query returned # of objects:"
                       " %i" % self.tokens)
             self.pagesize = self.tokens
-            self.it = iter(self.toks)
+
+            #  all tokens are read batch by batch, so that the memory does
+            #  not grow with the number of tokens
+            self.it = self._iterTokens(self._streamTokens(query, order,
+                                                          order_by,
+                                                          descending))
             return
 
         try:
@@ -401,9 +484,7 @@ class TokenIterator(object):
 
         log.debug("[TokenIterator::init] DB-Query condition: %s" % condition)
 
-        self.toks = Session.query(Token).filter(condition).\
-                                         order_by(order).distinct()
-        self.tokens = self.toks.count()
+        self.tokens = self._countTokens(query, params, count_realms)
         log.debug("[TokenIterator::init] DB-Query returned # of objects:"
                   " %i" % self.tokens)
         self.page = thePage + 1
@@ -412,20 +493,165 @@ class TokenIterator(object):
         if fpages - int(fpages) > 0:
             self.pages = self.pages + 1
         self.pagesize = pagesize
-        self.toks = self.toks.slice(start, stop)
 
-        self.it = iter(self.toks)
+        position = decodeCursor(params.get('cursor'))
+        if position is not None:
+            self.toks = query.filter(_keyset(order, descending, position))\
+                             .order_by(*order_by).limit(pagesize)
+        else:
+            self.toks = query.order_by(*order_by).slice(start, stop)
+
+        #  the owners of the page are resolved together
+        page_tokens = self.toks.all()
+        if len(page_tokens) == pagesize:
+            self.cursor = self._getCursor(page_tokens[-1])
+
+        self.it = self._iterTokens(page_tokens, batch=max(len(page_tokens),
+                                                          1))
 
         log.debug('[TokenIterator::init] end. Token iterator created: %r' % \
                   (self.it))
 
         return
 
+    def _countTokens(self, query, params, count_realms=None):
+        '''
+        get the number of tokens of the query - with the parameter
+        count=approx, the number is taken from the token counters, if only the
+        realms are filtered, or from the count cache
+
+        :param query: the query of the tokens
+        :param params: the request parameters
+        :param count_realms: the realms, if only the realms are filtered
+        :return: the number of tokens
+        '''
+        if params.get('count', 'exact') != 'approx':
+            return query.count()
+
+        if count_realms == ['*']:
+            return getTokenNumResolver(active=False)
+
+        if count_realms:
+            #  tokens in several realms are counted for each realm
+            return sum([getTokenInRealm(realm, active=False)
+                        for realm in count_realms])
+
+        try:
+            ttl = int(getFromConfig("tokencount_ttl", 60))
+        except ValueError:
+            ttl = 60
+        return cachedCount(query, ttl)
+
+    def _getPosition(self, tok):
+        '''
+        get the sort value and the id of a token
+        '''
+        value = sa.inspect(tok).attrs[self.sort_key].value
+        if value is None and self.sort_nullable:
+            value = u''
+        return (value, tok.LinOtpTokenId)
+
+    def _getCursor(self, tok):
+        '''
+        get the cursor of the page, which follows the token
+
+        :param tok: the last token of the page
+        :return: the cursor string
+        '''
+        return encodeCursor(*self._getPosition(tok))
+
+    def _streamTokens(self, query, order, order_by, descending, batch=None):
+        '''
+        read the tokens of the query in batches, each selected by the
+        position of the last token of the former batch - other than a server
+        side cursor this works on every database and does not keep the
+        connection busy, while the tokens are processed
+
+        :param query: the token query
+        :param order: the sort column expression
+        :param order_by: the complete sort order
+        :param descending: True, if the order is descending
+        :param batch: the number of tokens per batch
+        '''
+        batch = batch or STREAM_BATCH
+        position = None
+        while True:
+            #  the tokens are read in the current request Session, which
+            #  might be another one than the one of the iterator setup
+            batch_query = query.with_session(Session())
+            if position is not None:
+                batch_query = batch_query.filter(_keyset(order, descending,
+                                                         position))
+            tokens = batch_query.order_by(*order_by).limit(batch).all()
+
+            for tok in tokens:
+                yield tok
+
+            if len(tokens) < batch:
+                break
+            position = self._getPosition(tokens[-1])
+
+    def _iterTokens(self, tokens, batch=None):
+        '''
+        iterate the tokens and resolve their owners batch by batch
+
+        :param tokens: the token query or list
+        :param batch: the number of tokens, of which the owners are resolved
+                      together
+        '''
+        batch = batch or OWNER_BATCH
+        tokenBatch = []
+        for tok in tokens:
+            tokenBatch.append(tok)
+            if len(tokenBatch) < batch:
+                continue
+            self._loadRealms(tokenBatch)
+            self._resolveOwners(tokenBatch)
+            for tok in tokenBatch:
+                yield tok
+            tokenBatch = []
+
+        if tokenBatch:
+            self._loadRealms(tokenBatch)
+            self._resolveOwners(tokenBatch)
+        for tok in tokenBatch:
+            yield tok
+
+    def _loadRealms(self, tokens):
+        '''
+        load the realms of the tokens with one query instead of one query
+        per token
+        '''
+        realms = dict((tok.LinOtpTokenId, []) for tok in tokens)
+        for ids in [realms.keys()[i:i + OWNER_BATCH]
+                    for i in range(0, len(realms), OWNER_BATCH)]:
+            rows = Session.query(tokenrealm_table.c.token_id, Realm)\
+                    .filter(tokenrealm_table.c.realm_id == Realm.id)\
+                    .filter(tokenrealm_table.c.token_id.in_(ids)).all()
+            for (token_id, realm) in rows:
+                realms[token_id].append(realm)
+
+        for tok in tokens:
+            if 'realms' not in sa.inspect(tok).dict:
+                set_committed_value(tok, 'realms', realms[tok.LinOtpTokenId])
+        return
+
+    def _resolveOwners(self, tokens):
+        '''
+        get the user info of the owners of the tokens with one lookup per
+        resolver
+        '''
+        self.owners = getUserInfos([(tok.LinOtpUserid, tok.LinOtpIdResolver,
+                                     tok.LinOtpIdResClass)
+                                    for tok in tokens if tok.LinOtpUserid])
+        return
+
     def getResultSetInfo(self):
         resSet = {"pages": self.pages,
                   "pagesize": self.pagesize,
                   "tokens": self.tokens,
-                  "page": self.page}
+                  "page": self.page,
+                  "cursor": self.cursor}
         return resSet
 
     def getUserDetail(self, tok):
@@ -443,8 +669,12 @@ class TokenIterator(object):
             userInfo["User.userid"] = u'/:no user info:/'
             userInfo["User.username"] = u'/:no user info:/'
 
-            uInfo = getUserInfo(tok.LinOtpUserid, tok.LinOtpIdResolver,
-                                tok.LinOtpIdResClass)
+            owner = (tok.LinOtpUserid, tok.LinOtpIdResClass)
+            if owner in self.owners:
+                uInfo = self.owners[owner]
+            else:
+                uInfo = getUserInfo(tok.LinOtpUserid, tok.LinOtpIdResolver,
+                                    tok.LinOtpIdResClass)
             if uInfo is not None and len(uInfo) > 0:
                 if "description" in uInfo:
                     description = uInfo.get("description")
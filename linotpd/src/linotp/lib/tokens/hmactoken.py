@@ -599,8 +599,8 @@ class HmacTokenClass(TokenClass):
         log.debug("[get_multi_otp] retrieving %i OTP values for token %s" % (count, hmac2Otp))
 
         if count > 0:
-            for i in range(count):
-                otpval = hmac2Otp.generate(s_count + i, inc_counter=False)
+            otpvals = hmac2Otp.generateWindow(s_count, s_count + count)
+            for i, otpval in enumerate(otpvals):
                 otp_dict["otp"][s_count + i] = otpval
             ret = True
 
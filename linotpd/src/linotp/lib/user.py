@@ -33,6 +33,7 @@ from linotp.lib.error   import UserError
 from linotp.lib.util    import getParam
 from linotp.lib.config  import getFromConfig, storeConfig
 from linotp.lib.config  import getLinotpConfig
+from linotp.lib.config  import getGlobalObject
 from linotp.lib.realm   import setDefaultRealm
 from linotp.lib.realm   import getDefaultRealm
 from linotp.lib.realm   import getRealms
@@ -523,6 +524,50 @@ def getAllUserRealms(user):
 
     return results;
 
+def lookupUserId(realm, resolver, login):
+    '''
+    lookup the uid of the login in the resolver - the result is taken from
+    the process wide user cache, so that the resolver is only asked, if the
+    login has not been looked up in the realm before
+
+    :param realm: the realm name, the resolver is part of
+    :param resolver: the resolver specification
+    :param login: the login name of the user
+
+    :return: tuple of uid and resolver id - the uid is None, if the user
+             is not in the resolver
+    '''
+    cache = None
+    glo = getGlobalObject()
+    if glo is not None:
+        cache = glo.getUserCache()
+
+    if cache is not None:
+        cache.sync(getLinotpConfig())
+        (found, value) = cache.get(realm, resolver, login)
+        if found:
+            if value is None:
+                return (None, None)
+            return value
+
+    y = getResolverObject(resolver)
+    if y is None:
+        raise Exception("resolver %r not found" % resolver)
+
+    log.debug("[lookupUserId] checking in module %r" % y)
+    uid = y.getUserId(login)
+
+    if uid in ["", None]:
+        if cache is not None:
+            cache.set(realm, resolver, login, None)
+        return (None, None)
+
+    resId = y.getResolverId()
+    if cache is not None:
+        cache.set(realm, resolver, login, (uid, resId))
+    return (uid, resId)
+
+
 def getResolversOfUser(user, use_default_realm=True):
     '''
     This returns the list of the Resolvers of a user in a given realm.
@@ -571,14 +616,8 @@ def getResolversOfUser(user, use_default_realm=True):
             (package, module, class_, conf) = splitResolver(realm_resolver)
             module = package + "." + module
 
-            y = getResolverObject(realm_resolver)
-            if y is None:
-                log.error("[getResolversOfUser] [ module %r not found!]"
-                                                                    % (module))
-
             try:
-                log.debug("[getResolversOfUser] checking in module %r" % y)
-                uid = y.getUserId(login)
+                (uid, resId) = lookupUserId(realm, realm_resolver, login)
                 log.debug("[getResolversOfUser] type of uid: %s" % type(uid))
                 log.debug("[getResolversOfUser] type of realm_resolver: %s" % type(realm_resolver))
                 log.debug("[getResolversOfUser] type of login: %s" % type(login))
@@ -590,7 +629,6 @@ def getResolversOfUser(user, use_default_realm=True):
                     # v = (login, realm_resolver, uid)
                     # log.info("[getResolversOfUser] %s %s %s" % v)
 
-                    resId = y.getResolverId();
                     resCId = realm_resolver
                     Resolvers.append(realm_resolver)
                     user.addResolverUId(realm_resolver, uid, conf, resId, resCId)
@@ -619,11 +657,13 @@ def getUserId(user):
     loginUser = user.login;
 
     resolvers = '';
+    realm = None
     realms = getRealms();
 
     # Get the first resolver they're present in, because UID is independent of realm.
     for key, v in realms.items():
-        resolvers = getResolversOfUser(User(user.login, v['realmname'], ""))
+        realm = v['realmname']
+        resolvers = getResolversOfUser(User(user.login, realm, ""))
         if (resolvers):
             break;
 
@@ -645,18 +685,14 @@ def getUserId(user):
         # try to load the UserIdResolver Class
         try:
             module = package + "." + module
-            log.debug("[getUserId] Getting resolver class: [%r] [%r]"
-                       % (module, class_))
-            y = getResolverObject(reso)
             log.debug("[getUserId] Getting UserID for user %r"
                         % loginUser)
-            uid = y.getUserId(loginUser)
+            (uid, resId) = lookupUserId(realm, reso, loginUser)
+            if uid is None:
+                uid = ''
             log.debug("[getUserId] Got UserId for user %r: %r"
                         % (loginUser, uid))
 
-            log.debug("[getUserId] Retrieving ResolverID...")
-            resId = y.getResolverId()
-
             resIdC = reso
             log.debug("[getUserId] Got ResolverID: %r, Loginuser: %r, "
                       "Uid: %r ]" % (resId, loginUser, uid))
@@ -856,6 +892,37 @@ def getUserInfo(userid, resolver, resolverC):
     return userInfo
 
 
+def getUserInfos(users):
+    '''
+    get the user info of several users with one lookup per resolver
+
+    :param users: list of tuples of userid, resolver and resolver class -
+                  as they are stored with the tokens
+    :return: dict of the tuples (userid, resolver class) with the user info
+    '''
+    userids = {}
+    for (userid, _resolver, resolverC) in users:
+        if userid:
+            userids.setdefault(resolverC, set()).add(userid)
+
+    userInfos = {}
+    for resolverC, uids in userids.items():
+        log.debug("[getUserInfos] getting the user info of %d users from "
+                  "resolver %r" % (len(uids), resolverC))
+        found = {}
+        try:
+            y = getResolverObject(resolverC)
+            found = y.getUserInfos(list(uids))
+        except Exception as e:
+            log.error("[getUserInfos] resolver %r failed: %r"
+                      % (resolverC, e))
+
+        for userid in uids:
+            userInfos[(userid, resolverC)] = found.get(userid, {})
+
+    return userInfos
+
+
 def getUserDetail(user):
     '''
     Returns userinfo of an user
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+'''
+process wide cache of the user resolution
+
+Resolving a login to a user id means an LDAP search or an SQL query in
+every resolver of every realm. The UserCache holds the result of these
+lookups, keyed by (realm, resolver, login), for all requests of a process:
+
+    linotpUserCache.enable = True
+    linotpUserCache.ttl = 300
+    linotpUserCache.negative_ttl = 30
+    linotpUserCache.size = 10000
+
+A found user is cached for 'ttl' seconds, the information that a user does
+not exist in a resolver only for 'negative_ttl' seconds. If the cache holds
+more than 'size' entries, the least recently used entries are dropped.
+
+The cache is cleared whenever the definition of a resolver or of a realm
+changes.
+'''
+
+import time
+import logging
+import threading
+
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# the config entries, which define the resolvers and the realms
+REALM_ENTRIES = ('linotp.DefaultRealm',)
+
+
+def is_resolver_entry(key):
+    '''
+    check if the config entry is part of a resolver or realm definition -
+    like 'linotp.ldapresolver.LDAPURI.<name>' or
+    'linotp.useridresolver.group.<realm>'
+    '''
+    if key in REALM_ENTRIES:
+        return True
+    parts = key.split('.', 2)
+    return len(parts) > 2 and parts[1].endswith('resolver')
+
+
+class UserCache(object):
+    '''
+    thread safe TTL and LRU cache of the uid lookups
+    '''
+
+    def __init__(self, ttl=300, negative_ttl=30, size=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.version = None
+        self.fingerprint = None
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def sync(self, config):
+        '''
+        clear the cache if the resolver or realm definitions in the config
+        differ from the definitions the cached entries are based on
+
+        :param config: the LinOtpConfig of the request
+        '''
+        version = getattr(config, 'version', None)
+        if version is not None and version == self.version:
+            return
+
+        fingerprint = hash(frozenset((key, config.get(key))
+                                     for key in config.keys()
+                                     if is_resolver_entry(key)))
+
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                if self.fingerprint is not None:
+                    log.info("[sync] resolver definitions changed - "
+                             "dropping %d cached users" % len(self.entries))
+                    self.invalidations += 1
+                self.entries.clear()
+                self.fingerprint = fingerprint
+            self.version = version
+        return
+
+    def get(self, realm, resolver, login):
+        '''
+        lookup the cached result for the user
+
+        :return: tuple of (found, value) - found is False, if the cache has
+                 no valid entry. The value is None for a cached unknown user
+        '''
+        key = (realm, resolver, login)
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return (False, None)
+
+            (expires, value) = entry
+            if expires < now:
+                del self.entries[key]
+                self.misses += 1
+                return (False, None)
+
+            # move the entry to the end of the lru order
+            del self.entries[key]
+            self.entries[key] = entry
+
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return (True, value)
+
+    def set(self, realm, resolver, login, value):
+        '''
+        cache the result of the lookup - a value of None stands for an
+        unknown user and is cached with the shorter negative_ttl
+        '''
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+
+        key = (realm, resolver, login)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, value)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        return
+
+    def getStats(self):
+        '''
+        :return: dict with the size and the hit and miss counters
+        '''
+        return {'entries': len(self.entries),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                }
+
+
+def getUserCache(config):
+    '''
+    create the user cache as defined in the ini file
+
+    :param config: the pylons config
+    :return: the UserCache or None if the cache is disabled
+    '''
+    enable = config.get('linotpUserCache.enable', 'True')
+    if str(enable).strip().lower() != 'true':
+        return None
+
+    cache = UserCache(ttl=float(config.get('linotpUserCache.ttl', 300)),
+                      negative_ttl=float(config.get(
+                                    'linotpUserCache.negative_ttl', 30)),
+                      size=int(config.get('linotpUserCache.size', 10000)))
+
+    log.info("[getUserCache] caching %d users for %s seconds"
+             % (cache.size, cache.ttl))
+    return cache
@@ -26,11 +26,17 @@
 """ contains utility functions """
 
 import binascii
+import base64
 import string
 import re
 import netaddr
 import time
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 from pylons import request
 from pylons import config
 from pylons.controllers.util import abort
@@ -420,3 +426,27 @@ def unicode_compare(x, y):
     :return: the locale aware comparison result
     """
     return cmp(str2unicode(x), str2unicode(y))
+
+
+def encodeCursor(value, row_id):
+    '''
+    build the cursor of the next page from the sort value and the id of the
+    last row of the current page
+    '''
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]))
+
+
+def decodeCursor(cursor):
+    '''
+    get the sort value and the row id from the cursor
+
+    :return: tuple of sort value and row id or None
+    '''
+    if not cursor:
+        return None
+    try:
+        (value, row_id) = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        return (value, int(row_id))
+    except Exception as exx:
+        log.warning("[decodeCursor] invalid cursor %r: %r" % (cursor, exx))
+        return None
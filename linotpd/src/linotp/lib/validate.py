@@ -37,6 +37,7 @@ import linotp.lib.policy
 
 from linotp.model import Challenge
 from linotp.model.meta import Session
+from linotp.lib.challenges import getChallengeStore
 from linotp.lib.config  import getFromConfig
 from linotp.lib.resolver import getResolverObject
 
@@ -73,21 +74,13 @@ def get_challenges(serial=None, transid=None):
     if transid is None and serial is None:
         return challenges
 
+    store = getChallengeStore()
     if transid is None:
-        db_challenges = Session.query(Challenge)\
-            .filter(Challenge.tokenserial == u'' + serial)\
-            .order_by(desc(Challenge.id))\
-            .all()
+        db_challenges = store.lookup(serial=serial)
     else:
         transid_len = int(getFromConfig('TransactionIdLength', 12))
-        if len(transid) == transid_len:
-            db_challenges = Session.query(Challenge)\
-                .filter(Challenge.transid == transid)\
-                .all()
-        else:
-            db_challenges = Session.query(Challenge)\
-                .filter(Challenge.transid.startswith(transid))\
-                .all()
+        db_challenges = store.lookup(transid=transid,
+                                     exact=len(transid) == transid_len)
 
     challenges.extend(db_challenges)
 
@@ -143,10 +136,7 @@ def create_challenge(token, options=None, challenge_id=None, id_postfix='', pass
             else:
                 transactionid = challenge_id
 
-            num_challenges = Session.query(Challenge).\
-                    filter(Challenge.transid == transactionid).count()
-
-            if num_challenges == 0:
+            if not getChallengeStore().exists(transactionid):
                 challenge_obj = Challenge(transid=transactionid,
                                                 tokenserial=token.getSerial())
             if challenge_obj is not None:
@@ -206,7 +196,9 @@ def create_challenge(token, options=None, challenge_id=None, id_postfix='', pass
     if res == False and challenge_obj is not None:
         try:
             log.debug("deleting session")
-            Session.delete(challenge_obj)
+            if challenge_obj.id is not None:
+                getChallengeStore().delete(token.getSerial(),
+                                           [challenge_obj.id])
             Session.commit()
         except Exception as exx:
             log.debug("deleting session failed: %r" % exx)
@@ -311,13 +303,7 @@ def delete_challenges(serial, challenges):
     res = 1
     # gather all challenges with one sql 'in' statement
     if len(challenge_ids) > 0:
-        del_challes = Session.query(Challenge).\
-            filter(Challenge.tokenserial == serial).\
-            filter(Challenge.id.in_(challenge_ids)).all()
-
-        # and delete them via session
-        for dell in del_challes:
-            Session.delete(dell)
+        getChallengeStore().delete(serial, challenge_ids)
 
     return res
 
@@ -513,7 +499,7 @@ class ValidateToken(object):
         # default is: challenges which are younger than the matching one
         # are to be deleted
 
-        all_challenges = self.lookup_challenge()
+        all_challenges = self.lookup_challenge(serial=self.token.getSerial())
         to_be_deleted = self.token.challenge_janitor(matching_challenges,
                                                       all_challenges)
 
@@ -664,19 +650,14 @@ class ValidateToken(object):
         :return: the list of challenges
         '''
 
-        conditions = ()
-        if serial:
-            conditions += (and_(Challenge.tokenserial == serial),)
+        exact = True
         if state:
             transid_len = int(getFromConfig('TransactionIdLength', 12))
-            if len(state) == transid_len:
-                conditions += (and_(Challenge.transid == state),)
-            else:
-                conditions += (and_(Challenge.transid.startswith(state)),)
+            exact = len(state) == transid_len
 
-        # SQLAlchemy requires the conditions in one arg as tupple
-        condition = and_(*conditions)
-        challenges = Session.query(Challenge).filter(condition).all()
+        challenges = getChallengeStore().lookup(serial=serial or None,
+                                                transid=state or None,
+                                                exact=exact)
         return challenges
 
 
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+'''
+background threads of a process
+
+A PeriodicWorker calls its work() method in a daemon thread every interval
+seconds until it is stopped. As the threads do not survive a fork of the
+server process, the thread is started per process: start() only starts a
+new thread, if there is none in the calling process.
+
+Errors of a run should be handled by work() itself - the next run will
+catch up.
+'''
+
+import os
+import threading
+
+
+class PeriodicWorker(object):
+    '''
+    base class of the background threads, which are (re)started in every
+    process, which uses them
+    '''
+
+    def __init__(self, name, interval, wait_first=False):
+        '''
+        :param name: the name of the thread
+        :param interval: the seconds between the runs
+        :param wait_first: if True the first run starts after the interval,
+                           otherwise immediately
+        '''
+        self.name = name
+        self.interval = interval
+        self.wait_first = wait_first
+
+        self.pid = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def isRunning(self):
+        '''
+        :return: boolean - True if the thread has been started in this
+                 process
+        '''
+        return self.pid == os.getpid() and self.thread is not None
+
+    def start(self):
+        '''
+        start the thread, if it is not yet started in this process
+        '''
+        with self.lock:
+            if self.isRunning():
+                return
+
+            self.pid = os.getpid()
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name=self.name)
+            self.thread.daemon = True
+            self.thread.start()
+        return
+
+    def stop(self):
+        '''
+        stop the thread - a running work() call is finished
+        '''
+        self.stopped.set()
+        self.thread = None
+        return
+
+    def _run(self):
+        wait = self.wait_first
+        while not self.stopped.is_set():
+            if wait:
+                self.stopped.wait(self.interval)
+                if self.stopped.is_set():
+                    break
+            wait = True
+            self.work()
+        return
+
+    def work(self):
+        '''
+        one run of the thread - to be implemented by the workers
+        '''
+        raise NotImplementedError("work is not implemented by %r"
+                                  % self.__class__.__name__)
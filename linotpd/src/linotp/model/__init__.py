@@ -44,7 +44,9 @@ import sqlalchemy as sa
 
 from sqlalchemy import orm
 from sqlalchemy import ForeignKey
+from sqlalchemy import event
 from sqlalchemy.orm import relation
+from sqlalchemy.orm.attributes import flag_modified
 
 import linotp
 
@@ -120,6 +122,16 @@ token_table = sa.Table('Token', meta.metadata,
                 sa.Column('LinOtpCount', sa.types.Integer(), default=0),
                 sa.Column('LinOtpCountWindow', sa.types.Integer(), default=10),
                 sa.Column('LinOtpSyncWindow', sa.types.Integer(), default=1000),
+                ## former token info entries, which are evaluated on every
+                ## authentication - NULL for tokens, which are not migrated,
+                ## and until the entry is set, as the token info view shows
+                ## only the set entries
+                sa.Column('LinOtpCountAuth', sa.types.Integer(), index=True),
+                sa.Column('LinOtpCountAuthMax', sa.types.Integer()),
+                sa.Column('LinOtpCountAuthSuccess', sa.types.Integer(), index=True),
+                sa.Column('LinOtpCountAuthSuccessMax', sa.types.Integer()),
+                sa.Column('LinOtpValidityStart', sa.types.DateTime(), index=True),
+                sa.Column('LinOtpValidityEnd', sa.types.DateTime(), index=True),
                 implicit_returning=implicit_returning,
                 )
 
@@ -127,6 +139,18 @@ TOKEN_ENCODE = ["LinOtpTokenDesc", "LinOtpTokenSerialnumber",
                 "LinOtpTokenInfo", "LinOtpUserid", "LinOtpIdResClass",
                 "LinOtpIdResolver"]
 
+## the token info entries, which are stored in dedicated columns
+TOKEN_INFO_COLUMNS = {
+    "count_auth": "LinOtpCountAuth",
+    "count_auth_max": "LinOtpCountAuthMax",
+    "count_auth_success": "LinOtpCountAuthSuccess",
+    "count_auth_success_max": "LinOtpCountAuthSuccessMax",
+    "validity_period_start": "LinOtpValidityStart",
+    "validity_period_end": "LinOtpValidityEnd",
+}
+
+VALIDITY_FORMAT = "%d/%m/%y %H:%M"
+
 class Token(object):
 
     def __init__(self, serial):
@@ -169,6 +193,9 @@ class Token(object):
             ## encode data
             if value:
                 value = linotp.lib.crypt.uencode(value)
+            if name == 'LinOtpTokenInfo':
+                ## the parsed token info is replaced
+                self.__dict__.pop('_info_cache', None)
         super(Token, self).__setattr__(name, value)
 
     def __getattribute__(self, name):
@@ -356,6 +383,7 @@ class Token(object):
         ## is deleteted via foreign key relation
         ## so we delete it explicit
         Session.query(TokenRealm).filter(TokenRealm.token_id == self.LinOtpTokenId).delete()
+        Session.query(OtpIndex).filter(OtpIndex.token_id == self.LinOtpTokenId).delete()
         Session.delete(self)
         log.debug('delete token success')
         return True
@@ -422,7 +450,7 @@ class Token(object):
         ret['LinOtp.TokenSerialnumber'] = self.LinOtpTokenSerialnumber or ''
 
         ret['LinOtp.TokenType'] = self.LinOtpTokenType or 'hmac'
-        ret['LinOtp.TokenInfo'] = self._fix_spaces(self.LinOtpTokenInfo or '')
+        ret['LinOtp.TokenInfo'] = self.getInfoView()
         # ret['LinOtpTokenPinUser']   = self.LinOtpTokenPinUser
         # ret['LinOtpTokenPinSO']     = self.LinOtpTokenPinSO
 
@@ -471,6 +499,8 @@ class Token(object):
         return self.LinOtpCountWindow
 
     def getInfo(self):
+        # write back the pending changes of the parsed token info
+        self.storeInfo()
         # Fix for working with MS SQL servers
         # MS SQL servers sometimes return a '<space>' when the column is empty: ''
         return self._fix_spaces(self.LinOtpTokenInfo or '')
@@ -478,6 +508,79 @@ class Token(object):
     def setInfo(self, info):
         self.LinOtpTokenInfo = info
 
+    def getInfoDict(self):
+        '''
+        get the token info as dict - the json of the info column is parsed
+        only once and the dict is shared by all users of this token object
+
+        :return: the info dict - changes of the dict must be announced by
+                 setInfoDict to get stored
+        '''
+        cache = self.__dict__.get('_info_cache')
+        if cache is not None and cache[2]:
+            return cache[1]
+
+        tokeninfo = self.LinOtpTokenInfo
+        if cache is not None and cache[0] == tokeninfo:
+            return cache[1]
+
+        info = {}
+        data = self._fix_spaces(tokeninfo or '')
+        if data:
+            try:
+                info = json.loads(data)
+            except Exception as exx:
+                log.error('[getInfoDict] failed to load token info: %r' % exx)
+
+        self.__dict__['_info_cache'] = [tokeninfo, info, False]
+        return info
+
+    def setInfoDict(self, info):
+        '''
+        set the token info dict - the serialization into the info column
+        is deferred until the token is flushed or the info is read as text
+
+        :param info: the token info dict
+        '''
+        self.__dict__['_info_cache'] = [None, info, True]
+        ## make the token dirty, so that the next flush will store the info
+        flag_modified(self, 'LinOtpTokenInfo')
+
+    def storeInfo(self):
+        '''
+        serialize the changed token info dict into the info column
+        '''
+        cache = self.__dict__.get('_info_cache')
+        if cache is None or cache[2] == False:
+            return
+
+        self.LinOtpTokenInfo = u'' + json.dumps(cache[1], indent=0)
+        self.__dict__['_info_cache'] = [self.LinOtpTokenInfo, cache[1], False]
+        return
+
+    def getInfoView(self):
+        '''
+        get the token info as text including the token info entries, which
+        are stored in dedicated columns
+
+        :return: the json token info
+        '''
+        columns = {}
+        for key, column in TOKEN_INFO_COLUMNS.items():
+            value = getattr(self, column)
+            if value is None:
+                continue
+            if isinstance(value, datetime):
+                value = value.strftime(VALIDITY_FORMAT)
+            columns[key] = value
+
+        if not columns:
+            return self.getInfo()
+
+        info = dict(self.getInfoDict())
+        info.update(columns)
+        return u'' + json.dumps(info, indent=0)
+
     def _setPin(self, pin, hashed=True):
         log.debug("_setPin(%s)" % pin)
         if pin is None or pin == "":
@@ -643,6 +746,12 @@ tokenrealm_table = sa.Table('TokenRealm', meta.metadata,
                 implicit_returning=implicit_returning,
                 )
 
+## the realm filter of the token list looks up the tokens of the realms and
+## the realms of a token are loaded by the token id
+sa.Index('ix_tokenrealm_realm_id_token_id', tokenrealm_table.c.realm_id,
+         tokenrealm_table.c.token_id)
+sa.Index('ix_tokenrealm_token_id', tokenrealm_table.c.token_id)
+
 class TokenRealm(object):
 
     def __init__(self, realmid):
@@ -651,6 +760,26 @@ class TokenRealm(object):
         self.token_id = 0
 
 
+# This table holds the keyed hashes of the next otp values of the
+# unassigned tokens - see linotp.lib.otpindex
+otpindex_table = sa.Table('OtpIndex', meta.metadata,
+                sa.Column('id', sa.types.Integer(), sa.Sequence('otpindex_seq_id', optional=True), primary_key=True, nullable=False),
+                sa.Column('token_id', sa.types.Integer(), ForeignKey('Token.LinOtpTokenId'), index=True),
+                sa.Column('digest', sa.types.Unicode(64), default=u'', nullable=False, index=True),
+                sa.Column('counter', sa.types.Integer(), default=0),
+                sa.Column('lookahead', sa.types.Integer(), default=0),
+                implicit_returning=implicit_returning,
+                )
+
+class OtpIndex(object):
+
+    def __init__(self, token_id, digest, counter, lookahead):
+        self.token_id = token_id
+        self.digest = digest
+        self.counter = counter
+        self.lookahead = lookahead
+
+
 realm_table = sa.Table('Realm', meta.metadata,
                 sa.Column('id', sa.types.Integer(), sa.Sequence('realm_seq_id', optional=True), primary_key=True, nullable=False),
                 sa.Column('name', sa.types.Unicode(255), default=u'', unique=True, nullable=False),
@@ -716,6 +845,49 @@ class Realm(object):
         return True
 
 
+## the maintained number of the tokens and of the active tokens - overall,
+## per resolver class and per realm. The counters are changed in the same
+## transaction as the tokens and are reconciled by the TokenCounter job -
+## see linotp.lib.tokencounter
+tokencounter_table = sa.Table('TokenCounter', meta.metadata,
+                sa.Column('scope', sa.types.Unicode(16), primary_key=True, nullable=False),
+                sa.Column('name', sa.types.Unicode(255), primary_key=True, nullable=False),
+                sa.Column('tokens', sa.types.Integer(), default=0, nullable=False),
+                sa.Column('active', sa.types.Integer(), default=0, nullable=False),
+                implicit_returning=implicit_returning,
+                )
+
+## the counter scopes - the overall counter has the name '*', as oracle
+## does not support empty strings in the primary key
+COUNTER_ALL = u'all'
+COUNTER_RESOLVER = u'resolver'
+COUNTER_REALM = u'realm'
+
+class TokenCounter(object):
+
+    def __init__(self, scope, name, tokens=0, active=0):
+        self.scope = scope
+        self.name = name
+        self.tokens = tokens
+        self.active = active
+
+
+def counter_resolver_name(resolver_class):
+    """
+    the counter name of a resolver class - the 2.6 resolver classes
+    'useridresolveree.' are counted as 'useridresolver.'
+
+    :param resolver_class: the stored (encoded) resolver class
+    :return: the resolver class as unicode
+    """
+    if not resolver_class:
+        return u''
+    name = linotp.lib.crypt.udecode(resolver_class)
+    if name.startswith('useridresolveree.'):
+        name = 'useridresolver.' + name[len('useridresolveree.'):]
+    return u'' + name
+
+
 ''' ''' '''
 ocra challenges are stored
 ''' ''' '''
@@ -738,6 +910,12 @@ ocra_table = sa.Table('ocra', meta.metadata,
                 implicit_returning=implicit_returning,
                 )
 
+## the ocra challenges of a token are looked up at every request and the
+## janitor deletes the outdated ones
+sa.Index('ix_ocra_tokenserial', ocra_table.c.tokenserial)
+sa.Index('ix_ocra_timestamp', ocra_table.c[timestamp_column])
+sa.Index('ix_ocra_received_count', ocra_table.c.received_count)
+
 OCRA_ENCODE = ["data", "challenge", "tokenserial"]
 
 class OcraChallenge(object):
@@ -874,6 +1052,12 @@ challenges_table = sa.Table('challenges', meta.metadata,
                 implicit_returning=implicit_returning,
                 )
 
+## the challenges of a token are looked up on every challenge response
+## request and the expired challenges are deleted by the timestamp
+sa.Index('ix_challenges_tokenserial_timestamp',
+         challenges_table.c.tokenserial, challenges_table.c[timestamp_column])
+sa.Index('ix_challenges_timestamp', challenges_table.c[timestamp_column])
+
 CHALLENGE_ENCODE = ["data", "challenge", 'tokenserial']
 
 class Challenge(object):
@@ -1017,8 +1201,8 @@ class Challenge(object):
         '''
         log.debug('[save] save challenge')
         try:
-            Session.add(self)
-            Session.commit()
+            from linotp.lib.challenges import getChallengeStore
+            getChallengeStore().save(self)
             log.debug('save challenge : success')
 
         except Exception as exce:
@@ -1070,15 +1254,115 @@ log.debug('calling ORM Mapper')
 #    'realms':relation(TokenRealm, backref=backref('token'))
 #    })
 
+## the former values of the counted attributes are loaded on change, so
+## that the token counters could be adjusted
 orm.mapper(Token, token_table, properties={
     'realms':relation(Realm, secondary=tokenrealm_table,
         primaryjoin=token_table.c.LinOtpTokenId == tokenrealm_table.c.token_id,
-        secondaryjoin=tokenrealm_table.c.realm_id == realm_table.c.id)
+        secondaryjoin=tokenrealm_table.c.realm_id == realm_table.c.id),
+    'LinOtpIsactive': orm.column_property(token_table.c.LinOtpIsactive,
+                                          active_history=True),
+    'LinOtpIdResClass': orm.column_property(token_table.c.LinOtpIdResClass,
+                                            active_history=True),
     })
 orm.mapper(Realm, realm_table)
 orm.mapper(TokenRealm, tokenrealm_table)
+orm.mapper(OtpIndex, otpindex_table)
 orm.mapper(Config, config_table)
+orm.mapper(TokenCounter, tokencounter_table)
+
+
+def _store_token_info(session, flush_context, instances):
+    """
+    serialize the changed token info dicts before the tokens are flushed
+    """
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Token):
+            obj.storeInfo()
+
+if not event.contains(meta.Session, 'before_flush', _store_token_info):
+    event.listen(meta.Session, 'before_flush', _store_token_info)
+
+TOKEN_COUNTER_ATTRIBUTES = ['LinOtpIsactive', 'LinOtpIdResClass', 'realms']
+
+def _token_counter_state(token, committed=False):
+    """
+    get the counters, to which a token contributes
+
+    :param token: the Token of the session
+    :param committed: if True, the state before the changes of the session
+                      is returned
+    :return: tuple of the active flag and the list of the counter keys
+    """
+    state = sa.inspect(token)
+    values = {}
+    for key in TOKEN_COUNTER_ATTRIBUTES:
+        if key not in state.dict:
+            ## load the attribute to get its history
+            getattr(token, key)
+        history = state.attrs[key].history
+        changes = history.deleted if committed else history.added
+        values[key] = list(history.unchanged or ()) + list(changes or ())
+
+    active = bool(values['LinOtpIsactive'] and values['LinOtpIsactive'][0])
+    keys = [(COUNTER_ALL, u'*')]
+    if values['LinOtpIdResClass']:
+        resolver = counter_resolver_name(values['LinOtpIdResClass'][0])
+        if resolver:
+            keys.append((COUNTER_RESOLVER, resolver))
+    for realm in sorted(set([r.name for r in values['realms']])):
+        keys.append((COUNTER_REALM, u'' + realm))
+    return (active, keys)
+
+def _count_tokens(session, flush_context, instances):
+    """
+    adjust the token counters to the new, deleted and changed tokens of the
+    flush - within the transaction of the token changes
+    """
+    deltas = {}
+
+    def account(counter_state, sign):
+        (active, keys) = counter_state
+        for key in keys:
+            (tokens, actives) = deltas.get(key, (0, 0))
+            deltas[key] = (tokens + sign, actives + (sign if active else 0))
+
+    for obj in session.new:
+        if isinstance(obj, Token):
+            account(_token_counter_state(obj), 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Token):
+            account(_token_counter_state(obj, committed=True), -1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Token):
+            continue
+        state = sa.inspect(obj)
+        if not [key for key in TOKEN_COUNTER_ATTRIBUTES
+                if state.attrs[key].history.has_changes()]:
+            continue
+        before = _token_counter_state(obj, committed=True)
+        after = _token_counter_state(obj)
+        if before != after:
+            account(before, -1)
+            account(after, 1)
+
+    ## a counter, which does not exist yet, is created by the reconcile
+    ## job - the counters are updated in a fixed order to avoid deadlocks
+    table = tokencounter_table
+    for (scope, name), (tokens, active) in sorted(deltas.items()):
+        if tokens == 0 and active == 0:
+            continue
+        session.execute(table.update()
+                        .where(sa.and_(table.c.scope == scope,
+                                       table.c.name == name))
+                        .values(tokens=table.c.tokens + tokens,
+                                active=table.c.active + active))
+    return
 
+if not event.contains(meta.Session, 'before_flush', _count_tokens):
+    event.listen(meta.Session, 'before_flush', _count_tokens)
 
 ## for oracle and the SQLAlchemy 0.7 we need a mapping of columns
 ## due to reserved keywords session and timestamp
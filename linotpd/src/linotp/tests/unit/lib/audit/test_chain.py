@@ -0,0 +1,164 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the hash chained audit signatures
+"""
+
+import hmac
+import hashlib
+import unittest
+
+KEY = 'audit checkpoint key'
+
+
+def sign(data):
+    return hmac.new(KEY, data, hashlib.sha256).digest()
+
+
+def verify(data, signature):
+    return hmac.compare_digest(sign(data), signature)
+
+
+class AuditChainTestCase(unittest.TestCase):
+
+    def build(self, count, interval=3, start=1):
+        from linotp.lib.audit.chain import AuditChain
+
+        chain = AuditChain(sign, checkpoint_interval=interval)
+        rows = []
+        for row_id in range(start, start + count):
+            data = "number=%d, action=validate/check" % row_id
+            rows.append([row_id, data, chain.link(row_id, data)])
+        return chain, rows
+
+    def verify(self, rows):
+        from linotp.lib.audit.chain import ChainVerifier
+
+        verifier = ChainVerifier(verify)
+        for row_id, data, value in rows:
+            verifier.add(row_id, data, value)
+        return verifier.result()
+
+    def test_only_checkpoints_are_signed(self):
+        from linotp.lib.audit.chain import parse_signature
+        from linotp.lib.audit.chain import CHECKPOINT, LINK
+
+        chain, rows = self.build(7, interval=3)
+        kinds = [parse_signature(value)[0] for _id, _data, value in rows]
+
+        self.assertEqual(kinds, [CHECKPOINT, LINK, LINK,
+                                 CHECKPOINT, LINK, LINK, CHECKPOINT])
+        self.assertEqual(chain.checkpoints, 3)
+        self.assertEqual(chain.links, 4)
+        # the values fit into the signature column
+        self.assertTrue(max(len(value) for _i, _d, value in rows) < 512)
+
+    def test_verify_range(self):
+        _chain, rows = self.build(8, interval=3)
+
+        res = self.verify(rows)
+        self.assertEqual(res['rows'], 8)
+        self.assertEqual(res['verified'], 7)
+        # the row after the last checkpoint is not yet covered
+        self.assertEqual(res['unanchored'], 1)
+        self.assertEqual(res['failed'], 0)
+
+    def test_modified_row_fails(self):
+        _chain, rows = self.build(7, interval=3)
+        rows[4][1] = rows[4][1].replace('check', 'samlcheck')
+
+        res = self.verify(rows)
+        self.assertEqual(res['failed_ids'], [5, 6, 7])
+        self.assertEqual(res['verified'], 4)
+
+    def test_rehashed_row_fails_at_checkpoint(self):
+        from linotp.lib.audit.chain import chain_hash, parse_signature
+
+        _chain, rows = self.build(7, interval=3)
+        # recompute the hash of the modified row - the link of the next row
+        # and the checkpoint do not match any more
+        (_kind, prev_id, prev_hash, _hash) = parse_signature(rows[4][2])
+        rows[4][1] = rows[4][1].replace('check', 'samlcheck')
+        rows[4][2] = "h:%d:%s:%s" % (prev_id, prev_hash,
+                                     chain_hash(prev_hash, rows[4][1]))
+
+        res = self.verify(rows)
+        self.assertEqual(res['failed_ids'], [5, 6, 7])
+
+    def test_deleted_row_fails(self):
+        _chain, rows = self.build(7, interval=3)
+        del rows[1]
+
+        res = self.verify(rows)
+        self.assertEqual(res['failed_ids'], [3, 4])
+        self.assertEqual(res['verified'], 4)
+
+    def test_interleaved_chains(self):
+        from linotp.lib.audit.chain import AuditChain
+
+        first = AuditChain(sign, checkpoint_interval=2)
+        second = AuditChain(sign, checkpoint_interval=2)
+        rows = []
+        for row_id in range(1, 11):
+            chain = first if row_id % 2 else second
+            data = "number=%d" % row_id
+            rows.append([row_id, data, chain.link(row_id, data)])
+
+        res = self.verify(rows)
+        self.assertEqual(res['failed'], 0)
+        self.assertEqual(res['verified'] + res['unanchored'], 10)
+
+    def test_range_in_the_middle_of_a_chain(self):
+        _chain, rows = self.build(10, interval=3)
+
+        res = self.verify(rows[2:])
+        self.assertEqual(res['failed'], 0)
+        self.assertEqual(res['verified'], 8)
+
+    def test_reset_starts_new_chain(self):
+        from linotp.lib.audit.chain import parse_signature, CHECKPOINT
+
+        chain, rows = self.build(2, interval=3)
+        chain.reset()
+        value = chain.link(4, "number=4")
+
+        self.assertEqual(parse_signature(value)[:2], (CHECKPOINT, 0))
+        res = self.verify(rows + [[4, "number=4", value]])
+        self.assertEqual(res['failed'], 0)
+        # the broken off chain is not covered by a checkpoint any more
+        self.assertEqual(res['verified'], 2)
+        self.assertEqual(res['unanchored'], 1)
+
+    def test_former_row_signatures(self):
+        from linotp.lib.audit.chain import ChainVerifier
+
+        verifier = ChainVerifier(verify,
+                                 verify_row=lambda data, sig: sig == 'ok')
+        verifier.add(1, "number=1", 'ok')
+        verifier.add(2, "number=2", 'bad')
+
+        res = verifier.result()
+        self.assertEqual(res['verified'], 1)
+        self.assertEqual(res['failed_ids'], [2])
@@ -403,3 +403,39 @@ u""""number", "date", "sig_check", "missing_line", "action", "success", "serial"
                          "%r \n\n%r" % (expected_csv, result_csv))
 
         return
+
+    def test_JSONAuditIterator_cursor(self):
+        """
+        Verify that a cursor search returns the cursor of the next page and
+        counts the total only for the first page
+        """
+        from linotp.lib.audit.iterator import (AuditQuery, JSONAuditIterator)
+
+        rows = [{'number': i, 'serial': u'TOK%d' % i} for i in range(2)]
+
+        def search(cursor, rows):
+            param = {'rp': u'2', 'sortname': u'number', 'cursor': cursor}
+            audit = MagicMock(spec=["searchQuery", "getTotal", "getCursor"])
+            audit.searchQuery.return_value = iter(rows)
+            audit.getTotal.return_value = 5
+            audit.getCursor.return_value = 'next'
+            audit_query = AuditQuery(param, audit, columns=['serial'])
+            result = json.loads(''.join(JSONAuditIterator(audit_query)))
+            return (result, audit)
+
+        (result, audit) = search(u'', rows)
+        self.assertEqual(len(result['rows']), 2)
+        self.assertEqual(result['total'], 5)
+        self.assertEqual(result['cursor'], 'next')
+        audit.getCursor.assert_called_once_with(rows[1], rp_dict={
+                                                'rp': u'2',
+                                                'cursor': u'',
+                                                'sortname': u'number',
+                                                'sortorder': None})
+
+        # the last page is shorter than the page size
+        (result, audit) = search(u'former', rows[:1])
+        self.assertEqual(len(result['rows']), 1)
+        self.assertEqual(result['total'], None)
+        self.assertEqual(result['cursor'], None)
+        self.assertFalse(audit.getTotal.called)
@@ -0,0 +1,311 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the rotation of the audit table into time buckets
+"""
+
+import os
+import gzip
+import json
+import shutil
+import datetime
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy import schema, types
+from sqlalchemy import select
+from sqlalchemy.pool import StaticPool
+
+# the indexes of the audit table of the SQLAudit
+INDEXES = [
+    ('timestamp_id', ['timestamp', 'id']),
+    ('serial_id', ['serial', 'id']),
+    ('user_realm_id', ['user', 'realm', 'id']),
+    ('action_id', ['action', 'id']),
+]
+
+
+def audit_table(metadata):
+    table = schema.Table('audit', metadata,
+        schema.Column('id', types.Integer, primary_key=True),
+        schema.Column('timestamp', types.Unicode(30)),
+        schema.Column('signature', types.Unicode(512)),
+        schema.Column('action', types.Unicode(50)),
+        schema.Column('serial', types.Unicode(30)),
+        schema.Column('user', types.Unicode(255)),
+        schema.Column('realm', types.Unicode(255), index=True),
+        schema.Column('log_level', types.Unicode(20), index=True),
+    )
+    for index_name, columns in INDEXES:
+        schema.Index('ix_audit_%s' % index_name,
+                     *[table.c[column] for column in columns])
+    return table
+
+
+class AuditRotationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from linotp.lib.audit.rotation import AuditRotation
+
+        self.archive_dir = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite://', poolclass=StaticPool)
+        self.table = audit_table(schema.MetaData())
+        self.table.create(self.engine)
+
+        self.rotation = AuditRotation(self.engine, self.table,
+                                      period='month', retention_days=30,
+                                      archive_dir=self.archive_dir)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.archive_dir)
+
+    def log(self, day, entries):
+        '''
+        write the entries of a day into the audit table
+        '''
+        self.engine.execute(self.table.insert(), [
+            {'timestamp': u'%s %02d:00:00.000000' % (day, i),
+             'signature': u'sig-%s-%d' % (day, i),
+             'serial': u'TOK%d' % (i % 3)}
+            for i in range(entries)])
+
+    def indexes(self, table_name):
+        return sorted(index['name'] for index in
+                      self.engine.dialect.get_indexes(self.engine.connect(),
+                                                      table_name))
+
+    def ids(self, table):
+        return [row[0] for row in self.engine.execute(
+                        select([table.c.id]).order_by(table.c.id))]
+
+    def test_period_start(self):
+        from linotp.lib.audit.rotation import periodStart
+
+        now = datetime.datetime(2015, 2, 12, 13, 14)
+        self.assertEqual(periodStart(now, 'day'),
+                         datetime.datetime(2015, 2, 12))
+        self.assertEqual(periodStart(now, 'week'),
+                         datetime.datetime(2015, 2, 9))
+        self.assertEqual(periodStart(now, 'month'),
+                         datetime.datetime(2015, 2, 1))
+
+    def test_rotate(self):
+        from linotp.lib.audit.rotation import ID_GAP
+
+        self.log('2015-01-30', 5)
+        self.log('2015-02-01', 3)
+
+        # no entries of a former period
+        now = datetime.datetime(2015, 1, 31)
+        self.assertEqual(self.rotation.rotate(now), None)
+
+        now = datetime.datetime(2015, 2, 3)
+        self.assertEqual(self.rotation.rotate(now), 'audit_20150201')
+        self.assertEqual(self.rotation.getBuckets(), ['audit_20150201'])
+        self.assertEqual(self.rotation.rotate(now), None)
+
+        bucket = self.rotation.getBucketTable('audit_20150201')
+        self.assertEqual(self.ids(bucket), range(1, 9))
+        self.assertEqual(self.ids(self.table), [])
+
+        # the ids of the new audit table continue the ids of the bucket
+        self.log('2015-02-03', 2)
+        self.assertEqual(self.ids(self.table), [8 + ID_GAP, 9 + ID_GAP])
+
+        self.assertEqual(self.indexes('audit'),
+                         ['ix_audit_20150201_action_id',
+                          'ix_audit_20150201_log_level',
+                          'ix_audit_20150201_realm',
+                          'ix_audit_20150201_serial_id',
+                          'ix_audit_20150201_timestamp_id',
+                          'ix_audit_20150201_user_realm_id'])
+
+    def test_rotate_twice(self):
+        self.log('2015-01-30', 2)
+        now = datetime.datetime(2015, 2, 3)
+        self.assertEqual(self.rotation.rotate(now), 'audit_20150201')
+
+        # every index of the former period is kept by its bucket
+        self.log('2015-02-03', 2)
+        now = datetime.datetime(2015, 3, 3)
+        self.assertEqual(self.rotation.rotate(now), 'audit_20150301')
+
+        self.assertEqual(self.rotation.getBuckets(),
+                         ['audit_20150201', 'audit_20150301'])
+        self.assertTrue('ix_audit_realm' in self.indexes('audit_20150201'))
+        self.assertTrue('ix_audit_20150201_realm'
+                        in self.indexes('audit_20150301'))
+        self.assertEqual(len(self.indexes('audit')), len(INDEXES) + 2)
+        self.assertTrue('ix_audit_20150301_realm' in self.indexes('audit'))
+
+    def test_search_buckets(self):
+        from linotp.lib.audit.search import searchTables
+        from linotp.lib.audit.search import getCursor
+
+        self.log('2015-01-30', 5)
+        self.rotation.rotate(datetime.datetime(2015, 2, 3))
+        self.log('2015-02-03', 6)
+        self.rotation.rotate(datetime.datetime(2015, 3, 3))
+        self.log('2015-03-03', 4)
+
+        tables = self.rotation.getTables()
+        self.assertEqual([table.name for table in tables],
+                         ['audit_20150201', 'audit_20150301', 'audit'])
+
+        def search(param, rp_dict):
+            return [(row['serial'], row['timestamp']) for row in
+                    searchTables(self.engine.execute, tables, param,
+                                 rp_dict=rp_dict)]
+
+        rp_dict = {'sortname': 'serial', 'sortorder': 'desc'}
+        expected = search({}, rp_dict)
+        self.assertEqual(len(expected), 15)
+        self.assertEqual(expected, sorted(expected, key=lambda e: e[0],
+                                          reverse=True))
+
+        self.assertEqual(search({}, dict(rp_dict, rp='4', page='2')),
+                         expected[4:8])
+
+        rows = list(searchTables(self.engine.execute, tables, {},
+                                 rp_dict=dict(rp_dict, rp='4', cursor='')))
+        cursor = getCursor(self.table, rows[-1], rp_dict)
+        self.assertEqual(search({}, dict(rp_dict, rp='4', cursor=cursor)),
+                         expected[4:8])
+
+        # only the buckets of the period are searched
+        tables = self.rotation.getTables(date_from=u'2015-02-03 02',
+                                         date_to=u'2015-03-01')
+        self.assertEqual([table.name for table in tables],
+                         ['audit_20150301', 'audit'])
+        self.assertEqual(len(search({'date_from': u'2015-02-03 02',
+                                     'date_to': u'2015-03-01'}, {})), 4)
+
+    def test_search_page_skips_tables(self):
+        from sqlalchemy import event
+        from linotp.lib.audit.search import searchTables
+
+        self.log('2015-01-30', 5)
+        self.rotation.rotate(datetime.datetime(2015, 2, 3))
+        self.log('2015-02-03', 6)
+        self.rotation.rotate(datetime.datetime(2015, 3, 3))
+        self.log('2015-03-03', 4)
+
+        tables = self.rotation.getTables()
+        all_ids = (self.ids(tables[0]) + self.ids(tables[1]) +
+                   self.ids(tables[2]))
+
+        def search(rp_dict):
+            return [row['id'] for row in
+                    searchTables(self.engine.execute, tables, {},
+                                 rp_dict=rp_dict)]
+
+        for sortorder, ids in [('asc', all_ids),
+                               ('desc', list(reversed(all_ids)))]:
+            for page in range(1, 5):
+                rp_dict = {'sortname': 'number', 'sortorder': sortorder,
+                           'rp': '4', 'page': str(page)}
+                self.assertEqual(search(rp_dict),
+                                 ids[4 * (page - 1):4 * page])
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', record)
+        try:
+            rp_dict = {'sortname': 'date', 'sortorder': 'desc',
+                       'rp': '4', 'page': '2'}
+            self.assertEqual(len(search(rp_dict)), 4)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', record)
+
+        # the audit table is skipped by its count, the oldest bucket is
+        # not read at all
+        self.assertEqual(len(statements), 2)
+        self.assertTrue('count' in statements[0])
+        self.assertFalse([s for s in statements if 'audit_20150201' in s])
+
+    def test_expire(self):
+        self.log('2015-01-30', 5)
+        self.rotation.rotate(datetime.datetime(2015, 2, 3))
+        self.log('2015-02-03', 2)
+
+        # the bucket is kept for the retention days
+        self.assertEqual(self.rotation.expire(datetime.datetime(2015, 2, 3)),
+                         [])
+
+        archive_dir = self.rotation.archive_dir
+        self.rotation.archive_dir = None
+        self.assertEqual(self.rotation.expire(datetime.datetime(2015, 3, 3)),
+                         [])
+        self.assertEqual(self.rotation.getBuckets(), ['audit_20150201'])
+
+        self.rotation.archive_dir = archive_dir
+        archives = self.rotation.expire(datetime.datetime(2015, 3, 3))
+        self.assertEqual(archives, [os.path.join(archive_dir,
+                                                 'audit_20150201.jsonl.gz')])
+        self.assertEqual(self.rotation.getBuckets(), [])
+        self.assertEqual(os.listdir(archive_dir),
+                         ['audit_20150201.jsonl.gz'])
+
+        archive = gzip.open(archives[0])
+        try:
+            entries = [json.loads(line) for line in archive]
+        finally:
+            archive.close()
+        self.assertEqual([entry['id'] for entry in entries], range(1, 6))
+        self.assertEqual(entries[0]['signature'], u'sig-2015-01-30-0')
+        self.assertEqual(len(self.ids(self.table)), 2)
+
+    def test_rotation_lock(self):
+        from linotp.lib.audit.rotation import AuditRotation
+
+        other = AuditRotation(self.engine, self.table, period='month',
+                              retention_days=30,
+                              archive_dir=self.archive_dir)
+
+        self.assertTrue(self.rotation.rotation_lock.acquire())
+        self.assertFalse(other.rotation_lock.acquire())
+
+        # the run of the other process is skipped
+        self.log('2015-01-30', 5)
+        other.run(datetime.datetime(2015, 3, 3))
+        self.assertEqual(other.getStats()['skipped'], 1)
+        self.assertEqual(self.rotation.getBuckets(refresh=True), [])
+
+        # an expired lease is taken over, the former owner lost the lock
+        self.rotation.rotation_lock.lease = -1
+        self.assertTrue(self.rotation.rotation_lock.renew())
+        self.assertTrue(other.rotation_lock.acquire())
+        self.assertFalse(self.rotation.rotation_lock.renew())
+        other.rotation_lock.release()
+
+        self.rotation.run(datetime.datetime(2015, 2, 3))
+        self.assertEqual(self.rotation.getStats()['rotated'], 1)
+        self.assertEqual(self.rotation.rotation_lock.owner, None)
+        self.assertTrue(other.rotation_lock.acquire())
@@ -0,0 +1,157 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the conditions and the pagination of the audit search
+"""
+
+import unittest
+
+from mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import schema, types
+from sqlalchemy.pool import StaticPool
+
+metadata = schema.MetaData()
+
+audit_table = schema.Table('audit', metadata,
+    schema.Column('id', types.Integer, primary_key=True),
+    schema.Column('timestamp', types.Unicode(30)),
+    schema.Column('action', types.Unicode(30)),
+    schema.Column('serial', types.Unicode(30)),
+    schema.Column('user', types.Unicode(255)),
+    schema.Column('realm', types.Unicode(255)),
+)
+
+
+class AuditSearchTestCase(unittest.TestCase):
+
+    rows = 50
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://', poolclass=StaticPool)
+        metadata.create_all(self.engine)
+        self.engine.execute(audit_table.insert(), [
+            {'id': i,
+             'timestamp': u'2015-01-01 00:00:%02d.000000' % (i // 3),
+             'action': u'validate/check',
+             'serial': u'TOK_%d' % (i % 7),
+             'user': u'user%d' % (i % 5),
+             'realm': u'realm'}
+            for i in range(1, self.rows + 1)])
+
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.count)
+        self.engine.dispose()
+
+    def count(self, conn, cursor, statement, parameters, *args):
+        self.statements.append((statement, parameters))
+
+    def search(self, param, rp_dict):
+        from linotp.lib.audit.search import searchQuery
+        return [row['id'] for row in searchQuery(self.engine.execute,
+                                                 audit_table, param,
+                                                 rp_dict=rp_dict)]
+
+    def test_exact_match(self):
+        from linotp.lib.audit.search import buildCondition
+
+        condition = buildCondition(audit_table, {'serial': u'TOK1',
+                                                 'user': u'user%',
+                                                 'number': u'12',
+                                                 'unknown': u'x'})
+        sql = str(condition.compile(self.engine))
+        self.assertTrue('audit.serial = ?' in sql)
+        self.assertTrue('audit.user LIKE ?' in sql)
+        self.assertTrue('audit.id = ?' in sql)
+        self.assertEqual(len(condition.clauses), 3)
+
+        # the _ is a LIKE wildcard as well
+        self.assertEqual(self.search({'serial': u'TOK_3'}, {}),
+                         [i for i in range(1, self.rows + 1) if i % 7 == 3])
+        self.assertEqual(self.search({'serial': u'TOK?3'}, {}), [])
+        self.assertEqual(self.search({'number': u'12'}, {}), [12])
+
+    def test_cursor_pages(self):
+        from linotp.lib.audit.search import getCursor
+        from linotp.lib.audit.search import searchQuery
+
+        param = {'user': u'user%'}
+        rp_dict = {'sortname': 'date', 'sortorder': 'desc', 'rp': '7'}
+        expected = self.search(param, dict(rp_dict, rp=str(self.rows)))
+        self.assertEqual(expected, range(self.rows, 0, -1))
+
+        ids = []
+        cursor = ''
+        while cursor is not None:
+            del self.statements[:]
+            rows = list(searchQuery(self.engine.execute, audit_table, param,
+                                    rp_dict=dict(rp_dict, cursor=cursor)))
+            ids.extend([row['id'] for row in rows])
+            cursor = None
+            if len(rows) == 7:
+                cursor = getCursor(audit_table, rows[-1], rp_dict)
+
+            # the page is selected by the timestamp and the id - sqlite
+            # renders the offset 0 anyway
+            self.assertEqual(len(self.statements), 1)
+            (statement, parameters) = self.statements[0]
+            self.assertEqual(parameters[-1], 0)
+            if ids[7:]:
+                self.assertTrue('audit.timestamp < ?' in statement)
+
+        self.assertEqual(ids, expected)
+
+        # the offset pages are the same
+        self.assertEqual(self.search(param, dict(rp_dict, page='3')),
+                         expected[14:21])
+
+    def test_export_in_batches(self):
+        with patch('linotp.lib.audit.search.EXPORT_BATCH', 20):
+            ids = self.search({'realm': u'realm'}, {'sortname': 'user'})
+
+        expected = sorted(range(1, self.rows + 1), key=lambda i: (i % 5, i))
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(self.statements), 3)
+        self.assertTrue(all('LIMIT' in s for (s, _p) in self.statements))
+
+    def test_total(self):
+        from linotp.lib.audit.search import getTotal
+
+        self.assertEqual(getTotal(self.engine.execute, audit_table, {}),
+                         self.rows)
+        self.assertEqual(getTotal(self.engine.execute, audit_table,
+                                  {'user': u'user1', 'serial': u'TOK_1'}),
+                         len([i for i in range(1, self.rows + 1)
+                              if i % 5 == 1 and i % 7 == 1]))
+        self.assertEqual(getTotal(self.engine.execute, audit_table,
+                                  {'user': u'user1', 'serial': u'TOK_1',
+                                   'or': u'true'}, AND=False),
+                         len([i for i in range(1, self.rows + 1)
+                              if i % 5 == 1 or i % 7 == 1]))
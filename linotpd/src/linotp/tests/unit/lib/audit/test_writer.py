@@ -0,0 +1,128 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the asynchronous audit writer
+"""
+
+import os
+import threading
+import unittest
+
+
+class AsyncAuditWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def write_batch(self, entries):
+        self.batches.append(entries)
+
+    def test_entries_are_written_in_batches(self):
+        from linotp.lib.audit.writer import AsyncAuditWriter
+
+        writer = AsyncAuditWriter(self.write_batch, batch_size=10)
+        # fill the queue before the writer thread is started
+        writer.pid = os.getpid()
+        writer.thread = object()
+        for i in range(25):
+            writer.put(i)
+        writer.thread = None
+        writer.pid = None
+
+        writer.start()
+        self.assertTrue(writer.flush(timeout=5))
+        writer.stop()
+
+        self.assertEqual([len(batch) for batch in self.batches], [10, 10, 5])
+        self.assertEqual(sum(self.batches, []), range(25))
+
+        stats = writer.getStats()
+        self.assertEqual(stats['enqueued'], 25)
+        self.assertEqual(stats['written'], 25)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(stats['backlog'], 0)
+        self.assertTrue(stats['latency_max'] >= stats['latency_avg'] > 0)
+
+    def test_overflow_drop(self):
+        from linotp.lib.audit.writer import AsyncAuditWriter
+
+        blocked = threading.Event()
+
+        def write_batch(entries):
+            blocked.wait(5)
+            self.batches.append(entries)
+
+        writer = AsyncAuditWriter(write_batch, queue_size=2, batch_size=1,
+                                  overflow='drop')
+        results = [writer.put(i) for i in range(10)]
+        blocked.set()
+        writer.flush(timeout=5)
+        writer.stop()
+
+        stats = writer.getStats()
+        self.assertTrue(stats['dropped'] > 0)
+        self.assertEqual(results.count(False), stats['dropped'])
+        self.assertEqual(stats['written'] + stats['dropped'], 10)
+
+    def test_overflow_block_timeout(self):
+        from linotp.lib.audit.writer import AsyncAuditWriter
+
+        writer = AsyncAuditWriter(self.write_batch, queue_size=1,
+                                  overflow='block', block_timeout=0.01)
+        # no writer thread takes the entries from the queue
+        writer.pid = os.getpid()
+        writer.thread = object()
+        self.assertTrue(writer.put(1))
+        self.assertFalse(writer.put(2))
+        self.assertEqual(writer.getStats()['dropped'], 1)
+
+    def test_failed_batch_is_counted(self):
+        from linotp.lib.audit.writer import AsyncAuditWriter
+
+        def write_batch(entries):
+            raise Exception('database down')
+
+        writer = AsyncAuditWriter(write_batch)
+        writer.put(1)
+        self.assertTrue(writer.flush(timeout=5))
+        writer.stop()
+        self.assertEqual(writer.getStats()['failed'], 1)
+
+    def test_getAsyncWriter(self):
+        from linotp.lib.audit.writer import getAsyncWriter
+
+        self.assertEqual(getAsyncWriter({}, self.write_batch), None)
+
+        writer = getAsyncWriter({'linotpAudit.async.enable': 'True',
+                                 'linotpAudit.async.overflow': 'Drop',
+                                 'linotpAudit.async.queue_size': '5'},
+                                self.write_batch)
+        self.assertEqual(writer.overflow, 'drop')
+        self.assertEqual(writer.queue.maxsize, 5)
+
+        self.assertRaises(ValueError, getAsyncWriter,
+                          {'linotpAudit.async.enable': 'True',
+                           'linotpAudit.async.overflow': 'ignore'},
+                          self.write_batch)
@@ -0,0 +1,52 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+base of the unit tests, which run on the linotp model in an in memory
+sqlite database
+"""
+
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+
+class DBTestCase(unittest.TestCase):
+    '''
+    sets up the model with the tables of the linotp database - the engine
+    is shared by all threads and connections of the test
+    '''
+
+    def setUp(self):
+        from linotp.model import meta, init_model
+
+        self.meta = meta
+        self.engine = create_engine('sqlite://', poolclass=StaticPool,
+                            connect_args={'check_same_thread': False})
+        init_model(self.engine)
+        meta.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.meta.Session.remove()
@@ -0,0 +1,117 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the key slots of the DefaultSecurityModule
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class DefaultSecurityModuleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from linotp.lib.security import default
+        self.default = default
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.key_file = os.path.join(self.tmp_dir, 'encKey')
+        self._write_keys('a')
+
+    def tearDown(self):
+        with self.default.key_slots_lock:
+            slots = self.default.key_slots.pop(self.key_file, None)
+        if slots is not None:
+            slots.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_keys(self, char):
+        with open(self.key_file, 'w') as f:
+            for slot in range(4):
+                f.write(chr(ord(char) + slot) * 32)
+
+    def _module(self):
+        return self.default.DefaultSecurityModule({'file': self.key_file})
+
+    def test_key_file_is_read_once(self):
+        modules = [self._module() for _i in range(5)]
+
+        for module in modules:
+            self.assertEqual(module.getSecret(0), 'a' * 32)
+            self.assertEqual(module.getSecret(3), 'd' * 32)
+
+        reads = self.default.getKeyFileReads()
+        self.assertEqual(reads[self.key_file], 1)
+
+    def test_zeroed_key_is_a_copy(self):
+        from linotp.lib.crypt import zerome
+
+        module = self._module()
+        # encrypt and decrypt zero the key after the usage - the slots
+        # must not be affected
+        key = module.getSecret(2)
+        zerome(key)
+        self.assertEqual(module.getSecret(2), 'c' * 32)
+        self.assertEqual(self.default.getKeyFileReads()[self.key_file], 1)
+
+    def test_missing_slot(self):
+        module = self._module()
+        self.assertRaises(Exception, module.getSecret, 4)
+
+    def test_reload(self):
+        module = self._module()
+        self.assertEqual(module.getSecret(1), 'b' * 32)
+
+        self._write_keys('k')
+        # without reload the keys are kept
+        self.assertEqual(module.getSecret(1), 'b' * 32)
+
+        reloaded = self.default.reloadKeySlots()
+        self.assertTrue(self.key_file in reloaded)
+        self.assertEqual(module.getSecret(1), 'l' * 32)
+        self.assertEqual(self.default.getKeyFileReads()[self.key_file], 2)
+
+    def test_sighup_reload(self):
+        import signal
+        module = self._module()
+        self.assertEqual(module.getSecret(0), 'a' * 32)
+
+        self._write_keys('m')
+        # the signal might interrupt a thread, which holds the lock of the
+        # key slots - the handler must not wait for it
+        with self.default.key_slots_lock:
+            self.default._sighup(signal.SIGHUP, None)
+        self.assertEqual(self.default.getKeyFileReads()[self.key_file], 1)
+
+        # the keys are reloaded by the next access
+        self.assertEqual(module.getSecret(0), 'm' * 32)
+        self.assertEqual(self.default.getKeyFileReads()[self.key_file], 2)
+        self.assertFalse(self.default.reload_requested.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
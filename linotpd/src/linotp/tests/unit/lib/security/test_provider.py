@@ -0,0 +1,136 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the security module pool of the SecurityProvider
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class HSMPoolTestCase(unittest.TestCase):
+
+    def _pool(self, size=2, timeout=5):
+        from linotp.lib.security.provider import HSMPool
+        entries = [{'obj': 'hsm%d' % i, 'session': 0, 'error': ''}
+                   for i in range(size)]
+        return HSMPool('default', entries, timeout=timeout)
+
+    def test_checkout_and_return(self):
+        pool = self._pool()
+
+        first = pool.acquire('s1')
+        self.assertEqual(first['session'], 's1')
+        # the same session gets the same entry
+        self.assertTrue(pool.acquire('s1') is first)
+
+        second = pool.acquire('s2')
+        self.assertFalse(second is first)
+        self.assertEqual(pool.getStats()['utilisation'], 1.0)
+
+        self.assertTrue(pool.release('s1') is first)
+        self.assertEqual(first['session'], 0)
+        self.assertEqual(pool.release('s1'), None)
+
+        stats = pool.getStats()
+        self.assertEqual((stats['in_use'], stats['max_in_use'],
+                          stats['checkouts']), (1, 2, 2))
+
+    def test_timeout(self):
+        from linotp.lib.error import HSMException
+        pool = self._pool(size=1)
+        pool.acquire('s1')
+
+        start = time.time()
+        self.assertRaises(HSMException, pool.acquire, 's2', 0.1)
+        self.assertTrue(time.time() - start < 2)
+
+        stats = pool.getStats()
+        self.assertEqual((stats['waits'], stats['timeouts']), (1, 1))
+
+    def test_wait_for_returned_entry(self):
+        pool = self._pool(size=1)
+        entry = pool.acquire('s1')
+        result = {}
+
+        def waiting():
+            result['entry'] = pool.acquire('s2')
+
+        thread = threading.Thread(target=waiting)
+        thread.start()
+        time.sleep(0.1)
+        pool.release('s1')
+        thread.join(5)
+
+        self.assertTrue(result.get('entry') is entry)
+        self.assertEqual(entry['session'], 's2')
+        stats = pool.getStats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertTrue(stats['wait_time_max'] > 0)
+
+
+class SecurityProviderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.key_file = os.path.join(self.tmp_dir, 'encKey')
+        with open(self.key_file, 'w') as f:
+            f.write(os.urandom(32 * 4))
+
+    def tearDown(self):
+        from linotp.lib.security import default
+        with default.key_slots_lock:
+            slots = default.key_slots.pop(self.key_file, None)
+        if slots is not None:
+            slots.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_and_drop(self):
+        from linotp.lib.app_globals import RWLock
+        from linotp.lib.security.provider import SecurityProvider
+
+        sep = SecurityProvider(RWLock())
+        sep.load_config({'linotpSecretFile': self.key_file,
+                         'linotpSecurity.default.poolsize': '3',
+                         'linotpSecurity.default.pooltimeout': '1'})
+
+        hsm = sep.getSecurityModule(sessionId='s1')
+        self.assertEqual(hsm['error'], '')
+        self.assertTrue(hsm['obj'].isReady())
+        self.assertTrue(sep.getSecurityModule(sessionId='s1') is hsm)
+
+        stats = sep.getPoolStats()['default']
+        self.assertEqual((stats['size'], stats['in_use']), (3, 1))
+
+        sep.dropSecurityModule(sessionId='s1')
+        self.assertEqual(sep.getPoolStats()['default']['in_use'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
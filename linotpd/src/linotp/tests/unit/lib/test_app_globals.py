@@ -0,0 +1,111 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the copy-on-write config snapshots of linotp.lib.app_globals
+"""
+
+import unittest
+
+from linotp.lib.app_globals import Globals
+
+
+class ConfigSnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.glo = Globals()
+        self.glo.setConfig({'linotp.a': u'1', 'linotp.b': u'2'},
+                           replace=True)
+
+    def test_getConfig_is_shared(self):
+        self.assertTrue(self.glo.getConfig() is self.glo.getConfig())
+        count = self.glo.getConfigSnapshotCount()
+        for _i in range(10):
+            self.glo.getConfig()
+        self.assertEqual(self.glo.getConfigSnapshotCount(), count)
+
+    def test_setConfig_publishes_new_snapshot(self):
+        (version, config) = self.glo.getConfigSnapshot()
+        count = self.glo.getConfigSnapshotCount()
+
+        self.glo.setConfig({'linotp.c': u'3'})
+
+        (new_version, new_config) = self.glo.getConfigSnapshot()
+        self.assertEqual(new_version, version + 1)
+        self.assertEqual(self.glo.getConfigSnapshotCount(), count + 1)
+
+        # the former snapshot is not modified
+        self.assertFalse('linotp.c' in config)
+        self.assertEqual(new_config.get('linotp.c'), u'3')
+        self.assertEqual(new_config.get('linotp.a'), u'1')
+
+    def test_setConfig_replace(self):
+        self.glo.setConfig({'linotp.c': u'3'}, replace=True)
+        self.assertEqual(self.glo.getConfig(), {'linotp.c': u'3'})
+
+    def test_delConfig(self):
+        (version, config) = self.glo.getConfigSnapshot()
+
+        self.glo.delConfig(['linotp.a'])
+        self.assertFalse('linotp.a' in self.glo.getConfig())
+        self.assertTrue('linotp.a' in config)
+
+        self.glo.delConfig('linotp.b')
+        self.assertEqual(self.glo.getConfig(), {})
+        self.assertEqual(self.glo.getConfigVersion(), version + 2)
+
+    def test_policy_set_cache(self):
+        version = self.glo.getConfigVersion()
+        policy_set = object()
+
+        self.glo.setPolicySet(version, policy_set)
+        self.assertTrue(self.glo.getPolicySet(version) is policy_set)
+
+        # the new config version has no policy set yet
+        self.glo.setConfig({'linotp.c': u'3'})
+        new_version = self.glo.getConfigVersion()
+        self.assertEqual(self.glo.getPolicySet(new_version), None)
+
+        # a policy set of an outdated version does not replace the new one
+        new_policy_set = object()
+        self.glo.setPolicySet(new_version, new_policy_set)
+        self.glo.setPolicySet(version, policy_set)
+        self.assertTrue(self.glo.getPolicySet(new_version) is new_policy_set)
+        self.assertEqual(self.glo.getPolicySet(version), None)
+
+    def test_config_reload_stats(self):
+        stats = self.glo.getConfigReloadStats()
+        self.assertEqual(stats['reload_count'], 0)
+
+        self.glo.recordConfigReload(0.5)
+        self.glo.recordConfigReload(0.25)
+
+        stats = self.glo.getConfigReloadStats()
+        self.assertEqual(stats['reload_count'], 2)
+        self.assertEqual(stats['reload_duration'], 0.25)
+        self.assertEqual(stats['reload_duration_total'], 0.75)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the challenge stores and the sweeper of linotp.lib.challenges
+"""
+
+from datetime import datetime
+from datetime import timedelta
+
+from .db_base import DBTestCase
+
+
+class ChallengeStoreTests(object):
+    '''
+    the tests, which are run against every challenge store
+    '''
+
+    def create_store(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        DBTestCase.setUp(self)
+
+        self.store = self.create_store()
+
+    def _add(self, transid, serial, age=0):
+        from linotp.model import Challenge
+
+        challenge = Challenge(transid=transid, tokenserial=serial)
+        challenge.timestamp = datetime.now() - timedelta(seconds=age)
+        self.store.save(challenge)
+        return challenge
+
+    def _transids(self, challenges):
+        return [challenge.transid for challenge in challenges]
+
+    def test_lookup(self):
+        self._add(u'100000000001', u'TOK1')
+        self._add(u'100000000002', u'TOK2')
+        self._add(u'100000000003', u'TOK1')
+        self._add(u'200000000.01', u'TOK1')
+        self._add(u'200000000.02', u'TOK2')
+        self._add(u'2000000001.01', u'TOK3')
+
+        self.assertEqual(self._transids(self.store.lookup(serial=u'TOK1')),
+                         [u'200000000.01', u'100000000003', u'100000000001'])
+        self.assertEqual(self._transids(self.store.lookup(
+                                            transid=u'100000000002')),
+                         [u'100000000002'])
+
+        # the sub transactions of a transaction
+        self.assertEqual(self._transids(self.store.lookup(
+                                            transid=u'200000000',
+                                            exact=False)),
+                         [u'200000000.02', u'200000000.01'])
+        self.assertEqual(self.store.lookup(transid=u'200000000'), [])
+        self.assertEqual(self._transids(self.store.lookup(
+                                            serial=u'TOK2',
+                                            transid=u'200000000',
+                                            exact=False)),
+                         [u'200000000.02'])
+
+        self.assertTrue(self.store.exists(u'100000000003'))
+        self.assertFalse(self.store.exists(u'100000000004'))
+        self.assertEqual(self.store.lookup(), [])
+
+    def test_delete(self):
+        first = self._add(u'100000000001', u'TOK1')
+        self._add(u'100000000002', u'TOK1')
+        other = self._add(u'100000000003', u'TOK2')
+
+        # only the challenges of the token are deleted
+        self.store.delete(u'TOK1', [first.id, other.id])
+        self.meta.Session.flush()
+        self.assertEqual(self._transids(self.store.lookup(serial=u'TOK1')),
+                         [u'100000000002'])
+
+        self.store.delete(u'TOK1')
+        self.meta.Session.flush()
+        self.assertEqual(self.store.lookup(serial=u'TOK1'), [])
+        self.assertTrue(self.store.exists(u'100000000003'))
+
+    def test_sweeper(self):
+        from linotp.lib.challenges import ChallengeSweeper
+
+        for i in range(25):
+            self._add(u'1000000000%02d' % i, u'TOK1', age=7200)
+        self._add(u'200000000000', u'TOK1', age=60)
+        self.meta.Session.commit()
+
+        sweeper = ChallengeSweeper(self.store, ttl=3600, interval=0,
+                                   batch=10)
+        self.assertEqual(sweeper.sweep(), 25)
+        self.assertEqual(sweeper.getStats()['deleted'], 25)
+        self.meta.Session.expire_all()
+        self.assertEqual(self._transids(self.store.lookup(serial=u'TOK1')),
+                         [u'200000000000'])
+
+
+class SQLChallengeStoreTestCase(ChallengeStoreTests, DBTestCase):
+
+    def create_store(self):
+        from linotp.lib.challenges import SQLChallengeStore
+        return SQLChallengeStore()
+
+    def test_lookup_uses_index(self):
+        plan = self.engine.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM challenges "
+                "WHERE tokenserial = 'TOK1' ORDER BY id DESC").fetchall()
+        self.assertTrue('ix_challenges_tokenserial_timestamp'
+                        in " ".join(str(row) for row in plan))
+
+
+class MemoryChallengeStoreTestCase(ChallengeStoreTests, DBTestCase):
+
+    def create_store(self):
+        from linotp.lib.challenges import MemoryChallengeStore
+        return MemoryChallengeStore()
+
+    def test_no_database(self):
+        self._add(u'100000000001', u'TOK1')
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.engine.execute(
+                    "SELECT COUNT(*) FROM challenges").scalar(), 0)
@@ -0,0 +1,108 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the PBKDF2 key derivation of linotp.lib.crypt
+
+The benchmark compares the native PBKDF2 with the pure python
+implementation for the OCRA rollout key derivation:
+
+    python -m pytest -s linotp/tests/unit/lib/test_crypt.py -k benchmark
+"""
+
+import time
+import binascii
+import unittest
+
+from mock import patch
+
+# RFC 6070 and the corresponding SHA256 vectors:
+# (passphrase, salt, iterations, length, digest, key)
+KNOWN_ANSWERS = [
+    ('password', 'salt', 1, 20, 'SHA1',
+     '0c60c80f961f0e71f3a9b524af6012062fe037a6'),
+    ('password', 'salt', 2, 20, 'SHA1',
+     'ea6c014dc72d6f8ccd1ed92ace1d41f0d8de8957'),
+    ('password', 'salt', 4096, 20, 'SHA1',
+     '4b007901b765489abead49d926f721d065a429c1'),
+    ('passwordPASSWORDpassword', 'saltSALTsaltSALTsaltSALTsaltSALTsalt',
+     4096, 25, 'SHA1',
+     '3d2eec4fe41c849b80c8d83662c0e44a8b291a964cf2f07038'),
+    ('password', 'salt', 1, 32, 'SHA256',
+     '120fb6cffcf8b32c43e7225256c4f837a86548c92ccc35480805987cb70be17b'),
+    ('password', 'salt', 4096, 32, 'SHA256',
+     'c5e478d59288c841aa530db6845c4c8d962893a001ce4e11a4963873aa98134a'),
+    ]
+
+SHARED_SECRET = '3132333435363738393031323334353637383930'
+NONCE = ('f9f3d8a5f3b1fea0c3e4e4ed6e8f5e54e4ebb0fd0b0c7e2aebd86c2de71b5a6b'
+         'b46f6dc5fd0c7a5b')
+
+
+class Pbkdf2TestCase(unittest.TestCase):
+
+    def test_known_answers(self):
+        from linotp.lib.crypt import pbkdf2
+
+        for passphrase, salt, iterations, length, digest, key in \
+                KNOWN_ANSWERS:
+            for native in (True, False):
+                derived = pbkdf2(passphrase, salt, length,
+                                 iterations=iterations, digest=digest,
+                                 native=native)
+                self.assertEqual(binascii.hexlify(derived), key,
+                                 (passphrase, iterations, digest, native))
+
+    def _kdf2(self, native, key_len=32, iterations=10000):
+        from linotp.lib import crypt
+
+        acode = crypt.createActivationCode(acode='0123456789abcdefghij')
+        if native:
+            return crypt.kdf2(SHARED_SECRET, NONCE, acode, key_len,
+                              iterations=iterations)
+        with patch('linotp.lib.crypt.pbkdf2_hmac', None):
+            return crypt.kdf2(SHARED_SECRET, NONCE, acode, key_len,
+                              iterations=iterations)
+
+    def test_kdf2_native_and_fallback(self):
+        for key_len in (20, 32, 64):
+            self.assertEqual(self._kdf2(True, key_len, iterations=100),
+                             self._kdf2(False, key_len, iterations=100))
+
+    def test_benchmark(self):
+        timings = {}
+        keys = {}
+        for name, native in [('python', False), ('native', True)]:
+            start = time.time()
+            keys[name] = self._kdf2(native)
+            timings[name] = time.time() - start
+
+        self.assertEqual(keys['python'], keys['native'])
+        print ("\nkdf2 with 10000 iterations: python %.3f s, native %.3f s"
+               % (timings['python'], timings['native']))
+        self.assertTrue(timings['native'] < timings['python'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the otp window evaluation of linotp.lib.HMAC
+
+The microbenchmark compares the batched window evaluation with the former
+evaluation of one counter after the other for the window sizes 10, 100 and
+1000:
+
+    python -m pytest -s linotp/tests/unit/lib/test_hmac.py -k benchmark
+"""
+
+import time
+import binascii
+import unittest
+from hashlib import sha1, sha256
+
+from mock import patch
+
+SECRET = "12345678901234567890"
+
+# RFC 4226 appendix D
+RFC4226_OTPS = ['755224', '287082', '359152', '969429', '338314',
+                '254676', '287922', '162583', '399871', '520489']
+
+
+def decrypt(val, iv):
+    # the secret object holds the hex key instead of the encrypted one -
+    # a copy is returned, as the decrypted key is zeroed after its usage
+    return str(bytearray(val))
+
+
+class HmacOtpTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = patch('linotp.lib.crypt.decrypt', decrypt)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def _hmac_otp(self, counter=0, digits=6, hashfunc=sha1, secret=SECRET):
+        from linotp.lib.crypt import SecretObj
+        from linotp.lib.HMAC import HmacOtp
+
+        secret_obj = SecretObj(binascii.hexlify(secret), '', preserve=False)
+        return HmacOtp(secret_obj, counter, digits, hashfunc)
+
+    def test_generateWindow(self):
+        hmac_otp = self._hmac_otp()
+        self.assertEqual(hmac_otp.generateWindow(0, 10), RFC4226_OTPS)
+
+        hmac_otp = self._hmac_otp(digits=8, hashfunc=sha256)
+        self.assertEqual(hmac_otp.generateWindow(3, 6),
+                         [hmac_otp.generate(c, inc_counter=False)
+                          for c in range(3, 6)])
+
+    def test_checkOtp(self):
+        hmac_otp = self._hmac_otp(counter=2)
+
+        self.assertEqual(hmac_otp.checkOtp(u'969429', 10), 3)
+        self.assertEqual(hmac_otp.checkOtp('520489', 10), 9)
+        # outside of the window
+        self.assertEqual(hmac_otp.checkOtp('287082', 10), -1)
+        self.assertEqual(hmac_otp.checkOtp('520489', 5), -1)
+        self.assertEqual(hmac_otp.checkOtp('12345', 10), -1)
+
+    def test_checkOtp_symetric(self):
+        hmac_otp = self._hmac_otp(counter=5)
+
+        self.assertEqual(hmac_otp.checkOtp('287082', 4, symetric=True), 1)
+        self.assertEqual(hmac_otp.checkOtp('399871', 4, symetric=True), 8)
+        self.assertEqual(hmac_otp.checkOtp('520489', 4, symetric=True), -1)
+        self.assertEqual(hmac_otp.checkOtp('755224', 4, symetric=True), -1)
+
+    def test_benchmark(self):
+
+        def check_by_counter(hmac_otp, otp, window):
+            # the former evaluation: one hmac and key setup per counter
+            for counter in range(hmac_otp.counter,
+                                 hmac_otp.counter + window):
+                if unicode(hmac_otp.generate(counter)) == unicode(otp):
+                    return counter
+            return -1
+
+        for window in (10, 100, 1000):
+            rounds = max(10000 / window, 5)
+            timings = {}
+            for name, check in [('counter', check_by_counter),
+                                ('batched', lambda hmac_otp, otp, window:
+                                            hmac_otp.checkOtp(otp, window))]:
+                start = time.time()
+                for _i in range(rounds):
+                    hmac_otp = self._hmac_otp(counter=1)
+                    self.assertEqual(check(hmac_otp, '000000', window), -1)
+                timings[name] = (time.time() - start) / rounds
+
+            print ("\nwindow %4d: per counter %.3f ms, batched %.3f ms"
+                   % (window, timings['counter'] * 1000,
+                      timings['batched'] * 1000))
+            self.assertTrue(timings['batched'] < timings['counter'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the set based janitors of the ocra challenges in the OcraTokenClass
+"""
+
+from datetime import datetime
+from datetime import timedelta
+
+from mock import patch
+
+from sqlalchemy import event
+
+from .db_base import DBTestCase
+
+
+def config_default(key, default=None):
+    return default
+
+
+@patch('linotp.lib.tokenclass.getFromConfig', side_effect=config_default)
+class OcraJanitorTestCase(DBTestCase):
+
+    def setUp(self):
+        DBTestCase.setUp(self)
+
+    def _add(self, count, serial=u'OCRA01', age=0, received=0, offset=0):
+        from linotp.model import OcraChallenge
+
+        for i in range(count):
+            challenge = OcraChallenge(u'%s%06d' % (serial, offset + i),
+                                      u'challenge', serial, u'data')
+            challenge.timestamp = datetime.now() - timedelta(seconds=age)
+            challenge.received_count = received
+            self.meta.Session.add(challenge)
+        self.meta.Session.commit()
+
+    def _count(self):
+        return self.engine.execute("SELECT COUNT(*) FROM ocra").scalar()
+
+    def test_timeout_janitor(self, _config):
+        from linotp.lib.tokenclass import OcraTokenClass
+
+        self._add(25, age=2 * 86400)
+        self._add(3, serial=u'OCRA02')
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            self.assertEqual(OcraTokenClass.timeoutJanitor(limit=10), 10)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        # one select of the ids and one delete statement
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[1].startswith('DELETE'))
+        self.assertEqual(self._count(), 18)
+
+        self.assertEqual(OcraTokenClass.timeoutJanitor(), 15)
+        self.assertEqual(self._count(), 3)
+
+    def test_max_request_janitor(self, _config):
+        from linotp.lib.tokenclass import OcraTokenClass
+
+        self._add(4, received=3)
+        self._add(2, serial=u'OCRA02', received=1)
+
+        self.assertEqual(OcraTokenClass.maxChallengeRequestJanitor(), 4)
+        self.assertEqual(OcraTokenClass.maxChallengeRequestJanitor(
+                                                    maxRequests=1), 2)
+        self.assertEqual(self._count(), 0)
+
+    def test_request_time_lookup(self, _config):
+        from linotp.lib.tokenclass import OcraTokenClass
+
+        self._add(2, age=2 * 86400)
+        self._add(1, received=5, offset=2)
+        self._add(5, offset=3)
+
+        # only the last challenges of the token are kept and the outdated
+        # challenges are ignored until the janitor removes them
+        challenges = OcraTokenClass.getTransactions4serial(u'OCRA01')
+        self.assertEqual([c.transid for c in challenges],
+                         [u'OCRA01000007', u'OCRA01000006', u'OCRA01000005'])
+        self.meta.Session.commit()
+        self.assertEqual(self._count(), 3)
+
+        self._add(1, age=2 * 86400, offset=8)
+        self.assertEqual(OcraTokenClass.getTransaction(u'OCRA01000008'),
+                         None)
+
+    def test_sweeper(self, _config):
+        from linotp.lib.challenges import ChallengeSweeper
+        from linotp.lib.challenges import MemoryChallengeStore
+        from linotp.lib.tokenclass import OcraTokenClass
+
+        self._add(25, age=2 * 86400)
+        sweeper = ChallengeSweeper(MemoryChallengeStore(), interval=0,
+                                   batch=10, limit=20,
+                                   janitors={'ocra challenges':
+                                             OcraTokenClass.janitor})
+        sweeper.sweep()
+        self.assertEqual(sweeper.getStats()['last_purged'],
+                         {'challenges': 0, 'ocra challenges': 20})
+        sweeper.sweep()
+        self.assertEqual(sweeper.getStats()['purged']['ocra challenges'], 25)
+        self.assertEqual(self._count(), 0)
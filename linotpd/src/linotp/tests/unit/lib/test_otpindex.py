@@ -0,0 +1,228 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the otp lookahead index of linotp.lib.otpindex
+
+The benchmark compares the lookup of an unassigned token by its otp value
+through the index with the former check of every token. The number of
+tokens could be raised by OTPINDEX_BENCHMARK_TOKENS, e.g. to 100000:
+
+    python -m pytest -s linotp/tests/unit/lib/test_otpindex.py -k benchmark
+"""
+
+import os
+import time
+import unittest
+
+from mock import patch
+
+from .db_base import DBTestCase
+
+INDEX_KEY = 'otp index test key'
+
+
+def hotp(secret, counter):
+    from linotp.lib.HMAC import HmacOtp
+    return HmacOtp(digits=6).generate(counter, inc_counter=False, key=secret)
+
+
+class FakeHmacToken(object):
+    '''
+    the parts of the HmacTokenClass, which are used by the index
+    '''
+
+    def __init__(self, token):
+        self.token = token
+        self.type = token.LinOtpTokenType
+        self.secret = str(token.LinOtpTokenSerialnumber)
+
+    def getSerial(self):
+        return self.token.LinOtpTokenSerialnumber
+
+    def get_multi_otp(self, count=0):
+        counter = int(self.token.LinOtpCount)
+        otps = dict((counter + i, hotp(self.secret, counter + i))
+                    for i in range(count))
+        return (True, '', {'type': 'HMAC', 'otp': otps})
+
+    def check_otp_exist(self, otp, window=10):
+        counter = int(self.token.LinOtpCount)
+        for i in range(counter, counter + window):
+            if hotp(self.secret, i) == otp:
+                return i
+        return -1
+
+
+class OtpIndexTestCase(DBTestCase):
+
+    def setUp(self):
+        DBTestCase.setUp(self)
+
+    def _create_tokens(self, count, typ=u'HMAC', prefix=u'OATH'):
+        from linotp.model import Token
+
+        Session = self.meta.Session
+        tokens = []
+        for i in range(count):
+            token = Token(u'%s%06d' % (prefix, i))
+            token.LinOtpTokenType = typ
+            token.LinOtpUserid = u''
+            token.LinOtpCount = 0
+            token.LinOtpCountWindow = 10
+            token.LinOtpOtpLen = 6
+            tokens.append(token)
+        Session.add_all(tokens)
+        Session.flush()
+        return tokens
+
+    def _index(self, tokens, lookahead=20):
+        from linotp.lib.otpindex import indexToken
+        for token in tokens:
+            indexToken(FakeHmacToken(token), lookahead, INDEX_KEY)
+
+    def _candidates(self, otp, window=10):
+        from linotp.lib.otpindex import getOtpCandidates
+        from linotp.lib.token import getTokenQuery
+
+        query = getOtpCandidates(getTokenQuery(u'HMAC', None, '0'),
+                                 [otp], INDEX_KEY, window=window)
+        return sorted(tok.LinOtpTokenSerialnumber for tok in query)
+
+    def test_index_hit(self):
+        tokens = self._create_tokens(5)
+        self._index(tokens)
+
+        otp = hotp('OATH000003', 7)
+        self.assertEqual(self._candidates(otp), [u'OATH000003'])
+        # the window must be covered by the index
+        self.assertEqual(len(self._candidates(otp, window=30)), 5)
+
+    def test_unindexed_tokens_are_candidates(self):
+        tokens = self._create_tokens(5)
+        self._index(tokens[:3])
+
+        otp = hotp('OATH000004', 1)
+        self.assertEqual(self._candidates(otp), [u'OATH000003', u'OATH000004'])
+
+        # a moved counter invalidates the index entries of the token
+        tokens[0].LinOtpCount = 5
+        self.meta.Session.flush()
+        self.assertEqual(self._candidates(otp),
+                         [u'OATH000000', u'OATH000003', u'OATH000004'])
+
+    def test_assigned_token_is_removed(self):
+        from linotp.model import OtpIndex
+
+        tokens = self._create_tokens(2)
+        self._index(tokens)
+        Session = self.meta.Session
+        self.assertEqual(Session.query(OtpIndex).count(), 40)
+
+        tokens[0].LinOtpUserid = u'1000'
+        self._index(tokens[:1])
+        self.assertEqual(Session.query(OtpIndex).count(), 20)
+
+    def test_updateOtpIndex(self):
+        from linotp.model import OtpIndex
+        from linotp.lib.otpindex import updateOtpIndex
+
+        tokens = self._create_tokens(6)
+        self._create_tokens(2, typ=u'spass', prefix=u'SPASS')
+        self._index(tokens[:2])
+        tokens[0].LinOtpUserid = u'1000'
+        self.meta.Session.flush()
+
+        with patch('linotp.lib.otpindex.getIndexKey',
+                   return_value=INDEX_KEY):
+            with patch('linotp.lib.token.createTokenClassObject',
+                       FakeHmacToken):
+                res = updateOtpIndex(lookahead=20, limit=3)
+                self.assertEqual(res, {'removed': 20, 'indexed': 3,
+                                       'pending': 1})
+                res = updateOtpIndex(lookahead=20)
+                self.assertEqual(res, {'removed': 0, 'indexed': 1,
+                                       'pending': 0})
+
+        Session = self.meta.Session
+        self.assertEqual(Session.query(OtpIndex).count(), 5 * 20)
+
+    def test_get_token_by_otp(self):
+        from linotp.lib.token import get_token_by_otp
+
+        tokens = self._create_tokens(4)
+        self._index(tokens)
+
+        config = {'OtpIndex': 'True', 'OtpIndexLookahead': '20'}
+        with patch('linotp.lib.otpindex.getFromConfig', config.get):
+            with patch('linotp.lib.token.getIndexKey',
+                       return_value=INDEX_KEY):
+                with patch('linotp.lib.otpindex.getIndexKey',
+                           return_value=INDEX_KEY):
+                    with patch('linotp.lib.token.createTokenClassObject',
+                               FakeHmacToken):
+                        token = get_token_by_otp(otp=hotp('OATH000002', 3),
+                                                 assigned='0')
+        self.assertEqual(token.getSerial(), u'OATH000002')
+
+    def test_benchmark(self):
+        count = int(os.environ.get('OTPINDEX_BENCHMARK_TOKENS', 2000))
+        window = 10
+
+        tokens = self._create_tokens(count)
+        start = time.time()
+        self._index(tokens)
+        index_duration = time.time() - start
+
+        otp = hotp('OATH%06d' % (count - 1), 5)
+
+        # the former lookup: compute the window of every token
+        from linotp.lib.token import getTokensOfType
+        start = time.time()
+        with patch('linotp.lib.token.createTokenClassObject', FakeHmacToken):
+            found = [tok for tok in getTokensOfType(u'HMAC', None, '0')
+                     if tok.check_otp_exist(otp, window) >= 0]
+        scan_duration = time.time() - start
+
+        start = time.time()
+        candidates = self._candidates(otp, window=window)
+        found_index = [serial for serial in candidates
+                       if FakeHmacToken(self._token(serial))
+                       .check_otp_exist(otp, window) >= 0]
+        index_lookup = time.time() - start
+
+        self.assertEqual([tok.getSerial() for tok in found], found_index)
+        print ("\notp lookup of %d tokens: scan %.3f s, index %.3f s "
+               "(building the index %.3f s)"
+               % (count, scan_duration, index_lookup, index_duration))
+        self.assertTrue(index_lookup < scan_duration)
+
+    def _token(self, serial):
+        from linotp.model import Token
+        return self.meta.Session.query(Token).filter(
+                            Token.LinOtpTokenSerialnumber == serial).one()
+
+
+if __name__ == '__main__':
+    unittest.main()
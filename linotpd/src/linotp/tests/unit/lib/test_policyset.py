@@ -0,0 +1,155 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the compiled policy lookup of linotp.lib.policyset
+"""
+
+import unittest
+
+from linotp.lib.policyset import PolicySet
+
+
+def _policy_config(policies):
+    config = {'linotp.DefaultSyncWindow': '1000'}
+    for name, policy in policies.items():
+        for key, value in policy.items():
+            config['linotp.Policy.%s.%s' % (name, key)] = value
+    return config
+
+
+class PolicySetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = _policy_config({
+            'pin_realm1': {'scope': 'authentication',
+                           'action': 'otppin=1, passthru',
+                           'realm': 'Realm1',
+                           'user': 'hans, resolver1:',
+                           'client': '192.168.0.0/24, -192.168.0.10',
+                           'active': 'True'},
+            'pin_all': {'scope': 'authentication',
+                        'action': 'otppin=2',
+                        'realm': '*',
+                        'user': '*',
+                        'client': '',
+                        'active': 'True'},
+            'admin_all': {'scope': 'admin',
+                          'action': '*',
+                          'realm': 'realm1, realm2',
+                          'user': 'superadmin',
+                          'client': None,
+                          'active': 'True'},
+            'inactive': {'scope': 'authentication',
+                         'action': 'passthru',
+                         'realm': 'realm1',
+                         'user': '*',
+                         'client': '',
+                         'active': 'False'},
+            })
+        self.policy_set = PolicySet(self.config)
+
+    def test_getPolicies(self):
+        policies = self.policy_set.getPolicies()
+        self.assertEqual(len(policies), 4)
+        # the realm is lowered and None becomes an empty string
+        self.assertEqual(policies['pin_realm1']['realm'], 'realm1')
+        self.assertEqual(policies['admin_all']['client'], '')
+
+        # the returned definitions are copies
+        policies['pin_realm1']['active'] = 'False'
+        self.assertEqual(
+            self.policy_set.getPolicies()['pin_realm1']['active'], 'True')
+
+    def test_select_scope_realm_action(self):
+        pols = self.policy_set.select({'scope': 'authentication',
+                                       'realm': 'REALM1'})
+        self.assertEqual(set(pols.keys()), set(['pin_realm1', 'pin_all']))
+
+        pols = self.policy_set.select({'scope': 'authentication',
+                                       'realm': 'realm1',
+                                       'action': 'otppin'})
+        self.assertEqual(set(pols.keys()), set(['pin_realm1', 'pin_all']))
+
+        pols = self.policy_set.select({'scope': 'authentication',
+                                       'action': 'passthru'})
+        self.assertEqual(set(pols.keys()), set(['pin_realm1']))
+
+        pols = self.policy_set.select({'scope': 'admin',
+                                       'action': 'enable'})
+        self.assertEqual(set(pols.keys()), set(['admin_all']))
+
+    def test_select_name_and_inactive(self):
+        pols = self.policy_set.select({'name': 'INACTIVE'})
+        self.assertEqual(pols, {})
+
+        pols = self.policy_set.select({'name': 'INACTIVE'},
+                                      display_inactive=True)
+        self.assertEqual(pols.keys(), ['inactive'])
+
+        pols = self.policy_set.select({})
+        self.assertEqual(len(pols), 3)
+
+    def test_select_user(self):
+        pols = self.policy_set.select({'scope': 'admin',
+                                       'user': 'SuperAdmin'})
+        self.assertEqual(pols.keys(), ['admin_all'])
+
+        pols = self.policy_set.select({'scope': 'admin', 'user': 'other'})
+        self.assertEqual(pols, {})
+
+    def test_select_user_empty_userlist(self):
+        config = _policy_config({'empty': {'scope': 'admin',
+                                           'action': '*',
+                                           'realm': '*',
+                                           'user': '',
+                                           'active': 'True'}})
+        policy_set = PolicySet(config)
+        self.assertRaises(Exception, policy_set.select,
+                          {'scope': 'admin', 'user': 'admin'})
+
+    def test_select_client(self):
+        names = ['pin_realm1', 'pin_all']
+
+        found = self.policy_set.select_client(names, '192.168.0.20')
+        self.assertEqual(found, ['pin_realm1'])
+
+        # the excluded client falls back to the policy without client
+        found = self.policy_set.select_client(names, '192.168.0.10')
+        self.assertEqual(found, ['pin_all'])
+
+        found = self.policy_set.select_client(names, '10.0.0.1')
+        self.assertEqual(found, ['pin_all'])
+
+        found = self.policy_set.select_client(names, None)
+        self.assertEqual(found, ['pin_all'])
+
+    def test_user_and_resolver_lists(self):
+        policy = self.policy_set.get('pin_realm1')
+        self.assertEqual(policy.client_users, ['hans'])
+        self.assertEqual(policy.client_resolvers, ['resolver1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
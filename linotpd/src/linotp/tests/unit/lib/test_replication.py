@@ -0,0 +1,131 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the config change notifiers of linotp.lib.replication
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+from .db_base import DBTestCase
+
+
+class ConfigNotifierTestCase(DBTestCase):
+
+    def setUp(self):
+        DBTestCase.setUp(self)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        DBTestCase.tearDown(self)
+        shutil.rmtree(self.tmp_dir)
+
+    def _set_config_date(self, value):
+        from linotp.model import Config
+        from linotp.lib.replication import markConfigChanged
+        Session = self.meta.Session
+        entry = Session.query(Config).filter(
+                                    Config.Key == u'linotp.Config').first()
+        if entry is None:
+            entry = Config(Key=u'linotp.Config', Value=value)
+        entry.Value = value
+        Session.add(entry)
+        markConfigChanged()
+        Session.commit()
+
+    def test_db_notifier(self):
+        from linotp.lib.replication import DBConfigNotifier
+        notifier = DBConfigNotifier(interval=60)
+        notifier.refresh()
+        self.assertEqual(notifier.config_date, None)
+
+        self._set_config_date(u'2015-01-01 10:00:00')
+        # the change is only seen with the next poll
+        self.assertEqual(notifier.config_date, None)
+        notifier.refresh()
+        self.assertEqual(notifier.config_date, u'2015-01-01 10:00:00')
+        self.assertEqual(notifier.polls, 2)
+
+    def test_file_notifier(self):
+        from linotp.lib.replication import FileConfigNotifier
+        filename = os.path.join(self.tmp_dir, 'config.changed')
+        notifier = FileConfigNotifier(filename, interval=60)
+
+        self._set_config_date(u'2015-01-01 10:00:00')
+        notifier.refresh()
+        self.assertEqual(notifier.config_date, u'2015-01-01 10:00:00')
+
+        # without touching the file the database is not looked at
+        self._set_config_date(u'2015-01-01 11:00:00')
+        notifier._readConfigDate = MagicMock(return_value=u'unexpected')
+        notifier.refresh()
+        self.assertEqual(notifier.config_date, u'2015-01-01 10:00:00')
+        self.assertFalse(notifier._readConfigDate.called)
+
+        del notifier._readConfigDate
+        notifier.notify()
+        notifier.refresh()
+        self.assertEqual(notifier.config_date, u'2015-01-01 11:00:00')
+
+    def test_notify_after_commit(self):
+        from linotp.lib.replication import getConfigNotifier
+        filename = os.path.join(self.tmp_dir, 'config.changed')
+        notifier = getConfigNotifier({
+                        'linotpReplication.notifier': 'file',
+                        'linotpReplication.notify_file': filename})
+
+        with patch('linotp.lib.replication._get_notifier',
+                   return_value=notifier):
+            self._set_config_date(u'2015-01-01 10:00:00')
+            self.assertTrue(os.path.exists(filename))
+            # the own change is seen without waiting for the next poll
+            self.assertEqual(notifier.config_date, u'2015-01-01 10:00:00')
+
+            self._set_config_date(u'2015-01-01 11:00:00')
+            self.assertEqual(notifier.config_date, u'2015-01-01 11:00:00')
+
+    def test_getConfigNotifier(self):
+        from linotp.lib.replication import getConfigNotifier
+        from linotp.lib.replication import DBConfigNotifier
+
+        self.assertEqual(getConfigNotifier({}), None)
+
+        notifier = getConfigNotifier({'linotpReplication.notifier': 'DB',
+                                      'linotpReplication.poll_interval': '2'})
+        self.assertTrue(isinstance(notifier, DBConfigNotifier))
+        self.assertEqual(notifier.interval, 2.0)
+
+        self.assertRaises(Exception, getConfigNotifier,
+                          {'linotpReplication.notifier': 'file'})
+        self.assertRaises(Exception, getConfigNotifier,
+                          {'linotpReplication.notifier': 'socket'})
+
+
+if __name__ == '__main__':
+    unittest.main()
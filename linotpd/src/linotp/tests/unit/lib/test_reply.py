@@ -114,3 +114,32 @@ class TestReplyTestCase(unittest.TestCase):
         self.pylons_request.query_string = 'httperror=555'
         httperror = _get_httperror_from_params(self.pylons_request)
         self.assertEquals(httperror, None)
+
+    def test_csv_result_iterator(self):
+        from linotp.lib.reply import sendCSVResult
+        from linotp.lib.reply import sendCSVResultIterator
+
+        rows = [{'serial': u'T1', 'description': u'first\nline'},
+                {'serial': u'T2', 'description': u'\xe4'}]
+
+        response = MagicMock()
+        response.headers = {}
+        document = sendCSVResult(response, {'data': rows})
+
+        response = MagicMock()
+        response.headers = {}
+        lines = list(sendCSVResultIterator(response, iter(rows)))
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(''.join(lines), document.encode('utf-8'))
+        self.assertTrue('attachment' in
+                        response.headers['Content-disposition'])
+
+    def test_json_lines_iterator(self):
+        import json
+        from linotp.lib.reply import sendJSONLinesIterator
+
+        rows = [{'serial': u'T%d' % i} for i in range(3)]
+        lines = list(sendJSONLinesIterator(MagicMock(), iter(rows)))
+        self.assertEqual([json.loads(line) for line in lines], rows)
+        self.assertTrue(all(line.endswith('\n') for line in lines))
@@ -0,0 +1,114 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the token lookup of linotp.lib.token against an in memory database
+"""
+
+import unittest
+
+from sqlalchemy import event
+
+from .db_base import DBTestCase
+
+RESOLVER_CLASS = u'useridresolver.PasswdIdResolver.IdResolver.myDefRes'
+
+
+class TokenLookupTestCase(DBTestCase):
+
+    def setUp(self):
+        from linotp.model import meta
+        from linotp.model import Token, Realm
+
+        DBTestCase.setUp(self)
+
+        Session = meta.Session
+        realm1 = Realm(u'realm1')
+        realm2 = Realm(u'realm2')
+        Session.add_all([realm1, realm2])
+
+        tokens = [(u'TOK1', RESOLVER_CLASS, [realm1]),
+                  (u'TOK2', RESOLVER_CLASS, [realm1, realm2]),
+                  (u'TOK3', RESOLVER_CLASS.replace('useridresolver.',
+                                                   'useridresolveree.'), []),
+                  (u'TOK4', RESOLVER_CLASS, [realm2]),
+                  (u'TOK5', RESOLVER_CLASS + u'2', [realm1])]
+        for serial, resolver_class, realms in tokens:
+            token = Token(serial)
+            token.LinOtpUserid = u'1000'
+            token.LinOtpIdResolver = u'/etc/passwd'
+            token.LinOtpIdResClass = resolver_class
+            token.setRealms(realms)
+            Session.add(token)
+        Session.commit()
+        Session.remove()
+
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     self._count_statement)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute',
+                     self._count_statement)
+        DBTestCase.tearDown(self)
+
+    def _count_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def test_getTokens4UserId(self):
+        from linotp.lib.token import getTokens4UserId
+
+        tokens = getTokens4UserId(u'1000', RESOLVER_CLASS, u'realm1',
+                                  _class=False)
+        serials = sorted(tok.LinOtpTokenSerialnumber for tok in tokens)
+        self.assertEqual(serials, [u'TOK1', u'TOK2', u'TOK3'])
+
+        tokens = getTokens4UserId(u'1000', RESOLVER_CLASS, u'*',
+                                  _class=False)
+        serials = sorted(tok.LinOtpTokenSerialnumber for tok in tokens)
+        self.assertEqual(serials, [u'TOK1', u'TOK2', u'TOK3', u'TOK4'])
+
+    def test_getTokens4UserId_statement_count(self):
+        from linotp.lib.token import getTokens4UserId
+
+        tokens = getTokens4UserId(u'1000', RESOLVER_CLASS, u'realm2',
+                                  _class=False)
+        realms = [tok.getRealmNames() for tok in tokens]
+
+        self.assertEqual(len(tokens), 3)
+        self.assertEqual(sorted(realms),
+                         [[], [u'realm1', u'realm2'], [u'realm2']])
+        # tokens and their realms are loaded with one statement
+        self.assertEqual(len(self.statements), 1, self.statements)
+
+    def test_getTokens4UserOrSerial_serial(self):
+        from linotp.lib.token import getTokens4UserOrSerial
+
+        tokens = getTokens4UserOrSerial(serial=u'TOK2', _class=False)
+        self.assertEqual(tokens[0].getRealmNames(), [u'realm1', u'realm2'])
+        self.assertEqual(len(self.statements), 1, self.statements)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the maintained token counters, which replace the count of the token
+table for the token numbers
+"""
+
+from sqlalchemy import event
+
+from .db_base import DBTestCase
+
+RESOLVER = u'useridresolver.PasswdIdResolver.IdResolver.myDefRes'
+OTHER = u'useridresolveree.SQLIdResolver.IdResolver.mySQL'
+
+
+class TokenCounterTestCase(DBTestCase):
+
+    def setUp(self):
+        from linotp.model import meta, Realm
+
+        DBTestCase.setUp(self)
+
+        self.realms = {}
+        for name in [u'realm1', u'realm2']:
+            realm = Realm(name)
+            meta.Session.add(realm)
+            self.realms[name] = realm
+        meta.Session.commit()
+
+    def _token(self, serial, resolver=RESOLVER, realms=(u'realm1',),
+               active=True):
+        from linotp.model import Token
+
+        token = Token(serial)
+        token.LinOtpIdResClass = resolver
+        token.LinOtpIsactive = active
+        token.setRealms([self.realms[name] for name in realms])
+        self.meta.Session.add(token)
+        return token
+
+    def _counters(self):
+        from linotp.model import tokencounter_table
+
+        rows = self.engine.execute(tokencounter_table.select()).fetchall()
+        return dict(((row['scope'], row['name']),
+                     (row['tokens'], row['active'])) for row in rows)
+
+    def _assert_reconciled(self):
+        from linotp.lib.tokencounter import countTokens
+        from linotp.lib.tokencounter import reconcile
+
+        # the counters without tokens are removed by the reconcile
+        counters = self._counters()
+        empty = [key for key in counters if counters[key] == (0, 0)]
+        for key in empty:
+            del counters[key]
+
+        self.assertEqual(counters, countTokens(self.engine.connect()))
+        self.assertEqual(reconcile(self.engine), len(empty))
+
+    def test_counters_follow_the_token_changes(self):
+        from linotp.lib.tokencounter import reconcile
+
+        self._token(u'T1')
+        self.meta.Session.commit()
+
+        # the first reconcile creates the counters
+        self.assertEqual(reconcile(self.engine), 3)
+        self.assertEqual(self._counters(), {
+                            (u'all', u'*'): (1, 1),
+                            (u'resolver', RESOLVER): (1, 1),
+                            (u'realm', u'realm1'): (1, 1)})
+
+        token2 = self._token(u'T2', realms=(u'realm1', u'realm2'))
+        token3 = self._token(u'T3', resolver=OTHER, active=False)
+        self.meta.Session.commit()
+        self.assertEqual(self._counters()[(u'all', u'*')], (3, 2))
+        self.assertEqual(self._counters()[(u'realm', u'realm1')], (3, 2))
+
+        # the missing counters are created by the next reconcile
+        self.assertEqual(reconcile(self.engine), 2)
+        self._assert_reconciled()
+
+        # enable, move and reassign on expired tokens
+        token3.LinOtpIsactive = True
+        token2.setRealms([self.realms[u'realm2']])
+        self.meta.Session.commit()
+        token3.LinOtpIdResClass = RESOLVER
+        self.meta.Session.commit()
+        self._assert_reconciled()
+        self.assertEqual(self._counters()[(u'resolver', RESOLVER)], (3, 3))
+
+        # remove the realms and the tokens as in the removeToken
+        token2.setRealms([])
+        self.meta.Session.commit()
+        self.meta.Session.delete(token2)
+        self.meta.Session.delete(token3)
+        self.meta.Session.commit()
+        self._assert_reconciled()
+        self.assertEqual(self._counters()[(u'all', u'*')], (1, 1))
+
+    def test_rollback_reverts_the_counters(self):
+        from linotp.lib.tokencounter import reconcile
+
+        reconcile(self.engine)
+        self._token(u'T1')
+        self.meta.Session.flush()
+        self.meta.Session.rollback()
+        self.assertEqual(self._counters()[(u'all', u'*')], (0, 0))
+
+    def test_reconcile_locks_the_counters_before_the_count(self):
+        from linotp.lib.tokencounter import reconcile
+
+        self._token(u'T1')
+        self.meta.Session.commit()
+        reconcile(self.engine)
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(reconcile(self.engine), 0)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', record)
+
+        self.assertTrue('FROM "TokenCounter"' in statements[0])
+        self.assertTrue('FROM "Token"' in statements[1])
+
+    def test_token_numbers_without_count(self):
+        from linotp.lib.token import getTokenNumResolver
+        from linotp.lib.token import getTokenInRealm
+        from linotp.lib.tokencounter import reconcile
+
+        self._token(u'T1')
+        self._token(u'T2', resolver=OTHER, active=False)
+        self.meta.Session.commit()
+
+        # without the counters the tokens are counted
+        self.assertEqual(getTokenNumResolver(), 1)
+        self.assertEqual(getTokenInRealm(u'realm1', active=False), 2)
+
+        reconcile(self.engine)
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            self.assertEqual(getTokenNumResolver(), 1)
+            self.assertEqual(getTokenNumResolver(active=False), 2)
+            self.assertEqual(getTokenNumResolver(
+                u'useridresolver.SQLIdResolver.IdResolver.mySQL',
+                active=False), 1)
+            self.assertEqual(getTokenInRealm(u'realm1'), 1)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        self.assertEqual(len(statements), 4)
+        self.assertEqual([s for s in statements if 'FROM "Token"' in s], [])
@@ -0,0 +1,209 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the parsed token info and the token info columns of the TokenClass
+
+The benchmark compares the former parsing and dumping of the token info
+json for every token info access with the parsed token info:
+
+    python -m pytest -s linotp/tests/unit/lib/test_tokeninfo.py -k benchmark
+"""
+
+import json
+import time
+
+from mock import patch
+
+from .db_base import DBTestCase
+
+
+class TokenInfoTestCase(DBTestCase):
+
+    def setUp(self):
+        DBTestCase.setUp(self)
+
+    def _create_token(self, info=None, migrated=True):
+        from linotp.model import Token, token_table, TOKEN_INFO_COLUMNS
+
+        Session = self.meta.Session
+        token = Token(u'TOTP0001')
+        token.LinOtpTokenType = u'TOTP'
+        if info is not None:
+            token.setInfo(u'' + json.dumps(info, indent=0))
+        Session.add(token)
+        Session.commit()
+        if not migrated:
+            # the token columns of a token from before the migration
+            columns = dict((column, None)
+                           for column in TOKEN_INFO_COLUMNS.values())
+            self.engine.execute(token_table.update().values(**columns))
+        Session.remove()
+
+    def _load_token(self):
+        from linotp.model import Token
+        from linotp.lib.tokenclass import TokenClass
+
+        token = self.meta.Session.query(Token).filter(
+                        Token.LinOtpTokenSerialnumber == u'TOTP0001').one()
+        return TokenClass(token)
+
+    def test_info_is_parsed_once(self):
+        self._create_token({'timeStep': 30, 'timeWindow': 180,
+                            'timeShift': 0, 'hashlib': 'sha1'})
+        tok = self._load_token()
+
+        with patch('linotp.model.json.loads', side_effect=json.loads) \
+                as loads:
+            for key in ['hashlib', 'timeStep', 'timeWindow', 'timeShift']:
+                tok.getFromTokenInfo(key)
+            tok.addToTokenInfo('timeShift', 60)
+            self.assertEqual(tok.getFromTokenInfo('timeShift'), 60)
+            self.assertEqual(tok.getTokenInfo()['timeStep'], 30)
+
+        self.assertEqual(loads.call_count, 1)
+
+    def test_info_is_stored_on_flush(self):
+        self._create_token({'timeShift': 0})
+        tok = self._load_token()
+
+        with patch('linotp.model.json.dumps', side_effect=json.dumps) \
+                as dumps:
+            tok.addToTokenInfo('timeShift', 30)
+            tok.addToTokenInfo('timeShift', 60)
+            tok.removeFromTokenInfo('hashlib')
+            self.assertEqual(dumps.call_count, 0)
+            self.meta.Session.commit()
+
+        self.assertEqual(dumps.call_count, 1)
+        self.meta.Session.remove()
+
+        tok = self._load_token()
+        self.assertEqual(tok.getTokenInfo(), {'timeShift': 60})
+
+        # a copy of the token info does not change the token
+        info = tok.getTokenInfo()
+        info['timeShift'] = 90
+        self.assertEqual(tok.getFromTokenInfo('timeShift'), 60)
+
+        # the replaced info column is parsed again
+        tok.token.setInfo(u'{"timeShift": 120}')
+        self.assertEqual(tok.getFromTokenInfo('timeShift'), 120)
+
+    def test_new_token_info_view(self):
+        self._create_token({'timeStep': 30})
+        tok = self._load_token()
+
+        # the columns of not set entries do not show up in the info view
+        info = json.loads(tok.token.get_vars()['LinOtp.TokenInfo'])
+        self.assertEqual(info, {'timeStep': 30})
+        self.assertEqual(tok.get_count_auth(), 0)
+        self.assertTrue(tok.check_auth_counter())
+
+        tok.set_count_auth_max(3)
+        self.meta.Session.commit()
+        self.meta.Session.remove()
+
+        tok = self._load_token()
+        info = json.loads(tok.token.get_vars()['LinOtp.TokenInfo'])
+        self.assertEqual(info, {'timeStep': 30, 'count_auth_max': 3})
+
+    def test_counters_in_columns(self):
+        self._create_token({'count_auth': 4, 'count_auth_max': 5,
+                            'validity_period_end': '01/01/37 00:00',
+                            'timeStep': 30}, migrated=False)
+        tok = self._load_token()
+
+        # not migrated tokens keep their token info entries
+        self.assertEqual(tok.get_count_auth(), 4)
+        self.assertEqual(tok.get_count_auth_max(), 5)
+        self.assertEqual(tok.get_validity_period_end(), '01/01/37 00:00')
+        self.assertTrue(tok.check_auth_counter())
+
+        self.assertEqual(tok.inc_count_auth(), 5)
+        self.assertFalse(tok.check_auth_counter())
+        tok.set_validity_period_start('01/01/15 12:30')
+        self.meta.Session.commit()
+        self.meta.Session.remove()
+
+        tok = self._load_token()
+        self.assertEqual(tok.token.LinOtpCountAuth, 5)
+        self.assertEqual(tok.get_validity_period_start(), '01/01/15 12:30')
+        self.assertTrue(tok.check_validity_period())
+        self.assertFalse('count_auth' in tok.getTokenInfo())
+
+        # the token info view still contains all entries
+        info = json.loads(tok.token.get_vars()['LinOtp.TokenInfo'])
+        self.assertEqual(info['count_auth'], 5)
+        self.assertEqual(info['count_auth_max'], 5)
+        self.assertFalse('count_auth_success' in info)
+        self.assertEqual(info['validity_period_start'], '01/01/15 12:30')
+        self.assertEqual(info['validity_period_end'], '01/01/37 00:00')
+        self.assertEqual(info['timeStep'], 30)
+
+        tok.set_validity_period_end('01/01/15 12:31')
+        self.assertFalse(tok.check_validity_period())
+
+    def test_benchmark(self):
+        rounds = 2000
+        keys = ['hashlib', 'timeStep', 'timeWindow', 'timeShift']
+        self._create_token({'timeStep': 30, 'timeWindow': 180,
+                            'timeShift': 0, 'hashlib': 'sha1',
+                            'count_auth': 0, 'count_auth_success': 0,
+                            'count_auth_max': 0,
+                            'count_auth_success_max': 0})
+        tok = self._load_token()
+        token = tok.token
+
+        def former_validation():
+            # json parsing for every access and dumping for every change
+            for key in keys:
+                json.loads(token.LinOtpTokenInfo).get(key)
+            for key in ['count_auth', 'count_auth_success']:
+                info = json.loads(token.LinOtpTokenInfo)
+                info[key] = int(info.get(key, 0)) + 1
+                token.LinOtpTokenInfo = u'' + json.dumps(info, indent=0)
+            for key in ['count_auth_max', 'count_auth_success_max']:
+                json.loads(token.LinOtpTokenInfo).get(key)
+
+        def validation():
+            for key in keys:
+                tok.getFromTokenInfo(key)
+            tok.inc_count_auth()
+            tok.inc_count_auth_success()
+            tok.check_auth_counter()
+            token.storeInfo()
+
+        timings = {}
+        for name, run in [('former', former_validation),
+                          ('parsed', validation)]:
+            start = time.time()
+            for _i in range(rounds):
+                run()
+            timings[name] = (time.time() - start) / rounds
+
+        print ("\nToken info access per validation: former %.3f ms, "
+               "parsed %.3f ms" % (timings['former'] * 1000,
+                                   timings['parsed'] * 1000))
+        self.assertTrue(timings['parsed'] < timings['former'])
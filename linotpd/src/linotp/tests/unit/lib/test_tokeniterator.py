@@ -0,0 +1,225 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the keyset pagination, the approximate token number and the batched
+owner resolution of the TokenIterator
+"""
+
+from mock import patch
+
+from sqlalchemy import event
+
+from .db_base import DBTestCase
+
+RESOLVER = u'useridresolver.PasswdIdResolver.IdResolver.myDefRes'
+
+
+def config_default(key, default=None):
+    return default
+
+
+def user_infos(users):
+    return dict(((userid, resolverC), {'username': u'user%s' % userid})
+                for (userid, _resolver, resolverC) in users)
+
+
+@patch('linotp.lib.tokeniterator.getFromConfig', side_effect=config_default)
+@patch('linotp.lib.tokeniterator.getRealms', return_value={})
+class TokenIteratorTestCase(DBTestCase):
+
+    tokens = 23
+
+    def setUp(self):
+        from linotp.model import meta, Token
+
+        DBTestCase.setUp(self)
+
+        for i in range(self.tokens):
+            token = Token(u'TOK%03d' % i)
+            # some descriptions are equal and some are not set
+            if i % 5:
+                token.LinOtpTokenDesc = u'desc %d' % (i % 4)
+            else:
+                token.LinOtpTokenDesc = None
+            token.LinOtpUserid = u'%d' % (i % 7)
+            token.LinOtpIdResolver = u'myDefRes'
+            token.LinOtpIdResClass = RESOLVER
+            meta.Session.add(token)
+        meta.Session.commit()
+
+    def _pages(self, sortdir=None, keyset=True, params=None):
+        from linotp.lib.tokeniterator import TokenIterator
+        from linotp.lib.user import User
+
+        serials = []
+        cursor = None
+        for page in range(1, 5):
+            request_params = dict(params or {})
+            if keyset and cursor:
+                request_params['cursor'] = cursor
+            toks = TokenIterator(User('', '', ''), None, page=page, psize=10,
+                                 sortdir=sortdir, filterRealm=['*'],
+                                 params=request_params)
+            serials.extend([tok['LinOtp.TokenSerialnumber'] for tok in toks])
+            cursor = toks.getResultSetInfo()['cursor']
+            if cursor is None:
+                break
+        return serials
+
+    def test_keyset_pages(self, _realms, _config):
+        with patch('linotp.lib.tokeniterator.getUserInfos',
+                   side_effect=user_infos):
+            for sortdir in ['asc', 'desc']:
+                by_offset = self._pages(sortdir, keyset=False)
+                by_cursor = self._pages(sortdir)
+                self.assertEqual(len(set(by_cursor)), self.tokens)
+                self.assertEqual(by_cursor, by_offset)
+
+    def test_keyset_query(self, _realms, _config):
+        from linotp.lib.tokeniterator import TokenIterator
+        from linotp.lib.user import User
+
+        with patch('linotp.lib.tokeniterator.getUserInfos',
+                   side_effect=user_infos):
+            first = TokenIterator(User('', '', ''), None, page=1, psize=10,
+                                  filterRealm=['*'])
+            list(first)
+
+            statements = []
+
+            def count(conn, cursor, statement, parameters, *args):
+                statements.append((statement, parameters))
+
+            event.listen(self.engine, 'before_cursor_execute', count)
+            try:
+                TokenIterator(User('', '', ''), None, page=2, psize=10,
+                              filterRealm=['*'],
+                              params={'cursor': first.cursor})
+            finally:
+                event.remove(self.engine, 'before_cursor_execute', count)
+
+        # the page starts after the last token instead of an offset
+        page_queries = [(statement, parameters)
+                        for (statement, parameters) in statements
+                        if 'LIMIT' in statement]
+        self.assertEqual(len(page_queries), 1)
+        (statement, parameters) = page_queries[0]
+        self.assertTrue('"Token"."LinOtpTokenId" >' in statement)
+        self.assertEqual(parameters[-1], 0)
+
+    def test_owners_are_resolved_per_page(self, _realms, _config):
+        from linotp.lib.tokeniterator import TokenIterator
+        from linotp.lib.user import User
+
+        with patch('linotp.lib.tokeniterator.getUserInfos',
+                   side_effect=user_infos) as infos:
+            with patch('linotp.lib.tokeniterator.getUserInfo') as info:
+                toks = TokenIterator(User('', '', ''), None, page=1,
+                                     psize=15, filterRealm=['*'])
+                names = [tok['User.username'] for tok in toks]
+
+        self.assertEqual(infos.call_count, 1)
+        self.assertEqual(info.call_count, 0)
+        self.assertEqual(len(infos.call_args[0][0]), 15)
+        self.assertTrue(u'user0' in names)
+
+    def test_approximate_count(self, _realms, _config):
+        from linotp.model import Token
+        from linotp.lib.tokencounter import reconcile
+        from linotp.lib.tokeniterator import TokenIterator
+        from linotp.lib.user import User
+
+        reconcile(self.engine)
+        # the counter differs until the next reconcile
+        self.engine.execute("UPDATE TokenCounter SET tokens = 1000")
+
+        with patch('linotp.lib.tokeniterator.getUserInfos',
+                   side_effect=user_infos):
+            exact = TokenIterator(User('', '', ''), None, page=1, psize=10,
+                                  filterRealm=['*'])
+            approx = TokenIterator(User('', '', ''), None, page=1, psize=10,
+                                   filterRealm=['*'],
+                                   params={'count': 'approx'})
+
+            # other filters use the count cache
+            filtered = [TokenIterator(User('', '', ''), None, page=1,
+                                      psize=10, filter=u'desc 1',
+                                      filterRealm=['*'],
+                                      params={'count': 'approx'})
+                        for _i in range(2)]
+            self.meta.Session.delete(self.meta.Session.query(Token)
+                                     .filter_by(LinOtpTokenDesc=u'desc 1')
+                                     .first())
+            self.meta.Session.commit()
+            cached = TokenIterator(User('', '', ''), None, page=1, psize=10,
+                                   filter=u'desc 1', filterRealm=['*'],
+                                   params={'count': 'approx'})
+
+        self.assertEqual(exact.getResultSetInfo()['tokens'], self.tokens)
+        self.assertEqual(approx.getResultSetInfo()['tokens'], 1000)
+        self.assertEqual(approx.getResultSetInfo()['pages'], 100)
+        self.assertEqual(filtered[1].tokens, filtered[0].tokens)
+        self.assertEqual(cached.tokens, filtered[0].tokens)
+
+    def test_stream_all_tokens(self, _realms, _config):
+        from linotp.lib.tokeniterator import TokenIterator
+        from linotp.lib.user import User
+
+        expected = [tok['LinOtp.TokenSerialnumber'] for tok in
+                    TokenIterator(User('', '', ''), None, sort='TokenId',
+                                  filterRealm=['*'])]
+        self.meta.Session.remove()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            with patch('linotp.lib.tokeniterator.STREAM_BATCH', 5):
+                with patch('linotp.lib.tokeniterator.OWNER_BATCH', 5):
+                    with patch('linotp.lib.tokeniterator.getUserInfos',
+                               side_effect=user_infos) as infos:
+                        toks = TokenIterator(User('', '', ''), None,
+                                             sort='TokenId',
+                                             filterRealm=['*'])
+                        serials = [tok['LinOtp.TokenSerialnumber']
+                                   for tok in toks]
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        self.assertEqual(serials, [u'TOK%03d' % i
+                                   for i in range(self.tokens)])
+        self.assertEqual(serials, expected)
+
+        # the tokens are read, their realms loaded and owners resolved in
+        # batches of 5 tokens
+        batches = (self.tokens + 4) // 5
+        selects = [s for s in statements if 'FROM "Token"' in s]
+        self.assertEqual(len([s for s in selects if 'LIMIT' in s]), batches)
+        self.assertEqual(len([s for s in statements
+                              if 'FROM "TokenRealm"' in s]), batches)
+        self.assertEqual(infos.call_count, batches)
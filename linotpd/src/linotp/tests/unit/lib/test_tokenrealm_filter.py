@@ -0,0 +1,170 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the realm filter of the TokenIterator, which selects the tokens of the
+realms in the database instead of loading all token ids of the realms
+
+The benchmark compares the former filter - load the token ids and query
+them with an IN list - with the sub query on a synthetic token table with
+50 realms. The number of tokens could be raised to the size of a large
+installation:
+
+    TOKENREALM_BENCHMARK_TOKENS=1000000 \
+        python -m pytest -s linotp/tests/unit/lib/test_tokenrealm_filter.py
+"""
+
+import os
+import time
+
+from mock import patch
+
+from sqlalchemy import event
+
+from .db_base import DBTestCase
+
+REALMS = 50
+
+
+def config_default(key, default=None):
+    return default
+
+
+def no_owners(users):
+    return {}
+
+
+@patch('linotp.lib.tokeniterator.getUserInfos', side_effect=no_owners)
+@patch('linotp.lib.tokeniterator.getFromConfig', side_effect=config_default)
+class TokenRealmFilterTestCase(DBTestCase):
+
+    tokens = 1000
+
+    def setUp(self):
+        from linotp.model import token_table, realm_table, tokenrealm_table
+
+        DBTestCase.setUp(self)
+
+        self.realms = dict((u'realm%d' % i, {}) for i in range(REALMS))
+        self.engine.execute(realm_table.insert(),
+                            [{'id': i + 1, 'name': u'realm%d' % i}
+                             for i in range(REALMS)])
+
+        # every token is in one realm - every 20th token is in no realm
+        batch = 10000
+        for start in range(0, self.tokens, batch):
+            ids = range(start + 1, min(start + batch, self.tokens) + 1)
+            self.engine.execute(token_table.insert(),
+                    [{'LinOtpTokenId': i,
+                      'LinOtpTokenSerialnumber': u'TOK%08d' % i,
+                      'LinOtpTokenDesc': u'token %d' % i} for i in ids])
+            self.engine.execute(tokenrealm_table.insert(),
+                    [{'token_id': i, 'realm_id': i % REALMS + 1}
+                     for i in ids if i % 20])
+
+    def _list(self, filterRealm, page=None):
+        from linotp.lib.tokeniterator import TokenIterator
+        from linotp.lib.user import User
+
+        with patch('linotp.lib.tokeniterator.getRealms',
+                   return_value=self.realms):
+            toks = TokenIterator(User('', '', ''), None, page=page,
+                                 psize=20, sort='TokenId',
+                                 filterRealm=filterRealm)
+            serials = [tok['LinOtp.TokenSerialnumber'] for tok in toks]
+        return (toks.tokens, serials)
+
+    def test_realm_filter(self, _config, _owners):
+        expected = [u'TOK%08d' % i for i in range(1, self.tokens + 1)
+                    if i % 20 and i % REALMS + 1 in (3, 5)]
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, *args):
+            if 'FROM "Token"' in statement:
+                statements.append(parameters)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            (tokens, serials) = self._list([u'realm2', u'realm4'])
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        self.assertEqual(tokens, len(expected))
+        self.assertEqual(serials, expected)
+        # the token ids are not passed as parameters of the token query
+        self.assertTrue(max([len(p) for p in statements]) < 10)
+
+        (tokens, serials) = self._list([u'realm2'], page=2)
+        self.assertEqual(serials, [s for s in expected
+                                   if int(s[3:]) % REALMS == 2][20:40])
+
+    def test_no_realm_filter(self, _config, _owners):
+        expected = [u'TOK%08d' % i for i in range(1, self.tokens + 1)
+                    if i % 20 == 0]
+        (tokens, serials) = self._list([u'/:no realm:/'])
+        self.assertEqual(tokens, len(expected))
+        self.assertEqual(serials, expected)
+
+    def test_benchmark(self, _config, _owners):
+        from linotp.model import Token, Realm, TokenRealm
+
+        self.tearDown()
+        self.tokens = int(os.environ.get('TOKENREALM_BENCHMARK_TOKENS',
+                                         20000))
+        start = time.time()
+        self.setUp()
+        setup = time.time() - start
+
+        Session = self.meta.Session
+        realm = u'realm7'
+
+        def id_list_filter():
+            # the former filter: all token ids of the realm as IN list
+            realm_ids = set([r[0] for r in Session.query(Realm.id)
+                             .filter(Realm.name.in_([realm])).all()])
+            token_ids = set([t[0] for t in Session.query(TokenRealm.token_id)
+                             .filter(TokenRealm.realm_id.in_(realm_ids))
+                             .all()])
+            query = Session.query(Token).filter(
+                                    Token.LinOtpTokenId.in_(token_ids))
+            serials = [tok.LinOtpTokenSerialnumber for tok in
+                       query.order_by(Token.LinOtpTokenId).slice(0, 20)]
+            return (query.count(), serials)
+
+        timings = {}
+        results = {}
+        for name, list_tokens in [
+                ('id list', id_list_filter),
+                ('sub query', lambda: self._list([realm], page=1))]:
+            list_tokens()
+            start = time.time()
+            results[name] = list_tokens()
+            timings[name] = time.time() - start
+
+        self.assertEqual(results['sub query'], results['id list'])
+        print ("\nrealm filter on %d tokens (setup %.1f s): id list %.1f ms, "
+               "sub query %.1f ms" % (self.tokens, setup,
+                                      timings['id list'] * 1000,
+                                      timings['sub query'] * 1000))
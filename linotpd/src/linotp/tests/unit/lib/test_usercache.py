@@ -0,0 +1,191 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the process wide user resolution cache of linotp.lib.usercache
+"""
+
+import unittest
+
+from mock import MagicMock, patch
+
+
+class FakeConfig(dict):
+    version = None
+
+
+class UserCacheTestCase(unittest.TestCase):
+
+    def test_positive_and_negative_entries(self):
+        from linotp.lib.usercache import UserCache
+
+        cache = UserCache(ttl=300, negative_ttl=30)
+        self.assertEqual(cache.get('realm', 'reso', 'hans'), (False, None))
+
+        cache.set('realm', 'reso', 'hans', (u'1000', u'reso_id'))
+        cache.set('realm', 'reso', 'nobody', None)
+
+        self.assertEqual(cache.get('realm', 'reso', 'hans'),
+                         (True, (u'1000', u'reso_id')))
+        self.assertEqual(cache.get('realm', 'reso', 'nobody'), (True, None))
+        self.assertEqual(cache.get('other', 'reso', 'hans'), (False, None))
+
+        stats = cache.getStats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['negative_hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_expiry(self):
+        from linotp.lib.usercache import UserCache
+
+        cache = UserCache(ttl=300, negative_ttl=30)
+        with patch('linotp.lib.usercache.time') as mock_time:
+            mock_time.time.return_value = 1000.0
+            cache.set('realm', 'reso', 'hans', (u'1000', u'reso_id'))
+            cache.set('realm', 'reso', 'nobody', None)
+
+            # the negative entry expires first
+            mock_time.time.return_value = 1031.0
+            self.assertEqual(cache.get('realm', 'reso', 'nobody')[0], False)
+            self.assertEqual(cache.get('realm', 'reso', 'hans')[0], True)
+
+            mock_time.time.return_value = 1301.0
+            self.assertEqual(cache.get('realm', 'reso', 'hans')[0], False)
+        self.assertEqual(cache.getStats()['entries'], 0)
+
+    def test_lru_eviction(self):
+        from linotp.lib.usercache import UserCache
+
+        cache = UserCache(size=2)
+        cache.set('realm', 'reso', 'a', (u'1', u'r'))
+        cache.set('realm', 'reso', 'b', (u'2', u'r'))
+
+        # touch 'a', so that 'b' is the least recently used entry
+        cache.get('realm', 'reso', 'a')
+        cache.set('realm', 'reso', 'c', (u'3', u'r'))
+
+        self.assertEqual(cache.get('realm', 'reso', 'a')[0], True)
+        self.assertEqual(cache.get('realm', 'reso', 'b')[0], False)
+        self.assertEqual(cache.get('realm', 'reso', 'c')[0], True)
+        self.assertEqual(cache.getStats()['evictions'], 1)
+
+    def test_sync_on_resolver_change(self):
+        from linotp.lib.usercache import UserCache
+
+        config = FakeConfig({
+            'linotp.passwdresolver.fileName.myreso': u'/etc/passwd',
+            'linotp.useridresolver.group.myrealm':
+                        u'useridresolver.PasswdIdResolver.IdResolver.myreso',
+            'linotp.DefaultRealm': u'myrealm',
+            'linotp.DefaultSyncWindow': u'1000',
+            })
+        config.version = 1
+
+        cache = UserCache()
+        cache.sync(config)
+        cache.set('myrealm', 'reso', 'hans', (u'1000', u'r'))
+
+        # a change of some other entry keeps the cache
+        config = FakeConfig(config)
+        config['linotp.DefaultSyncWindow'] = u'100'
+        config.version = 2
+        cache.sync(config)
+        self.assertEqual(cache.get('myrealm', 'reso', 'hans')[0], True)
+
+        for key, value in [
+                ('linotp.passwdresolver.fileName.myreso', u'/etc/other'),
+                ('linotp.useridresolver.group.myrealm', u''),
+                ('linotp.DefaultRealm', u'other'), ]:
+            cache.set('myrealm', 'reso', 'hans', (u'1000', u'r'))
+
+            config = FakeConfig(config)
+            config[key] = value
+            config.version = None
+            cache.sync(config)
+            self.assertEqual(cache.get('myrealm', 'reso', 'hans')[0], False,
+                             key)
+
+        self.assertEqual(cache.getStats()['invalidations'], 3)
+
+    def test_getUserCache(self):
+        from linotp.lib.usercache import getUserCache
+
+        cache = getUserCache({'linotpUserCache.ttl': '60',
+                              'linotpUserCache.size': '10'})
+        self.assertEqual(cache.ttl, 60.0)
+        self.assertEqual(cache.negative_ttl, 30.0)
+        self.assertEqual(cache.size, 10)
+
+        self.assertEqual(getUserCache({'linotpUserCache.enable': 'False'}),
+                         None)
+
+
+class LookupUserIdTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from linotp.lib.usercache import UserCache
+
+        self.cache = UserCache()
+        glo = MagicMock()
+        glo.getUserCache.return_value = self.cache
+
+        self.resolver = MagicMock()
+        self.resolver.getUserId.side_effect = \
+                        lambda login: {'hans': u'1000'}.get(login, '')
+        self.resolver.getResolverId.return_value = u'reso_id'
+
+        config = FakeConfig()
+        config.version = 1
+
+        patches = [
+            patch('linotp.lib.user.getGlobalObject', return_value=glo),
+            patch('linotp.lib.user.getResolverObject',
+                  return_value=self.resolver),
+            patch('linotp.lib.user.getLinotpConfig', return_value=config),
+            ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_repeated_lookup_uses_cache(self):
+        from linotp.lib.user import lookupUserId
+
+        for _i in range(5):
+            self.assertEqual(lookupUserId('realm', 'reso', 'hans'),
+                             (u'1000', u'reso_id'))
+            self.assertEqual(lookupUserId('realm', 'reso', 'nobody'),
+                             (None, None))
+
+        self.assertEqual(self.resolver.getUserId.call_count, 2)
+        stats = self.cache.getStats()
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['negative_hits'], 4)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_resolver_errors_are_not_cached(self):
+        from linotp.lib.user import lookupUserId
+
+        self.resolver.getUserId.side_effect = Exception('server down')
+        self.assertRaises(Exception, lookupUserId, 'realm', 'reso', 'hans')
+        self.assertEqual(self.cache.getStats()['entries'], 0)
@@ -0,0 +1,144 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the single statement update of the token counters after a successful
+otp validation by TokenClass.commitValidation
+"""
+
+import json
+
+from mock import patch
+
+from sqlalchemy import event
+
+from .db_base import DBTestCase
+
+
+@patch('linotp.lib.tokenclass.getFromConfig', return_value='True')
+class CommitValidationTestCase(DBTestCase):
+
+    def setUp(self):
+        from linotp.model import meta, Token
+
+        DBTestCase.setUp(self)
+
+        token = Token(u'OATH0001')
+        token.LinOtpTokenType = u'HMAC'
+        token.LinOtpCount = 5
+        token.LinOtpFailCount = 3
+        meta.Session.add(token)
+        meta.Session.commit()
+        meta.Session.remove()
+
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     self._count_statement)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute',
+                     self._count_statement)
+        DBTestCase.tearDown(self)
+
+    def _count_statement(self, conn, cursor, statement, *args):
+        if not statement.startswith('SELECT'):
+            self.statements.append(statement)
+
+    def _load_token(self):
+        from linotp.model import Token
+        from linotp.lib.tokenclass import TokenClass
+
+        token = self.meta.Session.query(Token).filter(
+                        Token.LinOtpTokenSerialnumber == u'OATH0001').one()
+        return TokenClass(token)
+
+    def _stored(self, column):
+        from linotp.model import token_table
+
+        return self.engine.execute(
+                    token_table.select()).first()[column]
+
+    def test_one_statement(self, _config):
+        tok = self._load_token()
+
+        self.assertEqual(tok.commitValidation(7), 8)
+        self.assertEqual(len(self.statements), 1)
+        self.assertTrue(self.statements[0].startswith('UPDATE'))
+
+        # the token object is up to date without a further update
+        self.assertEqual(tok.token.LinOtpCount, 8)
+        self.assertEqual(tok.get_count_auth(), 1)
+        self.assertEqual(tok.get_count_auth_success(), 1)
+        self.assertEqual(tok.getFailCount(), 0)
+        self.meta.Session.commit()
+        self.assertEqual(len(self.statements), 1)
+
+        self.assertEqual(self._stored('LinOtpCount'), 8)
+        self.assertEqual(self._stored('LinOtpCountAuth'), 1)
+        self.assertEqual(self._stored('LinOtpFailCount'), 0)
+
+    def test_concurrent_replay(self, _config):
+        from linotp.model import token_table
+
+        tok = self._load_token()
+
+        # an other request has used the otp with counter 7 meanwhile
+        self.meta.Session.execute(token_table.update().values(
+                                                LinOtpCount=8,
+                                                LinOtpCountAuth=1))
+
+        self.assertEqual(tok.commitValidation(7), -1)
+        self.meta.Session.commit()
+        self.assertEqual(self._stored('LinOtpCount'), 8)
+        self.assertEqual(self._stored('LinOtpCountAuth'), 1)
+
+        # a later otp is still accepted
+        tok = self._load_token()
+        self.assertEqual(tok.commitValidation(9), 10)
+
+    def test_static_token(self, _config):
+        tok = self._load_token()
+
+        # static password tokens always match the same counter
+        self.assertEqual(tok.commitValidation(0, authenticated=False), 1)
+        self.assertEqual(tok.commitValidation(0, authenticated=False), 1)
+        self.assertEqual(tok.get_count_auth(), 0)
+
+    def test_not_migrated_token(self, _config):
+        from linotp.model import token_table
+
+        self.engine.execute(token_table.update().values(
+                        LinOtpCountAuth=None, LinOtpCountAuthSuccess=None,
+                        LinOtpTokenInfo=u'' + json.dumps({
+                                                'count_auth': 10,
+                                                'count_auth_success': 4,
+                                                'hashlib': 'sha1'})))
+        tok = self._load_token()
+
+        self.assertEqual(tok.commitValidation(5), 6)
+        self.meta.Session.commit()
+        self.assertEqual(self._stored('LinOtpCountAuth'), 11)
+        self.assertEqual(self._stored('LinOtpCountAuthSuccess'), 5)
+        self.assertEqual(json.loads(self._stored('LinOtpTokenInfo')),
+                         {'hashlib': 'sha1'})
@@ -0,0 +1,82 @@
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP server.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the background thread base of the process
+"""
+
+import threading
+import unittest
+
+from linotp.lib.worker import PeriodicWorker
+
+
+class CountingWorker(PeriodicWorker):
+
+    def __init__(self, interval, wait_first=False):
+        PeriodicWorker.__init__(self, 'test worker', interval,
+                                wait_first=wait_first)
+        self.runs = 0
+        self.ran = threading.Event()
+
+    def work(self):
+        self.runs += 1
+        self.ran.set()
+
+
+class PeriodicWorkerTestCase(unittest.TestCase):
+
+    def test_thread_is_started_once_per_process(self):
+        worker = CountingWorker(interval=60)
+        worker.start()
+        thread = worker.thread
+        worker.start()
+        self.assertTrue(worker.thread is thread)
+        self.assertTrue(worker.isRunning())
+
+        self.assertTrue(worker.ran.wait(5))
+        worker.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(worker.runs, 1)
+
+        # a forked process has no thread of its own
+        worker.start()
+        worker.pid = -1
+        self.assertFalse(worker.isRunning())
+        worker.stop()
+
+    def test_wait_first(self):
+        worker = CountingWorker(interval=60, wait_first=True)
+        worker.start()
+        thread = worker.thread
+        worker.stop()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(worker.runs, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
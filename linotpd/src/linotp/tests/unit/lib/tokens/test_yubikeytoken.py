@@ -74,15 +74,15 @@ class YubikeyTokenClassTestCase(unittest.TestCase):
             spec=[
                 "getSerial",
                 "getHOtpKey",
-                "getInfo",
-                "setInfo",
+                "getInfoDict",
+                "setInfoDict",
                 "setType",
                 "LinOtpCountWindow"
                 ]
             ) # linotp.model.Token
         model_token.getSerial.return_value = serial
         model_token.getHOtpKey.return_value = secret_obj
-        model_token.getInfo.return_value = u'' + '{\n"yubikey.tokenid": "' + self.private_uid + '"\n}'
+        model_token.getInfoDict.return_value = {"yubikey.tokenid": self.private_uid}
         model_token.LinOtpCountWindow = None # Not required in the Yubikey Token
         model_token.LinOtpCount = 0
         model_token.LinOtpOtpLen = 32
@@ -156,19 +156,19 @@ class YubikeyTokenClassTestCase(unittest.TestCase):
         setting it is called.
         """
         # yubikey.tokenid is not set
-        self.model_token.getInfo.return_value = '{}'
+        self.model_token.getInfoDict.return_value = {}
         otp = self.public_uid + "fcniufvgvjturjgvinhebbbertjnihit"
         self.yubikey_token.checkOtp(otp)
         # Verify that the tokenid is passed onto linotp.model.Token
-        expected_tokeninfo = u'' + '{\n"yubikey.tokenid": "' + self.private_uid + '"\n}'
-        self.model_token.setInfo.assert_called_once_with(expected_tokeninfo)
+        expected_tokeninfo = {"yubikey.tokenid": self.private_uid}
+        self.model_token.setInfoDict.assert_called_once_with(expected_tokeninfo)
 
     def test_checkotp_wrong_tokenid(self):
         """
         Verify that if the stored uid differs from the one contained in the OTP then an error
         is returned.
         """
-        self.model_token.getInfo.return_value = u'' + '{\n"yubikey.tokenid": "wrong-value"\n}'
+        self.model_token.getInfoDict.return_value = {"yubikey.tokenid": "wrong-value"}
         otp = self.public_uid + "fcniufvgvjturjgvinhebbbertjnihit"
         counter_expected = -2
         # We want to suppress the warning generated because of the wrong CRC
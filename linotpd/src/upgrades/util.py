@@ -78,3 +78,25 @@ def table_has_column(engine, table_name, column_name):
     else:
         return False
 
+
+def table_has_index(engine, table_name, index_name):
+
+    if 'offline' == where_from():
+        return False
+
+    indexes = sa.inspect(engine).get_indexes(table_name)
+    if index_name in [index['name'] for index in indexes]:
+        return True
+    else:
+        return False
+
+
+def has_table(engine, table_name):
+
+    if 'offline' == where_from():
+        return False
+
+    if table_name in sa.inspect(engine).get_table_names():
+        return True
+    else:
+        return False
@@ -0,0 +1,66 @@
+"""add token info columns for the auth counters and the validity period
+
+Revision ID: 3c5b2d1a9e04
+Revises: d21455fbe5f
+Create Date: 2026-10-18 10:12:31.204117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c5b2d1a9e04'
+down_revision = 'd21455fbe5f'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import MetaData
+from upgrades.util import table_has_column
+
+# the former token info entries - the existing tokens keep their entries in
+# the token info until they are written the next time
+token_info_columns = [
+    ('LinOtpCountAuth', sa.types.Integer(), True),
+    ('LinOtpCountAuthMax', sa.types.Integer(), False),
+    ('LinOtpCountAuthSuccess', sa.types.Integer(), True),
+    ('LinOtpCountAuthSuccessMax', sa.types.Integer(), False),
+    ('LinOtpValidityStart', sa.types.DateTime(), True),
+    ('LinOtpValidityEnd', sa.types.DateTime(), True),
+]
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def upgrade_linotp():
+    engine = op.get_bind().engine
+
+    for column_name, column_type, indexed in token_info_columns:
+        if table_has_column(engine, 'Token', column_name) == False:
+            op.add_column('Token', sa.Column(column_name, column_type))
+            if indexed:
+                op.create_index('ix_Token_%s' % column_name, 'Token',
+                                [column_name])
+    return
+
+def downgrade_linotp():
+    for column_name, column_type, indexed in reversed(token_info_columns):
+        if indexed:
+            op.drop_index('ix_Token_%s' % column_name, 'Token')
+        op.drop_column('Token', column_name)
+    return
+
+
+def upgrade_audit():
+    pass
+
+def downgrade_audit():
+    pass
+
+def upgrade_openid():
+    pass
+
+def downgrade_openid():
+    pass
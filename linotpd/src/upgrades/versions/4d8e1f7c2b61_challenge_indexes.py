@@ -0,0 +1,65 @@
+"""add the token serial and timestamp indexes to the challenges table
+
+Revision ID: 4d8e1f7c2b61
+Revises: 3c5b2d1a9e04
+Create Date: 2026-10-18 11:40:05.873312
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d8e1f7c2b61'
+down_revision = '3c5b2d1a9e04'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import MetaData
+from upgrades.util import table_has_column
+from upgrades.util import table_has_index
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def _timestamp_column(engine):
+    # oracle uses prefixed column names due to the reserved keywords
+    if table_has_column(engine, 'challenges', 'timestamp'):
+        return 'timestamp'
+    for column in sa.inspect(engine).get_columns('challenges'):
+        if column['name'].lower().endswith('timestamp'):
+            return column['name']
+    return 'timestamp'
+
+def upgrade_linotp():
+    engine = op.get_bind().engine
+    timestamp = _timestamp_column(engine)
+
+    if not table_has_index(engine, 'challenges',
+                           'ix_challenges_tokenserial_timestamp'):
+        op.create_index('ix_challenges_tokenserial_timestamp', 'challenges',
+                        ['tokenserial', timestamp])
+
+    if not table_has_index(engine, 'challenges', 'ix_challenges_timestamp'):
+        op.create_index('ix_challenges_timestamp', 'challenges', [timestamp])
+    return
+
+def downgrade_linotp():
+    op.drop_index('ix_challenges_timestamp', 'challenges')
+    op.drop_index('ix_challenges_tokenserial_timestamp', 'challenges')
+    return
+
+
+def upgrade_audit():
+    pass
+
+def downgrade_audit():
+    pass
+
+def upgrade_openid():
+    pass
+
+def downgrade_openid():
+    pass
@@ -0,0 +1,65 @@
+"""add the token serial, timestamp and request count indexes to the ocra table
+
+Revision ID: 5a9c3e2d7f18
+Revises: 4d8e1f7c2b61
+Create Date: 2026-10-18 12:52:44.106385
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a9c3e2d7f18'
+down_revision = '4d8e1f7c2b61'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import MetaData
+from upgrades.util import table_has_column
+from upgrades.util import table_has_index
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def _timestamp_column(engine):
+    # oracle uses prefixed column names due to the reserved keywords
+    if table_has_column(engine, 'ocra', 'timestamp'):
+        return 'timestamp'
+    for column in sa.inspect(engine).get_columns('ocra'):
+        if column['name'].lower().endswith('timestamp'):
+            return column['name']
+    return 'timestamp'
+
+def upgrade_linotp():
+    engine = op.get_bind().engine
+
+    indexes = [('ix_ocra_tokenserial', 'tokenserial'),
+               ('ix_ocra_timestamp', _timestamp_column(engine)),
+               ('ix_ocra_received_count', 'received_count')]
+
+    for index_name, column_name in indexes:
+        if not table_has_index(engine, 'ocra', index_name):
+            op.create_index(index_name, 'ocra', [column_name])
+    return
+
+def downgrade_linotp():
+    for index_name in ['ix_ocra_received_count', 'ix_ocra_timestamp',
+                       'ix_ocra_tokenserial']:
+        op.drop_index(index_name, 'ocra')
+    return
+
+
+def upgrade_audit():
+    pass
+
+def downgrade_audit():
+    pass
+
+def upgrade_openid():
+    pass
+
+def downgrade_openid():
+    pass
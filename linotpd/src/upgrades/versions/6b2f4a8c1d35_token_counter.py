@@ -0,0 +1,57 @@
+"""add the token counter table
+
+Revision ID: 6b2f4a8c1d35
+Revises: 5a9c3e2d7f18
+Create Date: 2026-10-18 14:08:17.518302
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b2f4a8c1d35'
+down_revision = '5a9c3e2d7f18'
+
+from alembic import op
+import sqlalchemy as sa
+from upgrades.util import has_table
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def upgrade_linotp():
+    engine = op.get_bind().engine
+
+    # the counters are created by the first reconcile run
+    if has_table(engine, 'TokenCounter') == False:
+        op.create_table('TokenCounter',
+            sa.Column('scope', sa.types.Unicode(16), primary_key=True,
+                      nullable=False),
+            sa.Column('name', sa.types.Unicode(255), primary_key=True,
+                      nullable=False),
+            sa.Column('tokens', sa.types.Integer(), default=0,
+                      nullable=False),
+            sa.Column('active', sa.types.Integer(), default=0,
+                      nullable=False),
+            )
+    return
+
+def downgrade_linotp():
+    op.drop_table('TokenCounter')
+    return
+
+
+def upgrade_audit():
+    pass
+
+def downgrade_audit():
+    pass
+
+def upgrade_openid():
+    pass
+
+def downgrade_openid():
+    pass
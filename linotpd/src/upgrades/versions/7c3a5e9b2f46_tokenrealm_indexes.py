@@ -0,0 +1,53 @@
+"""add the realm and token indexes to the token realm table
+
+Revision ID: 7c3a5e9b2f46
+Revises: 6b2f4a8c1d35
+Create Date: 2026-10-18 15:21:05.730916
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c3a5e9b2f46'
+down_revision = '6b2f4a8c1d35'
+
+from alembic import op
+from upgrades.util import table_has_index
+
+tokenrealm_indexes = [
+    ('ix_tokenrealm_realm_id_token_id', ['realm_id', 'token_id']),
+    ('ix_tokenrealm_token_id', ['token_id']),
+]
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def upgrade_linotp():
+    engine = op.get_bind().engine
+
+    for index_name, columns in tokenrealm_indexes:
+        if table_has_index(engine, 'TokenRealm', index_name) == False:
+            op.create_index(index_name, 'TokenRealm', columns)
+    return
+
+def downgrade_linotp():
+    for index_name, columns in reversed(tokenrealm_indexes):
+        op.drop_index(index_name, 'TokenRealm')
+    return
+
+
+def upgrade_audit():
+    pass
+
+def downgrade_audit():
+    pass
+
+def upgrade_openid():
+    pass
+
+def downgrade_openid():
+    pass
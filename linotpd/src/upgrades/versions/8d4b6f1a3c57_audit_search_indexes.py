@@ -0,0 +1,73 @@
+"""replace the single column audit indexes by the indexes of the search
+
+Revision ID: 8d4b6f1a3c57
+Revises: 7c3a5e9b2f46
+Create Date: 2026-10-18 17:42:19.318204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d4b6f1a3c57'
+down_revision = '7c3a5e9b2f46'
+
+from alembic import op
+from upgrades.util import get_audit_table_name
+from upgrades.util import table_has_index
+
+audit_indexes = [
+    ('timestamp_id', ['timestamp', 'id']),
+    ('serial_id', ['serial', 'id']),
+    ('user_realm_id', ['user', 'realm', 'id']),
+    ('action_id', ['action', 'id']),
+]
+
+# the former single column indexes, which are covered by the new ones
+audit_column_indexes = ['timestamp', 'serial', 'user', 'action']
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def upgrade_linotp():
+    pass
+
+def downgrade_linotp():
+    pass
+
+
+def upgrade_audit():
+    engine = op.get_bind().engine
+
+    for table_name in get_audit_table_name(engine):
+        for index_name, columns in audit_indexes:
+            index_name = 'ix_%s_%s' % (table_name, index_name)
+            if table_has_index(engine, table_name, index_name) == False:
+                op.create_index(index_name, table_name, columns)
+
+        for column in audit_column_indexes:
+            index_name = 'ix_%s_%s' % (table_name, column)
+            if table_has_index(engine, table_name, index_name) == True:
+                op.drop_index(index_name, table_name)
+    return
+
+def downgrade_audit():
+    engine = op.get_bind().engine
+
+    for table_name in get_audit_table_name(engine):
+        for column in audit_column_indexes:
+            op.create_index('ix_%s_%s' % (table_name, column), table_name,
+                            [column])
+
+        for index_name, columns in reversed(audit_indexes):
+            op.drop_index('ix_%s_%s' % (table_name, index_name), table_name)
+    return
+
+def upgrade_openid():
+    pass
+
+def downgrade_openid():
+    pass
@@ -0,0 +1,60 @@
+"""add the otp index table of the unassigned tokens
+
+Revision ID: 9e5c7b2d4a68
+Revises: 8d4b6f1a3c57
+Create Date: 2026-10-18 21:16:43.271950
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9e5c7b2d4a68'
+down_revision = '8d4b6f1a3c57'
+
+from alembic import op
+import sqlalchemy as sa
+from upgrades.util import has_table
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+def upgrade_linotp():
+    engine = op.get_bind().engine
+
+    # the index entries are created by system/updateOtpIndex
+    if has_table(engine, 'OtpIndex') == False:
+        op.create_table('OtpIndex',
+            sa.Column('id', sa.types.Integer(),
+                      sa.Sequence('otpindex_seq_id', optional=True),
+                      primary_key=True, nullable=False),
+            sa.Column('token_id', sa.types.Integer(),
+                      sa.ForeignKey('Token.LinOtpTokenId')),
+            sa.Column('digest', sa.types.Unicode(64), default=u'',
+                      nullable=False),
+            sa.Column('counter', sa.types.Integer(), default=0),
+            sa.Column('lookahead', sa.types.Integer(), default=0),
+            )
+        op.create_index('ix_OtpIndex_token_id', 'OtpIndex', ['token_id'])
+        op.create_index('ix_OtpIndex_digest', 'OtpIndex', ['digest'])
+    return
+
+def downgrade_linotp():
+    op.drop_table('OtpIndex')
+    return
+
+
+def upgrade_audit():
+    pass
+
+def downgrade_audit():
+    pass
+
+def upgrade_openid():
+    pass
+
+def downgrade_openid():
+    pass
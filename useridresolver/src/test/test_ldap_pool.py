@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP userid resolvers.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the connection pool of the LDAPIdResolver
+"""
+
+import unittest
+
+from mock import MagicMock, patch
+
+import ldap
+
+from useridresolver.LDAPIdResolver import LDAPConnectionPool
+from useridresolver.LDAPIdResolver import IdResolver
+
+
+class LDAPConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+        self.down = set()
+
+        def initialize(uri, trace_level=0):
+            l_obj = MagicMock()
+            l_obj.uri = uri
+            if uri in self.down:
+                l_obj.simple_bind_s.side_effect = ldap.SERVER_DOWN('down')
+            self.connections.append(l_obj)
+            return l_obj
+
+        patcher = patch('useridresolver.LDAPIdResolver.ldap.initialize',
+                        side_effect=initialize)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connection_is_reused(self):
+        pool = LDAPConnectionPool(['ldap://one'], u'cn=admin', u'secret')
+
+        for _i in range(5):
+            (l_obj, uri) = pool.acquire()
+            self.assertEqual(uri, 'ldap://one')
+            pool.release(l_obj, uri)
+
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.connections[0].simple_bind_s.call_count, 1)
+
+        stats = pool.getStats()
+        self.assertEqual(stats['acquired'], 5)
+        self.assertEqual(stats['reused'], 4)
+        self.assertEqual(stats['reuse_rate'], 0.8)
+
+    def test_broken_connection_is_discarded(self):
+        pool = LDAPConnectionPool(['ldap://one'], u'cn=admin', u'secret')
+
+        (l_obj, uri) = pool.acquire()
+        pool.release(l_obj, uri, broken=True)
+        self.assertEqual(l_obj.unbind_s.call_count, 1)
+
+        (l_obj2, uri) = pool.acquire()
+        self.assertFalse(l_obj2 is l_obj)
+        self.assertEqual(pool.getStats()['discarded'], 1)
+
+    def test_failover_and_breaker(self):
+        self.down.add('ldap://one')
+        pool = LDAPConnectionPool(['ldap://one', 'ldap://two'],
+                                  u'cn=admin', u'secret', size=2)
+
+        (l_obj, uri) = pool.acquire()
+        self.assertEqual(uri, 'ldap://two')
+        self.assertEqual(pool.getStats()['unavailable_servers'],
+                         ['ldap://one'])
+
+        # the failed server is skipped until the breaker timeout is over
+        (l_obj2, uri) = pool.acquire()
+        self.assertEqual(uri, 'ldap://two')
+        self.assertEqual([c.uri for c in self.connections],
+                         ['ldap://one', 'ldap://two', 'ldap://two'])
+
+    def test_no_server_available(self):
+        self.down.update(['ldap://one', 'ldap://two'])
+        pool = LDAPConnectionPool(['ldap://one', 'ldap://two'],
+                                  u'cn=admin', u'secret')
+
+        self.assertEqual(pool.acquire(), (None, None))
+        self.assertEqual(pool.getStats()['connections'], 0)
+
+        # no further bind attempt within the breaker timeout
+        self.assertEqual(pool.acquire(), (None, None))
+        self.assertEqual(len(self.connections), 2)
+
+    def test_pool_exhausted(self):
+        pool = LDAPConnectionPool(['ldap://one'], u'cn=admin', u'secret',
+                                  size=1)
+        (l_obj, uri) = pool.acquire()
+
+        self.assertEqual(pool.acquire(wait_timeout=0.01), (None, None))
+        self.assertEqual(pool.getStats()['wait_timeouts'], 1)
+
+        pool.release(l_obj, uri)
+        self.assertEqual(pool.acquire(wait_timeout=0.01), (l_obj, uri))
+
+    def test_health_check_of_idle_connection(self):
+        pool = LDAPConnectionPool(['ldap://one'], u'cn=admin', u'secret',
+                                  check_interval=0)
+        (l_obj, uri) = pool.acquire()
+        pool.release(l_obj, uri)
+
+        l_obj.whoami_s.side_effect = ldap.SERVER_DOWN('down')
+        (l_obj2, uri) = pool.acquire()
+        self.assertFalse(l_obj2 is l_obj)
+        self.assertEqual(pool.getStats()['discarded'], 1)
+
+    def test_resolver_releases_connection_after_unbind(self):
+        pool = LDAPConnectionPool(['ldap://one'], u'cn=admin', u'secret',
+                                  size=1)
+        resolver = IdResolver()
+
+        with patch.object(resolver, '_getConnectionPool', return_value=pool):
+            l_obj = resolver.bind()
+
+            # a nested bind shares the connection of the outer one
+            self.assertTrue(resolver.bind() is l_obj)
+            resolver.unbind(l_obj)
+            self.assertEqual(pool.getStats()['idle'], 0)
+
+            # the last unbind returns the connection without a request end
+            resolver.unbind(l_obj)
+            self.assertEqual(pool.getStats()['idle'], 1)
+            self.assertTrue(resolver.l_obj is None)
+
+
+class LDAPUserInfosTest(unittest.TestCase):
+
+    def test_failed_chunk_keeps_the_other_chunks(self):
+        resolver = IdResolver()
+        resolver.uidType = 'uidNumber'
+        resolver.base = 'dc=example,dc=com'
+        resolver.sizelimit = 500
+        resolver.userinfo = {'username': 'uid'}
+
+        def result(l_id, all=1):
+            if l_id == 1:
+                # e.g. two entries share the uidNumber of the first chunk
+                raise ldap.SIZELIMIT_EXCEEDED('size limit exceeded')
+            return (ldap.RES_SEARCH_RESULT,
+                    [('uid=bob,dc=example,dc=com',
+                      {'uidNumber': ['2'], 'uid': ['bob']})])
+
+        def search_ext(base, scope, filterstr=None, attrlist=None,
+                       sizelimit=0):
+            return 1 if '(uidNumber=1)' in filterstr else 2
+
+        l_obj = MagicMock()
+        l_obj.search_ext.side_effect = search_ext
+        l_obj.result.side_effect = result
+
+        with patch('useridresolver.LDAPIdResolver.USERINFO_CHUNK', 1):
+            with patch.object(resolver, 'bind', return_value=l_obj):
+                with patch.object(resolver, 'unbind'):
+                    infos = resolver.getUserInfos([u'1', u'2'])
+
+        self.assertEqual(infos.keys(), [u'2'])
+        self.assertEqual(infos[u'2']['username'], u'bob')
+        for call in l_obj.search_ext.call_args_list:
+            self.assertEqual(call[1]['sizelimit'], 500)
+
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP userid resolvers.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the shared index of the PasswdIdResolver
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from useridresolver import PasswdIdResolver
+from useridresolver.UserIdResolver import getResolverClass
+
+
+USERS = '''root:x:0:0:root:/root:/bin/bash
+user1:0DM4AJtW/rTYY:10:10:User Eins,,12,34,eins@example.com:/home:/bin/sh
+user2:.4UO1mxvTmdM6:11:11:User Zwei:Irgendwas:Nochmal
+
+hans:x:1000:1000:Hans Meier:/home/hans:/bin/sh
+hanna:x:1001:1001:Hanna Schmidt:/home/hanna:/bin/sh
+otto:x:1500:1500:Otto Schmidt:/home/otto:/bin/sh
+'''
+
+
+class PasswdIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.tmp_dir, 'passwd')
+        self.write(USERS)
+
+    def tearDown(self):
+        PasswdIdResolver.indexes.pop(self.fileName, None)
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, content):
+        with open(self.fileName, 'w') as f:
+            f.write(content)
+
+    def resolver(self):
+        resolver = getResolverClass("PasswdIdResolver", "IdResolver")()
+        resolver.loadConfig({'linotp.passwdresolver.fileName':
+                             self.fileName}, "")
+        return resolver
+
+    def usernames(self, searchDict):
+        return [user['username'] for user in
+                self.resolver().getUserList(searchDict)]
+
+    def test_index_is_shared(self):
+        self.assertTrue(self.resolver().index is self.resolver().index)
+
+    def test_index_is_reloaded_on_change(self):
+        index = self.resolver().index
+        self.assertEqual(self.resolver().getUserId('fritz'), '')
+
+        self.write(USERS + 'fritz:x:2000:2000:Fritz:/home:/bin/sh\n')
+        resolver = self.resolver()
+        self.assertFalse(resolver.index is index)
+        self.assertEqual(resolver.getUserId('fritz'), '2000')
+
+    def test_user_info(self):
+        resolver = self.resolver()
+        userid = resolver.getUserId(u'user1')
+        self.assertEqual(userid, '10')
+
+        info = resolver.getUserInfo(userid)
+        self.assertEqual(info['surname'], 'Eins')
+        self.assertEqual(info['givenname'], 'User')
+        self.assertEqual(info['mobile'], '12')
+        self.assertEqual(info['phone'], '34')
+        self.assertEqual(info['email'], 'eins@example.com')
+        self.assertEqual(info['cryptpass'], '0DM4AJtW/rTYY')
+        self.assertFalse('cryptpass' in
+                         resolver.getUserInfo(userid, no_passwd=True))
+
+        self.assertTrue(resolver.getUsername('1000'))
+        self.assertFalse(resolver.getUsername('9'))
+        self.assertTrue(resolver.checkPass('10', 'pwU1'))
+
+    def test_search_username(self):
+        self.assertEqual(self.usernames({}), ['root', 'user1', 'user2',
+                                              'hans', 'hanna', 'otto'])
+        self.assertEqual(self.usernames({'username': '*'}),
+                         self.usernames({}))
+        self.assertEqual(self.usernames({'username': 'HANS'}), ['hans'])
+        self.assertEqual(self.usernames({'username': 'han*'}),
+                         ['hans', 'hanna'])
+        self.assertEqual(self.usernames({'username': '*1'}), ['user1'])
+        self.assertEqual(self.usernames({'username': '*nn*'}), ['hanna'])
+        self.assertEqual(self.usernames({'username': 'nobody'}), [])
+        self.assertEqual(self.usernames({'unknown': '*'}), [])
+
+    def test_search_description(self):
+        self.assertEqual(self.usernames({'description': '*schmidt'}),
+                         ['hanna', 'otto'])
+        self.assertEqual(self.usernames({'email': '*@example.com*'}),
+                         ['user1'])
+
+    def test_search_userid(self):
+        self.assertEqual(self.usernames({'userid': '= 1000'}), ['hans'])
+        self.assertEqual(self.usernames({'userid': '>= 1000'}),
+                         ['hans', 'hanna', 'otto'])
+        self.assertEqual(self.usernames({'userid': '> 1000'}),
+                         ['hanna', 'otto'])
+        self.assertEqual(self.usernames({'userid': '< 11'}),
+                         ['root', 'user1'])
+        self.assertEqual(self.usernames({'userid': '<= 11'}),
+                         ['root', 'user1', 'user2'])
+        self.assertEqual(self.usernames({'userid': 'between 1500, 1001'}),
+                         ['hanna', 'otto'])
+        self.assertEqual(self.usernames({'userid': '= abc'}), [])
+
+    def test_search_combined(self):
+        self.assertEqual(self.usernames({'username': 'h*',
+                                         'userid': '> 1000'}), ['hanna'])
+        self.assertEqual(self.usernames({'username': 'o*',
+                                         'description': '*meier'}), [])
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+#    LinOTP - the open source solution for two factor authentication
+#    Copyright (C) 2010 - 2015 LSE Leading Security Experts GmbH
+#
+#    This file is part of LinOTP userid resolvers.
+#
+#    This program is free software: you can redistribute it and/or
+#    modify it under the terms of the GNU Affero General Public
+#    License, version 3, as published by the Free Software Foundation.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the
+#               GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#    E-mail: linotp@lsexperts.de
+#    Contact: www.linotp.org
+#    Support: www.lsexperts.de
+#
+"""
+Tests the process wide engine and table cache of the SQLIdResolver
+
+The benchmark compares the latency of a user lookup with the cached engine
+and table with the former behaviour - a new engine and a table reflection
+for every request:
+
+    python -m pytest -s test/test_sql_engine.py -k benchmark
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+
+import useridresolver.SQLIdResolver as SQLIdResolver
+from useridresolver.SQLIdResolver import IdResolver
+from useridresolver.SQLIdResolver import engine_args
+
+
+class SQLEngineCacheTest(unittest.TestCase):
+
+    users = 100
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.connect = "sqlite:///%s/users.sqlite" % self.tmp_dir
+
+        engine = create_engine(self.connect)
+        engine.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, "
+                       "username VARCHAR(40), password VARCHAR(80))")
+        for i in range(self.users):
+            engine.execute("INSERT INTO users VALUES (%d, 'user%d', 'x')"
+                           % (i, i))
+        engine.dispose()
+
+        self.config = {
+            'linotp.sqlresolver.Driver': 'sqlite',
+            'linotp.sqlresolver.Server': '',
+            'linotp.sqlresolver.Port': '',
+            'linotp.sqlresolver.Database': '%s/users.sqlite' % self.tmp_dir,
+            'linotp.sqlresolver.User': '',
+            'linotp.sqlresolver.Password': '',
+            'linotp.sqlresolver.Table': 'users',
+            'linotp.sqlresolver.Map': '{"username": "username", '
+                                      '"userid": "id", '
+                                      '"password": "password"}',
+            }
+
+    def tearDown(self):
+        for key in SQLIdResolver.engines.keys():
+            if self.tmp_dir in key:
+                SQLIdResolver.engines.pop(key)[0].dispose()
+        for key in SQLIdResolver.tables.keys():
+            if self.tmp_dir in key[0]:
+                del SQLIdResolver.tables[key]
+        shutil.rmtree(self.tmp_dir)
+
+    def lookup(self, login):
+        """
+        one request: a resolver, which is closed at the request end
+        """
+        resolver = IdResolver()
+        resolver.loadConfig(self.config, "")
+        try:
+            return resolver.getUserId(login)
+        finally:
+            resolver.close()
+
+    def test_engine_and_table_are_shared(self):
+        self.assertEqual(self.lookup('user1'), 1)
+        self.assertEqual(self.lookup('user2'), 2)
+
+        engines = [key for key in SQLIdResolver.engines
+                   if self.tmp_dir in key]
+        self.assertEqual(len(engines), 1)
+
+        # after the table is reflected, a lookup is a single query
+        (engine, _meta) = SQLIdResolver.engines[engines[0]]
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, many):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            self.assertEqual(self.lookup('user3'), 3)
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        self.assertEqual(len(statements), 1)
+
+    def test_connection_test_uses_private_engine(self):
+        params = {'Driver': 'sqlite', 'Server': '', 'Port': '', 'User': '',
+                  'Password': '', 'Table': 'users',
+                  'Database': '%s/users.sqlite' % self.tmp_dir}
+        (num, err) = SQLIdResolver.testconnection(params)
+        self.assertEqual((num, err), (self.users, ""))
+        self.assertEqual([key for key in SQLIdResolver.engines
+                          if self.tmp_dir in key], [])
+
+    def test_user_infos_in_one_query(self):
+        resolver = IdResolver()
+        resolver.loadConfig(self.config, "")
+        try:
+            self.assertEqual(resolver.getUserId('user1'), 1)
+            (engine, _meta) = [SQLIdResolver.engines[key]
+                               for key in SQLIdResolver.engines
+                               if self.tmp_dir in key][0]
+            statements = []
+
+            def count(conn, cursor, statement, parameters, context, many):
+                statements.append(statement)
+
+            event.listen(engine, 'before_cursor_execute', count)
+            try:
+                infos = resolver.getUserInfos([u'1', u'2', u'7', u'999'])
+            finally:
+                event.remove(engine, 'before_cursor_execute', count)
+        finally:
+            resolver.close()
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(sorted(infos.keys()), [u'1', u'2', u'7'])
+        self.assertEqual(infos[u'7']['username'], 'user7')
+        self.assertEqual(infos[u'7'], resolver.getUserInfo(u'7'))
+
+    def test_benchmark(self):
+        rounds = 200
+
+        def uncached_lookup(login):
+            # the former behaviour: engine and reflection per request
+            engine = create_engine(self.connect,
+                                   **engine_args(self.connect))
+            from sqlalchemy import Table, MetaData
+            table = Table('users', MetaData(), autoload=True,
+                          autoload_with=engine)
+            row = engine.execute(table.select(
+                                table.c.username == login)).first()
+            engine.dispose()
+            return row['id']
+
+        timings = {}
+        for name, lookup in [('uncached', uncached_lookup),
+                             ('cached', self.lookup)]:
+            lookup('user0')
+            start = time.time()
+            for i in range(rounds):
+                self.assertEqual(lookup('user%d' % (i % self.users)),
+                                 i % self.users)
+            timings[name] = (time.time() - start) / rounds
+
+        print ("\nSQLIdResolver lookup latency: uncached %.3f ms, "
+               "cached %.3f ms" % (timings['uncached'] * 1000,
+                                   timings['cached'] * 1000))
+        self.assertTrue(timings['cached'] < timings['uncached'])
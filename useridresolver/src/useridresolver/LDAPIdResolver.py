@@ -29,6 +29,12 @@
                 The LinOTPd imports this module to
                 use LDAP servers as a userstore.
 
+                The bound connections to the LDAP servers are
+                shared by all requests of a process - there is one
+                connection pool per resolver config, which could be
+                tuned by the optional resolver settings POOLSIZE,
+                POOLIDLETIMEOUT and POOLCHECKINTERVAL.
+
   Dependencies: UserIdResolver
 """
 
@@ -43,8 +49,10 @@ import ldap
 import ldap.filter
 
 import sys
+import time
 import traceback
 import binascii
+import threading
 from hashlib import sha1
 import tempfile
 
@@ -61,8 +69,386 @@ DEFAULT_UID_TYPE = "DN"  # can be entryUUID, GUID, objectGUID or DN
 # DEFAULT_UID_TYPE = "entryUUID"
 ENCODING = 'utf-8'
 DEFAULT_SIZELIMIT = 500
+
+# the number of user ids, which are looked up with one search
+USERINFO_CHUNK = 50
 BIND_NOT_POSSIBLE_TIMEOUT = 30
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 300.0
+DEFAULT_POOL_CHECK_INTERVAL = 60.0
+
+# the connection errors, after which a connection is not reused
+CONNECTION_ERRORS = (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.CONNECT_ERROR)
+
+
+class ServerBreaker(object):
+    '''
+    circuit breaker of one LDAP server: after a failed bind the server is
+    skipped for BIND_NOT_POSSIBLE_TIMEOUT seconds, then one connection
+    attempt is allowed again
+    '''
+
+    def __init__(self, uri, timeout=BIND_NOT_POSSIBLE_TIMEOUT):
+        self.uri = uri
+        self.timeout = timeout
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def available(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened > self.timeout:
+                # half open - the next attempt decides
+                self.opened = None
+                log.info("[ServerBreaker] retrying LDAP server %r after %r "
+                         "seconds" % (self.uri, self.timeout))
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.opened = time.time()
+
+
+class LDAPConnectionPool(object):
+    '''
+    thread safe pool of bound LDAP connections of one resolver config
+
+    A connection is taken from the pool by the resolver bind() and
+    returned by the last unbind() of the resolver. New connections are bound to the
+    first available server of the LDAPURI list - a server with a failed
+    bind is skipped by its circuit breaker.
+    '''
+
+    def __init__(self, uris, binddn, bindpw, timeout=10, noreferrals=False,
+                 size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+                 check_interval=DEFAULT_POOL_CHECK_INTERVAL):
+        self.uris = uris
+        self.binddn = binddn
+        self.bindpw = bindpw
+        self.timeout = timeout
+        self.noreferrals = noreferrals
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+
+        self.breakers = dict((uri, ServerBreaker(uri)) for uri in uris)
+
+        # list of idle (connection, uri, last used) tuples
+        self.idle = []
+        self.connections = 0
+        self.cond = threading.Condition(threading.Lock())
+
+        self.acquired = 0
+        self.reused = 0
+        self.created = 0
+        self.discarded = 0
+        self.wait_time = 0.0
+        self.wait_time_max = 0.0
+        self.wait_timeouts = 0
+
+    def connect(self):
+        '''
+        bind a new connection to the first available server
+
+        :return: tuple of connection and uri or (None, None)
+        '''
+        for uri in self.uris:
+            breaker = self.breakers[uri]
+            if not breaker.available():
+                log.debug("[connect] skipping LDAP server %r" % uri)
+                continue
+            try:
+                log.debug("[connect] LDAP: Try to bind to %r", uri)
+                l_obj = ldap.initialize(uri, trace_level=0)
+
+                if uri.startswith('ldaps'):
+                    # the setting of the CERTFILE is required only once
+                    old_cert_file = ldap.get_option(ldap.OPT_X_TLS_CACERTFILE)
+                    if IdResolver.CERTFILE is not None and old_cert_file == None:
+                        ldap.set_option(ldap.OPT_X_TLS_CACERTFILE,
+                                        IdResolver.CERTFILE)
+
+                # referrals for AD
+                if self.noreferrals:
+                    l_obj.set_option(ldap.OPT_REFERRALS, 0)
+                l_obj.network_timeout = self.timeout
+                l_obj.simple_bind_s(self.binddn.encode(ENCODING),
+                                    self.bindpw.encode(ENCODING))
+                breaker.success()
+                return (l_obj, uri)
+
+            except ldap.LDAPError as exc:
+                log.error("[connect] LDAP error: %r" % exc)
+                log.error("[connect] LDAPURI   : %r" % uri)
+                log.error("[connect] %s" % traceback.format_exc())
+                breaker.failure()
+
+        log.error("[connect] LDAP bind not possible to any of %r - retrying "
+                  "after %r seconds" % (self.uris, BIND_NOT_POSSIBLE_TIMEOUT))
+        return (None, None)
+
+    def _check(self, l_obj, uri):
+        '''
+        health check of an idle connection
+        '''
+        try:
+            l_obj.whoami_s()
+            return True
+        except ldap.LDAPError as exc:
+            log.warning("[_check] discarding connection to %r: %r"
+                        % (uri, exc))
+            return False
+
+    def _unbind(self, l_obj):
+        try:
+            l_obj.unbind_s()
+        except ldap.LDAPError as exc:
+            log.warning("[_unbind] LDAP error: %r" % exc)
+
+    def acquire(self, wait_timeout=None):
+        '''
+        get a bound connection - either an idle one or a new one. If all
+        connections are in use, wait until one is released.
+
+        :param wait_timeout: seconds to wait for a released connection
+        :return: tuple of connection and uri or (None, None)
+        '''
+        if wait_timeout is None:
+            wait_timeout = self.timeout
+
+        start = time.time()
+        deadline = start + wait_timeout
+        waited = False
+
+        self.cond.acquire()
+        try:
+            while True:
+                now = time.time()
+                while self.idle:
+                    (l_obj, uri, last_used) = self.idle.pop()
+                    if now - last_used > self.idle_timeout:
+                        self._discard(l_obj)
+                        continue
+                    if now - last_used > self.check_interval:
+                        # release the lock during the server roundtrip
+                        self.cond.release()
+                        try:
+                            alive = self._check(l_obj, uri)
+                        finally:
+                            self.cond.acquire()
+                        if not alive:
+                            self._discard(l_obj)
+                            continue
+                    self.reused += 1
+                    return self._acquired(l_obj, uri, start, waited)
+
+                if self.connections < self.size:
+                    self.connections += 1
+                    break
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.wait_timeouts += 1
+                    log.error("[acquire] no LDAP connection available for %r "
+                              "after %r seconds" % (self.uris, wait_timeout))
+                    return (None, None)
+                waited = True
+                self.cond.wait(remaining)
+        finally:
+            self.cond.release()
+
+        # bind the new connection without holding the lock
+        (l_obj, uri) = (None, None)
+        try:
+            (l_obj, uri) = self.connect()
+        finally:
+            if l_obj is None:
+                self.release(None, None, broken=True)
+
+        if l_obj is None:
+            return (None, None)
+
+        with self.cond:
+            self.created += 1
+            return self._acquired(l_obj, uri, start, waited)
+
+    def _acquired(self, l_obj, uri, start, waited):
+        # the caller holds the lock
+        self.acquired += 1
+        if waited:
+            duration = time.time() - start
+            self.wait_time += duration
+            self.wait_time_max = max(self.wait_time_max, duration)
+        return (l_obj, uri)
+
+    def _discard(self, l_obj):
+        # the caller holds the lock
+        self.connections -= 1
+        self.discarded += 1
+        self._unbind(l_obj)
+
+    def release(self, l_obj, uri, broken=False):
+        '''
+        return the connection into the pool
+
+        :param broken: if True, the connection is closed and not reused
+        '''
+        with self.cond:
+            if broken:
+                self.connections -= 1
+                if l_obj is not None:
+                    self.discarded += 1
+                    self._unbind(l_obj)
+            else:
+                self.idle.append((l_obj, uri, time.time()))
+            self.cond.notify()
+        return
+
+    def close(self, idle_timeout=None):
+        '''
+        unbind the idle connections
+
+        :param idle_timeout: if given, only the connections idle for
+                             more than idle_timeout seconds are unbound
+        '''
+        now = time.time()
+        with self.cond:
+            idle = []
+            for (l_obj, uri, last_used) in self.idle:
+                if idle_timeout is None or now - last_used > idle_timeout:
+                    self._discard(l_obj)
+                else:
+                    idle.append((l_obj, uri, last_used))
+            self.idle = idle
+        return
+
+    def getStats(self):
+        '''
+        :return: dict with the connection counters, the reuse rate and the
+                 accumulated and the max wait time for a connection
+        '''
+        with self.cond:
+            reuse_rate = 0.0
+            if self.acquired:
+                reuse_rate = float(self.reused) / self.acquired
+            return {'size': self.size,
+                    'connections': self.connections,
+                    'idle': len(self.idle),
+                    'acquired': self.acquired,
+                    'reused': self.reused,
+                    'created': self.created,
+                    'discarded': self.discarded,
+                    'reuse_rate': reuse_rate,
+                    'wait_time': self.wait_time,
+                    'wait_time_max': self.wait_time_max,
+                    'wait_timeouts': self.wait_timeouts,
+                    'unavailable_servers': [uri for uri in self.uris
+                                        if self.breakers[uri].opened],
+                    }
+
+
+# the connection pools of all resolver configs of the process
+connection_pools = {}
+connection_pools_lock = threading.Lock()
+
+
+def getConnectionPool(uris, binddn, bindpw, **params):
+    '''
+    get the shared connection pool of the resolver config - a pool is
+    created on the first call for the config
+
+    :param uris: list of the LDAP server uris
+    :param binddn: the service user dn
+    :param bindpw: the service user password
+    :param params: additional LDAPConnectionPool parameters
+
+    :return: the LDAPConnectionPool
+    '''
+    key = (tuple(uris), binddn, sha1(bindpw.encode(ENCODING)).hexdigest(),
+           tuple(sorted(params.items())))
+
+    with connection_pools_lock:
+        pool = connection_pools.get(key)
+        if pool is None:
+            # the pools of a former resolver config are not used anymore,
+            # so this is the chance to drop their expired connections
+            for other in connection_pools.values():
+                other.close(idle_timeout=other.idle_timeout)
+
+            pool = LDAPConnectionPool(uris, binddn, bindpw, **params)
+            connection_pools[key] = pool
+    return pool
+
+
+def getConnectionPoolStats():
+    '''
+    :return: dict with the statistics of the connection pools by uris
+    '''
+    with connection_pools_lock:
+        pools = connection_pools.values()
+    return dict(("%s@%s" % (pool.binddn, ','.join(pool.uris)),
+                 pool.getStats()) for pool in pools)
+
+
+def decode_entry(resList):
+    """
+    convert the attribute values of a ldap search result entry to unicode
+
+    :param resList: dict of the attributes with the list of utf-8 values
+    :return: dict of the attributes with the unicode values
+    """
+    resultList = {}
+
+    for key in resList:
+        val = resList.get(key)
+        rval = val
+
+        if type(val) == list:
+            # val should be a list of utf str
+            rval = []
+            for v in val:
+                try:
+                    if type(v) == str:
+                        rval.append(v.decode(ENCODING))
+                    else:
+                        rval.append(v)
+                except:
+                    rval.append(v)
+                    log.debug('[decode_entry] failed to '
+                              'decode data type %r: %r'
+                                                % (type(v), v))
+
+        elif type(val) == str:
+            # or val might be a direct utf-8 str
+            try:
+                rval = val.decode(ENCODING)
+            except:
+                rval = val
+                log.debug('[decode_entry] failed to decode '
+                          'data type %r: %r'
+                          % (type(val), val))
+        else:
+            # this should not be reached -
+            # so anything different is treated as unknown
+            rval = val
+            log.warning('[decode_entry] unknown and '
+                        'unsupported LDAP return data type'
+                        ' %r: %r' % (type(val), val))
+
+        resultList[key] = rval
+
+    return resultList
+
 
 def escape_filter_chars(filterstr):
     """
@@ -322,109 +708,96 @@ class IdResolver (UserIdResolver):
         self.loginnameattribute = ""
         self.userinfo = {}
         self.timeout = 10
-        self.bind_not_possible = False
-        self.bind_not_possible_time = datetime.now()
         self.brokenconfig = False
         self.brokenconfig_text = ""
         self.sizelimit = 5
         self.noreferrals = False
         self.proxy = False
         self.uidType = DEFAULT_UID_TYPE
+        self.poolsize = DEFAULT_POOL_SIZE
+        self.poolidletimeout = DEFAULT_POOL_IDLE_TIMEOUT
+        self.poolcheckinterval = DEFAULT_POOL_CHECK_INTERVAL
+        self.pool = None
         self.l_obj = None
+        self.l_uri = None
+        self.l_obj_broken = False
+        self.l_obj_users = 0
 
     def close(self):
         """
         closes method is called, when the request ends
-        - here we close the ldap connection by unbind
+        - here we return the ldap connection into the connection pool, if
+        it is still in use
         """
 
-        try:
-            if self.l_obj is not None:
-                self.l_obj.unbind_s()
-        except ldap.LDAPError as  error:
-            log.warning("[unbind] LDAP error: %r" % error)
-        finally:
-            self.l_obj = None
+        if self.l_obj is not None:
+            self.pool.release(self.l_obj, self.l_uri,
+                              broken=self.l_obj_broken)
+        self.l_obj = None
+        self.l_uri = None
+        self.l_obj_broken = False
+        self.l_obj_users = 0
+
+    def _getConnectionPool(self):
+        """
+        get the shared connection pool of the resolver config
+        """
+        return getConnectionPool(self.ldapuri.split(','),
+                                 self.binddn, self.bindpw,
+                                 timeout=self.timeout,
+                                 noreferrals=self.noreferrals,
+                                 size=self.poolsize,
+                                 idle_timeout=self.poolidletimeout,
+                                 check_interval=self.poolcheckinterval)
 
     def bind(self):
         """
-        bind() - this function starts an ldap conncetion
+        bind() - this function takes an bound ldap connection from the
+        connection pool, which is kept until the matching unbind() - nested
+        binds, e.g. during a paged search, share the connection
+
+        :return: the ldap connection or False, if no bind was possible
         """
 
         if self.l_obj is not None:
+            self.l_obj_users += 1
             return self.l_obj
 
-        if self.bind_not_possible:
-            t2 = datetime.now()
-            tdelta = t2 - self.bind_not_possible_time
-            # If we try a bind within 30 seconds, we will
-            # bail out!
-            if tdelta.seconds > BIND_NOT_POSSIBLE_TIMEOUT or tdelta.days > 1:
-                log.info("[bind] Resetting the bind_not_possible timeout.")
-                self.bind_not_possible = False
-            else:
-                log.error("[bind] LDAP bind timed out the last time. "
-                          "So we do not try to bind again at this moment. "
-                          "Skipping for performance sake! "
-                          "Trying a real bind again in %r seconds"
-                                % (BIND_NOT_POSSIBLE_TIMEOUT - tdelta.seconds))
-                return False
-
-        uri = ""
-        urilist = self.ldapuri.split(',')
-        i = 0
-        log.debug("[bind] trying to bind to one of the servers: %r" % urilist)
-        l_obj = None
-        while i < len(urilist):
-            uri = urilist[i]
-            try:
-                log.debug("[bind] LDAP: Try to bind to %r", uri)
-                l_obj = ldap.initialize(uri, trace_level=0)
-
-                if uri.startswith('ldaps'):
-                    # the setting of the CERTFILE is required only once
-                    old_cert_file = ldap.get_option(ldap.OPT_X_TLS_CACERTFILE)
-                    if self.CERTFILE is not None and old_cert_file == None:
-                        ldap.set_option(
-                                    ldap.OPT_X_TLS_CACERTFILE, self.CERTFILE)
+        self.pool = self._getConnectionPool()
+        (l_obj, uri) = self.pool.acquire()
+        if l_obj is None:
+            return False
 
-                # referrals for AD
-                log.debug("[bind] checking noreferrals: %r" % self.noreferrals)
-                if self.noreferrals:
-                    l_obj.set_option(ldap.OPT_REFERRALS, 0)
-                l_obj.network_timeout = self.timeout
-                # This is HIGH debug
-                # log.debug("[bind] %s, %s" %(self.binddn, self.bindpw))
-                dn_encode = self.binddn.encode(ENCODING)
-                pw_encode = self.bindpw.encode(ENCODING)
-                l_obj.simple_bind_s(dn_encode, pw_encode)
-                if i > 0:
-                    urilist[i] = urilist[0]
-                    urilist[0] = uri
-                    self.ldapuri = ','.join(urilist)
-
-                self.l_obj = l_obj
-                return l_obj
-            except ldap.LDAPError as  e:
-                log.error("[bind] LDAP error: %r" % e)
-                log.error("[bind] LDAPURI   : %r" % uri)
-                log.error("[bind] %s" % traceback.format_exc())
-                i = i + 1
-        # We were not able to do a successful bind! :-(
-        self.bind_not_possible = True
-        self.bind_not_possible_time = datetime.now()
         self.l_obj = l_obj
+        self.l_uri = uri
+        self.l_obj_broken = False
+        self.l_obj_users = 1
         return l_obj
 
+    def _connection_error(self, exc):
+        """
+        mark the connection of the request as broken, so that it is not
+        returned into the connection pool
+        """
+        if isinstance(exc, CONNECTION_ERRORS):
+            self.l_obj_broken = True
+
     def unbind(self, lobj):
         """
-        unbind() - this function formarly freed the ldap connection
-        which is now done in the class destructor __del__()
+        unbind() - the last unbind returns the ldap connection into the
+        connection pool. So the connection is released as well, if the
+        resolver is not closed at a request end, as for the authentication
+        of a 401 redirect, which has no request context.
 
         :param l: ldap object
         :return: empty string
         """
+        if self.l_obj is None or lobj is not self.l_obj:
+            return
 
+        self.l_obj_users -= 1
+        if self.l_obj_users <= 0:
+            self.close()
         return
 
     def getUserId(self, loginname):
@@ -484,6 +857,7 @@ class IdResolver (UserIdResolver):
             resultList = l_obj.result(l_id, all=1)[1]
         except ldap.LDAPError as exc:
             log.error("[getUserId] LDAP error: %r" % exc)
+            self._connection_error(exc)
             resultList = None
 
         finally:
@@ -618,51 +992,11 @@ class IdResolver (UserIdResolver):
                 if r:
                     resList = r[0][1]
                     resList["dn"] = [r[0][0]]
-
-                    resultList = {}
-
-                    # now convert the resList to unicode:
-                    #   dict of list(UTF-8)
-                    for key in resList:
-                        val = resList.get(key)
-                        rval = val
-
-                        if type(val) == list:
-                            # val should be a list of utf str
-                            rval = []
-                            for v in val:
-                                try:
-                                    if type(v) == str:
-                                        rval.append(v.decode(ENCODING))
-                                    else:
-                                        rval.append(v)
-                                except:
-                                    rval.append(v)
-                                    log.debug('[getUserLDAPInfo] failed to '
-                                              'decode data type %r: %r'
-                                                                % (type(v), v))
-
-                        elif type(val) == str:
-                            # or val might be a direct utf-8 str
-                            try:
-                                rval = val.decode(ENCODING)
-                            except:
-                                rval = val
-                                log.debug('[getUserLDAPInfo] failed to decode '
-                                          'data type %r: %r'
-                                          % (type(val), val))
-                        else:
-                            # this should not be reached -
-                            # so anything different is treated as unknown
-                            rval = val
-                            log.warning('[getUserLDAPInfo] unknown and '
-                                        'unsupported LDAP return data type'
-                                        ' %r: %r' % (type(val), val))
-
-                        resultList[key] = rval
+                    resultList = decode_entry(resList)
 
             except ldap.LDAPError as  e:
                 log.error("[getUserLDAPInfo] LDAP error: %s" % str(e))
+                self._connection_error(e)
                 log.error("[getUserLDAPInfo] %s" % traceback.format_exc())
 
             finally:
@@ -697,9 +1031,18 @@ class IdResolver (UserIdResolver):
         """
         log.debug("[getUserInfo]")
 
-        ret = {}
-
         user = self.getUserLDAPInfo(userid)
+        return self._getUserInfo(userid, user)
+
+    def _getUserInfo(self, userid, user):
+        """
+        build the user info of a user from the ldap attributes
+
+        :param userid: the user id
+        :param user: the decoded ldap attributes of the user
+        :return: the user info dict
+        """
+        ret = {}
 
         if len(user) > 0:
             ret['userid'] = userid
@@ -733,6 +1076,89 @@ class IdResolver (UserIdResolver):
 
         return ret
 
+    def getUserInfos(self, userids):
+        """
+        return the user related information of several users
+
+        The users are searched with one OR filter per chunk of user ids on a
+        single connection. If the user id is the DN or the objectGUID, each
+        user is looked up on its own.
+
+        :param userids: list of user ids
+        :return: dictionary of the found user ids with their user info
+        """
+        log.debug("[getUserInfos] %d users" % len(userids))
+
+        if self.uidType.lower() in ["dn", "objectguid"]:
+            return UserIdResolver.getUserInfos(self, userids)
+
+        userInfos = {}
+        requested = dict(((u'%s' % userid).lower(), userid)
+                         for userid in userids)
+        if not requested:
+            return userInfos
+
+        l_obj = self.bind()
+        if not l_obj:
+            return userInfos
+
+        ids = requested.values()
+        try:
+            for start in range(0, len(ids), USERINFO_CHUNK):
+                chunk = ids[start:start + USERINFO_CHUNK]
+                try:
+                    self._searchUserInfos(l_obj, chunk, requested, userInfos)
+                except ldap.LDAPError as exc:
+                    # a failed chunk, e.g. by a sizelimit exceeded, must not
+                    # drop the user info of the other chunks
+                    log.error("[getUserInfos] LDAP error: %r" % exc)
+                    log.error("[getUserInfos] %s" % traceback.format_exc())
+                    self._connection_error(exc)
+                    if isinstance(exc, CONNECTION_ERRORS):
+                        break
+
+        finally:
+            self.unbind(l_obj)
+
+        return userInfos
+
+    def _searchUserInfos(self, l_obj, chunk, requested, userInfos):
+        """
+        search the users of one chunk of user ids with one OR filter
+
+        :param l_obj: the ldap connection
+        :param chunk: list of user ids
+        :param requested: dict of the lower case user ids with the user ids
+        :param userInfos: dict of the user infos, the found users are added
+        """
+        filterstr = "(|%s)" % "".join(
+                ["(%s=%s)" % (self.uidType,
+                              ldap.filter.escape_filter_chars(
+                                    (u'%s' % userid).encode(ENCODING)))
+                 for userid in chunk])
+
+        l_id = l_obj.search_ext(self.base,
+                                ldap.SCOPE_SUBTREE,
+                                filterstr=filterstr,
+                                attrlist=['*', self.uidType],
+                                sizelimit=self.sizelimit)
+
+        for (dn, resList) in l_obj.result(l_id, all=1)[1]:
+            if dn is None:
+                # search reference
+                continue
+            resList["dn"] = [dn]
+            user = decode_entry(resList)
+
+            for key in user:
+                if key.lower() != self.uidType.lower():
+                    continue
+                for value in user[key]:
+                    userid = requested.get((u'%s' % value).lower())
+                    if userid is not None:
+                        userInfos[userid] = self._getUserInfo(userid, user)
+        return
+
     def getResolverId(self):
         '''
         getResolverId - provide the resolver identifier
@@ -935,6 +1361,23 @@ class IdResolver (UserIdResolver):
                                 "linotp.ldapresolver.CACERTIFICATE", conf,
                                 required=False, default=None)
 
+        # the optional settings of the connection pool
+        for (attr, key, default) in [
+                ('poolsize', 'POOLSIZE', DEFAULT_POOL_SIZE),
+                ('poolidletimeout', 'POOLIDLETIMEOUT',
+                                            DEFAULT_POOL_IDLE_TIMEOUT),
+                ('poolcheckinterval', 'POOLCHECKINTERVAL',
+                                            DEFAULT_POOL_CHECK_INTERVAL), ]:
+            value = self.getConfigEntry(config,
+                                "linotp.ldapresolver.%s" % key, conf,
+                                required=False, default=default)
+            try:
+                setattr(self, attr, type(default)(value))
+            except (ValueError, TypeError):
+                log.warning("[loadConfig] invalid %s %r - using %r"
+                            % (key, value, default))
+                setattr(self, attr, default)
+
         return self
 
     def getSearchFields(self, searchDict=None):
@@ -983,6 +1426,7 @@ class IdResolver (UserIdResolver):
                             resultList.append(result_data)
             except ldap.LDAPError as exc:
                 log.error("[searchLDAPUserList] LDAP error: %r" % exc)
+                self._connection_error(exc)
 
             self.unbind(l_obj)
             if resultList:
@@ -1047,6 +1491,12 @@ class IdResolver (UserIdResolver):
         log.debug("[checkPass] we will try to authenticate to these LDAP "
                   "servers: %r" % urilist)
 
+        # skip the servers, which are known to be unavailable
+        breakers = self._getConnectionPool().breakers
+        available = [uri for uri in urilist if breakers[uri].available()]
+        if available:
+            urilist = available
+
         while i < len(urilist):
             uri = urilist[i]
             l = None
@@ -1270,6 +1720,7 @@ class IdResolver (UserIdResolver):
                             resultList.append(userdata)
             except ldap.LDAPError as exce:
                 log.error("[getUserList] LDAP error: %r" % exce)
+                self._connection_error(exce)
             except Exception as exce:
                 log.error("[getUserList] error during LDAP access: %r" % exce)
                 log.error("[getUserList] %s" % traceback.format_exc())
@@ -1438,6 +1889,7 @@ class IdResolver (UserIdResolver):
         (msgid, l_obj, lc) = self._set_cursor(searchFilter,
                                               attrlist,
                                               api_ver=api_ver)
+        connection = l_obj
 
         done = False
         results_size = 0
@@ -1476,6 +1928,7 @@ class IdResolver (UserIdResolver):
 
         except ldap.LDAPError as exce:
             log.error("LDAP error: %r" % exce)
+            self._connection_error(exce)
             raise exce
 
         except StopIteration as exce:
@@ -1488,7 +1941,9 @@ class IdResolver (UserIdResolver):
             log.error("%s" % traceback.format_exc())
             raise exce
 
-        # we do no unbind here, as this is done at the request end
+        finally:
+            if connection:
+                self.unbind(connection)
 
     def _process_result(self, result_data):
         """
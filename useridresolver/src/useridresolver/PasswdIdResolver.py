@@ -36,7 +36,9 @@ Remarks:
 
 import os
 import re
+import bisect
 import logging
+import threading
 
 
 from UserIdResolver import (UserIdResolver,
@@ -49,6 +51,9 @@ from UserIdResolver import getResolverClass
 log = logging.getLogger(__name__)
 ENCODING = "utf-8"
 
+# very basic e-mail regex
+EMAIL_RE = re.compile('.+@.+\..+')
+
 
 def tokenise(r):
     def _(s):
@@ -63,6 +68,233 @@ def tokenise(r):
     return _
 
 
+class PasswdUser(object):
+    """
+    the record of one user of the passwd file
+    """
+
+    __slots__ = ('username', 'cryptpass', 'userid', 'description',
+                 'givenname', 'surname', 'phone', 'mobile', 'email',
+                 'position')
+
+    def __init__(self, fields, position):
+        self.username = fields[0]
+        self.cryptpass = fields[1]
+        self.userid = fields[2]
+        self.description = fields[4] if len(fields) > 4 else ""
+        self.position = position
+
+        ## surname, givenname and phones from the description
+        descriptions = self.description.split(",")
+        names = descriptions[0].split(' ', 1)
+        self.givenname = names[0]
+        self.surname = ""
+        self.phone = ""
+        self.mobile = ""
+        self.email = ""
+        if len(names) >= 2:
+            self.surname = names[1]
+        if len(descriptions) >= 4:
+            self.mobile = descriptions[2]
+            self.phone = descriptions[3]
+        if len(descriptions) >= 5:
+            for field in descriptions[4:]:
+                email_match = EMAIL_RE.search(field)
+                if email_match:
+                    self.email = email_match.group(0)
+
+
+class SearchIndex(object):
+    """
+    index of one search field of the users to lookup an exact value, a
+    prefix 'abc*', a suffix '*abc' or a substring '*abc*' - the values
+    are compared case insensitive as by stringMatch
+    """
+
+    def __init__(self, values):
+        """
+        :param values: list of (value, userid) tuples
+        """
+        self.exact = {}
+        for value, userid in values:
+            self.exact.setdefault(value.lower(), set()).add(userid)
+
+        self.prefixes = sorted(self.exact.keys())
+        self.suffixes = sorted(value[::-1] for value in self.exact.keys())
+
+    def _starting(self, keys, prefix):
+        found = []
+        for pos in xrange(bisect.bisect_left(keys, prefix), len(keys)):
+            if not keys[pos].startswith(prefix):
+                break
+            found.append(keys[pos])
+        return found
+
+    def search(self, pattern):
+        """
+        :param pattern: the search pattern with an optional leading and
+                        trailing wildcard '*'
+        :return: set of the matching userids
+        """
+        if type(pattern) == unicode:
+            pattern = pattern.encode(ENCODING)
+        pattern = pattern.lower()
+
+        contains = starts = ends = False
+        if pattern.startswith("*"):
+            ends = True
+            pattern = pattern[1:]
+        if pattern.endswith("*"):
+            starts = True
+            pattern = pattern[:-1]
+        if starts and ends:
+            contains = True
+
+        if contains:
+            values = [value for value in self.exact if pattern in value]
+        elif starts:
+            values = self._starting(self.prefixes, pattern)
+        elif ends:
+            values = [value[::-1] for value in
+                      self._starting(self.suffixes, pattern[::-1])]
+        else:
+            values = [pattern]
+
+        found = set()
+        for value in values:
+            found.update(self.exact.get(value, ()))
+        return found
+
+
+class PasswdIndex(object):
+    """
+    the parsed passwd file with one record per user and the search
+    indexes - the index is shared by all resolvers of the file
+    """
+
+    def __init__(self, fileName, stat=None):
+        self.fileName = fileName
+        self.stat = stat
+
+        self.users = {}
+        self.logins = {}
+
+        log.info('[PasswdIndex] loading users from file %s' % (fileName))
+
+        fileHandle = open(fileName, "r")
+        try:
+            for position, line in enumerate(fileHandle):
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+
+                fields = line.split(":", 7)
+                if len(fields) < 3:
+                    log.warning("[PasswdIndex] skipping invalid line %d"
+                                % (position + 1))
+                    continue
+
+                user = PasswdUser(fields, position)
+                self.logins[user.username] = user.userid
+                self.users[user.userid] = user
+        finally:
+            fileHandle.close()
+
+        users = self.users.values()
+        self.usernames = SearchIndex((user.username, user.userid)
+                                     for user in users)
+        self.descriptions = SearchIndex((user.description, user.userid)
+                                        for user in users)
+
+        # the numeric userids for the range search
+        self.userids = []
+        for userid in self.users:
+            try:
+                self.userids.append((int(userid), userid))
+            except ValueError:
+                pass
+        self.userids.sort()
+        self.userid_keys = [iuserid for iuserid, _userid in self.userids]
+
+    def _userid_range(self, low=None, high=None):
+        """
+        the userids in the numeric range - low and high are inclusive
+        """
+        start = 0
+        end = len(self.userid_keys)
+        if low is not None:
+            start = bisect.bisect_left(self.userid_keys, low)
+        if high is not None:
+            end = bisect.bisect_right(self.userid_keys, high)
+        return set(userid for _iuserid, userid in self.userids[start:end])
+
+    def searchUserId(self, pattern):
+        """
+        search the userids by a comparison like '>= 1000' or
+        'between 1000, 2000'
+
+        :return: set of the matching userids
+        """
+        res = tokenise(">=|<=|>|<|=|between")(pattern)
+        if res is None:
+            return set()
+        (op, val) = res
+
+        if op == "between":
+            try:
+                (lVal, hVal) = val.split(",", 2)
+                ilVal = int(lVal.strip())
+                ihVal = int(hVal.strip())
+            except ValueError:
+                return set()
+            return self._userid_range(min(ilVal, ihVal), max(ilVal, ihVal))
+
+        try:
+            ival = int(val)
+        except ValueError:
+            return set()
+
+        if op == "=":
+            return self._userid_range(ival, ival)
+        elif op == ">":
+            return self._userid_range(ival + 1, None)
+        elif op == ">=":
+            return self._userid_range(ival, None)
+        elif op == "<":
+            return self._userid_range(None, ival - 1)
+        elif op == "<=":
+            return self._userid_range(None, ival)
+        return set()
+
+
+# the indexes of the passwd files by file name
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def getPasswdIndex(fileName):
+    """
+    get the index of the passwd file - the file is only parsed again,
+    if its modification time or size has changed
+
+    :param fileName: the name of the passwd file
+    :return: the PasswdIndex
+    """
+    st = os.stat(fileName)
+    stat = (st.st_mtime, st.st_size, st.st_ino)
+
+    index = indexes.get(fileName)
+    if index is not None and index.stat == stat:
+        return index
+
+    with indexes_lock:
+        index = indexes.get(fileName)
+        if index is None or index.stat != stat:
+            index = PasswdIndex(fileName, stat)
+            indexes[fileName] = index
+    return index
+
+
 class IdResolver (UserIdResolver):
 
     fields = {"username": 1, "userid": 1,
@@ -106,15 +338,7 @@ class IdResolver (UserIdResolver):
         self.fileName = ""
 
         self.name = "P"
-        self.nameDict = {}
-        self.descDict = {}
-        self.reversDict = {}
-        self.passDict = {}
-        self.officePhoneDict = {}
-        self.homePhoneDict = {}
-        self.surnameDict = {}
-        self.givennameDict = {}
-        self.emailDict = {}
+        self.index = None
 
     def close(self):
         """
@@ -128,62 +352,15 @@ class IdResolver (UserIdResolver):
           init loads the /etc/passwd
             user and uid as a dict for /
             user loginname lookup
+
+          the parsed file is shared with the other resolvers of the file
+          and only parsed again, if the file has changed
         """
 
         if (self.fileName == ""):
             self.fileName = "/etc/passwd"
 
-        log.info('[loadFile] loading users from file %s' % (self.fileName))
-
-        fileHandle = open(self.fileName, "r")
-
-        line = fileHandle.readline()
-
-        ID = self.sF["userid"]
-        NAME = self.sF["username"]
-        PASS = self.sF["cryptpass"]
-        DESCRIPTION = self.sF["description"]
-
-        while line:
-            line = line.strip()
-            if len(line) == 0:
-                continue
-
-            fields = line.split(":", 7)
-            self.nameDict["%s" % fields[NAME]] = fields[ID]
-
-            ## for speed reason - build a revers lookup
-            self.reversDict[fields[ID]] = "%s" % fields[NAME]
-
-            ## for full info store the line
-            self.descDict[fields[ID]] = fields
-
-            ## store the crypted password
-            self.passDict[fields[ID]] = fields[PASS]
-
-            ## store surname, givenname and phones
-            descriptions = fields[DESCRIPTION].split(",")
-            name = descriptions[0]
-            names = name.split(' ', 1)
-            self.givennameDict[fields[ID]] = names[0]
-            self.surnameDict[fields[ID]] = ""
-            self.officePhoneDict[fields[ID]] = ""
-            self.homePhoneDict[fields[ID]] = ""
-            self.emailDict[fields[ID]] = ""
-            if len(names) >= 2:
-                self.surnameDict[fields[ID]] = names[1]
-            if len(descriptions) >= 4:
-                self.officePhoneDict[fields[ID]] = descriptions[2]
-                self.homePhoneDict[fields[ID]] = descriptions[3]
-            if len(descriptions) >= 5:
-                for field in descriptions[4:]:
-                    # very basic e-mail regex
-                    email_match = re.search('.+@.+\..+', field)
-                    if email_match:
-                        self.emailDict[fields[ID]] = email_match.group(0)
-
-            """ print ">>" + key[0] + "<< " + key[2] """
-            line = fileHandle.readline()
+        self.index = getPasswdIndex(self.fileName)
 
     def checkPass(self, uid, password):
         """
@@ -201,7 +378,7 @@ class IdResolver (UserIdResolver):
                        crypt.crypt() function.")
             password = password.encode('utf-8')
         log.info("[checkPass] checking password for user uid %s" % uid)
-        cryptedpasswd = self.passDict[uid]
+        cryptedpasswd = self.index.users[uid].cryptpass
         log.debug("[checkPass] We found the crypted pass %s for uid %s"
                                                     % (cryptedpasswd, uid))
         if cryptedpasswd:
@@ -227,7 +404,6 @@ class IdResolver (UserIdResolver):
     def getUserInfo(self, userId, no_passwd=False):
         """
         get some info about the user
-        as we only have the loginId, we have to traverse the dict for the value
 
         :param userId: the to be searched user
         :param no_passwd: retrun no password
@@ -235,20 +411,19 @@ class IdResolver (UserIdResolver):
         """
         ret = {}
 
-        if userId in self.reversDict:
-            fields = self.descDict.get(userId)
-
-            for key in self.sF:
-                if no_passwd and key == "cryptpass":
-                    continue
-                index = self.sF[key]
-                ret[key] = fields[index]
+        user = self.index.users.get(userId)
+        if user is not None:
+            ret['username'] = user.username
+            ret['userid'] = user.userid
+            ret['description'] = user.description
+            if not no_passwd:
+                ret['cryptpass'] = user.cryptpass
 
-            ret['givenname'] = self.givennameDict.get(userId)
-            ret['surname'] = self.surnameDict.get(userId)
-            ret['phone'] = self.homePhoneDict.get(userId)
-            ret['mobile'] = self.officePhoneDict.get(userId)
-            ret['email'] = self.emailDict.get(userId)
+            ret['givenname'] = user.givenname
+            ret['surname'] = user.surname
+            ret['phone'] = user.phone
+            ret['mobile'] = user.mobile
+            ret['email'] = user.email
 
         return ret
 
@@ -259,7 +434,7 @@ class IdResolver (UserIdResolver):
         :param userId: the user to be searched
         :return: true, if a user id exists
         '''
-        return userId in self.reversDict
+        return userId in self.index.users
 
     def getUserId(self, LoginName):
         """
@@ -274,11 +449,7 @@ class IdResolver (UserIdResolver):
         if type(LoginName) == unicode:
             LoginName = LoginName.encode(ENCODING)
 
-        if LoginName in self.nameDict.keys():
-            #log.debug("YES YES YES YES")
-            return self.nameDict[LoginName]
-        else:
-            return ""
+        return self.index.logins.get(LoginName, "")
 
     def getSearchFields(self, searchDict=None):
         """
@@ -304,151 +475,43 @@ class IdResolver (UserIdResolver):
 
         :param searchDict: dict of search expressions
         """
-        ret = []
-
-        ##  first check if the searches are in the searchDict
-        for l in self.descDict:
-            line = self.descDict[l]
-            ok = True
-
-            for search in searchDict:
-
-                if not search in self.searchFields:
-                    ok = False
-                    break
-
-                pattern = searchDict[search]
-
-                log.debug("[getUserList] searching for %s:%s", search, pattern)
-
-                if search == "username":
-                    ok = self.checkUserName(line, pattern)
-                elif search == "userid":
-                    ok = self.checkUserId(line, pattern)
-                elif search == "description":
-                    ok = self.checkDescription(line, pattern)
-                elif search == "email":
-                    ok = self.checkEmail(line, pattern)
-
-                if ok != True:
-                    break
-
-            if ok == True:
-                uid = line[self.sF["userid"]]
-                info = self.getUserInfo(uid, no_passwd=True)
-                ret.append(info)
-
-        return ret
-
-    def checkUserName(self, line, pattern):
-        """
-        check for user name
-        """
-
-        username = line[self.sF["username"]]
-        ret = self.stringMatch(username, pattern)
-        return ret
-
-    def checkDescription(self, line, pattern):
-        description = line[self.sF["description"]]
-        ret = self.stringMatch(description, pattern)
-        return ret
-
-    def checkEmail(self, line, pattern):
-        email = line[self.sF["email"]]
-        ret = self.stringMatch(email, pattern)
-        return ret
-
-    def stringMatch(self, cString, cPattern):
-        ret = False
-        e = s = ""
-
-        if type(cString) == unicode:
-            cString = cString.encode(ENCODING)
-
-        if type(cPattern) == unicode:
-            cPattern = cPattern.encode(ENCODING)
-
-        string = cString.lower()
-        pattern = cPattern.lower()
-
-        if pattern.startswith("*"):
-            e = "e"
-            pattern = pattern[1:]
-
-        if pattern.endswith("*"):
-            s = "s"
-            pattern = pattern[:-1]
-
-        if (e == "e" and s == "s"):
-            if string.find(pattern) != -1:
-                return True
-        elif (e == "e"):
-            if string.endswith(pattern):
-                return True
-        elif (s == "s"):
-            if string.startswith(pattern):
-                return True
-        else:
-            if string == pattern:
-                return True
-
-        return ret
-
-    def checkUserId(self, line, pattern):
-        """
-        check for the userId
-        """
-        ret = False
+        index = self.index
+        userids = None
 
-        try:
-            cUserId = int(line[self.sF["userid"]])
-        except:
-            return ret
+        ## the result is the intersection of the matches of every search
+        for search in searchDict:
 
-        (op, val) = tokenise(">=|<=|>|<|=|between")(pattern)
+            if not search in self.searchFields:
+                return []
 
-        if op == "between":
-            (lVal, hVal) = val.split(",", 2)
-            try:
-                ilVal = int(lVal.strip())
-                ihVal = int(hVal.strip())
-                if ihVal < ilVal:
-                    v = ihVal
-                    ihVal = ilVal
-                    ilVal = v
-            except:
-                return ret
-
-            if (cUserId <= ihVal and cUserId >= ilVal):
-                ret = True
-        else:
-            try:
-                ival = int(val)
-            except:
-                return ret
+            pattern = searchDict[search]
 
-            if op == "=":
-                if (cUserId == ival):
-                    ret = True
+            log.debug("[getUserList] searching for %s:%s", search, pattern)
 
-            elif op == ">":
-                if (cUserId > ival):
-                    ret = True
+            if search == "username":
+                found = index.usernames.search(pattern)
+            elif search == "userid":
+                found = index.searchUserId(pattern)
+            else:
+                ## the email is searched in the description as well
+                found = index.descriptions.search(pattern)
 
-            elif op == ">=":
-                if (cUserId >= ival):
-                    ret = True
+            if userids is None:
+                userids = found
+            else:
+                userids = userids & found
 
-            elif op == "<":
-                if (cUserId < ival):
-                    ret = True
+            if not userids:
+                return []
 
-            elif op == "<=":
-                if (cUserId < ival):
-                    ret = True
+        if userids is None:
+            userids = index.users.keys()
 
-        return ret
+        ## return the users in the order of the file
+        users = sorted((index.users[userid] for userid in userids),
+                       key=lambda user: user.position)
+        return [self.getUserInfo(user.userid, no_passwd=True)
+                for user in users]
 
 #############################################################
 # server info methods
@@ -28,6 +28,10 @@
 This module implements the communication and data mapping to SQL servers.
 The LinOTP server imports this module to use SQL databases as a userstore.
 
+The database engines with their connection pools and the reflected user
+tables are held for the lifetime of the process, so that a user lookup
+is one query on a pooled connection.
+
 Dependencies: UserIdResolver
 """
 
@@ -49,6 +53,7 @@ import base64
 import hashlib
 import sys
 import urllib
+import threading
 
 
 import linotp.lib.phppass as phppass
@@ -64,6 +69,64 @@ log = logging.getLogger(__name__)
 
 DEFAULT_ENCODING = "utf-8"
 
+# the number of user ids, which are looked up with one statement
+USERINFO_CHUNK = 500
+
+# the engines by connect string and the reflected tables by
+# connect string and table name, shared by all resolvers of the process
+engines = {}
+tables = {}
+engines_lock = threading.Lock()
+
+
+def getEngine(sqlConnect):
+    """
+    get the process wide engine with its connection pool for the connect
+    string - the engine is created on the first call
+
+    :param sqlConnect: sql url for the connection
+    :return: tuple of the engine and its MetaData
+    """
+    with engines_lock:
+        entry = engines.get(sqlConnect)
+        if entry is None:
+            entry = (create_engine(sqlConnect, **engine_args(sqlConnect)),
+                     MetaData())
+            engines[sqlConnect] = entry
+    return entry
+
+
+def engine_args(sqlConnect):
+    """
+    the create_engine arguments for the connect string
+    """
+    args = {'echo': False, 'echo_pool': True}
+    if 'sqlite' not in sqlConnect:
+        args['pool_timeout'] = 30
+        # connections are kept for the lifetime of the process, so they
+        # have to be refreshed before the server closes them
+        args['pool_recycle'] = 3600
+    return args
+
+
+def getTable(sqlConnect, tableName, engine, meta):
+    """
+    get the reflected table - the table definition is read only once
+    per connect string and table name
+
+    :return: the sqlalchemy Table
+    """
+    key = (sqlConnect, tableName)
+    table = tables.get(key)
+    if table is None:
+        with engines_lock:
+            table = tables.get(key)
+            if table is None:
+                table = Table(tableName, meta, autoload=True,
+                              autoload_with=engine)
+                tables[key] = table
+    return table
+
 
 def testconnection(params):
     """
@@ -97,7 +160,7 @@ def testconnection(params):
 
         log.debug("[testconnection] testing connection with connect str: %r"
                                                                 % connect_str)
-        dbObj.connect(connect_str)
+        dbObj.connect(connect_str, shared=False)
         table = dbObj.getTable(params.get("Table"))
         num = dbObj.count(table, params.get("Where", ""))
 
@@ -184,25 +247,33 @@ class dbObject():
         self.engine = None
         self.meta = None
         self.sess = None
+        self.sqlConnect = None
+        self.shared = True
 
         return None
 
-    def connect(self, sqlConnect):
+    def connect(self, sqlConnect, shared=True):
         """
         create a db session with the sqlConnect string
 
         :param sqlConnect: sql url for the connection
+        :param shared: if True, the process wide engine of the connect
+                       string is used, otherwise a private engine, which
+                       is disposed on close - as for the connection test
         """
         log.debug('[dbObject::connect] %s' % sqlConnect)
 
-        args = {'echo': False, 'echo_pool': True}
-        if 'sqlite' not in sqlConnect:
-            args['pool_timeout'] = 30
+        self.sqlConnect = sqlConnect
+        self.shared = shared
 
-        self.engine = create_engine(sqlConnect, **args)
+        if shared:
+            (self.engine, self.meta) = getEngine(sqlConnect)
+        else:
+            self.engine = create_engine(sqlConnect,
+                                        **engine_args(sqlConnect))
+            self.meta = MetaData()
 
         #listen(self.engine, 'connect', call_on_connect)
-        self.meta = MetaData()
         # Session = sessionmaker(bind=self.engine)
         Session = sessionmaker(bind=self.engine, autoflush=True,
                                autocommit=True, expire_on_commit=True)
@@ -212,8 +283,10 @@ class dbObject():
 
     def getTable(self, tableName):
         log.debug('[dbObject::getTable] %s' % tableName)
-        return Table(tableName, self.meta, autoload=True,
+        if not self.shared:
+            return Table(tableName, self.meta, autoload=True,
                                             autoload_with=self.engine)
+        return getTable(self.sqlConnect, tableName, self.engine, self.meta)
 
     def count(self, table, where=""):
         log.debug('[dbObject::count] %s:%s' % (table, where))
@@ -233,6 +306,8 @@ class dbObject():
         log.debug('[dbObject::close]')
         if self.sess is not None:
             self.sess.close()
+        if not self.shared and self.engine is not None:
+            self.engine.dispose()
         return
 
 
@@ -716,6 +791,45 @@ class IdResolver (UserIdResolver):
         log.debug('[getUserInfo] done')
         return userInfo
 
+    def getUserInfos(self, userids):
+        '''
+            return the user related information of several users - the users
+            are looked up with one query per chunk of user ids
+
+            @param userids: list of user ids
+            @type userids: list of strings
+            @return: dictionary of the found user ids with their user info
+            @rtype:  dict
+        '''
+        log.debug("[getUserInfos] %d users" % len(userids))
+        userInfos = {}
+
+        column_name = self.sqlUserInfo.get("userid")
+        if column_name is None or not userids:
+            return userInfos
+
+        requested = dict((u'%s' % userid, userid) for userid in userids)
+        ids = requested.values()
+
+        dbObj = self.connect(self.sqlConnect)
+        try:
+            table = dbObj.getTable(self.sqlTable)
+            for start in range(0, len(ids), USERINFO_CHUNK):
+                chunk = ids[start:start + USERINFO_CHUNK]
+                select = table.select(self.__add_where_clause_to_filter(
+                                            table.c[column_name].in_(chunk)))
+                for row in dbObj.query(select):
+                    userid = requested.get(u'%s' % row[column_name])
+                    if userid is not None:
+                        userInfos[userid] = self.__getUserInfo(dbObj, row)
+
+        except Exception as e:
+            log.error('[getUserInfos] Exception: %s' % (str(e)))
+            log.error("[getUserInfos] %s" % traceback.format_exc())
+
+        log.debug('[getUserInfos] done')
+        return userInfos
+
     def getSearchFields(self):
         '''
         return all fields on which a search could be made
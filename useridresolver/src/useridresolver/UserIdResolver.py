@@ -136,6 +136,23 @@ class UserIdResolver(object):
         """
         return ""
 
+    def getUserInfos(self, userids):
+        """
+        This function returns the user information of several users, which
+        are identified by their UserIDs. Resolvers, which could look up
+        several users at once, should overwrite it.
+
+        :param userids: list of user ids
+        :return: dictionary of the user ids, which are found, with their
+                 user information dictionary
+        """
+        userInfos = {}
+        for userid in userids:
+            userInfo = self.getUserInfo(userid)
+            if userInfo:
+                userInfos[userid] = userInfo
+        return userInfos
+
     def getUserList(self, serachDict):
         """
         This function finds the user objects,